@@ -29,6 +29,12 @@ LOG = logging.getLogger(__name__)
 ROOT_HELPER_OPTS = [
     cfg.StrOpt('root_helper', default='sudo',
                help=_('Root helper application.')),
+    cfg.StrOpt('root_helper_daemon',
+               help=_('Root helper daemon application, e.g. "sudo '
+                      'neutron-rootwrap-daemon /etc/neutron/rootwrap.conf". '
+                      'When set, commands run as root are requested to a '
+                      'long-lived daemon instead of running root_helper '
+                      'for each of them.')),
 ]
 
 AGENT_STATE_OPTS = [
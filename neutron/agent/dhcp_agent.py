@@ -16,6 +16,7 @@
 #    under the License.
 
 import os
+import time
 
 import eventlet
 import netaddr
@@ -61,6 +62,13 @@ class DhcpAgent(manager.Manager):
                            "enable_isolated_metadata = True")),
         cfg.IntOpt('num_sync_threads', default=4,
                    help=_('Number of threads to use during sync process.')),
+        cfg.FloatOpt('network_event_interval', default=0.5,
+                     help=_('Seconds during which the port and subnet '
+                            'notifications of a network are merged before '
+                            'being processed.')),
+        cfg.IntOpt('num_event_threads', default=4,
+                   help=_('Number of networks whose notifications are '
+                          'processed in parallel.')),
         cfg.StrOpt('metadata_proxy_socket',
                    default='$state_path/metadata_proxy',
                    help=_('Location of Metadata Proxy UNIX domain '
@@ -70,8 +78,18 @@ class DhcpAgent(manager.Manager):
     def __init__(self, host=None):
         super(DhcpAgent, self).__init__(host=host)
         self.needs_resync = False
+        # Server time of the last complete sync, None before the first one
+        self.sync_timestamp = None
         self.conf = cfg.CONF
         self.cache = NetworkCache()
+        # Events queued for each network, by network id
+        self.network_events = {}
+        # Seconds the oldest event of the last processed batch waited
+        self.network_events_latency = 0
+        # Generation of the last change of the DHCP state of each network,
+        # to find the changes made while a network is fetched
+        self.generation = 0
+        self.network_generations = {}
         self.root_helper = config.get_root_helper(self.conf)
         self.dhcp_driver_cls = importutils.import_class(self.conf.dhcp_driver)
         ctx = context.get_admin_context_without_session()
@@ -113,6 +131,7 @@ class DhcpAgent(manager.Manager):
         """Activate the DHCP agent."""
         self.sync_state()
         self.periodic_resync()
+        self.start_network_events_processing()
 
     def call_driver(self, action, network, **action_kwargs):
         """Invoke an action on a DHCP driver instance."""
@@ -140,14 +159,20 @@ class DhcpAgent(manager.Manager):
 
     @utils.synchronized('dhcp-agent')
     def sync_state(self):
-        """Sync the local DHCP state with Neutron."""
+        """Sync the local DHCP state with Neutron.
+
+        Only the networks changed since the last complete sync, and the
+        networks whose number of subnets or ports differs from the cache, are
+        fetched and reconfigured.
+        """
         LOG.info(_('Synchronizing state'))
         pool = eventlet.GreenPool(cfg.CONF.num_sync_threads)
         known_network_ids = set(self.cache.get_network_ids())
 
         try:
-            active_networks = self.plugin_rpc.get_active_networks_info()
-            active_network_ids = set(network.id for network in active_networks)
+            changes = self.plugin_rpc.get_changed_networks_info(
+                self.sync_timestamp)
+            active_network_ids = set(changes['counts'])
             for deleted_id in known_network_ids - active_network_ids:
                 try:
                     self.disable_dhcp_helper(deleted_id)
@@ -156,13 +181,37 @@ class DhcpAgent(manager.Manager):
                     LOG.exception(_('Unable to sync network state on deleted '
                                     'network %s'), deleted_id)
 
-            for network in active_networks:
+            changed_network_ids = set()
+            for network in changes['networks']:
+                changed_network_ids.add(network.id)
                 pool.spawn_n(self.safe_configure_dhcp_for_network, network)
-
+            for network_id, counts in changes['counts'].iteritems():
+                if (network_id not in changed_network_ids and
+                    not self._is_cached_network_complete(network_id,
+                                                         *counts)):
+                    pool.spawn_n(self.refresh_dhcp_helper, network_id)
+            pool.waitall()
+
+            LOG.info(_('Synchronized %d changed networks'),
+                     len(changed_network_ids))
+            if not self.needs_resync:
+                self.sync_timestamp = changes['timestamp']
         except Exception:
             self.needs_resync = True
             LOG.exception(_('Unable to sync network state.'))
 
+    def _is_cached_network_complete(self, network_id, num_subnets, num_ports):
+        """Return whether the cache has all the subnets and ports of a network.
+
+        Networks without DHCP enabled subnets are not cached.
+        """
+        network = self.cache.get_network_by_id(network_id)
+        if network is None:
+            return not num_subnets
+        return (num_subnets == len([s for s in network.subnets
+                                    if s.enable_dhcp]) and
+                num_ports == len(network.ports))
+
     def _periodic_resync_helper(self):
         """Resync the dhcp state at the configured interval."""
         while True:
@@ -175,6 +224,113 @@ class DhcpAgent(manager.Manager):
         """Spawn a thread to periodically resync the dhcp state."""
         eventlet.spawn(self._periodic_resync_helper)
 
+    def queue_network_event(self, network_id, refresh=False, release=None):
+        """Queue the processing of an event of a network.
+
+        The events of a network are merged until they are processed.
+
+        :param refresh: whether the network must be fetched from the server,
+               otherwise the allocations of the cached network are reloaded.
+        :param release: a (mac_address, removed_ips) tuple of the leases to
+               release once the allocations are reloaded.
+        """
+        event = self.network_events.get(network_id)
+        if event is None:
+            event = self.network_events[network_id] = NetworkEvent()
+        event.refresh |= refresh
+        if release:
+            event.releases.append(release)
+
+    @utils.synchronized('dhcp-agent')
+    def _take_network_events(self):
+        """Return the queued events and start a new queue."""
+        events, self.network_events = self.network_events, {}
+        return events
+
+    def process_network_events(self):
+        """Process the queued events, one network per thread.
+
+        The networks are fetched from the server without the lock, so that
+        the notification handlers can queue new events meanwhile. The lock
+        is taken to apply the events.
+        """
+        events = self._take_network_events()
+        if not events:
+            return
+        start = time.time()
+        self.network_events_latency = max(start - event.queued_at
+                                          for event in events.itervalues())
+        pool = eventlet.GreenPool(self.conf.num_event_threads)
+        for network_id, event in events.iteritems():
+            pool.spawn_n(self._process_network_event, network_id, event)
+        pool.waitall()
+        LOG.debug(_('Processed the events of %(count)d networks in '
+                    '%(elapsed).3f seconds'),
+                  {'count': len(events), 'elapsed': time.time() - start})
+
+    def _network_changed(self, network_id):
+        self.generation += 1
+        self.network_generations[network_id] = self.generation
+
+    def _process_network_event(self, network_id, event):
+        try:
+            generation = network = None
+            if event.refresh:
+                generation = self.network_generations.get(network_id)
+                network = self.safe_get_network_info(network_id)
+            self._apply_network_event(network_id, event, generation, network)
+        except Exception:
+            self.needs_resync = True
+            LOG.exception(_('Unable to process the events of network %s'),
+                          network_id)
+
+    @utils.synchronized('dhcp-agent')
+    def _apply_network_event(self, network_id, event, generation, network):
+        """Apply the event of a network, refreshed with network if fetched.
+
+        When the DHCP state of the network changed while it was fetched,
+        the fetched network may be older than the cache, and the event is
+        queued again instead.
+        """
+        if event.refresh:
+            if self.network_generations.get(network_id) != generation:
+                LOG.debug(_('Network %s changed while it was fetched, '
+                            'fetching it again'), network_id)
+                self.queue_network_event(network_id, refresh=True)
+                self.network_events[network_id].releases.extend(
+                    event.releases)
+                return
+            if network:
+                old_network = self.cache.get_network_by_id(network_id)
+                if old_network:
+                    self.update_dhcp_for_network(old_network, network)
+                else:
+                    self.configure_dhcp_for_network(network)
+        network = self.cache.get_network_by_id(network_id)
+        if not network:
+            return
+        if not event.refresh:
+            self.call_driver('reload_allocations', network)
+        for mac_address, removed_ips in event.releases:
+            self.call_driver('release_lease',
+                             network,
+                             mac_address=mac_address,
+                             removed_ips=removed_ips)
+
+    def _network_events_loop(self):
+        while True:
+            eventlet.sleep(self.conf.network_event_interval)
+            self.process_network_events()
+
+    def start_network_events_processing(self):
+        """Spawn a thread processing the queued events periodically."""
+        eventlet.spawn(self._network_events_loop)
+
+    def get_network_events_state(self):
+        return {'network_events_queued': len(self.network_events),
+                'network_events_latency': round(
+                    self.network_events_latency, 3)}
+
     def safe_get_network_info(self, network_id):
         try:
             network = self.plugin_rpc.get_network_info(network_id)
@@ -193,12 +349,18 @@ class DhcpAgent(manager.Manager):
 
     def safe_configure_dhcp_for_network(self, network):
         try:
-            self.configure_dhcp_for_network(network)
+            old_network = self.cache.get_network_by_id(network.id)
+            # The networks found on disk at startup have no subnets yet
+            if old_network and old_network.subnets:
+                self.update_dhcp_for_network(old_network, network)
+            else:
+                self.configure_dhcp_for_network(network)
         except (exceptions.NetworkNotFound, RuntimeError):
             LOG.warn(_('Network %s may have been deleted and its resources '
                        'may have already been disposed.'), network.id)
 
     def configure_dhcp_for_network(self, network):
+        self._network_changed(network.id)
         if not network.admin_state_up:
             return
 
@@ -213,6 +375,7 @@ class DhcpAgent(manager.Manager):
 
     def disable_dhcp_helper(self, network_id):
         """Disable DHCP for a network known to the agent."""
+        self._network_changed(network_id)
         network = self.cache.get_network_by_id(network_id)
         if network:
             if (self.conf.use_namespaces and
@@ -231,9 +394,12 @@ class DhcpAgent(manager.Manager):
             return self.enable_dhcp_helper(network_id)
 
         network = self.safe_get_network_info(network_id)
-        if not network:
-            return
+        if network:
+            self.update_dhcp_for_network(old_network, network)
 
+    def update_dhcp_for_network(self, old_network, network):
+        """Update the DHCP of a cached network to its current state."""
+        self._network_changed(network.id)
         old_cidrs = set(s.cidr for s in old_network.subnets if s.enable_dhcp)
         new_cidrs = set(s.cidr for s in network.subnets if s.enable_dhcp)
 
@@ -246,21 +412,6 @@ class DhcpAgent(manager.Manager):
         else:
             self.disable_dhcp_helper(network.id)
 
-    def release_lease_for_removed_ips(self, prev_port, updated_port, network):
-        """Releases the dhcp lease for ips removed from a port."""
-        if prev_port:
-            previous_ips = set(fixed_ip.ip_address
-                               for fixed_ip in prev_port.fixed_ips)
-            current_ips = set(fixed_ip.ip_address
-                              for fixed_ip in updated_port.fixed_ips)
-            # pass in port with removed ips on it
-            removed_ips = previous_ips - current_ips
-            if removed_ips:
-                self.call_driver('release_lease',
-                                 network,
-                                 mac_address=updated_port.mac_address,
-                                 removed_ips=removed_ips)
-
     @utils.synchronized('dhcp-agent')
     def network_create_end(self, context, payload):
         """Handle the network.create.end notification event."""
@@ -279,13 +430,14 @@ class DhcpAgent(manager.Manager):
     @utils.synchronized('dhcp-agent')
     def network_delete_end(self, context, payload):
         """Handle the network.delete.end notification event."""
+        self.network_events.pop(payload['network_id'], None)
         self.disable_dhcp_helper(payload['network_id'])
 
     @utils.synchronized('dhcp-agent')
     def subnet_update_end(self, context, payload):
         """Handle the subnet.update.end notification event."""
         network_id = payload['subnet']['network_id']
-        self.refresh_dhcp_helper(network_id)
+        self.queue_network_event(network_id, refresh=True)
 
     # Use the update handler for the subnet create event.
     subnet_create_end = subnet_update_end
@@ -296,7 +448,7 @@ class DhcpAgent(manager.Manager):
         subnet_id = payload['subnet_id']
         network = self.cache.get_network_by_subnet_id(subnet_id)
         if network:
-            self.refresh_dhcp_helper(network.id)
+            self.queue_network_event(network.id, refresh=True)
 
     @utils.synchronized('dhcp-agent')
     def port_update_end(self, context, payload):
@@ -304,11 +456,20 @@ class DhcpAgent(manager.Manager):
         updated_port = dhcp.DictModel(payload['port'])
         network = self.cache.get_network_by_id(updated_port.network_id)
         if network:
+            self._network_changed(network.id)
             prev_port = self.cache.get_port_by_id(updated_port.id)
             self.cache.put_port(updated_port)
-            self.call_driver('reload_allocations', network)
-            self.release_lease_for_removed_ips(prev_port, updated_port,
-                                               network)
+            release = None
+            if prev_port:
+                # release the leases of the ips removed from the port
+                removed_ips = (
+                    set(fixed_ip.ip_address
+                        for fixed_ip in prev_port.fixed_ips) -
+                    set(fixed_ip.ip_address
+                        for fixed_ip in updated_port.fixed_ips))
+                if removed_ips:
+                    release = (updated_port.mac_address, removed_ips)
+            self.queue_network_event(network.id, release=release)
 
     # Use the update handler for the port create event.
     port_create_end = port_update_end
@@ -319,14 +480,12 @@ class DhcpAgent(manager.Manager):
         port = self.cache.get_port_by_id(payload['port_id'])
         if port:
             network = self.cache.get_network_by_id(port.network_id)
+            self._network_changed(network.id)
             self.cache.remove_port(port)
-            self.call_driver('reload_allocations', network)
             removed_ips = [fixed_ip.ip_address
                            for fixed_ip in port.fixed_ips]
-            self.call_driver('release_lease',
-                             network,
-                             mac_address=port.mac_address,
-                             removed_ips=removed_ips)
+            self.queue_network_event(network.id,
+                                     release=(port.mac_address, removed_ips))
 
     def enable_isolated_metadata_proxy(self, network):
 
@@ -409,6 +568,34 @@ class DhcpPluginApi(proxy.RpcProxy):
                              topic=self.topic)
         return [dhcp.NetModel(self.use_namespaces, n) for n in networks]
 
+    def get_changed_networks_info(self, changed_since):
+        """Make a remote process call to retrieve the changed networks.
+
+        changed_since is the timestamp returned by the previous call, None
+        to retrieve all the active networks. Servers which do not support it
+        always return all the active networks and no timestamp.
+        """
+        try:
+            changes = self.call(self.context,
+                                self.make_msg('get_changed_networks_info',
+                                              changed_since=changed_since,
+                                              host=self.host),
+                                topic=self.topic)
+        except common.RemoteError as e:
+            if e.exc_type != 'AttributeError':
+                raise
+            networks = self.get_active_networks_info()
+            counts = dict((network.id,
+                           [len([s for s in network.subnets
+                                 if s.enable_dhcp]),
+                            len(network.ports)])
+                          for network in networks)
+            return {'networks': networks, 'counts': counts,
+                    'timestamp': None}
+        changes['networks'] = [dhcp.NetModel(self.use_namespaces, n)
+                               for n in changes['networks']]
+        return changes
+
     def get_network_info(self, network_id):
         """Make a remote process call to retrieve network info."""
         network = self.call(self.context,
@@ -467,6 +654,14 @@ class DhcpPluginApi(proxy.RpcProxy):
                          topic=self.topic)
 
 
+class NetworkEvent(object):
+    """Work merged from the events of a network until it is processed."""
+    def __init__(self):
+        self.queued_at = time.time()
+        self.refresh = False
+        self.releases = []
+
+
 class NetworkCache(object):
     """Agent cache of the current network state."""
     def __init__(self):
@@ -573,6 +768,8 @@ class DhcpAgentWithStateReport(DhcpAgent):
         try:
             self.agent_state.get('configurations').update(
                 self.cache.get_state())
+            self.agent_state.get('configurations').update(
+                self.get_network_events_state())
             ctx = context.get_admin_context_without_session()
             self.state_rpc.report_state(ctx, self.agent_state, self.use_call)
             self.use_call = False
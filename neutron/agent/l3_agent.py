@@ -17,7 +17,11 @@
 # @author: Dan Wendlandt, Nicira, Inc
 #
 
+import itertools
+import time
+
 import eventlet
+from eventlet import queue
 import netaddr
 from oslo.config import cfg
 
@@ -35,13 +39,13 @@ from neutron.common import utils as common_utils
 from neutron import context
 from neutron import manager
 from neutron.openstack.common import importutils
-from neutron.openstack.common import lockutils
 from neutron.openstack.common import log as logging
 from neutron.openstack.common import loopingcall
 from neutron.openstack.common import periodic_task
 from neutron.openstack.common.rpc import common as rpc_common
 from neutron.openstack.common.rpc import proxy
 from neutron.openstack.common import service
+from neutron.openstack.common import timeutils
 from neutron import service as neutron_service
 from neutron.services.firewall.agents.l3reference import firewall_l3_agent
 
@@ -49,9 +53,13 @@ LOG = logging.getLogger(__name__)
 NS_PREFIX = 'qrouter-'
 INTERNAL_DEV_PREFIX = 'qr-'
 EXTERNAL_DEV_PREFIX = 'qg-'
-RPC_LOOP_INTERVAL = 1
 FLOATING_IP_CIDR_SUFFIX = '/32'
 
+# Priorities of the router updates, lowest first
+PRIORITY_RPC = 0
+PRIORITY_SYNC_ROUTERS_TASK = 1
+DELETE_ROUTER = 'delete'
+
 
 class L3PluginApi(proxy.RpcProxy):
     """Agent side of the l3 agent RPC API.
@@ -88,6 +96,75 @@ class L3PluginApi(proxy.RpcProxy):
                          topic=self.topic)
 
 
+class RouterUpdate(object):
+    """Pending update of a router, merged until it is processed.
+
+    :param router: the router data fetched at timestamp, None if it must be
+           fetched when the update is processed.
+    :param action: DELETE_ROUTER if the router must be removed.
+    :param verify: whether the state applied to the router must be checked
+           against the kernel before it is processed.
+    """
+
+    def __init__(self, router_id, priority, action=None, router=None,
+                 timestamp=None, verify=False):
+        self.id = router_id
+        self.priority = priority
+        self.action = action
+        self.router = router
+        self.timestamp = timestamp or timeutils.utcnow()
+        self.verify = verify
+
+
+class RouterProcessingQueue(object):
+    """Priority queue of router updates, merged per router.
+
+    A router update added while another one of the same router is queued
+    replaces it if it is newer, with the highest priority of both. A router
+    is only processed by one worker at a time: the updates added while it is
+    processed are returned by done().
+    """
+
+    def __init__(self):
+        # Pending update of each router, by router id
+        self._updates = {}
+        self._in_progress = set()
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._updates)
+
+    def add(self, update):
+        queued = self._updates.get(update.id)
+        if queued is not None:
+            priority = min(queued.priority, update.priority)
+            verify = queued.verify or update.verify
+            if queued.timestamp > update.timestamp:
+                update = queued
+            update.priority = priority
+            update.verify = verify
+        self._updates[update.id] = update
+        # Queue entries of routers without pending update are skipped
+        self._queue.put((update.priority, next(self._counter), update.id))
+
+    def get(self):
+        """Wait for and return the next update of a router not in progress."""
+        while True:
+            _priority, _count, router_id = self._queue.get()
+            if (router_id in self._updates and
+                router_id not in self._in_progress):
+                self._in_progress.add(router_id)
+                return self._updates.pop(router_id)
+
+    def done(self, router_id):
+        """Return the next update of a router processed, None if none."""
+        update = self._updates.pop(router_id, None)
+        if update is None:
+            self._in_progress.discard(router_id)
+        return update
+
+
 class RouterInfo(object):
 
     def __init__(self, router_id, root_helper, use_namespaces, router):
@@ -96,6 +173,13 @@ class RouterInfo(object):
         self._snat_enabled = None
         self._snat_action = None
         self.internal_ports = []
+        # State applied to the router, so that only the differences with
+        # the router data are applied: the SNAT rules, the fixed IP of each
+        # floating IP, and the floating IP addresses of the gateway device
+        # (None when they must be listed from the device).
+        self.snat_rules = None
+        self.floating_ips = {}
+        self.floating_ip_cidrs = None
         self.root_helper = root_helper
         self.use_namespaces = use_namespaces
         # Invoke the setter for establishing initial SNAT action
@@ -186,6 +270,12 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
                    default='$state_path/metadata_proxy',
                    help=_('Location of Metadata Proxy UNIX domain '
                           'socket')),
+        cfg.IntOpt('num_router_threads', default=8,
+                   help=_('Number of routers processed in parallel.')),
+        cfg.IntOpt('router_verify_interval', default=0,
+                   help=_('Seconds between the checks of the devices and '
+                          'addresses applied to the routers against the '
+                          'kernel, 0 to disable them.')),
     ]
 
     def __init__(self, host, conf=None):
@@ -212,15 +302,13 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
         self.context = context.get_admin_context_without_session()
         self.plugin_rpc = L3PluginApi(topics.L3PLUGIN, host)
         self.fullsync = True
-        self.updated_routers = set()
-        self.removed_routers = set()
-        self.sync_progress = False
+        self._queue = RouterProcessingQueue()
+        # Time of the router data last processed, by router id
+        self._router_timestamps = {}
+        self._verified_at = time.time()
         if self.conf.use_namespaces:
             self._destroy_router_namespaces(self.conf.router_id)
 
-        self.rpc_loop = loopingcall.FixedIntervalLoopingCall(
-            self._rpc_loop)
-        self.rpc_loop.start(interval=RPC_LOOP_INTERVAL)
         super(L3NATAgent, self).__init__(conf=self.conf)
 
     def _check_config_params(self):
@@ -410,9 +498,12 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
             interface_name = self.get_external_device_name(ex_gw_port_id)
         if ex_gw_port and not ri.ex_gw_port:
             self._set_subnet_info(ex_gw_port)
+            # The addresses of the device are reset when it is configured
+            ri.floating_ip_cidrs = None
             self.external_gateway_added(ri, ex_gw_port,
                                         interface_name, internal_cidrs)
         elif not ex_gw_port and ri.ex_gw_port:
+            ri.floating_ip_cidrs = None
             self.external_gateway_removed(ri, ri.ex_gw_port,
                                           interface_name, internal_cidrs)
 
@@ -431,6 +522,16 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
 
     def _handle_router_snat_rules(self, ri, ex_gw_port, internal_cidrs,
                                   interface_name, action):
+        rules = []
+        if action == 'add_rules' and ex_gw_port:
+            # ex_gw_port should not be None in this case
+            ex_gw_ip = ex_gw_port['fixed_ips'][0]['ip_address']
+            rules = self.external_gateway_nat_rules(ex_gw_ip,
+                                                    internal_cidrs,
+                                                    interface_name)
+        if rules == ri.snat_rules:
+            return
+
         # Remove all the rules
         # This is safe because if use_namespaces is set as False
         # then the agent can only configure one router, otherwise
@@ -442,56 +543,99 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
         ri.iptables_manager.ipv4['nat'].add_rule('snat', '-j $float-snat')
 
         # And add them back if the action if add_rules
-        if action == 'add_rules' and ex_gw_port:
-            # ex_gw_port should not be None in this case
-            ex_gw_ip = ex_gw_port['fixed_ips'][0]['ip_address']
-            for rule in self.external_gateway_nat_rules(ex_gw_ip,
-                                                        internal_cidrs,
-                                                        interface_name):
-                ri.iptables_manager.ipv4['nat'].add_rule(*rule)
+        for rule in rules:
+            ri.iptables_manager.ipv4['nat'].add_rule(*rule)
+        ri.snat_rules = rules
         ri.iptables_manager.apply()
 
     def process_router_floating_ips(self, ri, ex_gw_port):
         """Configure the router's floating IPs
         Configures floating ips in iptables and on the router's gateway device.
 
-        Cleans up floating ips that should not longer be configured.
+        Only the differences with the floating IPs previously configured are
+        applied. The addresses of the device are listed when they are not
+        known, e.g. after the gateway was added.
         """
         interface_name = self.get_external_device_name(ex_gw_port['id'])
         device = ip_lib.IPDevice(interface_name, self.root_helper,
                                  namespace=ri.ns_name())
+        floating_ips = dict(
+            (fip['floating_ip_address'], fip['fixed_ip_address'])
+            for fip in ri.router.get(l3_constants.FLOATINGIP_KEY, []))
+
+        # Update the iptables rules of the floating IPs changed
+        nat = ri.iptables_manager.ipv4['nat']
+        for fip_ip, fixed in ri.floating_ips.iteritems():
+            if floating_ips.get(fip_ip) != fixed:
+                for chain, rule in self.floating_forward_rules(fip_ip, fixed):
+                    nat.remove_rule(chain, rule)
+        for fip_ip, fixed in floating_ips.iteritems():
+            if ri.floating_ips.get(fip_ip) != fixed:
+                for chain, rule in self.floating_forward_rules(fip_ip, fixed):
+                    nat.add_rule(chain, rule, tag='floating_ip')
+        ri.floating_ips = floating_ips
+
+        existing_cidrs = ri.floating_ip_cidrs
+        if existing_cidrs is None:
+            existing_cidrs = self._get_floating_ip_cidrs(device)
+        new_cidrs = set(str(fip_ip) + FLOATING_IP_CIDR_SUFFIX
+                        for fip_ip in floating_ips)
+        # Unknown until the changes below succeed
+        ri.floating_ip_cidrs = None
+
+        for ip_cidr in new_cidrs - existing_cidrs:
+            net = netaddr.IPNetwork(ip_cidr)
+            device.addr.add(net.version, ip_cidr, str(net.broadcast))
+            self._send_gratuitous_arp_packet(ri, interface_name,
+                                             ip_cidr.split('/')[0])
 
-        # Clear out all iptables rules for floating ips
-        ri.iptables_manager.ipv4['nat'].clear_rules_by_tag('floating_ip')
+        ri.iptables_manager.apply()
 
-        existing_cidrs = set([addr['cidr'] for addr in device.addr.list()])
-        new_cidrs = set()
+        # Clean up addresses that no longer belong on the gateway interface.
+        for ip_cidr in existing_cidrs - new_cidrs:
+            net = netaddr.IPNetwork(ip_cidr)
+            device.addr.delete(net.version, ip_cidr)
+        ri.floating_ip_cidrs = new_cidrs
 
-        # Loop once to ensure that floating ips are configured.
-        for fip in ri.router.get(l3_constants.FLOATINGIP_KEY, []):
-            fip_ip = fip['floating_ip_address']
-            ip_cidr = str(fip_ip) + FLOATING_IP_CIDR_SUFFIX
+    def _get_floating_ip_cidrs(self, device):
+        return set(addr['cidr'] for addr in device.addr.list()
+                   if addr['cidr'].endswith(FLOATING_IP_CIDR_SUFFIX))
 
-            new_cidrs.add(ip_cidr)
+    def _verify_router(self, ri):
+        """Check the devices and addresses applied to ri against the kernel.
 
-            if ip_cidr not in existing_cidrs:
-                net = netaddr.IPNetwork(ip_cidr)
-                device.addr.add(net.version, ip_cidr, str(net.broadcast))
-                self._send_gratuitous_arp_packet(ri, interface_name, fip_ip)
+        The state of the devices missing or with different addresses is
+        forgotten, so that they are configured again when the router is
+        processed.
+        """
+        ns_name = ri.ns_name()
 
-            # Rebuild iptables rules for the floating ip.
-            fixed = fip['fixed_ip_address']
-            for chain, rule in self.floating_forward_rules(fip_ip, fixed):
-                ri.iptables_manager.ipv4['nat'].add_rule(chain, rule,
-                                                         tag='floating_ip')
+        def device_exists(name):
+            return ip_lib.device_exists(name, root_helper=self.root_helper,
+                                        namespace=ns_name)
 
-        ri.iptables_manager.apply()
+        missing_ports = [p for p in ri.internal_ports if not device_exists(
+            self.get_internal_device_name(p['id']))]
+        for p in missing_ports:
+            LOG.warn(_("Device of port %(port)s of router %(router)s is "
+                       "missing"), {'port': p['id'], 'router': ri.router_id})
+            ri.internal_ports.remove(p)
 
-        # Clean up addresses that no longer belong on the gateway interface.
-        for ip_cidr in existing_cidrs - new_cidrs:
-            if ip_cidr.endswith(FLOATING_IP_CIDR_SUFFIX):
-                net = netaddr.IPNetwork(ip_cidr)
-                device.addr.delete(net.version, ip_cidr)
+        if not ri.ex_gw_port:
+            return
+        interface_name = self.get_external_device_name(ri.ex_gw_port['id'])
+        if not device_exists(interface_name):
+            LOG.warn(_("Gateway device of router %s is missing"),
+                     ri.router_id)
+            ri.ex_gw_port = None
+            ri.floating_ip_cidrs = None
+        elif ri.floating_ip_cidrs is not None:
+            device = ip_lib.IPDevice(interface_name, self.root_helper,
+                                     namespace=ns_name)
+            if self._get_floating_ip_cidrs(device) != ri.floating_ip_cidrs:
+                LOG.warn(_("Floating IP addresses of router %s differ from "
+                           "the kernel"), ri.router_id)
+                ri.floating_ip_cidrs = None
 
     def _get_ex_gw_port(self, ri):
         return ri.router.get('gw_port')
@@ -626,7 +770,8 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
     def router_deleted(self, context, router_id):
         """Deal with router deletion RPC message."""
         LOG.debug(_('Got router deleted notification for %s'), router_id)
-        self.removed_routers.add(router_id)
+        self._queue.add(RouterUpdate(router_id, PRIORITY_RPC,
+                                     action=DELETE_ROUTER))
 
     def routers_updated(self, context, routers):
         """Deal with routers modification and creation RPC message."""
@@ -635,11 +780,13 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
             # This is needed for backward compatiblity
             if isinstance(routers[0], dict):
                 routers = [router['id'] for router in routers]
-            self.updated_routers.update(routers)
+            for router_id in routers:
+                self._queue.add(RouterUpdate(router_id, PRIORITY_RPC))
 
     def router_removed_from_agent(self, context, payload):
         LOG.debug(_('Got router removed from agent :%r'), payload)
-        self.removed_routers.add(payload['router_id'])
+        self._queue.add(RouterUpdate(payload['router_id'], PRIORITY_RPC,
+                                     action=DELETE_ROUTER))
 
     def router_added_to_agent(self, context, payload):
         LOG.debug(_('Got router added to agent :%r'), payload)
@@ -690,39 +837,52 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
             pool.spawn_n(self._router_removed, router_id)
         pool.waitall()
 
-    @lockutils.synchronized('l3-agent', 'neutron-')
-    def _rpc_loop(self):
-        # _rpc_loop and _sync_routers_task will not be
-        # executed in the same time because of lock.
-        # so we can clear the value of updated_routers
-        # and removed_routers
+    def _process_router_update(self, update):
+        router_id = update.id
+        processed_at = self._router_timestamps.get(router_id)
+        if processed_at and update.timestamp < processed_at:
+            LOG.debug(_("Skipping update of router %s older than the data "
+                        "already processed"), router_id)
+            return
         try:
-            LOG.debug(_("Starting RPC loop for %d updated routers"),
-                      len(self.updated_routers))
-            if self.updated_routers:
-                router_ids = list(self.updated_routers)
-                self.updated_routers.clear()
-                routers = self.plugin_rpc.get_routers(
-                    self.context, router_ids)
+            if update.verify and router_id in self.router_info:
+                self._verify_router(self.router_info[router_id])
+            timestamp = update.timestamp
+            if update.action == DELETE_ROUTER:
+                routers = []
+            elif update.router:
+                routers = [update.router]
+            else:
+                timestamp = timeutils.utcnow()
+                routers = self.plugin_rpc.get_routers(self.context,
+                                                      [router_id])
+            if routers:
                 self._process_routers(routers)
-            self._process_router_delete()
-            LOG.debug(_("RPC loop successfully completed"))
+            elif router_id in self.router_info:
+                self._router_removed(router_id)
+            self._router_timestamps[router_id] = timestamp
         except Exception:
-            LOG.exception(_("Failed synchronizing routers"))
+            LOG.exception(_("Failed processing router %s"), router_id)
             self.fullsync = True
 
-    def _process_router_delete(self):
-        current_removed_routers = list(self.removed_routers)
-        for router_id in current_removed_routers:
-            self._router_removed(router_id)
-            self.removed_routers.remove(router_id)
+    def _process_router_updates(self):
+        """Process the next router of the queue until it has no update."""
+        update = self._queue.get()
+        while update:
+            self._process_router_update(update)
+            update = self._queue.done(update.id)
+
+    def _process_routers_loop(self):
+        pool = eventlet.GreenPool(size=self.conf.num_router_threads)
+        while True:
+            # Blocks while num_router_threads routers are being processed
+            pool.spawn_n(self._process_router_updates)
 
     def _router_ids(self):
         if not self.conf.use_namespaces:
             return [self.conf.router_id]
 
     @periodic_task.periodic_task
-    @lockutils.synchronized('l3-agent', 'neutron-')
     def _sync_routers_task(self, context):
         if self.services_sync:
             super(L3NATAgent, self).process_services_sync(context)
@@ -730,22 +890,46 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
                   self.fullsync)
         if not self.fullsync:
             return
+        # The routers updated after the fetch are processed with newer data
+        timestamp = timeutils.utcnow()
         try:
             router_ids = self._router_ids()
-            self.updated_routers.clear()
-            self.removed_routers.clear()
             routers = self.plugin_rpc.get_routers(
                 context, router_ids)
 
-            LOG.debug(_('Processing :%r'), routers)
-            self._process_routers(routers, all_routers=True)
+            LOG.debug(_('Queuing :%r'), routers)
+            for router in routers:
+                self._queue.add(RouterUpdate(
+                    router['id'], PRIORITY_SYNC_ROUTERS_TASK, router=router,
+                    timestamp=timestamp))
+            removed_ids = set(self.router_info) - set(r['id'] for r in routers)
+            for router_id in removed_ids:
+                self._queue.add(RouterUpdate(
+                    router_id, PRIORITY_SYNC_ROUTERS_TASK,
+                    action=DELETE_ROUTER, timestamp=timestamp))
             self.fullsync = False
             LOG.debug(_("_sync_routers_task successfully completed"))
         except Exception:
             LOG.exception(_("Failed synchronizing routers"))
             self.fullsync = True
 
+    @periodic_task.periodic_task
+    def _verify_routers_task(self, context):
+        interval = self.conf.router_verify_interval
+        if interval <= 0 or time.time() - self._verified_at < interval:
+            return
+        self._verified_at = time.time()
+        for router_id, ri in self.router_info.items():
+            timestamp = self._router_timestamps.get(router_id)
+            if timestamp:
+                # Processed again with the data last processed, unless
+                # newer updates are queued
+                self._queue.add(RouterUpdate(
+                    router_id, PRIORITY_SYNC_ROUTERS_TASK, router=ri.router,
+                    timestamp=timestamp, verify=True))
+
     def after_start(self):
+        eventlet.spawn_n(self._process_routers_loop)
         LOG.info(_("L3 agent started"))
 
     def _update_routing_table(self, ri, operation, route):
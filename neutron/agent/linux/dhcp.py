@@ -22,8 +22,10 @@ import shutil
 import socket
 import StringIO
 import sys
+import time
 import uuid
 
+import eventlet
 import netaddr
 from oslo.config import cfg
 import six
@@ -58,6 +60,10 @@ OPTS = [
         'dnsmasq_lease_max',
         default=(2 ** 24),
         help=_('Limit number of leases to prevent a denial-of-service.')),
+    cfg.IntOpt('dnsmasq_reload_interval', default=1,
+               help=_('Minimum number of seconds between two reloads of a '
+                      'dnsmasq process. The configuration changes made in '
+                      'between are applied by a single reload.')),
     cfg.StrOpt('interface_driver',
                help=_("The driver used to manage the virtual interface.")),
 ]
@@ -281,6 +287,16 @@ class Dnsmasq(DhcpLocalProcess):
     NEUTRON_NETWORK_ID_KEY = 'NEUTRON_NETWORK_ID'
     NEUTRON_RELAY_SOCKET_PATH_KEY = 'NEUTRON_RELAY_SOCKET_PATH'
     MINIMUM_VERSION = 2.59
+    # dnsmasq reads the new files of --dhcp-hostsdir by itself since 2.73
+    HOSTSDIR_MINIMUM_VERSION = 2.73
+
+    # The driver is instantiated for each action of the agent, so the
+    # content last written to each config file, and the pending and last
+    # reloads of each network are kept by the class.
+    _conf_file_contents = {}
+    _pending_reloads = {}
+    _last_reloads = {}
+    _reload_needed = False
 
     @classmethod
     def check_version(cls):
@@ -312,11 +328,30 @@ class Dnsmasq(DhcpLocalProcess):
             if uuidutils.is_uuid_like(c)
         ]
 
+    def _use_hostsdir(self):
+        return self.version >= self.HOSTSDIR_MINIMUM_VERSION
+
+    def disable(self, retain_port=False):
+        """Disable DHCP for this network by killing the local process."""
+        pending = self._pending_reloads.pop(self.network.id, None)
+        if pending:
+            pending.cancel()
+        self._last_reloads.pop(self.network.id, None)
+        super(Dnsmasq, self).disable(retain_port)
+        conf_dir = self.get_conf_file_name('')
+        for name in self._conf_file_contents.keys():
+            if name.startswith(conf_dir):
+                del self._conf_file_contents[name]
+
     def spawn_process(self):
         """Spawns a Dnsmasq process for the network."""
         env = {
             self.NEUTRON_NETWORK_ID_KEY: self.network.id,
         }
+        if self._use_hostsdir():
+            hosts_option = '--dhcp-hostsdir=%s'
+        else:
+            hosts_option = '--dhcp-hostsfile=%s'
 
         cmd = [
             'dnsmasq',
@@ -328,7 +363,7 @@ class Dnsmasq(DhcpLocalProcess):
             '--except-interface=lo',
             '--pid-file=%s' % self.get_conf_file_name(
                 'pid', ensure_conf_dir=True),
-            '--dhcp-hostsfile=%s' % self._output_hosts_file(),
+            hosts_option % self._output_hosts_file(),
             '--dhcp-optsfile=%s' % self._output_opts_file(),
             '--leasefile-ro',
         ]
@@ -400,41 +435,118 @@ class Dnsmasq(DhcpLocalProcess):
                         'turned off DHCP: %s'), self.network.id)
             return
 
+        self._reload_needed = False
         self._output_hosts_file()
         self._output_opts_file()
-        if self.active:
-            cmd = ['kill', '-HUP', self.pid]
-            utils.execute(cmd, self.root_helper)
-        else:
+        if not self.active:
             LOG.debug(_('Pid %d is stale, relaunching dnsmasq'), self.pid)
+        elif self._reload_needed:
+            self._schedule_reload()
+        else:
+            LOG.debug(_('Configuration of dnsmasq for network %s is up to '
+                        'date'), self.network.id)
         LOG.debug(_('Reloading allocations for network: %s'), self.network.id)
         self.device_manager.update(self.network)
 
-    def _output_hosts_file(self):
-        """Writes a dnsmasq compatible hosts file."""
+    def _schedule_reload(self):
+        """Reload dnsmasq, at most once per dnsmasq_reload_interval.
+
+        The reloads requested while one is pending are merged into it.
+        """
+        network_id = self.network.id
+        if network_id in self._pending_reloads:
+            return
+        delay = (self._last_reloads.get(network_id, 0) +
+                 self.conf.dnsmasq_reload_interval - time.time())
+        if delay > 0:
+            self._pending_reloads[network_id] = eventlet.spawn_after(
+                delay, self._deferred_reload)
+        else:
+            self._reload()
+
+    def _deferred_reload(self):
+        try:
+            if self.active:
+                self._reload()
+            else:
+                self._pending_reloads.pop(self.network.id, None)
+        except Exception:
+            LOG.exception(_('Unable to reload dnsmasq for network %s'),
+                          self.network.id)
+
+    def _reload(self):
+        self._pending_reloads.pop(self.network.id, None)
+        self._last_reloads[self.network.id] = time.time()
+        cmd = ['kill', '-HUP', self.pid]
+        utils.execute(cmd, self.root_helper)
+
+    def _write_conf_file(self, name, content):
+        """Write content to the config file name, unless it already has it.
+
+        Sets _reload_needed when the file is written.
+        """
+        if self._conf_file_contents.get(name) == content:
+            return
+        utils.replace_file(name, content)
+        self._conf_file_contents[name] = content
+        self._reload_needed = True
+
+    def _format_hosts(self, port):
+        """Return the lines of the hosts file for port."""
         r = re.compile('[:.]')
         buf = StringIO.StringIO()
+        for alloc in port.fixed_ips:
+            name = 'host-%s.%s' % (r.sub('-', alloc.ip_address),
+                                   self.conf.dhcp_domain)
+            set_tag = ''
+            if getattr(port, 'extra_dhcp_opts', False):
+                if self.version >= self.MINIMUM_VERSION:
+                    set_tag = 'set:'
 
-        for port in self.network.ports:
-            for alloc in port.fixed_ips:
-                name = 'host-%s.%s' % (r.sub('-', alloc.ip_address),
-                                       self.conf.dhcp_domain)
-                set_tag = ''
-                if getattr(port, 'extra_dhcp_opts', False):
-                    if self.version >= self.MINIMUM_VERSION:
-                        set_tag = 'set:'
-
-                    buf.write('%s,%s,%s,%s%s\n' %
-                              (port.mac_address, name, alloc.ip_address,
-                               set_tag, port.id))
-                else:
-                    buf.write('%s,%s,%s\n' %
-                              (port.mac_address, name, alloc.ip_address))
+                buf.write('%s,%s,%s,%s%s\n' %
+                          (port.mac_address, name, alloc.ip_address,
+                           set_tag, port.id))
+            else:
+                buf.write('%s,%s,%s\n' %
+                          (port.mac_address, name, alloc.ip_address))
+        return buf.getvalue()
 
+    def _output_hosts_file(self):
+        """Writes a dnsmasq compatible hosts file."""
+        if self._use_hostsdir():
+            return self._output_hosts_dir()
         name = self.get_conf_file_name('host')
-        utils.replace_file(name, buf.getvalue())
+        self._write_conf_file(name, ''.join(self._format_hosts(port)
+                                            for port in self.network.ports))
         return name
 
+    def _output_hosts_dir(self):
+        """Writes a dnsmasq compatible hosts file per port in a directory.
+
+        Only the files of the changed ports are written. dnsmasq reads the
+        new files by itself, a reload is only needed to forget the hosts of
+        the changed and removed files.
+        """
+        hosts_dir = self.get_conf_file_name('hostsdir', ensure_conf_dir=True)
+        if not os.path.isdir(hosts_dir):
+            os.mkdir(hosts_dir, 0o755)
+        reload_needed = self._reload_needed
+        port_ids = set()
+        for port in self.network.ports:
+            port_ids.add(port.id)
+            name = os.path.join(hosts_dir, port.id)
+            content = self._format_hosts(port)
+            if self._conf_file_contents.get(name) != content:
+                reload_needed |= os.path.exists(name)
+                self._write_conf_file(name, content)
+        for file_name in set(os.listdir(hosts_dir)) - port_ids:
+            name = os.path.join(hosts_dir, file_name)
+            os.remove(name)
+            self._conf_file_contents.pop(name, None)
+            reload_needed = True
+        self._reload_needed = reload_needed
+        return hosts_dir
+
     def _output_opts_file(self):
         """Write a dnsmasq compatible options file."""
 
@@ -487,7 +599,7 @@ class Dnsmasq(DhcpLocalProcess):
                     for opt in port.extra_dhcp_opts)
 
         name = self.get_conf_file_name('opts')
-        utils.replace_file(name, '\n'.join(options))
+        self._write_conf_file(name, '\n'.join(options))
         return name
 
     def _make_subnet_interface_ip_map(self):
@@ -0,0 +1,87 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from neutron.agent.linux import utils as linux_utils
+from neutron.common import constants
+from neutron.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+# ipset names are limited to 31 characters
+MAX_NAME_LEN = 31
+SET_PREFIX = 'N'
+FAMILY = {constants.IPv4: 'inet',
+          constants.IPv6: 'inet6'}
+
+
+class IpsetManager(object):
+    """Wrapper for ipset.
+
+    Sets are created on first use, then their members are changed in place:
+    each update only adds and removes the difference with the members
+    previously set, in a single ipset restore call.
+    """
+
+    def __init__(self, execute=None, root_helper=None):
+        self.execute = execute or linux_utils.execute
+        self.root_helper = root_helper
+        # Members of the sets managed by this instance, by set name
+        self.sets = {}
+
+    @staticmethod
+    def get_name(id, ethertype):
+        """Return the name of the set of security group id for ethertype."""
+        return (SET_PREFIX + ethertype + id)[:MAX_NAME_LEN]
+
+    def set_members(self, id, ethertype, members):
+        """Make members the content of the set of id for ethertype."""
+        name = self.get_name(id, ethertype)
+        members = set(members)
+        previous = self.sets.get(name)
+        commands = []
+        if previous is None:
+            # The set may be left over by a previous run of the agent
+            commands.append('create %s hash:net family %s' %
+                            (name, FAMILY[ethertype]))
+            commands.append('flush %s' % name)
+            previous = set()
+        commands += ['add %s %s' % (name, member)
+                     for member in sorted(members - previous)]
+        commands += ['del %s %s' % (name, member)
+                     for member in sorted(previous - members)]
+        if commands:
+            LOG.debug(_("Updating ipset %(name)s: %(count)d changes"),
+                      {'name': name, 'count': len(commands)})
+            self._restore(commands)
+        self.sets[name] = members
+        return name
+
+    def destroy_unused(self, names):
+        """Destroy the sets not in names.
+
+        This must be called once iptables rules no longer reference them.
+        """
+        for name in set(self.sets) - set(names):
+            LOG.debug(_("Destroying ipset %s"), name)
+            self.execute(['ipset', 'destroy', name],
+                         root_helper=self.root_helper)
+            del self.sets[name]
+
+    def _restore(self, commands):
+        self.execute(['ipset', 'restore', '-exist'],
+                     process_input='\n'.join(commands) + '\n',
+                     root_helper=self.root_helper)
@@ -19,6 +19,7 @@ import netaddr
 from oslo.config import cfg
 
 from neutron.agent import firewall
+from neutron.agent.linux import ipset_manager
 from neutron.agent.linux import iptables_manager
 from neutron.common import constants
 from neutron.openstack.common import log as logging
@@ -32,6 +33,10 @@ SPOOF_FILTER = 'spoof-filter'
 CHAIN_NAME_PREFIX = {INGRESS_DIRECTION: 'i',
                      EGRESS_DIRECTION: 'o',
                      SPOOF_FILTER: 's'}
+DIRECTION_IP_PREFIX = {INGRESS_DIRECTION: 'source_ip_prefix',
+                       EGRESS_DIRECTION: 'dest_ip_prefix'}
+IPSET_DIRECTION = {INGRESS_DIRECTION: 'src',
+                   EGRESS_DIRECTION: 'dst'}
 LINUX_DEV_LEN = 14
 
 
@@ -49,6 +54,15 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
         self._add_fallback_chain_v4v6()
         self._defer_apply = False
         self._pre_defer_filtered_ports = None
+        self.ipset = None
+        if cfg.CONF.SECURITYGROUP.enable_ipset:
+            self.ipset = ipset_manager.IpsetManager(
+                root_helper=cfg.CONF.AGENT.root_helper)
+        # With ipset, what the chains of each port are built from, and
+        # whether chains changed while applying was deferred
+        self._filter_keys = {}
+        self._chains_changed = False
+        self._ipset_names = []
 
     @property
     def ports(self):
@@ -56,11 +70,13 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
 
     def prepare_port_filter(self, port):
         LOG.debug(_("Preparing device (%s) filter"), port['device'])
+        self._set_filter_key(port)
+        self._chains_changed = True
         self._remove_chains()
         self.filtered_ports[port['device']] = port
         # each security group has it own chains
         self._setup_chains()
-        self.iptables.apply()
+        self._apply()
 
     def update_port_filter(self, port):
         LOG.debug(_("Updating device (%s) filter"), port['device'])
@@ -68,10 +84,19 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
             LOG.info(_('Attempted to update port filter which is not '
                        'filtered %s'), port['device'])
             return
+        if not self._set_filter_key(port):
+            # Only the members of remote groups changed, the sets are
+            # updated in place
+            LOG.debug(_("Updating device (%s) ipset members"),
+                      port['device'])
+            self.filtered_ports[port['device']] = port
+            if not self._defer_apply:
+                self._update_ipsets(self.filtered_ports)
+            return
         self._remove_chains()
         self.filtered_ports[port['device']] = port
         self._setup_chains()
-        self.iptables.apply()
+        self._apply()
 
     def remove_port_filter(self, port):
         LOG.debug(_("Removing device (%s) filter"), port['device'])
@@ -79,10 +104,72 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
             LOG.info(_('Attempted to remove port filter which is not '
                        'filtered %r'), port)
             return
+        self._filter_keys.pop(port['device'], None)
+        self._chains_changed = True
         self._remove_chains()
         self.filtered_ports.pop(port['device'], None)
         self._setup_chains()
+        self._apply()
+
+    def _apply(self):
         self.iptables.apply()
+        if self.ipset and not self._defer_apply:
+            self._destroy_unused_ipsets()
+
+    def _get_filter_key(self, port):
+        """Return what the chains of port are built from.
+
+        The member IP addresses of the remote groups are left out, since
+        they are matched with ipsets.
+        """
+        rules = set()
+        for rule in port.get('security_group_rules', []):
+            if rule.get('remote_group_id'):
+                ip_prefix = DIRECTION_IP_PREFIX[rule['direction']]
+                rule = dict((k, v) for k, v in rule.iteritems()
+                            if k != ip_prefix)
+            rules.add(tuple(sorted(rule.iteritems())))
+        address_pairs = tuple(
+            sorted((pair['mac_address'], pair['ip_address'])
+                   for pair in port.get('allowed_address_pairs') or []))
+        return (port.get('mac_address'), tuple(port.get('fixed_ips', [])),
+                address_pairs, frozenset(rules))
+
+    def _set_filter_key(self, port):
+        """Record the filter key of port.
+
+        :returns: whether the chains of port need to be rebuilt
+        """
+        if not self.ipset:
+            return True
+        key = self._get_filter_key(port)
+        if self._filter_keys.get(port['device']) == key:
+            return False
+        self._filter_keys[port['device']] = key
+        self._chains_changed = True
+        return True
+
+    def _get_ipset_members(self, ports):
+        """Return the member IP prefixes by (remote group, ethertype)."""
+        members = {}
+        for port in ports.values():
+            for rule in port.get('security_group_rules', []):
+                remote_group_id = rule.get('remote_group_id')
+                ip_prefix = rule.get(DIRECTION_IP_PREFIX[rule['direction']])
+                if remote_group_id and ip_prefix:
+                    key = (remote_group_id, rule['ethertype'])
+                    members.setdefault(key, set()).add(ip_prefix)
+        return members
+
+    def _update_ipsets(self, ports):
+        members = self._get_ipset_members(ports)
+        for (remote_group_id, ethertype), ips in members.iteritems():
+            self.ipset.set_members(remote_group_id, ethertype, ips)
+        self._ipset_names = [self.ipset.get_name(remote_group_id, ethertype)
+                             for remote_group_id, ethertype in members]
+
+    def _destroy_unused_ipsets(self):
+        self.ipset.destroy_unused(self._ipset_names)
 
     def _setup_chains(self):
         """Setup ingress and egress chain for a port."""
@@ -90,6 +177,9 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
             self._setup_chains_apply(self.filtered_ports)
 
     def _setup_chains_apply(self, ports):
+        if self.ipset:
+            # Sets must exist before the rules referencing them are applied
+            self._update_ipsets(ports)
         self._add_chain_by_name_v4v6(SG_CHAIN)
         for port in ports.values():
             self._setup_chain(port, INGRESS_DIRECTION)
@@ -282,15 +372,19 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
         iptables_rules = []
         self._drop_invalid_packets(iptables_rules)
         self._allow_established(iptables_rules)
+        ipset_rules = set()
         for rule in security_group_rules:
+            use_ipset = self.ipset and rule.get('remote_group_id')
             # These arguments MUST be in the format iptables-save will
-            # display them: source/dest, protocol, sport, dport, target
-            # Otherwise the iptables_manager code won't be able to find
-            # them to preserve their [packet:byte] counts.
-            args = self._ip_prefix_arg('s',
-                                       rule.get('source_ip_prefix'))
-            args += self._ip_prefix_arg('d',
-                                        rule.get('dest_ip_prefix'))
+            # display them: source/dest, protocol, sport, dport, set,
+            # target. Otherwise the iptables_manager code won't be able to
+            # find them to preserve their [packet:byte] counts.
+            args = []
+            if not use_ipset:
+                args += self._ip_prefix_arg('s',
+                                            rule.get('source_ip_prefix'))
+                args += self._ip_prefix_arg('d',
+                                            rule.get('dest_ip_prefix'))
             args += self._protocol_arg(rule.get('protocol'))
             args += self._port_arg('sport',
                                    rule.get('protocol'),
@@ -300,8 +394,17 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
                                    rule.get('protocol'),
                                    rule.get('port_range_min'),
                                    rule.get('port_range_max'))
+            if use_ipset:
+                args += self._ipset_arg(rule)
             args += ['-j RETURN']
-            iptables_rules += [' '.join(args)]
+            iptables_rule = ' '.join(args)
+            if use_ipset:
+                # The rules of all the members of a remote group are
+                # replaced by a single one
+                if iptables_rule in ipset_rules:
+                    continue
+                ipset_rules.add(iptables_rule)
+            iptables_rules += [iptables_rule]
 
         iptables_rules += ['-j $sg-fallback']
 
@@ -345,6 +448,11 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
             return ['-%s' % direction, ip_prefix]
         return []
 
+    def _ipset_arg(self, rule):
+        name = self.ipset.get_name(rule['remote_group_id'], rule['ethertype'])
+        return ['-m set --match-set', name,
+                IPSET_DIRECTION[rule['direction']]]
+
     def _port_chain_name(self, port, direction):
         return iptables_manager.get_chain_name(
             '%s%s' % (CHAIN_NAME_PREFIX[direction], port['device'][3:]))
@@ -353,15 +461,24 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
         if not self._defer_apply:
             self.iptables.defer_apply_on()
             self._pre_defer_filtered_ports = dict(self.filtered_ports)
+            self._chains_changed = False
             self._defer_apply = True
 
     def filter_defer_apply_off(self):
         if self._defer_apply:
             self._defer_apply = False
+            if self.ipset and not self._chains_changed:
+                # Only the members of remote groups changed
+                self._pre_defer_filtered_ports = None
+                self._update_ipsets(self.filtered_ports)
+                self.iptables.defer_apply_off(apply=False)
+                return
             self._remove_chains_apply(self._pre_defer_filtered_ports)
             self._pre_defer_filtered_ports = None
             self._setup_chains_apply(self.filtered_ports)
             self.iptables.defer_apply_off()
+            if self.ipset:
+                self._destroy_unused_ipsets()
 
 
 class OVSHybridIptablesFirewallDriver(IptablesFirewallDriver):
@@ -21,8 +21,12 @@
 
 """Implements iptables rules using linux utilities."""
 
+import hashlib
 import inspect
 import os
+import re
+
+from oslo.config import cfg
 
 from neutron.agent.linux import utils as linux_utils
 from neutron.common import utils
@@ -30,6 +34,18 @@ from neutron.openstack.common import log as logging
 
 LOG = logging.getLogger(__name__)
 
+OPTS = [
+    cfg.BoolOpt('iptables_incremental_apply', default=False,
+                help=_("Only restore the chains changed since the previous "
+                       "apply with iptables-restore --noflush. The whole "
+                       "ruleset is restored when the rules of this agent "
+                       "were changed outside of it")),
+]
+cfg.CONF.register_opts(OPTS)
+
+# [packet:byte] counters of iptables-save output
+COUNTERS_RE = re.compile(r'\[\d+:\d+\]')
+
 
 # NOTE(vish): Iptables supports chain names of up to 28 characters,  and we
 #             add up to 12 characters to binary_name which is used as a prefix,
@@ -277,6 +293,10 @@ class IptablesManager(object):
         self.namespace = namespace
         self.iptables_apply_deferred = False
         self.wrap_name = binary_name[:16]
+        self.incremental = cfg.CONF.iptables_incremental_apply
+        # Maps the iptables command to the state of the last apply, used by
+        # the incremental mode
+        self._applied = {}
 
         self.ipv4 = {'filter': IptablesTable(binary_name=self.wrap_name)}
         self.ipv6 = {'filter': IptablesTable(binary_name=self.wrap_name)}
@@ -341,9 +361,10 @@ class IptablesManager(object):
     def defer_apply_on(self):
         self.iptables_apply_deferred = True
 
-    def defer_apply_off(self):
+    def defer_apply_off(self, apply=True):
         self.iptables_apply_deferred = False
-        self._apply()
+        if apply:
+            self._apply()
 
     def apply(self):
         if self.iptables_apply_deferred:
@@ -365,22 +386,159 @@ class IptablesManager(object):
             s += [('ip6tables', self.ipv6)]
 
         for cmd, tables in s:
+            all_tables = None
+            if self.incremental and cmd in self._applied:
+                # The only dump of the kernel rules of the apply
+                all_tables = self._run(['%s-save' % cmd, '-c'])
+                if self._apply_incremental(cmd, tables, all_tables):
+                    continue
+            self._apply_full(cmd, tables, all_tables)
+        LOG.debug(_("IPTablesManager.apply completed with success"))
+
+    def _run(self, args, process_input=None):
+        if self.namespace:
+            args = ['ip', 'netns', 'exec', self.namespace] + args
+        return self.execute(args, process_input=process_input,
+                            root_helper=self.root_helper)
+
+    def _apply_full(self, cmd, tables, all_tables=None):
+        if all_tables is None:
             args = ['%s-save' % (cmd,), '-c']
             if self.namespace:
                 args = ['ip', 'netns', 'exec', self.namespace] + args
             all_tables = self.execute(args, root_helper=self.root_helper)
-            all_lines = all_tables.split('\n')
-            for table_name, table in tables.iteritems():
-                start, end = self._find_table(all_lines, table_name)
-                all_lines[start:end] = self._modify_rules(
-                    all_lines[start:end], table, table_name)
-
-            args = ['%s-restore' % (cmd,), '-c']
-            if self.namespace:
-                args = ['ip', 'netns', 'exec', self.namespace] + args
-            self.execute(args, process_input='\n'.join(all_lines),
-                         root_helper=self.root_helper)
-        LOG.debug(_("IPTablesManager.apply completed with success"))
+        all_lines = all_tables.split('\n')
+        for table_name, table in tables.iteritems():
+            start, end = self._find_table(all_lines, table_name)
+            all_lines[start:end] = self._modify_rules(
+                all_lines[start:end], table, table_name)
+
+        args = ['%s-restore' % (cmd,), '-c']
+        if self.namespace:
+            args = ['ip', 'netns', 'exec', self.namespace] + args
+        self.execute(args, process_input='\n'.join(all_lines),
+                     root_helper=self.root_helper)
+        if self.incremental:
+            self._applied[cmd] = self._get_state(tables)
+
+    def _apply_incremental(self, cmd, tables, all_tables):
+        """Restore only the wrapped chains changed since the last apply.
+
+        Declaring an existing chain with iptables-restore --noflush flushes
+        it, so every changed chain is declared and all its rules are
+        written again; removed chains are flushed and deleted.
+
+        :param all_tables: the iptables-save output of the kernel rules.
+        :returns: False if the whole ruleset has to be restored instead,
+                  because the rules of this manager were changed in the
+                  kernel, or unwrapped chains changed
+        """
+        old_state = self._applied[cmd]
+        if (self._get_kernel_checksum(all_tables) !=
+                self._get_checksum(old_state)):
+            LOG.warn(_("%s rules changed since the last apply; restoring "
+                       "all of them"), cmd)
+            return False
+        state = self._get_state(tables)
+        lines = []
+        for table_name, table in tables.iteritems():
+            old_chains, old_unwrapped = old_state.get(table_name,
+                                                      (None, None))
+            chains, unwrapped = state[table_name]
+            if (old_chains is None or old_unwrapped != unwrapped or
+                    table.remove_chains or table.remove_rules):
+                return False
+            changed = sorted(name for name, rules in chains.iteritems()
+                             if old_chains.get(name) != rules)
+            removed = sorted(set(old_chains) - set(chains))
+            if not changed and not removed:
+                continue
+            lines.append('*%s' % table_name)
+            lines += [':%s - [0:0]' % name for name in changed + removed]
+            for name in changed:
+                lines += chains[name]
+            lines += ['-X %s' % name for name in removed]
+            lines.append('COMMIT')
+        if lines:
+            self._run(['%s-restore' % cmd, '-n'],
+                      process_input='\n'.join(lines) + '\n')
+        self._applied[cmd] = state
+        return True
+
+    def _get_state(self, tables):
+        """Return the rules of the tables, by table name.
+
+        For each table the state is a tuple of a dict mapping wrapped chain
+        names to their rules, and the rules of the unwrapped chains.
+        """
+        state = {}
+        for table_name, table in tables.iteritems():
+            chains = dict(('%s-%s' % (self.wrap_name, name), [])
+                          for name in table.chains)
+            unwrapped = [sorted(table.unwrapped_chains)]
+            rules = ([rule for rule in table.rules if rule.top] +
+                     [rule for rule in table.rules if not rule.top])
+            for rule in rules:
+                if rule.wrap:
+                    chain = '%s-%s' % (self.wrap_name, rule.chain)
+                    chains.setdefault(chain, []).append(str(rule))
+                else:
+                    unwrapped.append(str(rule))
+            for name, chain_rules in chains.iteritems():
+                # As for a full apply, the last duplicate rule is kept
+                seen = set()
+                kept = []
+                for rule in reversed(chain_rules):
+                    if rule not in seen:
+                        seen.add(rule)
+                        kept.append(rule)
+                kept.reverse()
+                chains[name] = kept
+            state[table_name] = (chains, unwrapped)
+        return state
+
+    @staticmethod
+    def _checksum(chains):
+        checksum = hashlib.md5()
+        for key in sorted(chains):
+            checksum.update('%s %s %d\n' % (key + (chains[key],)))
+        return checksum.hexdigest()
+
+    def _get_checksum(self, state):
+        """Return the checksum of the rules of this manager in state.
+
+        The checksum covers the wrapped chains and the number of rules
+        referring to this manager in each chain, which is what the kernel
+        dump is compared with: iptables normalizes the text of the rules,
+        so the rules themselves cannot be compared without saving them
+        again after each restore.
+        """
+        chains = {}
+        for table_name, (wrapped, unwrapped) in state.iteritems():
+            for name, rules in wrapped.iteritems():
+                chains[(table_name, name)] = len(rules)
+            for rule in unwrapped[1:]:
+                if self.wrap_name in rule:
+                    key = (table_name, rule.split()[1])
+                    chains[key] = chains.get(key, 0) + 1
+        return self._checksum(chains)
+
+    def _get_kernel_checksum(self, all_tables):
+        """Return the checksum of the rules of this manager in a dump."""
+        chains = {}
+        table_name = ''
+        for line in all_tables.split('\n'):
+            line = COUNTERS_RE.sub('', line).strip()
+            if line.startswith('*'):
+                table_name = line[1:]
+            elif self.wrap_name not in line:
+                continue
+            elif line.startswith(':'):
+                chains.setdefault((table_name, line.split()[0][1:]), 0)
+            elif line.startswith('-A '):
+                key = (table_name, line.split()[1])
+                chains[key] = chains.get(key, 0) + 1
+        return self._checksum(chains)
 
     def _find_table(self, lines, table_name):
         if len(lines) < 3:
@@ -0,0 +1,668 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Minimal rtnetlink support, without any dependency on an external library.
+
+Only the messages used by the agents are handled: the link notifications
+received by LinkMonitor, and the link, bridge port, FDB and neighbour
+requests sent by IpRoute.
+"""
+
+import errno
+import os
+import struct
+
+import eventlet
+import eventlet.event
+from eventlet.green import socket
+import eventlet.semaphore
+import eventlet.timeout
+
+from neutron.openstack.common import excutils
+from neutron.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 0x1
+RTMGRP_NEIGH = 0x4
+
+AF_UNSPEC = 0
+AF_BRIDGE = 7
+
+# Message types
+NLMSG_NOOP = 1
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_NEWNEIGH = 28
+RTM_DELNEIGH = 29
+RTM_GETNEIGH = 30
+
+# Message flags
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_ACK = 0x4
+NLM_F_REPLACE = 0x100
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+NLM_F_APPEND = 0x800
+NLM_F_DUMP = 0x300
+
+# Link flags
+IFF_UP = 0x1
+
+# Link attributes
+IFLA_IFNAME = 3
+IFLA_LINK = 5
+IFLA_MASTER = 10
+IFLA_LINKINFO = 18
+IFLA_INFO_KIND = 1
+IFLA_INFO_DATA = 2
+IFLA_VLAN_ID = 1
+IFLA_VXLAN_ID = 1
+IFLA_VXLAN_GROUP = 2
+IFLA_VXLAN_LINK = 3
+IFLA_VXLAN_LOCAL = 4
+IFLA_VXLAN_TTL = 5
+IFLA_VXLAN_TOS = 6
+IFLA_VXLAN_PROXY = 11
+
+# Neighbour attributes, states and flags
+NDA_DST = 1
+NDA_LLADDR = 2
+NUD_PERMANENT = 0x80
+NTF_SELF = 0x2
+
+# struct nlmsghdr: length, type, flags, sequence number, port id
+NLMSG_HDR = struct.Struct('=IHHII')
+# struct nlmsgerr: error, followed by the header of the request
+NLMSG_ERR = struct.Struct('=i')
+# struct ifinfomsg: family, pad, type, index, flags, change
+IFINFOMSG = struct.Struct('=BxHiII')
+# struct ndmsg: family, pad, pad, index, state, flags, type
+NDMSG = struct.Struct('=BxxxiHBB')
+# struct rtattr: length, type
+RTA_HDR = struct.Struct('=HH')
+
+RECV_SIZE = 65536
+# Maximum size of the messages sent in a single datagram
+MAX_BATCH_SIZE = 32768
+# Seconds to wait for the replies of the kernel to a request
+REQUEST_TIMEOUT = 10
+
+SYS_CLASS_NET = '/sys/class/net'
+
+# Link events reported by LinkMonitor
+LINK_ADDED = 'added'
+LINK_REMOVED = 'removed'
+
+
+class NetlinkError(RuntimeError):
+
+    def __init__(self, code, message=None):
+        super(NetlinkError, self).__init__(message or os.strerror(code))
+        self.errno = code
+
+
+def align(length):
+    return (length + 3) & ~3
+
+
+def _pad(data):
+    return data + '\0' * (align(len(data)) - len(data))
+
+
+def parse_messages(data):
+    """Return the (type, seq, payload) of the messages of a datagram."""
+    messages = []
+    offset = 0
+    while offset + NLMSG_HDR.size <= len(data):
+        length, msg_type, _flags, seq, _pid = NLMSG_HDR.unpack_from(data,
+                                                                    offset)
+        if length < NLMSG_HDR.size or offset + length > len(data):
+            break
+        messages.append((msg_type, seq,
+                         data[offset + NLMSG_HDR.size:offset + length]))
+        offset += align(length)
+    return messages
+
+
+def parse_attrs(data, offset=0):
+    """Return a dict of the raw values of the rtattrs of a payload."""
+    attrs = {}
+    while offset + RTA_HDR.size <= len(data):
+        length, attr_type = RTA_HDR.unpack_from(data, offset)
+        if length < RTA_HDR.size or offset + length > len(data):
+            break
+        attrs[attr_type] = data[offset + RTA_HDR.size:offset + length]
+        offset += align(length)
+    return attrs
+
+
+def parse_link(payload):
+    """Return the index and the name of the link of a RTM_*LINK payload."""
+    _family, _type, index, _flags, _change = IFINFOMSG.unpack_from(payload)
+    name = parse_attrs(payload, IFINFOMSG.size).get(IFLA_IFNAME)
+    if name is not None:
+        name = name.split('\0', 1)[0]
+    return index, name
+
+
+def parse_neigh(payload):
+    """Return the family, index, MAC and destination of a RTM_*NEIGH."""
+    family, index, _state, _flags, _type = NDMSG.unpack_from(payload)
+    attrs = parse_attrs(payload, NDMSG.size)
+    mac = attrs.get(NDA_LLADDR)
+    if mac is not None:
+        mac = ':'.join('%02x' % ord(c) for c in mac)
+    dst = attrs.get(NDA_DST)
+    if dst is not None:
+        dst = socket.inet_ntop(socket.AF_INET if len(dst) == 4
+                               else socket.AF_INET6, dst)
+    return family, index, mac, dst
+
+
+def attr(attr_type, value):
+    return _pad(RTA_HDR.pack(RTA_HDR.size + len(value), attr_type) + value)
+
+
+def message(msg_type, flags, seq, payload):
+    return _pad(NLMSG_HDR.pack(NLMSG_HDR.size + len(payload), msg_type,
+                               flags, seq, 0) + payload)
+
+
+def _mac_to_bytes(mac):
+    return ''.join(chr(int(byte, 16)) for byte in mac.split(':'))
+
+
+def _ip_to_bytes(ip):
+    family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+    return family, socket.inet_pton(family, ip)
+
+
+class NetlinkMonitor(object):
+    """Receives the notifications of rtnetlink multicast groups.
+
+    Subclasses handle the messages in _handle_message() and are told by
+    _handle_lost() when notifications may have been lost: when the receive
+    buffer of the socket overflowed or the socket was closed.
+    """
+
+    groups = 0
+
+    def __init__(self, respawn_interval=None):
+        self.respawn_interval = respawn_interval
+        self._sock = None
+        self._thread = None
+
+    @property
+    def is_active(self):
+        return self._sock is not None
+
+    def _open(self):
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                             NETLINK_ROUTE)
+        try:
+            sock.bind((0, self.groups))
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def start(self):
+        if self._thread:
+            return
+        self._sock = self._open()
+        self._thread = eventlet.spawn(self._run)
+
+    def stop(self):
+        if self._thread:
+            self._thread.kill()
+            self._thread = None
+        self._close()
+
+    def _close(self):
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+        self._handle_lost()
+
+    def _run(self):
+        while True:
+            try:
+                if not self._sock:
+                    self._sock = self._open()
+                    # The notifications sent while the socket was closed
+                    # are lost
+                    self._handle_lost()
+                self._handle_data(self._sock.recv(RECV_SIZE))
+            except socket.error as e:
+                if e.errno == errno.ENOBUFS:
+                    LOG.warn(_("Netlink notifications lost, the receive "
+                               "buffer overflowed"))
+                    self._handle_lost()
+                    continue
+                LOG.exception(_("Error receiving netlink notifications"))
+                self._close()
+                if self.respawn_interval is None:
+                    self._thread = None
+                    return
+                eventlet.sleep(self.respawn_interval)
+
+    def _handle_data(self, data):
+        for msg_type, _seq, payload in parse_messages(data):
+            try:
+                self._handle_message(msg_type, payload)
+            except struct.error:
+                LOG.warn(_("Unable to parse netlink notification"))
+                self._handle_lost()
+
+    def _handle_message(self, msg_type, payload):
+        pass
+
+    def _handle_lost(self):
+        pass
+
+
+class LinkMonitor(NetlinkMonitor):
+    """Monitors the link notifications of the kernel.
+
+    The added and removed links are returned by get_events() as dicts with
+    the action (LINK_ADDED or LINK_REMOVED), and the index and the name of
+    the link. RTM_NEWLINK is also sent when a link is updated, so links
+    already known by the consumer can be reported as added again.
+
+    Netlink notifications are lost when the receive buffer of the socket
+    overflows: get_events() then returns None, like when the monitor is not
+    running, and the consumer must find the links by itself.
+    """
+
+    groups = RTMGRP_LINK
+
+    def __init__(self, respawn_interval=None):
+        super(LinkMonitor, self).__init__(respawn_interval)
+        self._reset_events()
+
+    def _reset_events(self):
+        self._events = []
+        # Whether notifications were lost since the previous call to
+        # get_events()
+        self._events_lost = False
+        self._events_ready = eventlet.event.Event()
+
+    def _notify(self):
+        if not self._events_ready.ready():
+            self._events_ready.send()
+
+    def _handle_data(self, data):
+        super(LinkMonitor, self)._handle_data(data)
+        self._notify()
+
+    def _handle_message(self, msg_type, payload):
+        if msg_type not in (RTM_NEWLINK, RTM_DELLINK):
+            return
+        index, name = parse_link(payload)
+        action = LINK_ADDED if msg_type == RTM_NEWLINK else LINK_REMOVED
+        self._events.append({'action': action, 'index': index,
+                             'name': name})
+
+    def _handle_lost(self):
+        self._events_lost = True
+        self._notify()
+
+    def get_events(self):
+        """Return the link events received since the previous call.
+
+        None is returned when the events do not describe all the changes:
+        when the monitor is not active or notifications were lost.
+        """
+        events = self._events
+        complete = self.is_active and not self._events_lost
+        self._reset_events()
+        if complete:
+            return events
+
+    def wait_for_events(self, timeout):
+        """Wait at most timeout seconds for the next link notifications.
+
+        Return immediately if notifications were received since the
+        previous call to get_events().
+        """
+        with eventlet.timeout.Timeout(timeout, False):
+            self._events_ready.wait()
+
+
+class FdbMonitor(NetlinkMonitor):
+    """Keeps the bridge FDB entries of some links up to date.
+
+    entries maps the index of the links whose entries were dumped to a set
+    of (MAC, destination) tuples. It is updated from the RTM_NEWNEIGH and
+    RTM_DELNEIGH notifications, and cleared when notifications are lost.
+    """
+
+    groups = RTMGRP_NEIGH
+
+    def __init__(self, respawn_interval=None):
+        super(FdbMonitor, self).__init__(respawn_interval)
+        self.entries = {}
+
+    def _handle_message(self, msg_type, payload):
+        if msg_type not in (RTM_NEWNEIGH, RTM_DELNEIGH):
+            return
+        family, index, mac, dst = parse_neigh(payload)
+        if family != AF_BRIDGE or index not in self.entries:
+            return
+        if msg_type == RTM_NEWNEIGH:
+            self.entries[index].add((mac, dst))
+        else:
+            self.entries[index].discard((mac, dst))
+
+    def _handle_lost(self):
+        self.entries.clear()
+
+
+class IpRoute(object):
+    """Programs links, bridge ports, FDB and neighbour entries.
+
+    The requests are sent on a rtnetlink socket instead of running ip,
+    brctl and bridge, which requires the agent to run with the
+    CAP_NET_ADMIN capability. The FDB and neighbour entries are sent in
+    batches, and the FDB entries are read from a cache refreshed by an
+    FdbMonitor.
+    """
+
+    def __init__(self, respawn_interval=None):
+        self._sock = None
+        self._seq = 0
+        # The socket is shared by the RPC and the daemon loop greenthreads,
+        # which send their requests and read the replies one at a time
+        self._lock = eventlet.semaphore.Semaphore()
+        self._fdb = FdbMonitor(respawn_interval)
+
+    def _socket(self):
+        if not self._sock:
+            self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                       NETLINK_ROUTE)
+            self._sock.settimeout(REQUEST_TIMEOUT)
+            self._sock.bind((0, 0))
+        return self._sock
+
+    def _next_seq(self):
+        self._seq = self._seq % 0xffffffff + 1
+        return self._seq
+
+    def request(self, requests):
+        """Send (type, flags, payload) requests and wait for their acks.
+
+        The requests are sent in as few datagrams as possible. The list of
+        the errors of the requests is returned, None for the successful
+        ones.
+        """
+        errors = []
+        batch = []
+        size = 0
+        with self._lock:
+            for msg_type, flags, payload in requests:
+                seq = self._next_seq()
+                data = message(msg_type, flags | NLM_F_REQUEST | NLM_F_ACK,
+                               seq, payload)
+                if batch and size + len(data) > MAX_BATCH_SIZE:
+                    errors.extend(self._send_batch(batch))
+                    batch = []
+                    size = 0
+                batch.append((seq, data))
+                size += len(data)
+            if batch:
+                errors.extend(self._send_batch(batch))
+        return errors
+
+    def _send_batch(self, batch):
+        sock = self._socket()
+        try:
+            sock.sendall(''.join(data for _seq, data in batch))
+            pending = dict((seq, None) for seq, _data in batch)
+            acked = set()
+            while len(acked) < len(pending):
+                for msg_type, seq, payload in parse_messages(
+                        sock.recv(RECV_SIZE)):
+                    if msg_type != NLMSG_ERROR or seq not in pending:
+                        continue
+                    code = NLMSG_ERR.unpack_from(payload)[0]
+                    if code:
+                        pending[seq] = NetlinkError(-code)
+                    acked.add(seq)
+        except socket.error as e:
+            # Acks of this batch could be read with the next one
+            self._close()
+            raise NetlinkError(e.errno or errno.EIO, str(e))
+        except Exception:
+            self._close()
+            raise
+        return [pending[seq] for seq, _data in batch]
+
+    def _close(self):
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+    def _check(self, requests):
+        for error in self.request(requests):
+            if error:
+                raise error
+
+    def dump(self, msg_type, payload):
+        """Return the (type, payload) of the replies to a dump request."""
+        with self._lock:
+            sock = self._socket()
+            seq = self._next_seq()
+            replies = []
+            try:
+                sock.sendall(message(msg_type, NLM_F_REQUEST | NLM_F_DUMP,
+                                     seq, payload))
+                while True:
+                    for reply_type, reply_seq, reply in parse_messages(
+                            sock.recv(RECV_SIZE)):
+                        if reply_seq != seq:
+                            continue
+                        if reply_type == NLMSG_DONE:
+                            return replies
+                        if reply_type == NLMSG_ERROR:
+                            raise NetlinkError(
+                                -NLMSG_ERR.unpack_from(reply)[0])
+                        replies.append((reply_type, reply))
+            except socket.error as e:
+                self._close()
+                raise NetlinkError(e.errno or errno.EIO, str(e))
+            except Exception:
+                self._close()
+                raise
+
+    def get_link_index(self, name):
+        try:
+            with open(os.path.join(SYS_CLASS_NET, name, 'ifindex')) as f:
+                return int(f.read())
+        except (IOError, ValueError):
+            raise NetlinkError(errno.ENODEV,
+                               _("Device %s does not exist") % name)
+
+    def link_exists(self, name):
+        return os.path.exists(os.path.join(SYS_CLASS_NET, name))
+
+    def _link_request(self, msg_type, flags, index=0, up=None, attrs=()):
+        if_flags = IFF_UP if up else 0
+        change = IFF_UP if up is not None else 0
+        return (msg_type, flags,
+                IFINFOMSG.pack(AF_UNSPEC, 0, index, if_flags, change) +
+                ''.join(attrs))
+
+    def _add_link(self, name, kind, data=(), link=None):
+        attrs = [attr(IFLA_IFNAME, name + '\0'),
+                 attr(IFLA_LINKINFO,
+                      attr(IFLA_INFO_KIND, kind) +
+                      attr(IFLA_INFO_DATA, ''.join(data)))]
+        if link:
+            attrs.append(attr(IFLA_LINK,
+                              struct.pack('=I', self.get_link_index(link))))
+        self._check([self._link_request(RTM_NEWLINK,
+                                        NLM_F_CREATE | NLM_F_EXCL,
+                                        up=True, attrs=attrs)])
+
+    def add_bridge(self, name):
+        """Add a bridge with STP disabled and no forward delay."""
+        self._add_link(name, 'bridge')
+        for option, value in (('stp_state', 0), ('forward_delay', 0)):
+            with open(os.path.join(SYS_CLASS_NET, name, 'bridge', option),
+                      'w') as f:
+                f.write(str(value))
+
+    def add_vlan(self, name, physical_interface, vlan_id):
+        self._add_link(name, 'vlan',
+                       data=[attr(IFLA_VLAN_ID,
+                                  struct.pack('=H', int(vlan_id)))],
+                       link=physical_interface)
+
+    def add_vxlan(self, name, vni, group=None, dev=None, ttl=None, tos=None,
+                  proxy=False):
+        data = [attr(IFLA_VXLAN_ID, struct.pack('=I', int(vni)))]
+        if group:
+            data.append(attr(IFLA_VXLAN_GROUP, _ip_to_bytes(group)[1]))
+        if dev:
+            data.append(attr(IFLA_VXLAN_LINK,
+                             struct.pack('=I', self.get_link_index(dev))))
+        if ttl:
+            data.append(attr(IFLA_VXLAN_TTL, struct.pack('=B', int(ttl))))
+        if tos:
+            data.append(attr(IFLA_VXLAN_TOS, struct.pack('=B', int(tos))))
+        if proxy:
+            data.append(attr(IFLA_VXLAN_PROXY, struct.pack('=B', 1)))
+        self._add_link(name, 'vxlan', data=data)
+
+    def set_link_up(self, name, up=True):
+        self._check([self._link_request(RTM_NEWLINK, 0,
+                                        index=self.get_link_index(name),
+                                        up=up)])
+
+    def delete_link(self, name):
+        self._check([self._link_request(RTM_DELLINK, 0,
+                                        index=self.get_link_index(name))])
+
+    def set_master(self, name, master=None):
+        """Add a link to a bridge, or remove it from its bridge."""
+        master_index = self.get_link_index(master) if master else 0
+        self._check([self._link_request(
+            RTM_NEWLINK, 0, index=self.get_link_index(name),
+            attrs=[attr(IFLA_MASTER, struct.pack('=I', master_index))])])
+
+    def _neigh_request(self, msg_type, flags, family, index, mac, dst,
+                       ntf_flags=0):
+        dst_family, dst_bytes = _ip_to_bytes(dst)
+        if family != AF_BRIDGE:
+            family = dst_family
+        return (msg_type, flags,
+                NDMSG.pack(family, index, NUD_PERMANENT, ntf_flags, 0) +
+                attr(NDA_LLADDR, _mac_to_bytes(mac)) +
+                attr(NDA_DST, dst_bytes))
+
+    def get_fdb_entries(self, name):
+        """Return the set of (MAC, destination) FDB entries of a link."""
+        index = self.get_link_index(name)
+        if not self._fdb.is_active:
+            try:
+                self._fdb.start()
+            except socket.error:
+                LOG.exception(_("Unable to monitor the FDB notifications"))
+        if index in self._fdb.entries:
+            return self._fdb.entries[index]
+        entries = set()
+        if self._fdb.is_active:
+            # The notifications received during the dump are added to the
+            # entries, which are dropped by the monitor if some are lost
+            self._fdb.entries[index] = entries
+        try:
+            replies = self.dump(RTM_GETNEIGH,
+                                NDMSG.pack(AF_BRIDGE, 0, 0, 0, 0))
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                if self._fdb.entries.get(index) is entries:
+                    del self._fdb.entries[index]
+        for msg_type, payload in replies:
+            family, entry_index, mac, dst = parse_neigh(payload)
+            if (msg_type == RTM_NEWNEIGH and family == AF_BRIDGE and
+                    entry_index == index):
+                entries.add((mac, dst))
+        return entries
+
+    def _update_fdb(self, name, msg_type, flags, entries):
+        index = self.get_link_index(name)
+        errors = self.request(
+            [self._neigh_request(msg_type, flags, AF_BRIDGE, index, mac, dst,
+                                 NTF_SELF)
+             for mac, dst in entries])
+        cached = self._fdb.entries.get(index)
+        for entry, error in zip(entries, errors):
+            if error:
+                LOG.warn(_("Unable to update the FDB entry %(entry)s of "
+                           "%(name)s: %(error)s"),
+                         {'entry': entry, 'name': name, 'error': error})
+            elif cached is not None and msg_type == RTM_NEWNEIGH:
+                if not flags & NLM_F_APPEND:
+                    # The entry replaced the other ones of the MAC
+                    cached.difference_update(
+                        [e for e in cached if e[0] == entry[0]])
+                cached.add(entry)
+            elif cached is not None:
+                cached.discard(entry)
+        return errors
+
+    def add_fdb_entries(self, name, entries, append=False):
+        """Add or replace the (MAC, destination) FDB entries of a link.
+
+        With append, the destinations are added to the existing ones of
+        the MACs, like the flooding entries of the VXLAN links.
+        """
+        flags = NLM_F_CREATE | (NLM_F_APPEND if append else NLM_F_REPLACE)
+        return self._update_fdb(name, RTM_NEWNEIGH, flags, entries)
+
+    def delete_fdb_entries(self, name, entries):
+        return self._update_fdb(name, RTM_DELNEIGH, 0, entries)
+
+    def _update_neighbours(self, name, msg_type, flags, entries):
+        index = self.get_link_index(name)
+        errors = self.request(
+            [self._neigh_request(msg_type, flags, AF_UNSPEC, index, mac, ip)
+             for mac, ip in entries])
+        for entry, error in zip(entries, errors):
+            if error:
+                LOG.debug(_("Unable to update the neighbour entry "
+                            "%(entry)s of %(name)s: %(error)s"),
+                          {'entry': entry, 'name': name, 'error': error})
+        return errors
+
+    def add_neighbours(self, name, entries):
+        """Add or replace permanent (MAC, IP) neighbour entries."""
+        return self._update_neighbours(name, RTM_NEWNEIGH,
+                                       NLM_F_CREATE | NLM_F_REPLACE, entries)
+
+    def delete_neighbours(self, name, entries):
+        return self._update_neighbours(name, RTM_DELNEIGH, 0, entries)
+
+    def stop(self):
+        self._fdb.stop()
+        self._close()
@@ -18,9 +18,12 @@
 # @author: Dan Wendlandt, Nicira Networks, Inc.
 # @author: Dave Lapsley, Nicira Networks, Inc.
 
+import itertools
 import re
+import time
 
 from neutron.agent.linux import ip_lib
+from neutron.agent.linux import ovsdb_client
 from neutron.agent.linux import utils
 from neutron.openstack.common import jsonutils
 from neutron.openstack.common import log as logging
@@ -28,6 +31,10 @@ from neutron.plugins.openvswitch.common import constants
 
 LOG = logging.getLogger(__name__)
 
+# Flow arguments which are not part of the match of a flow
+FLOW_NON_MATCH_ARGS = ('actions', 'cookie', 'delete', 'hard_timeout',
+                       'idle_timeout', 'priority')
+
 
 class VifPort:
     def __init__(self, port_name, ofport, vif_id, vif_mac, switch):
@@ -49,6 +56,11 @@ class BaseOVS(object):
     def __init__(self, root_helper):
         self.root_helper = root_helper
 
+    @property
+    def ovsdb(self):
+        """The native OVSDB client, None when ovs-vsctl must be used."""
+        return ovsdb_client.get_client()
+
     def run_vsctl(self, args, check_error=False):
         full_args = ["ovs-vsctl", "--timeout=2"] + args
         try:
@@ -92,7 +104,16 @@ class OVSBridge(BaseOVS):
         self.br_name = br_name
         self.re_id = self.re_compile_id()
         self.defer_apply_flows = False
-        self.deferred_flows = {'add': '', 'mod': '', 'del': ''}
+        # (action, flow) tuples, applied in order by defer_apply_off()
+        self.deferred_flows = []
+        # Cookie of the flows added or modified, None for the default one
+        self.flow_cookie = None
+        # Shadow table of the flows programmed through this instance:
+        # (flow string, match) tuples by (priority, match). Entries a
+        # deletion or modification may have affected are dropped, so that an
+        # add_flow() or mod_flow() is only skipped when the flow is known to
+        # be on the bridge.
+        self.flows = {}
 
     def re_compile_id(self):
         external = 'external_ids\s*'
@@ -114,6 +135,7 @@ class OVSBridge(BaseOVS):
         self.delete_bridge(self.br_name)
 
     def reset_bridge(self):
+        self.clear_shadow_flows()
         self.destroy()
         self.create()
 
@@ -127,6 +149,18 @@ class OVSBridge(BaseOVS):
                         port_name])
 
     def set_db_attribute(self, table_name, record, column, value):
+        ovsdb = self.ovsdb
+        if ovsdb:
+            try:
+                if ovsdb.set_column(table_name, record, column, value):
+                    return
+            except ovsdb_client.OvsdbError as e:
+                LOG.error(_("Unable to set %(column)s of %(table)s "
+                            "%(record)s. Exception: %(exception)s"),
+                          {'column': column, 'table': table_name,
+                           'record': record, 'exception': e})
+                if ovsdb.connected:
+                    return
         args = ["set", table_name, record, "%s=%s" % (column, value)]
         self.run_vsctl(args)
 
@@ -148,8 +182,38 @@ class OVSBridge(BaseOVS):
         return len(flow_list) - 1
 
     def remove_all_flows(self):
+        self.clear_shadow_flows()
         self.run_ofctl("del-flows", [])
 
+    def clear_shadow_flows(self):
+        """Forget the programmed flows, so that they are applied again."""
+        self.flows.clear()
+
+    def shadow_flows_lost(self):
+        """Return True if the bridge lost the flows of the shadow table.
+
+        This happens when Open vSwitch restarts and drops all the flows.
+        """
+        if not self.flows or self.flow_cookie is None:
+            return False
+        return self.flow_cookie not in self.get_flow_cookies()
+
+    def get_flow_cookies(self):
+        """Return the set of the cookies of the flows of the bridge."""
+        output = self.run_ofctl("dump-flows", []) or ''
+        return set(int(cookie, 16)
+                   for cookie in re.findall(r'cookie=(0x[0-9a-fA-F]+)',
+                                            output))
+
+    def delete_stale_flows(self):
+        """Delete the flows which are not tagged with flow_cookie.
+
+        The flows of the shadow table all have flow_cookie, they are kept.
+        """
+        current = self.flow_cookie or 0
+        for cookie in sorted(self.get_flow_cookies() - set([current])):
+            self._program_flow('del', 'cookie=%#x/-1' % cookie)
+
     def get_port_ofport(self, port_name):
         return self.db_get_val("Interface", port_name, "ofport")
 
@@ -198,23 +262,87 @@ class OVSBridge(BaseOVS):
             kwargs["priority"] = "0"
 
         flow_expr_arr = self._build_flow_expr_arr(**kwargs)
+        cookie = kwargs.get('cookie', self.flow_cookie)
+        if cookie is not None:
+            flow_expr_arr.insert(0, "cookie=%s" % cookie)
         flow_expr_arr.append("actions=%s" % (kwargs["actions"]))
         flow_str = ",".join(flow_expr_arr)
         return flow_str
 
-    def add_flow(self, **kwargs):
-        flow_str = self.add_or_mod_flow_str(**kwargs)
+    @staticmethod
+    def _flow_match(kwargs):
+        return dict((key, str(value)) for key, value in kwargs.items()
+                    if key not in FLOW_NON_MATCH_ARGS)
+
+    def _flow_key(self, kwargs):
+        return (str(kwargs.get('priority', '0')),
+                frozenset(self._flow_match(kwargs).items()))
+
+    def _select_shadow_flows(self, kwargs):
+        """Return the keys of the shadow flows kwargs may select.
+
+        Like non-strict modifications and deletions, the priority is ignored
+        and a flow is selected unless one of its match fields differs.
+        """
+        match = self._flow_match(kwargs).items()
+        return [key for key, (_flow_str, flow_match) in self.flows.iteritems()
+                if all(flow_match.get(field, value) == value
+                       for field, value in match)]
+
+    def _is_programmed(self, kwargs, flow_str):
+        """Return whether the flow of kwargs is on the bridge as flow_str.
+
+        Flows with timeouts expire, they are never considered programmed.
+        """
+        if (str(kwargs.get('hard_timeout', '0')) != '0' or
+                str(kwargs.get('idle_timeout', '0')) != '0'):
+            return False
+        shadow_flow = self.flows.get(self._flow_key(kwargs))
+        return shadow_flow is not None and shadow_flow[0] == flow_str
+
+    def _apply_flows(self, action, flows):
+        """Apply flows with a single ovs-ofctl command."""
+        start = time.time()
+        if self.defer_apply_flows:
+            result = self.run_ofctl('%s-flows' % action, ['-'],
+                                    ''.join(flow + '\n' for flow in flows))
+        elif action == 'add':
+            result = self.run_ofctl('add-flow', flows)
+        else:
+            result = self.run_ofctl('%s-flows' % action, flows)
+        if result is None:
+            # The flows of the bridge are unknown after a failure
+            self.flows.clear()
+        LOG.debug(_("%(action)s of %(count)d flows on bridge %(bridge)s "
+                    "completed in %(elapsed)d us"),
+                  {'action': action, 'count': len(flows),
+                   'bridge': self.br_name,
+                   'elapsed': (time.time() - start) * 1000000})
+
+    def _program_flow(self, action, flow_str):
         if self.defer_apply_flows:
-            self.deferred_flows['add'] += flow_str + '\n'
+            self.deferred_flows.append((action, flow_str))
         else:
-            self.run_ofctl("add-flow", [flow_str])
+            self._apply_flows(action, [flow_str])
+
+    def add_flow(self, **kwargs):
+        flow_str = self.add_or_mod_flow_str(**kwargs)
+        if self._is_programmed(kwargs, flow_str):
+            return
+        self.flows[self._flow_key(kwargs)] = (flow_str,
+                                              self._flow_match(kwargs))
+        self._program_flow('add', flow_str)
 
     def mod_flow(self, **kwargs):
         flow_str = self.add_or_mod_flow_str(**kwargs)
-        if self.defer_apply_flows:
-            self.deferred_flows['mod'] += flow_str + '\n'
-        else:
-            self.run_ofctl("mod-flows", [flow_str])
+        key = self._flow_key(kwargs)
+        selected = self._select_shadow_flows(kwargs)
+        if selected == [key] and self._is_programmed(kwargs, flow_str):
+            return
+        for selected_key in selected:
+            del self.flows[selected_key]
+        self.flows[key] = (flow_str, self._flow_match(kwargs))
+        self._program_flow('mod', flow_str)
 
     def delete_flows(self, **kwargs):
         kwargs['delete'] = True
@@ -222,27 +350,32 @@ class OVSBridge(BaseOVS):
         if "actions" in kwargs:
             flow_expr_arr.append("actions=%s" % (kwargs["actions"]))
         flow_str = ",".join(flow_expr_arr)
-        if self.defer_apply_flows:
-            self.deferred_flows['del'] += flow_str + '\n'
-        else:
-            self.run_ofctl("del-flows", [flow_str])
+        for key in self._select_shadow_flows(kwargs):
+            del self.flows[key]
+        self._program_flow('del', flow_str)
 
     def defer_apply_on(self):
         LOG.debug(_('defer_apply_on'))
         self.defer_apply_flows = True
 
     def defer_apply_off(self):
+        """Apply the deferred flows, with one command per run of an action.
+
+        The flows are applied in the order they were programmed in.
+        """
         LOG.debug(_('defer_apply_off'))
-        for action, flows in self.deferred_flows.items():
-            if flows:
-                LOG.debug(_('Applying following deferred flows '
-                            'to bridge %s'), self.br_name)
-                for line in flows.splitlines():
-                    LOG.debug(_('%(action)s: %(flow)s'),
-                              {'action': action, 'flow': line})
-                self.run_ofctl('%s-flows' % action, ['-'], flows)
+        if self.deferred_flows:
+            LOG.debug(_('Applying following deferred flows '
+                        'to bridge %s'), self.br_name)
+        for action, flows in itertools.groupby(self.deferred_flows,
+                                               lambda flow: flow[0]):
+            flows = [flow for _action, flow in flows]
+            for line in flows:
+                LOG.debug(_('%(action)s: %(flow)s'),
+                          {'action': action, 'flow': line})
+            self._apply_flows(action, flows)
         self.defer_apply_flows = False
-        self.deferred_flows = {'add': '', 'mod': '', 'del': ''}
+        self.deferred_flows = []
 
     def add_tunnel_port(self, port_name, remote_ip, local_ip,
                         tunnel_type=constants.TYPE_GRE,
@@ -266,13 +399,20 @@ class OVSBridge(BaseOVS):
         return self.get_port_ofport(port_name)
 
     def add_patch_port(self, local_name, remote_name):
-        self.run_vsctl(["add-port", self.br_name, local_name])
+        self.run_vsctl(["--", "--may-exist", "add-port", self.br_name,
+                        local_name])
         self.set_db_attribute("Interface", local_name, "type", "patch")
         self.set_db_attribute("Interface", local_name, "options:peer",
                               remote_name)
         return self.get_port_ofport(local_name)
 
     def db_get_map(self, table, record, column):
+        ovsdb = self.ovsdb
+        if ovsdb and ovsdb.monitors(table, column):
+            row = ovsdb.get_row(table, record)
+            if row and isinstance(row[column], dict):
+                return row[column]
+            return {}
         output = self.run_vsctl(["get", table, record, column])
         if output:
             output_str = output.rstrip("\n\r")
@@ -295,6 +435,9 @@ class OVSBridge(BaseOVS):
         return ret
 
     def get_port_name_list(self):
+        ovsdb = self.ovsdb
+        if ovsdb:
+            return ovsdb.get_port_names(self.br_name)
         res = self.run_vsctl(["list-ports", self.br_name])
         if res:
             return res.strip().split("\n")
@@ -316,9 +459,14 @@ class OVSBridge(BaseOVS):
     def get_vif_ports(self):
         edge_ports = []
         port_names = self.get_port_name_list()
+        ovsdb = self.ovsdb
         for name in port_names:
             external_ids = self.db_get_map("Interface", name, "external_ids")
-            ofport = self.db_get_val("Interface", name, "ofport")
+            if ovsdb:
+                row = ovsdb.get_row("Interface", name) or {}
+                ofport = ovsdb_client.to_vsctl_str(row.get("ofport", []))
+            else:
+                ofport = self.db_get_val("Interface", name, "ofport")
             if "iface-id" in external_ids and "attached-mac" in external_ids:
                 p = VifPort(name, ofport, external_ids["iface-id"],
                             external_ids["attached-mac"], self)
@@ -334,19 +482,49 @@ class OVSBridge(BaseOVS):
 
         return edge_ports
 
-    def get_vif_port_set(self):
-        port_names = self.get_port_name_list()
-        edge_ports = set()
+    def _list_interface_external_ids(self):
+        """Return (name, external_ids) tuples of all the interfaces."""
+        ovsdb = self.ovsdb
+        if ovsdb:
+            return [(row['name'], row['external_ids'])
+                    for row in ovsdb.tables['Interface'].values()]
         args = ['--format=json', '--', '--columns=name,external_ids',
                 'list', 'Interface']
         result = self.run_vsctl(args)
         if not result:
-            return edge_ports
-        for row in jsonutils.loads(result)['data']:
-            name = row[0]
+            return []
+        return [(row[0], dict(row[1][1]))
+                for row in jsonutils.loads(result)['data']]
+
+    def get_ports_tag_and_other_config(self):
+        """Return the (tag, other_config) tuples of the ports by name.
+
+        The tag is None for the ports without one.
+        """
+        port_names = set(self.get_port_name_list())
+        ovsdb = self.ovsdb
+        if ovsdb:
+            rows = [(row['name'], row['tag'], row['other_config'])
+                    for row in ovsdb.tables['Port'].values()]
+        else:
+            args = ['--format=json', '--', '--columns=name,tag,other_config',
+                    'list', 'Port']
+            result = self.run_vsctl(args)
+            rows = []
+            if result:
+                rows = [[ovsdb_client.from_datum(value) for value in row]
+                        for row in jsonutils.loads(result)['data']]
+        return dict((name, (tag if isinstance(tag, int) else None,
+                            other_config))
+                    for name, tag, other_config in rows
+                    if name in port_names)
+
+    def get_vif_port_set(self):
+        port_names = self.get_port_name_list()
+        edge_ports = set()
+        for name, external_ids in self._list_interface_external_ids():
             if name not in port_names:
                 continue
-            external_ids = dict(row[1][1])
             if "iface-id" in external_ids and "attached-mac" in external_ids:
                 edge_ports.add(external_ids['iface-id'])
             elif ("xs-vif-uuid" in external_ids and
@@ -358,6 +536,16 @@ class OVSBridge(BaseOVS):
         return edge_ports
 
     def get_vif_port_by_id(self, port_id):
+        ovsdb = self.ovsdb
+        if ovsdb:
+            for row in ovsdb.find_rows('Interface', 'external_ids',
+                                       'iface-id', port_id):
+                external_ids = row['external_ids']
+                if ('attached-mac' in external_ids and
+                        isinstance(row['ofport'], int)):
+                    return VifPort(row['name'], row['ofport'], port_id,
+                                   external_ids['attached-mac'], self)
+            return
         args = ['--', '--columns=external_ids,name,ofport',
                 'find', 'Interface',
                 'external_ids:iface-id="%s"' % port_id]
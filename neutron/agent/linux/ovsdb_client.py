@@ -0,0 +1,420 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""In-process client of the Open vSwitch database.
+
+The client speaks the OVSDB JSON-RPC protocol (RFC 7047) over a persistent
+connection, and keeps a replica of the monitored columns of the Bridge,
+Port and Interface tables up to date with the notifications of the server,
+so that reading them does not cost an ovs-vsctl process.
+"""
+
+import json
+import re
+import time
+
+import eventlet
+import eventlet.event
+from eventlet.green import socket
+import eventlet.timeout
+from oslo.config import cfg
+
+from neutron.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+OPTS = [
+    cfg.StrOpt('ovsdb_backend', default='vsctl',
+               choices=['vsctl', 'native'],
+               help=_("The backend used to read and write the Open "
+                      "vSwitch database: 'vsctl' runs ovs-vsctl, 'native' "
+                      "keeps a connection to ovsdb-server and a replica of "
+                      "the Bridge, Port and Interface tables")),
+    cfg.StrOpt('ovsdb_connection',
+               default='unix:/var/run/openvswitch/db.sock',
+               help=_("The connection to ovsdb-server used by the native "
+                      "backend, as unix:<path> or tcp:<ip>:<port>")),
+    cfg.IntOpt('ovsdb_timeout', default=10,
+               help=_("Timeout in seconds of the requests of the native "
+                      "backend")),
+]
+cfg.CONF.register_opts(OPTS, 'OVS')
+
+DB_NAME = 'Open_vSwitch'
+
+# Columns replicated by the client. Interface statistics are left out since
+# they change all the time.
+MONITORED_COLUMNS = {
+    'Bridge': ['name', 'ports', 'datapath_id', 'external_ids'],
+    'Port': ['name', 'interfaces', 'tag', 'other_config', 'external_ids'],
+    'Interface': ['name', 'ofport', 'type', 'options', 'external_ids'],
+}
+
+# Seconds before connecting again once the connection failed
+RETRY_INTERVAL = 60
+
+UUID_RE = re.compile(r'^[0-9a-fA-F]{8}-([0-9a-fA-F]{4}-){3}[0-9a-fA-F]{12}$')
+BARE_STRING_RE = re.compile(r'^[A-Za-z_][A-Za-z_.-]*$')
+
+
+class OvsdbError(RuntimeError):
+    pass
+
+
+def from_datum(datum):
+    """Convert an OVSDB datum to Python: sets to lists, maps to dicts."""
+    if isinstance(datum, list):
+        kind, value = datum
+        if kind == 'set':
+            return [from_datum(v) for v in value]
+        if kind == 'map':
+            return dict((from_datum(k), from_datum(v)) for k, v in value)
+        # uuid or named-uuid
+        return value
+    return datum
+
+
+def to_list(value):
+    """Return the elements of a set column, which may hold a single atom."""
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def to_vsctl_str(value):
+    """Format value the way ovs-vsctl get prints it."""
+    if isinstance(value, dict):
+        return '{%s}' % ', '.join('%s=%s' % (to_vsctl_str(k),
+                                             to_vsctl_str(v))
+                                  for k, v in sorted(value.items()))
+    if isinstance(value, list):
+        return '[%s]' % ', '.join(to_vsctl_str(v) for v in value)
+    if isinstance(value, bool):
+        return value and 'true' or 'false'
+    if isinstance(value, (int, long, float)):
+        return str(value)
+    if (not BARE_STRING_RE.match(value) or value in ('true', 'false') or
+            UUID_RE.match(value)):
+        return json.dumps(value)
+    return value
+
+
+class JsonStreamParser(object):
+    """Split a stream of concatenated JSON objects into messages.
+
+    JSON-RPC messages of OVSDB are not delimited: the end of a message is
+    found by counting the braces outside of strings.
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, data):
+        """Return the list of the messages completed by data."""
+        self._buffer += data
+        messages = []
+        buf = self._buffer
+        start = 0
+        for i in xrange(self._pos, len(buf)):
+            c = buf[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif c == '\\':
+                    self._escaped = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c == '{':
+                self._depth += 1
+            elif c == '}':
+                self._depth -= 1
+                if not self._depth:
+                    messages.append(json.loads(buf[start:i + 1]))
+                    start = i + 1
+        self._buffer = buf[start:]
+        self._pos = len(self._buffer)
+        return messages
+
+
+class OvsdbClient(object):
+    """Persistent connection to ovsdb-server with a replica of its tables.
+
+    tables maps each table of MONITORED_COLUMNS to its rows by uuid, each
+    row being a dict of the monitored columns converted with from_datum.
+    """
+
+    def __init__(self, connection, timeout=10):
+        self.connection = connection
+        self.timeout = timeout
+        self.tables = dict((table, {}) for table in MONITORED_COLUMNS)
+        self.connected = False
+        self._sock = None
+        self._reader = None
+        self._next_id = 0
+        # Events of the requests waiting for their reply, by request id
+        self._pending = {}
+        # Column types of the schema, by table
+        self._columns = {}
+
+    def _connect(self):
+        kind, _sep, address = self.connection.partition(':')
+        if kind == 'unix':
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(address)
+        elif kind == 'tcp':
+            host, _sep, port = address.rpartition(':')
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.connect((host, int(port)))
+        else:
+            raise OvsdbError(_("Unsupported OVSDB connection %s") %
+                             self.connection)
+        return sock
+
+    def start(self):
+        """Connect, and return once the replica holds the current rows."""
+        self._sock = self._connect()
+        self._reader = eventlet.spawn(self._read_loop, self._sock)
+        schema = self._call('get_schema', [DB_NAME])
+        self._columns = dict(
+            (table, dict((column, spec['type'])
+                         for column, spec in desc['columns'].iteritems()))
+            for table, desc in schema['tables'].iteritems())
+        requests = dict((table, {'columns': columns})
+                        for table, columns in MONITORED_COLUMNS.iteritems())
+        # The initial rows are applied by the reader, before the updates
+        # which may follow them
+        self._call('monitor', [DB_NAME, None, requests],
+                   on_reply=self._apply_updates)
+        self.connected = True
+        LOG.debug(_("Connected to OVSDB at %s"), self.connection)
+
+    def stop(self):
+        self.connected = False
+        if self._reader:
+            self._reader.kill()
+            self._reader = None
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+    def _send(self, message):
+        try:
+            self._sock.sendall(json.dumps(message))
+        except socket.error as e:
+            self.connected = False
+            raise OvsdbError(_("Unable to send to OVSDB: %s") % e)
+
+    def _read_loop(self, sock):
+        parser = JsonStreamParser()
+        try:
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                for message in parser.feed(data):
+                    self._handle_message(message)
+        except Exception:
+            LOG.exception(_("Error reading from OVSDB at %s"),
+                          self.connection)
+        LOG.warn(_("Connection to OVSDB at %s lost"), self.connection)
+        self.connected = False
+        pending, self._pending = self._pending, {}
+        for event, _on_reply in pending.itervalues():
+            event.send_exception(OvsdbError(_("Connection to OVSDB lost")))
+
+    def _handle_message(self, message):
+        method = message.get('method')
+        if method == 'update':
+            self._apply_updates(message['params'][1])
+        elif method == 'echo':
+            self._send({'id': message['id'], 'result': message['params'],
+                        'error': None})
+        elif method is None:
+            event, on_reply = self._pending.pop(message.get('id'),
+                                                (None, None))
+            if event:
+                if on_reply and not message.get('error'):
+                    on_reply(message['result'])
+                event.send(message)
+
+    def _call(self, method, params, on_reply=None):
+        request_id = self._next_id
+        self._next_id += 1
+        event = eventlet.event.Event()
+        self._pending[request_id] = (event, on_reply)
+        try:
+            self._send({'method': method, 'params': params,
+                        'id': request_id})
+        except OvsdbError:
+            self._pending.pop(request_id, None)
+            raise
+        try:
+            with eventlet.timeout.Timeout(self.timeout):
+                reply = event.wait()
+        except eventlet.timeout.Timeout:
+            self._pending.pop(request_id, None)
+            raise OvsdbError(_("OVSDB %s request timed out") % method)
+        if reply.get('error'):
+            raise OvsdbError(_("OVSDB %(method)s request failed: "
+                               "%(error)s") % {'method': method,
+                                               'error': reply['error']})
+        return reply['result']
+
+    def _apply_updates(self, updates):
+        for table, rows in updates.iteritems():
+            replica = self.tables.setdefault(table, {})
+            for uuid, row in rows.iteritems():
+                if 'new' in row:
+                    replica[uuid] = dict(
+                        (column, from_datum(datum))
+                        for column, datum in row['new'].iteritems())
+                else:
+                    replica.pop(uuid, None)
+
+    def transact(self, operations):
+        """Run a transaction and return the results of its operations."""
+        results = self._call('transact', [DB_NAME] + operations)
+        for result in results:
+            if result and result.get('error'):
+                raise OvsdbError(_("OVSDB transaction failed: %s") % result)
+        return results
+
+    def monitors(self, table, column):
+        """Return whether the replica holds column of table."""
+        return column in MONITORED_COLUMNS.get(table, [])
+
+    def get_row(self, table, record):
+        """Return the row of table named or identified by record."""
+        rows = self.tables[table]
+        if record in rows:
+            return rows[record]
+        for row in rows.itervalues():
+            if row.get('name') == record:
+                return row
+
+    def find_rows(self, table, column, key, value):
+        """Return the rows of table whose column map has key=value."""
+        return [row for row in self.tables[table].itervalues()
+                if row.get(column, {}).get(key) == value]
+
+    def get_port_names(self, br_name):
+        """Return the names of the ports of bridge br_name."""
+        bridge = self.get_row('Bridge', br_name)
+        if not bridge:
+            return []
+        ports = self.tables['Port']
+        return sorted(ports[uuid]['name']
+                      for uuid in to_list(bridge.get('ports', []))
+                      if uuid in ports)
+
+    def _to_atom(self, atomic_type, value):
+        if isinstance(atomic_type, dict):
+            atomic_type = atomic_type['type']
+        if atomic_type == 'integer':
+            return int(value)
+        if atomic_type == 'real':
+            return float(value)
+        if atomic_type == 'boolean':
+            return value in (True, 'true')
+        if atomic_type == 'uuid':
+            return ['uuid', value]
+        if isinstance(value, basestring):
+            return value
+        return str(value)
+
+    def set_column(self, table, record, column, value):
+        """Set column of a record, as ovs-vsctl set does.
+
+        column may be a map key, as in options:remote_ip.
+
+        :returns: False when the record cannot be addressed by name, in
+        which case nothing was done
+        """
+        column, _sep, key = column.partition(':')
+        columns = self._columns.get(table, {})
+        if 'name' not in columns or column not in columns:
+            return False
+        if UUID_RE.match(record):
+            where = [['_uuid', '==', ['uuid', record]]]
+        else:
+            where = [['name', '==', record]]
+        col_type = columns[column]
+        if not isinstance(col_type, dict):
+            col_type = {'key': col_type}
+        if key:
+            value = self._to_atom(col_type.get('value'), value)
+            operation = {'op': 'mutate', 'table': table, 'where': where,
+                         'mutations': [
+                             [column, 'delete', ['set', [key]]],
+                             [column, 'insert', ['map', [[key, value]]]]]}
+        else:
+            value = self._to_atom(col_type['key'], value)
+            operation = {'op': 'update', 'table': table, 'where': where,
+                         'row': {column: value}}
+        result = self.transact([operation])[0]
+        if not result.get('count'):
+            raise OvsdbError(_("No row %(record)s in table %(table)s") %
+                             {'record': record, 'table': table})
+        # Update the replica right away rather than on the notification of
+        # the server, so that the value can be read back immediately
+        row = table in self.tables and self.get_row(table, record)
+        if row and column in row:
+            if key:
+                row[column] = dict(row[column])
+                row[column][key] = from_datum(value)
+            else:
+                row[column] = from_datum(value)
+        return True
+
+
+_client = None
+_retry_after = 0
+
+
+def get_client():
+    """Return the shared client of the native backend.
+
+    None is returned when the vsctl backend is configured, or when the
+    connection to ovsdb-server failed, in which case the callers fall back
+    to ovs-vsctl until the next connection attempt.
+    """
+    global _client, _retry_after
+    if cfg.CONF.OVS.ovsdb_backend != 'native':
+        return None
+    if _client and _client.connected:
+        return _client
+    if time.time() < _retry_after:
+        return None
+    client = OvsdbClient(cfg.CONF.OVS.ovsdb_connection,
+                         cfg.CONF.OVS.ovsdb_timeout)
+    try:
+        client.start()
+    except (socket.error, OvsdbError) as e:
+        LOG.warn(_("Unable to connect to OVSDB at %(connection)s, using "
+                   "ovs-vsctl: %(error)s"),
+                 {'connection': client.connection, 'error': e})
+        client.stop()
+        _retry_after = time.time() + RETRY_INTERVAL
+        return None
+    _client = client
+    return _client
@@ -15,13 +15,30 @@
 #    under the License.
 
 import eventlet
+import eventlet.event
+import eventlet.timeout
 
 from neutron.agent.linux import async_process
+from neutron.agent.linux import ovsdb_client
+from neutron.openstack.common import jsonutils
 from neutron.openstack.common import log as logging
 
 
 LOG = logging.getLogger(__name__)
 
+# Interface events reported by SimpleInterfaceMonitor
+INTERFACE_ADDED = 'added'
+INTERFACE_REMOVED = 'removed'
+INTERFACE_UPDATED = 'updated'
+
+# Actions of the rows output by ovsdb-client monitor. Rows modified by an
+# update are output twice, with the 'old' and the 'new' action: only the
+# second one has all the columns.
+OVSDB_ACTIONS = {'initial': INTERFACE_ADDED,
+                 'insert': INTERFACE_ADDED,
+                 'delete': INTERFACE_REMOVED,
+                 'new': INTERFACE_UPDATED}
+
 
 class OvsdbMonitor(async_process.AsyncProcess):
     """Manages an invocation of 'ovsdb-client monitor'."""
@@ -67,17 +84,32 @@ class SimpleInterfaceMonitor(OvsdbMonitor):
     The has_updates() method indicates whether changes to the ovsdb
     Interface table have been detected since the monitor started or
     since the previous access.
+
+    The changes are also parsed into interface events, returned by
+    get_events(): dicts with the action (INTERFACE_ADDED, INTERFACE_REMOVED
+    or INTERFACE_UPDATED), and the name, ofport and external_ids of the
+    interface.
     """
 
+    COLUMNS = ['name', 'ofport', 'external_ids']
+
     def __init__(self, root_helper=None, respawn_interval=None):
         super(SimpleInterfaceMonitor, self).__init__(
             'Interface',
-            columns=['name'],
+            columns=self.COLUMNS,
             format='json',
             root_helper=root_helper,
             respawn_interval=respawn_interval,
         )
         self.data_received = False
+        self._reset_events()
+
+    def _reset_events(self):
+        self._events = []
+        # Whether the initial content of the table was output since the
+        # previous call to get_events(), i.e. the monitor was (re)started
+        self._initial_received = False
+        self._events_ready = eventlet.event.Event()
 
     @property
     def is_active(self):
@@ -111,4 +143,53 @@ class SimpleInterfaceMonitor(OvsdbMonitor):
         data = super(SimpleInterfaceMonitor, self)._read_stdout()
         if data and not self.data_received:
             self.data_received = True
+        if data:
+            self._parse_output(data)
         return data
+
+    def _parse_output(self, data):
+        try:
+            output = jsonutils.loads(data)
+            headings = output['headings']
+            rows = [dict(zip(headings, row)) for row in output['data']]
+        except (ValueError, KeyError, TypeError):
+            LOG.warn(_("Unable to parse ovsdb monitor output: %s"), data)
+            # The changes are unknown: let the consumer rescan everything
+            self._initial_received = True
+        else:
+            for row in rows:
+                action = OVSDB_ACTIONS.get(row.get('action'))
+                if not action:
+                    continue
+                if row['action'] == 'initial':
+                    self._initial_received = True
+                self._events.append({
+                    'action': action,
+                    'name': row.get('name'),
+                    'ofport': ovsdb_client.from_datum(row.get('ofport')),
+                    'external_ids': ovsdb_client.from_datum(
+                        row.get('external_ids') or ['map', []])})
+        if not self._events_ready.ready():
+            self._events_ready.send()
+
+    def get_events(self):
+        """Return the interface events received since the previous call.
+
+        None is returned when the events do not describe all the changes:
+        when the monitor is not active, or when it was restarted and output
+        the whole table again.
+        """
+        events = self._events
+        complete = self.is_active and not self._initial_received
+        self._reset_events()
+        if complete:
+            return events
+
+    def wait_for_events(self, timeout):
+        """Wait at most timeout seconds for the next output of the monitor.
+
+        Return immediately if output was received since the previous call
+        to get_events().
+        """
+        with eventlet.timeout.Timeout(timeout, False):
+            self._events_ready.wait()
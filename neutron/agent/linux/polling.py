@@ -15,6 +15,7 @@
 #    under the License.
 
 import contextlib
+import time
 
 import eventlet
 
@@ -56,6 +57,18 @@ class BasePollingManager(object):
     def _is_polling_required(self):
         raise NotImplemented
 
+    def get_events(self):
+        """Return the interface events detected since the previous call.
+
+        None means that the changes are unknown and must be found by
+        polling all the interfaces.
+        """
+        return None
+
+    def wait_for_updates(self, timeout):
+        """Wait for at most timeout seconds, less if updates are detected."""
+        time.sleep(timeout)
+
     @property
     def is_polling_required(self):
         # Always consume the updates to minimize polling.
@@ -112,3 +125,9 @@ class InterfacePollingMinimizer(BasePollingManager):
         # collect output.
         eventlet.sleep()
         return self._monitor.has_updates
+
+    def get_events(self):
+        return self._monitor.get_events()
+
+    def wait_for_updates(self, timeout):
+        self._monitor.wait_for_events(timeout)
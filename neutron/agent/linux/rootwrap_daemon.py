@@ -0,0 +1,249 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Root wrapper daemon
+
+   Long-lived alternative to the neutron-rootwrap command: the filters are
+   loaded once, and commands are requested over a UNIX socket instead of
+   forking sudo and a Python interpreter for each of them. The same filters
+   as the ones of neutron-rootwrap apply.
+
+   The daemon is started by the service, through sudo:
+   neutron ALL = (root) NOPASSWD: /usr/bin/neutron-rootwrap-daemon
+                                   /etc/neutron/rootwrap.conf
+
+   It creates its socket in a new directory only accessible by the user
+   which invoked sudo, writes the socket path and an authentication token
+   as a JSON line on its standard output, and exits when its standard input
+   is closed, i.e. when the service which started it exits.
+
+   Messages are JSON objects preceded by their length, as a 4 bytes
+   unsigned integer in network order. Requests are:
+   {"token": ..., "cmd": [...], "stdin": ...}
+   and replies:
+   {"returncode": ..., "stdout": ..., "stderr": ...}
+   Binary data is sent as latin-1 decoded strings, see encode_data.
+"""
+
+from __future__ import print_function
+
+import binascii
+import ConfigParser
+import json
+import logging
+import os
+import shutil
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+
+from neutron.openstack.common.rootwrap import wrapper
+
+
+RC_UNAUTHORIZED = 99
+RC_NOEXECFOUND = 96
+RC_BADCONFIG = 97
+
+HEADER = struct.Struct('!I')
+# Upper bound of a message, to protect the daemon from bogus clients
+MAX_MESSAGE_LEN = 64 * 1024 * 1024
+
+
+def _subprocess_setup():
+    # Python installs a SIGPIPE handler by default. This is usually not what
+    # non-Python subprocesses expect.
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+
+def _recv_exactly(sock, length):
+    data = []
+    while length:
+        chunk = sock.recv(length)
+        if not chunk:
+            return None
+        data.append(chunk)
+        length -= len(chunk)
+    return ''.join(data)
+
+
+def encode_data(data):
+    """Return the JSON string sending data, a byte or unicode string.
+
+    Byte strings are decoded as latin-1, which maps each byte to one
+    character. Unicode strings are sent as their UTF-8 encoding.
+    """
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    return data.decode('latin-1')
+
+
+def decode_data(data):
+    """Return the byte string sent by encode_data."""
+    return data.encode('latin-1')
+
+
+def send_message(sock, message):
+    data = json.dumps(message)
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def recv_message(sock):
+    """Return the next message received on sock, None on EOF."""
+    header = _recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    length, = HEADER.unpack(header)
+    if length > MAX_MESSAGE_LEN:
+        raise ValueError("Message too long: %d bytes" % length)
+    data = _recv_exactly(sock, length)
+    if data is None:
+        return None
+    return json.loads(data)
+
+
+class RootwrapDaemon(object):
+
+    def __init__(self, config, filters, token):
+        self.config = config
+        self.filters = filters
+        self.token = token
+
+    def run_command(self, userargs, stdin=None):
+        """Run userargs if it matches a filter.
+
+        :returns: a (returncode, stdout, stderr) tuple
+        """
+        try:
+            filtermatch = wrapper.match_filter(self.filters, userargs,
+                                               exec_dirs=self.config.exec_dirs)
+            command = filtermatch.get_command(userargs,
+                                              exec_dirs=self.config.exec_dirs)
+        except wrapper.FilterMatchNotExecutable as exc:
+            msg = ("Executable not found: %s (filter match = %s)"
+                   % (exc.match.exec_path, exc.match.name))
+            return self._error(msg, RC_NOEXECFOUND)
+        except wrapper.NoFilterMatched:
+            msg = ("Unauthorized command: %s (no filter matched)"
+                   % ' '.join(userargs))
+            return self._error(msg, RC_UNAUTHORIZED)
+
+        if self.config.use_syslog:
+            logging.info("Executing %s (filter match = %s)" % (
+                command, filtermatch.name))
+        obj = subprocess.Popen(command,
+                               stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE,
+                               close_fds=True,
+                               preexec_fn=_subprocess_setup,
+                               env=filtermatch.get_environment(userargs))
+        stdout, stderr = obj.communicate(stdin)
+        return obj.returncode, stdout, stderr
+
+    def _error(self, msg, returncode):
+        if self.config.use_syslog:
+            logging.error(msg)
+        return returncode, '', 'neutron-rootwrap-daemon: %s\n' % msg
+
+    def handle_connection(self, conn):
+        try:
+            while True:
+                request = recv_message(conn)
+                if request is None:
+                    return
+                if request.get('token') != self.token:
+                    logging.error("Request with an invalid token rejected")
+                    return
+                stdin = request.get('stdin')
+                if stdin is not None:
+                    stdin = decode_data(stdin)
+                returncode, stdout, stderr = self.run_command(
+                    [arg.encode('utf-8') for arg in request['cmd']], stdin)
+                send_message(conn, {'returncode': returncode,
+                                    'stdout': encode_data(stdout),
+                                    'stderr': encode_data(stderr)})
+        except Exception:
+            logging.exception("Unable to process a rootwrap request")
+        finally:
+            conn.close()
+
+    def serve(self, server):
+        while True:
+            conn, _addr = server.accept()
+            thread = threading.Thread(target=self.handle_connection,
+                                      args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+
+def _create_socket_dir():
+    """Create a directory only accessible by the user which invoked sudo."""
+    path = tempfile.mkdtemp(prefix='rootwrap-')
+    os.chmod(path, 0o700)
+    uid = int(os.environ.get('SUDO_UID', os.getuid()))
+    gid = int(os.environ.get('SUDO_GID', os.getgid()))
+    os.chown(path, uid, gid)
+    return path, uid, gid
+
+
+def main():
+    execname = sys.argv.pop(0)
+    if len(sys.argv) != 1:
+        print("%s: usage: %s <config file>" % (execname, execname),
+              file=sys.stderr)
+        sys.exit(RC_BADCONFIG)
+    configfile = sys.argv[0]
+    try:
+        rawconfig = ConfigParser.RawConfigParser()
+        rawconfig.read(configfile)
+        config = wrapper.RootwrapConfig(rawconfig)
+    except (ValueError, ConfigParser.Error) as exc:
+        print("%s: Incorrect configuration file %s: %s" %
+              (execname, configfile, exc), file=sys.stderr)
+        sys.exit(RC_BADCONFIG)
+
+    if config.use_syslog:
+        wrapper.setup_syslog(execname,
+                             config.syslog_log_facility,
+                             config.syslog_log_level)
+
+    filters = wrapper.load_filters(config.filters_path)
+    token = binascii.hexlify(os.urandom(32))
+    socket_dir, uid, gid = _create_socket_dir()
+    socket_path = os.path.join(socket_dir, 'rootwrap.sock')
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(socket_path)
+        os.chown(socket_path, uid, gid)
+        server.listen(128)
+        daemon = RootwrapDaemon(config, filters, token)
+        thread = threading.Thread(target=daemon.serve, args=(server,))
+        thread.daemon = True
+        thread.start()
+        sys.stdout.write(json.dumps({'socket': socket_path,
+                                     'token': token}) + '\n')
+        sys.stdout.flush()
+        # Serve until the service which started the daemon goes away
+        while sys.stdin.read(4096):
+            pass
+    finally:
+        server.close()
+        shutil.rmtree(socket_dir, ignore_errors=True)
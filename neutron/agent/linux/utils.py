@@ -26,13 +26,100 @@ import tempfile
 
 from eventlet.green import subprocess
 from eventlet import greenthread
+from eventlet import semaphore
+from oslo.config import cfg
 
+from neutron.agent.linux import rootwrap_daemon
 from neutron.common import utils
+from neutron.openstack.common import jsonutils
 from neutron.openstack.common import log as logging
 
 
 LOG = logging.getLogger(__name__)
 
+# Root helper daemon clients, by daemon command
+_rootwrap_clients = {}
+
+
+class RootwrapDaemonClient(object):
+    """Run commands through a neutron-rootwrap-daemon.
+
+    The daemon is started on the first command, and again if it exited.
+    """
+
+    def __init__(self, daemon_cmd):
+        self.daemon_cmd = shlex.split(daemon_cmd)
+        self._process = None
+        self._socket_path = None
+        self._token = None
+        self._lock = semaphore.Semaphore()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._process and self._process.poll() is None:
+                return
+            LOG.info(_("Starting root helper daemon: %s"), self.daemon_cmd)
+            self._process = utils.subprocess_popen(self.daemon_cmd,
+                                                   shell=False,
+                                                   stdin=subprocess.PIPE,
+                                                   stdout=subprocess.PIPE)
+            line = self._process.stdout.readline()
+            if not line:
+                self._process = None
+                raise RuntimeError(_("Root helper daemon %s failed to "
+                                     "start") % self.daemon_cmd)
+            info = jsonutils.loads(line)
+            self._socket_path = info['socket']
+            self._token = info['token']
+
+    def _request(self, request):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self._socket_path)
+            rootwrap_daemon.send_message(sock, request)
+            return rootwrap_daemon.recv_message(sock)
+        finally:
+            sock.close()
+
+    def execute(self, cmd, process_input=None):
+        """Run cmd as root.
+
+        :returns: a (returncode, stdout, stderr) tuple
+        """
+        self._ensure_started()
+        request = {'token': self._token, 'cmd': cmd}
+        if process_input is not None:
+            request['stdin'] = rootwrap_daemon.encode_data(process_input)
+        try:
+            reply = self._request(request)
+        except socket.error:
+            # The daemon may have exited since it was checked
+            LOG.warn(_("Root helper daemon unreachable, restarting it"))
+            self._ensure_started()
+            request['token'] = self._token
+            reply = self._request(request)
+        if reply is None:
+            raise RuntimeError(_("Root helper daemon closed the connection "
+                                 "while running %s") % cmd)
+        return (reply['returncode'],
+                rootwrap_daemon.decode_data(reply['stdout']),
+                rootwrap_daemon.decode_data(reply['stderr']))
+
+
+def get_rootwrap_client():
+    """Return the root helper daemon client, None if not configured."""
+    try:
+        daemon_cmd = cfg.CONF.AGENT.root_helper_daemon
+    except cfg.NoSuchOptError:
+        return
+    if not daemon_cmd:
+        return
+    client = _rootwrap_clients.get(daemon_cmd)
+    if client is None:
+        client = _rootwrap_clients[daemon_cmd] = RootwrapDaemonClient(
+            daemon_cmd)
+    return client
+
 
 def create_process(cmd, root_helper=None, addl_env=None):
     """Create a process object for the given command.
@@ -61,17 +148,26 @@ def create_process(cmd, root_helper=None, addl_env=None):
 def execute(cmd, root_helper=None, process_input=None, addl_env=None,
             check_exit_code=True, return_stderr=False):
     try:
-        obj, cmd = create_process(cmd, root_helper=root_helper,
-                                  addl_env=addl_env)
-        _stdout, _stderr = (process_input and
-                            obj.communicate(process_input) or
-                            obj.communicate())
-        obj.stdin.close()
+        # The environment of the daemon cannot be changed by the caller
+        client = root_helper and not addl_env and get_rootwrap_client()
+        if client:
+            cmd = map(str, cmd)
+            LOG.debug(_("Running command with root helper daemon: %s"), cmd)
+            returncode, _stdout, _stderr = client.execute(cmd,
+                                                          process_input)
+        else:
+            obj, cmd = create_process(cmd, root_helper=root_helper,
+                                      addl_env=addl_env)
+            _stdout, _stderr = (process_input and
+                                obj.communicate(process_input) or
+                                obj.communicate())
+            obj.stdin.close()
+            returncode = obj.returncode
         m = _("\nCommand: %(cmd)s\nExit code: %(code)s\nStdout: %(stdout)r\n"
-              "Stderr: %(stderr)r") % {'cmd': cmd, 'code': obj.returncode,
+              "Stderr: %(stderr)r") % {'cmd': cmd, 'code': returncode,
                                        'stdout': _stdout, 'stderr': _stderr}
         LOG.debug(m)
-        if obj.returncode and check_exit_code:
+        if returncode and check_exit_code:
             raise RuntimeError(m)
     finally:
         # NOTE(termie): this appears to be necessary to let the subprocess
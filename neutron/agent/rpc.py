@@ -21,6 +21,7 @@ from neutron.common import topics
 
 from neutron.openstack.common import log as logging
 from neutron.openstack.common import rpc
+from neutron.openstack.common.rpc import common as rpc_common
 from neutron.openstack.common.rpc import proxy
 from neutron.openstack.common import timeutils
 
@@ -79,14 +80,28 @@ class PluginApi(proxy.RpcProxy):
 
     API version history:
         1.0 - Initial version.
+        1.3 - get_devices_details_list and update_device_list.
 
     '''
 
     BASE_RPC_API_VERSION = '1.1'
+    DEVICE_LIST_RPC_API_VERSION = '1.3'
 
     def __init__(self, topic):
         super(PluginApi, self).__init__(
             topic=topic, default_version=self.BASE_RPC_API_VERSION)
+        # Whether the server supports the device list methods; cleared on
+        # the first call rejected by the server
+        self.use_device_list = True
+
+    def _disable_device_list(self, e):
+        """Return whether e rejected a device list call as unsupported."""
+        if e.exc_type not in ('UnsupportedRpcVersion', 'AttributeError'):
+            return False
+        LOG.info(_("Device list RPCs not supported by the server, falling "
+                   "back to one call per device"))
+        self.use_device_list = False
+        return True
 
     def get_device_details(self, context, device, agent_id):
         return self.call(context,
@@ -106,6 +121,62 @@ class PluginApi(proxy.RpcProxy):
                                        agent_id=agent_id, host=host),
                          topic=self.topic)
 
+    def get_devices_details_list(self, context, devices, agent_id):
+        """Return the details of each device of devices, in order."""
+        if self.use_device_list:
+            try:
+                return self.call(context,
+                                 self.make_msg('get_devices_details_list',
+                                               devices=devices,
+                                               agent_id=agent_id),
+                                 topic=self.topic,
+                                 version=self.DEVICE_LIST_RPC_API_VERSION)
+            except rpc_common.RemoteError as e:
+                if not self._disable_device_list(e):
+                    raise
+        return [self.get_device_details(context, device, agent_id)
+                for device in devices]
+
+    def update_device_list(self, context, devices_up, devices_down,
+                           agent_id, host=None):
+        """Report devices_up as up and devices_down as down.
+
+        :returns: a dict of the devices_up updated, of the devices_down
+                  replies of update_device_down, and of the failed_devices_up
+                  and failed_devices_down which could not be updated.
+        """
+        if self.use_device_list:
+            try:
+                return self.call(context,
+                                 self.make_msg('update_device_list',
+                                               devices_up=devices_up,
+                                               devices_down=devices_down,
+                                               agent_id=agent_id, host=host),
+                                 topic=self.topic,
+                                 version=self.DEVICE_LIST_RPC_API_VERSION)
+            except rpc_common.RemoteError as e:
+                if not self._disable_device_list(e):
+                    raise
+        result = {'devices_up': [], 'failed_devices_up': [],
+                  'devices_down': [], 'failed_devices_down': []}
+        for device in devices_up:
+            try:
+                self.update_device_up(context, device, agent_id, host)
+                result['devices_up'].append(device)
+            except Exception as e:
+                LOG.debug(_("update_device_up failed for %(device)s: %(e)s"),
+                          {'device': device, 'e': e})
+                result['failed_devices_up'].append(device)
+        for device in devices_down:
+            try:
+                result['devices_down'].append(
+                    self.update_device_down(context, device, agent_id, host))
+            except Exception as e:
+                LOG.debug(_("update_device_down failed for %(device)s: "
+                            "%(e)s"), {'device': device, 'e': e})
+                result['failed_devices_down'].append(device)
+        return result
+
     def tunnel_sync(self, context, tunnel_ip, tunnel_type=None):
         return self.call(context,
                          self.make_msg('tunnel_sync', tunnel_ip=tunnel_ip,
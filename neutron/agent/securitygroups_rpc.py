@@ -16,20 +16,39 @@
 #    under the License.
 #
 
+import eventlet
+import netaddr
 from oslo.config import cfg
 
 from neutron.common import topics
 from neutron.openstack.common import importutils
 from neutron.openstack.common import log as logging
+from neutron.openstack.common.rpc import common as rpc_common
 
 LOG = logging.getLogger(__name__)
 SG_RPC_VERSION = "1.1"
+# Version of the server API providing security_group_info_for_devices
+SG_INFO_RPC_VERSION = "1.2"
+DIRECTION_IP_PREFIX = {'ingress': 'source_ip_prefix',
+                       'egress': 'dest_ip_prefix'}
 
 security_group_opts = [
     cfg.StrOpt(
         'firewall_driver',
         default='neutron.agent.firewall.NoopFirewallDriver',
-        help=_('Driver for Security Groups Firewall'))
+        help=_('Driver for Security Groups Firewall')),
+    cfg.BoolOpt(
+        'enable_ipset',
+        default=False,
+        help=_('Use ipset to match the members of remote security groups '
+               'instead of one iptables rule per member')),
+    cfg.FloatOpt(
+        'firewall_refresh_delay',
+        default=0,
+        help=_('Seconds during which security group notifications are '
+               'accumulated, before refreshing the firewall of all the '
+               'affected devices at once. 0 refreshes it on each '
+               'notification'))
 ]
 cfg.CONF.register_opts(security_group_opts, 'SECURITYGROUP')
 
@@ -57,6 +76,15 @@ class SecurityGroupServerRpcApiMixin(object):
                          version=SG_RPC_VERSION,
                          topic=self.topic)
 
+    def security_group_info_for_devices(self, context, devices):
+        LOG.debug(_("Get security group information "
+                    "for devices via rpc %r"), devices)
+        return self.call(context,
+                         self.make_msg('security_group_info_for_devices',
+                                       devices=devices),
+                         version=SG_INFO_RPC_VERSION,
+                         topic=self.topic)
+
 
 class SecurityGroupAgentRpcCallbackMixin(object):
     """A mix-in that enable SecurityGroup agent
@@ -111,13 +139,86 @@ class SecurityGroupAgentRpcMixin(object):
         firewall_driver = cfg.CONF.SECURITYGROUP.firewall_driver
         LOG.debug(_("Init firewall settings (driver=%s)"), firewall_driver)
         self.firewall = importutils.import_object(firewall_driver)
+        # Whether the server supports security_group_info_for_devices;
+        # cleared on the first call rejected by the server
+        self.use_enhanced_rpc = True
+        # Devices whose firewall refresh is pending, when refreshes are
+        # delayed, and whether all of them must be refreshed
+        self.devices_to_refresh = set()
+        self.global_refresh_firewall = False
+        self._refresh_timer = None
+        self.refresh_stats = {'requested': 0,
+                              'coalesced': 0,
+                              'executed': 0}
+
+    def get_refresh_state(self):
+        """Return the firewall refresh counters, for the agent report."""
+        return dict(('firewall_refreshes_%s' % key, value)
+                    for key, value in self.refresh_stats.items())
+
+    def _security_group_rules_for_devices(self, device_ids):
+        """Return the ports of device_ids with their security group rules.
+
+        The compact security group information is requested when the server
+        supports it, and remote groups are then expanded locally.
+        """
+        if self.use_enhanced_rpc:
+            try:
+                sg_info = self.plugin_rpc.security_group_info_for_devices(
+                    self.context, list(device_ids))
+                return self._expand_security_group_info(sg_info)
+            except rpc_common.RemoteError as e:
+                if e.exc_type not in ('UnsupportedRpcVersion',
+                                      'AttributeError'):
+                    raise
+                LOG.info(_("Security group information RPC not supported "
+                           "by the server, falling back to "
+                           "security_group_rules_for_devices"))
+                self.use_enhanced_rpc = False
+        return self.plugin_rpc.security_group_rules_for_devices(
+            self.context, list(device_ids))
+
+    def _expand_security_group_info(self, sg_info):
+        """Build the rules of each device from security group info.
+
+        The result is the same as the one of
+        security_group_rules_for_devices: rules of remote groups are
+        converted to one rule per member IP address of the group, other
+        than the ones of the port itself.
+        """
+        devices = sg_info['devices']
+        security_groups = sg_info['security_groups']
+        member_ips = sg_info['sg_member_ips']
+        for port in devices.values():
+            # Provider rules are added by the server
+            provider_rules = port.get('security_group_rules', [])
+            rules = []
+            for sg_id in port.get('security_groups', []):
+                for rule in security_groups.get(sg_id, []):
+                    remote_group_id = rule.get('remote_group_id')
+                    if not remote_group_id:
+                        rules.append(dict(rule))
+                        continue
+                    port['security_group_source_groups'].append(
+                        remote_group_id)
+                    direction_ip_prefix = DIRECTION_IP_PREFIX[
+                        rule['direction']]
+                    ips = member_ips.get(remote_group_id, {})
+                    for ip in ips.get(rule['ethertype'], []):
+                        if ip in port.get('fixed_ips', []):
+                            continue
+                        ip_rule = dict(rule)
+                        ip_rule[direction_ip_prefix] = str(
+                            netaddr.IPNetwork(ip).cidr)
+                        rules.append(ip_rule)
+            port['security_group_rules'] = rules + provider_rules
+        return devices
 
     def prepare_devices_filter(self, device_ids):
         if not device_ids:
             return
         LOG.info(_("Preparing filters for devices %s"), device_ids)
-        devices = self.plugin_rpc.security_group_rules_for_devices(
-            self.context, list(device_ids))
+        devices = self._security_group_rules_for_devices(device_ids)
         with self.firewall.defer_apply():
             for device in devices.values():
                 self.firewall.prepare_port_filter(device)
@@ -144,11 +245,65 @@ class SecurityGroupAgentRpcMixin(object):
                 devices.append(device)
 
         if devices:
-            self.refresh_firewall(devices)
+            self._schedule_refresh(devices)
 
     def security_groups_provider_updated(self):
         LOG.info(_("Provider rule updated"))
-        self.refresh_firewall()
+        self._schedule_refresh()
+
+    def _schedule_refresh(self, devices=None):
+        """Refresh the firewall of devices, all of them if None.
+
+        When firewall_refresh_delay is set, the refresh is delayed and
+        merged with the ones requested in the meantime.
+        """
+        self.refresh_stats['requested'] += 1
+        delay = cfg.CONF.SECURITYGROUP.firewall_refresh_delay
+        if not delay:
+            self.refresh_stats['executed'] += 1
+            if devices is None:
+                self.refresh_firewall()
+            else:
+                self.refresh_firewall(devices)
+            return
+        if devices is None:
+            self.global_refresh_firewall = True
+        else:
+            self.devices_to_refresh.update(d['device'] for d in devices)
+        if self._refresh_timer:
+            self.refresh_stats['coalesced'] += 1
+        else:
+            self._refresh_timer = eventlet.spawn_after(delay,
+                                                       self._refresh_delayed)
+
+    def _refresh_delayed(self):
+        self._refresh_timer = None
+        devices = None
+        if not self.global_refresh_firewall:
+            devices = [self.firewall.ports[device_id]
+                       for device_id in self.devices_to_refresh
+                       if device_id in self.firewall.ports]
+        global_refresh = self.global_refresh_firewall
+        device_ids = self.devices_to_refresh
+        self.global_refresh_firewall = False
+        self.devices_to_refresh = set()
+        if devices == []:
+            return
+        self.refresh_stats['executed'] += 1
+        LOG.debug(_("Refreshing firewall: %(requested)d refreshes "
+                    "requested, %(coalesced)d coalesced, %(executed)d "
+                    "executed"), self.refresh_stats)
+        try:
+            self.refresh_firewall(devices)
+        except Exception:
+            LOG.exception(_("Delayed firewall refresh failed, will retry"))
+            # Merge with the refreshes requested in the meantime
+            self.global_refresh_firewall |= global_refresh
+            self.devices_to_refresh |= device_ids
+            if not self._refresh_timer:
+                self._refresh_timer = eventlet.spawn_after(
+                    cfg.CONF.SECURITYGROUP.firewall_refresh_delay,
+                    self._refresh_delayed)
 
     def remove_devices_filter(self, device_ids):
         if not device_ids:
@@ -171,8 +326,7 @@ class SecurityGroupAgentRpcMixin(object):
         if not device_ids:
             LOG.info(_("No ports here to refresh firewall"))
             return
-        devices = self.plugin_rpc.security_group_rules_for_devices(
-            self.context, device_ids)
+        devices = self._security_group_rules_for_devices(device_ids)
         with self.firewall.defer_apply():
             for device in devices.values():
                 LOG.debug(_("Update port filter for %s"), device['device'])
@@ -150,14 +150,49 @@ class Controller(object):
         attr_val = self._attr_info.get(attr_name)
         return attr_val and attr_val['is_visible'] and authz_check
 
-    def _view(self, context, data, fields_to_strip=None):
+    def _get_view(self, context, fields_to_strip=None):
+        """Return a function returning the visible attributes of an object.
+
+        The policy of the attributes is checked once for all the objects
+        of the request, except for the rules which depend on the object,
+        e.g. on its tenant_id, which are checked by _is_visible.
+        """
         # make sure fields_to_strip is iterable
         if not fields_to_strip:
             fields_to_strip = []
 
-        return dict(item for item in data.iteritems()
-                    if (self._is_visible(context, item[0], data) and
-                        item[0] not in fields_to_strip))
+        action = self._plugin_handlers[self.SHOW]
+        resource_attrs = attributes.RESOURCE_ATTRIBUTE_MAP.get(
+            self._collection, {})
+        visible = set()
+        checked = set()
+        for attr_name, attr_val in self._attr_info.iteritems():
+            if (not attr_val.get('is_visible') or
+                    attr_name in fields_to_strip):
+                continue
+            attr = resource_attrs.get(attr_name)
+            authz_check = True
+            if attr and attr.get('enforce_policy'):
+                try:
+                    authz_check = policy.check_without_target(
+                        context, "%s:%s" % (action, attr_name),
+                        must_exist=True)
+                except exceptions.PolicyRuleNotFound:
+                    pass
+            if authz_check is None:
+                checked.add(attr_name)
+            elif authz_check:
+                visible.add(attr_name)
+
+        def view(data):
+            return dict(item for item in data.iteritems()
+                        if (item[0] in visible or
+                            (item[0] in checked and
+                             self._is_visible(context, item[0], data))))
+        return view
+
+    def _view(self, context, data, fields_to_strip=None):
+        return self._get_view(context, fields_to_strip)(data)
 
     def _do_field_list(self, original_fields):
         fields_to_add = None
@@ -237,16 +272,20 @@ class Controller(object):
         if do_authz:
             # FIXME(salvatore-orlando): obj_getter might return references to
             # other resources. Must check authZ on them too.
-            # Omit items from list that should not be visible
-            obj_list = [obj for obj in obj_list
-                        if policy.check(request.context,
-                                        self._plugin_handlers[self.SHOW],
-                                        obj,
-                                        plugin=self._plugin)]
-        collection = {self._collection:
-                      [self._view(request.context, obj,
-                                  fields_to_strip=fields_to_add)
-                       for obj in obj_list]}
+            # Omit items from list that should not be visible, the objects
+            # are only checked when the result depends on them
+            authz_check = policy.check_without_target(
+                request.context, self._plugin_handlers[self.SHOW])
+            if authz_check is None:
+                obj_list = [obj for obj in obj_list
+                            if policy.check(request.context,
+                                            self._plugin_handlers[self.SHOW],
+                                            obj,
+                                            plugin=self._plugin)]
+            elif not authz_check:
+                obj_list = []
+        view = self._get_view(request.context, fields_to_strip=fields_to_add)
+        collection = {self._collection: [view(obj) for obj in obj_list]}
         pagination_links = pagination_helper.get_links(obj_list)
         if pagination_links:
             collection[self._collection + "_links"] = pagination_links
@@ -71,6 +71,11 @@ core_opts = [
                help=_("Maximum number of host routes per subnet")),
     cfg.IntOpt('max_fixed_ips_per_port', default=5,
                help=_("Maximum number of fixed ips per port")),
+    cfg.StrOpt('ipam_driver',
+               help=_("The driver used for tracking free addresses in "
+                      "subnet allocation pools, e.g.: "
+                      "neutron.db.ipam_chunk_db.ChunkIpamDriver. If not set "
+                      "the availability ranges table is used")),
     cfg.IntOpt('dhcp_lease_duration', default=86400,
                deprecated_name='dhcp_lease_time',
                help=_("DHCP lease duration")),
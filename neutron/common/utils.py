@@ -205,3 +205,14 @@ def log_opt_values(log):
 
 def is_valid_vlan_tag(vlan):
     return q_const.MIN_VLAN_TAG <= vlan <= q_const.MAX_VLAN_TAG
+
+
+def split_list(items, size):
+    """Split items in successive lists of at most size items.
+
+    All the items are returned in a single list when size is not positive.
+    """
+    items = list(items)
+    if size <= 0:
+        return [items] if items else []
+    return [items[i:i + size] for i in range(0, len(items), size)]
@@ -28,6 +28,7 @@ from neutron.api.v2 import attributes
 from neutron.common import constants
 from neutron.common import exceptions as q_exc
 from neutron.db import api as db
+from neutron.db import ipam_base
 from neutron.db import models_v2
 from neutron.db import sqlalchemyutils
 from neutron import neutron_plugin_base_v2
@@ -65,6 +66,11 @@ class CommonDbMixin(object):
     # TODO(salvatore-orlando): Avoid using class-level variables
     _dict_extend_functions = {}
 
+    # The attributes of each model that its dict function, given by name,
+    # copies unchanged from a column and that no extend function rewrites.
+    # They are selected alone when they are the only requested fields.
+    _projected_columns = {}
+
     @classmethod
     def register_model_query_hook(cls, model, name, query_hook, filter_hook,
                                   result_filters=None):
@@ -185,6 +191,25 @@ class CommonDbMixin(object):
                                                     marker_obj=marker_obj)
         return collection
 
+    def _get_field_columns(self, model, dict_func, fields):
+        """Return the (field, column) pairs of the fields, if all projected.
+
+        The fields must all be in _projected_columns for the model, and
+        dict_func must be the dict function of the class declaring them,
+        not an override of a subclass.
+        """
+        if not fields or model not in self._projected_columns:
+            return
+        func_name, projected = self._projected_columns[model]
+        owner = [cls for cls in type(self).__mro__
+                 if '_projected_columns' in vars(cls)][0]
+        if getattr(dict_func, 'im_func', None) is not vars(owner).get(
+                func_name):
+            return
+        fields = sorted(set(fields))
+        if all(field in projected for field in fields):
+            return [(field, getattr(model, field)) for field in fields]
+
     def _get_collection(self, context, model, dict_func, filters=None,
                         fields=None, sorts=None, limit=None, marker_obj=None,
                         page_reverse=False):
@@ -193,7 +218,15 @@ class CommonDbMixin(object):
                                            limit=limit,
                                            marker_obj=marker_obj,
                                            page_reverse=page_reverse)
-        items = [dict_func(c, fields) for c in query]
+        field_columns = self._get_field_columns(model, dict_func, fields)
+        if field_columns:
+            # Only the columns of the fields are loaded, without the
+            # relationships and the extensions of the objects
+            fields, columns = zip(*field_columns)
+            items = [dict(zip(fields, row))
+                     for row in query.with_entities(*columns)]
+        else:
+            items = [dict_func(c, fields) for c in query]
         if limit and page_reverse:
             items.reverse()
         return items
@@ -224,6 +257,20 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
     __native_pagination_support = True
     __native_sorting_support = True
 
+    _projected_columns = {
+        models_v2.Network: ('_make_network_dict',
+                            ('id', 'name', 'tenant_id', 'admin_state_up',
+                             'status', 'shared')),
+        models_v2.Subnet: ('_make_subnet_dict',
+                           ('id', 'name', 'tenant_id', 'network_id',
+                            'ip_version', 'cidr', 'gateway_ip',
+                            'enable_dhcp', 'shared')),
+        models_v2.Port: ('_make_port_dict',
+                         ('id', 'name', 'network_id', 'tenant_id',
+                          'mac_address', 'admin_state_up', 'status',
+                          'device_id', 'device_owner')),
+    }
+
     def __init__(self):
         # NOTE(jkoelker) This is an incomplete implementation. Subclasses
         #                must override __init__ and setup the database
@@ -284,16 +331,20 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
         return context.session.query(models_v2.Subnet).all()
 
     @staticmethod
-    def _generate_mac(context, network_id):
+    def _get_random_mac():
         base_mac = cfg.CONF.base_mac.split(':')
+        mac = [int(base_mac[0], 16), int(base_mac[1], 16),
+               int(base_mac[2], 16), random.randint(0x00, 0xff),
+               random.randint(0x00, 0xff), random.randint(0x00, 0xff)]
+        if base_mac[3] != '00':
+            mac[3] = int(base_mac[3], 16)
+        return ':'.join(map(lambda x: "%02x" % x, mac))
+
+    @staticmethod
+    def _generate_mac(context, network_id):
         max_retries = cfg.CONF.mac_generation_retries
         for i in range(max_retries):
-            mac = [int(base_mac[0], 16), int(base_mac[1], 16),
-                   int(base_mac[2], 16), random.randint(0x00, 0xff),
-                   random.randint(0x00, 0xff), random.randint(0x00, 0xff)]
-            if base_mac[3] != '00':
-                mac[3] = int(base_mac[3], 16)
-            mac_address = ':'.join(map(lambda x: "%02x" % x, mac))
+            mac_address = NeutronDbPluginV2._get_random_mac()
             if NeutronDbPluginV2._check_unique_mac(context, network_id,
                                                    mac_address):
                 LOG.debug(_("Generated mac for network %(network_id)s "
@@ -310,6 +361,34 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                   max_retries)
         raise q_exc.MacAddressGenerationFailure(net_id=network_id)
 
+    @staticmethod
+    def _generate_macs(context, network_id, count):
+        """Generate count MAC addresses unique on the network.
+
+        Each attempt checks all the candidate addresses with a single query.
+        """
+        macs = set()
+        if not count:
+            return []
+        max_retries = cfg.CONF.mac_generation_retries
+        for i in range(max_retries):
+            candidates = set(NeutronDbPluginV2._get_random_mac()
+                             for _i in range(count - len(macs))) - macs
+            mac_qry = context.session.query(models_v2.Port.mac_address)
+            in_use = set(mac for (mac,) in mac_qry.filter(
+                models_v2.Port.network_id == network_id,
+                models_v2.Port.mac_address.in_(candidates)))
+            macs |= candidates - in_use
+            if len(macs) == count:
+                return list(macs)
+            LOG.debug(_("Generated %(count)s macs already in use. Remaining "
+                        "attempts %(max_retries)s."),
+                      {'count': len(in_use) + count - len(macs),
+                       'max_retries': max_retries - (i + 1)})
+        LOG.error(_("Unable to generate mac address after %s attempts"),
+                  max_retries)
+        raise q_exc.MacAddressGenerationFailure(net_id=network_id)
+
     @staticmethod
     def _check_unique_mac(context, network_id, mac_address):
         mac_qry = context.session.query(models_v2.Port)
@@ -325,6 +404,12 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
         """Return an IP address to the pool of free IP's on the network
         subnet.
         """
+        ipam_driver = ipam_base.get_driver()
+        if ipam_driver:
+            ipam_driver.release_ip(context, subnet_id, ip_address)
+            NeutronDbPluginV2._delete_ip_allocation(
+                context, network_id, subnet_id, ip_address)
+            return
         # Grab all allocation pools for the subnet
         allocation_pools = (context.session.query(
             models_v2.IPAllocationPool).filter_by(subnet_id=subnet_id).
@@ -442,10 +527,14 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                   {'ip_address': ip_address,
                    'network_id': network_id,
                    'subnet_id': subnet_id})
-        context.session.query(models_v2.IPAllocation).filter_by(
+        query = context.session.query(models_v2.IPAllocation).filter_by(
             network_id=network_id,
             ip_address=ip_address,
-            subnet_id=subnet_id).delete()
+            subnet_id=subnet_id)
+        port_ids = [port_id for port_id, in query.with_entities(
+            models_v2.IPAllocation.port_id)]
+        query.delete()
+        models_v2.set_updated_at(context.session, models_v2.Port, port_ids)
 
     @staticmethod
     def _generate_ip(context, subnets):
@@ -454,6 +543,9 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
         The IP address will be generated from one of the subnets defined on
         the network.
         """
+        ipam_driver = ipam_base.get_driver()
+        if ipam_driver:
+            return ipam_driver.generate_ip(context, subnets)
         range_qry = context.session.query(
             models_v2.IPAvailabilityRange).join(
                 models_v2.IPAllocationPool).with_lockmode('update')
@@ -481,9 +573,48 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
             return {'ip_address': ip_address, 'subnet_id': subnet['id']}
         raise q_exc.IpAddressGenerationFailure(net_id=subnets[0]['network_id'])
 
+    @staticmethod
+    def _generate_ips(context, subnets, count):
+        """Generate count IP addresses.
+
+        Addresses are taken in blocks from the availability ranges of the
+        subnets, which are locked once for the whole batch.
+        """
+        ipam_driver = ipam_base.get_driver()
+        if ipam_driver:
+            return ipam_driver.generate_ips(context, subnets, count)
+        ips = []
+        range_qry = context.session.query(
+            models_v2.IPAvailabilityRange).join(
+                models_v2.IPAllocationPool).with_lockmode('update')
+        for subnet in subnets:
+            for ip_range in range_qry.filter_by(subnet_id=subnet['id']):
+                first = netaddr.IPAddress(ip_range['first_ip'])
+                last = netaddr.IPAddress(ip_range['last_ip'])
+                taken = min(count - len(ips), int(last) - int(first) + 1)
+                ips.extend({'ip_address': str(first + i),
+                            'subnet_id': subnet['id']}
+                           for i in range(taken))
+                LOG.debug(_("Allocated %(count)s IPs from %(first_ip)s "
+                            "to %(last_ip)s"),
+                          {'count': taken,
+                           'first_ip': ip_range['first_ip'],
+                           'last_ip': ip_range['last_ip']})
+                if first + taken > last:
+                    context.session.delete(ip_range)
+                else:
+                    ip_range['first_ip'] = str(first + taken)
+                if len(ips) == count:
+                    return ips
+        raise q_exc.IpAddressGenerationFailure(net_id=subnets[0]['network_id'])
+
     @staticmethod
     def _allocate_specific_ip(context, subnet_id, ip_address):
         """Allocate a specific IP address on the subnet."""
+        ipam_driver = ipam_base.get_driver()
+        if ipam_driver:
+            return ipam_driver.allocate_specific_ip(context, subnet_id,
+                                                    ip_address)
         ip = int(netaddr.IPAddress(ip_address))
         range_qry = context.session.query(
             models_v2.IPAvailabilityRange).join(
@@ -1164,11 +1295,15 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                         nexthop=rt['nexthop'])
                     context.session.add(route)
 
+            ipam_driver = ipam_base.get_driver()
             for pool in s['allocation_pools']:
                 ip_pool = models_v2.IPAllocationPool(subnet=subnet,
                                                      first_ip=pool['start'],
                                                      last_ip=pool['end'])
                 context.session.add(ip_pool)
+                if ipam_driver:
+                    ipam_driver.create_pool(context, ip_pool)
+                    continue
                 ip_range = models_v2.IPAvailabilityRange(
                     ipallocationpool=ip_pool,
                     first_ip=pool['start'],
@@ -1302,7 +1437,157 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                                           filters=filters)
 
     def create_port_bulk(self, context, ports):
-        return self._create_bulk('port', context, ports)
+        # Plugins extending create_port need it to be invoked for each port
+        if (getattr(self.create_port, 'im_func', None) is not
+                NeutronDbPluginV2.create_port.im_func):
+            return self._create_bulk('port', context, ports)
+        return self._create_ports_bulk_db(context, ports)
+
+    def _generate_ips_for_ports(self, context, network_id, count):
+        """Allocate an IPv4 and an IPv6 address (if any) for count ports."""
+        if not count:
+            return []
+        filter = {'network_id': [network_id]}
+        subnets = self.get_subnets(context, filters=filter)
+        ips = [[] for _i in range(count)]
+        for version in (4, 6):
+            version_subnets = [subnet for subnet in subnets
+                               if subnet['ip_version'] == version]
+            if version_subnets:
+                for port_ips, ip in zip(ips, NeutronDbPluginV2._generate_ips(
+                        context, version_subnets, count)):
+                    port_ips.append(ip)
+        return ips
+
+    @staticmethod
+    def _allocate_ip_in_batch(context, network_id, allocated, subnet_id,
+                              ip_address):
+        """Allocate a requested IP address unless the batch already has it.
+
+        :raises: IpAddressInUse
+        """
+        if (subnet_id, ip_address) in allocated:
+            raise q_exc.IpAddressInUse(net_id=network_id,
+                                       ip_address=ip_address)
+        NeutronDbPluginV2._allocate_specific_ip(context, subnet_id,
+                                                ip_address)
+        allocated.add((subnet_id, ip_address))
+
+    def _create_ports_bulk_db(self, context, ports):
+        """Create ports in the DB with a few set based operations.
+
+        MAC and IP addresses are generated for all the ports of each network
+        at once, and ports and IP allocations are inserted with a single
+        statement each. Extensions are not processed, as in create_port.
+        """
+        items = [port['port'] for port in ports['ports']]
+        port_rows = []
+        ip_rows = []
+        networks = {}
+        for p in items:
+            p['tenant_id'] = self._get_tenant_id_for_create(context, p)
+            p['id'] = p.get('id') or uuidutils.generate_uuid()
+            networks.setdefault(p['network_id'], []).append(p)
+
+        with context.session.begin(subtransactions=True):
+            for network_id, net_items in networks.iteritems():
+                # Raises NetworkNotFound
+                self._get_network(context, network_id)
+
+                requested_macs = [p['mac_address'] for p in net_items
+                                  if p['mac_address'] is not
+                                  attributes.ATTR_NOT_SPECIFIED]
+                if requested_macs:
+                    mac_qry = context.session.query(
+                        models_v2.Port.mac_address)
+                    in_use = mac_qry.filter(
+                        models_v2.Port.network_id == network_id,
+                        models_v2.Port.mac_address.in_(requested_macs)).first()
+                    if (in_use or
+                            len(set(requested_macs)) < len(requested_macs)):
+                        mac = in_use[0] if in_use else requested_macs[0]
+                        raise q_exc.MacAddressInUse(net_id=network_id,
+                                                    mac=mac)
+                macs = NeutronDbPluginV2._generate_macs(
+                    context, network_id,
+                    len(net_items) - len(requested_macs))
+
+                # The requested IP addresses are allocated first, so that
+                # they are not generated for the other ports of the batch
+                allocated = set()
+                configured_ips = {}
+                for p in net_items:
+                    if p['fixed_ips'] is attributes.ATTR_NOT_SPECIFIED:
+                        continue
+                    fixed_ips = self._test_fixed_ips_for_port(
+                        context, network_id, p['fixed_ips'])
+                    for fixed in fixed_ips:
+                        if 'ip_address' in fixed:
+                            self._allocate_ip_in_batch(
+                                context, network_id, allocated,
+                                fixed['subnet_id'], fixed['ip_address'])
+                    configured_ips[p['id']] = fixed_ips
+
+                auto_ip_items = [p for p in net_items if p['fixed_ips'] is
+                                 attributes.ATTR_NOT_SPECIFIED]
+                auto_ips = self._generate_ips_for_ports(
+                    context, network_id, len(auto_ip_items))
+
+                for p in net_items:
+                    if p['mac_address'] is attributes.ATTR_NOT_SPECIFIED:
+                        p['mac_address'] = macs.pop()
+                    if p['fixed_ips'] is attributes.ATTR_NOT_SPECIFIED:
+                        ips = auto_ips.pop(0)
+                        generated = ips
+                    else:
+                        ips = []
+                        generated = []
+                        for fixed in configured_ips[p['id']]:
+                            if 'ip_address' not in fixed:
+                                subnets = [self._get_subnet(
+                                    context, fixed['subnet_id'])]
+                                fixed = self._generate_ip(context, subnets)
+                                generated.append(fixed)
+                            ips.append({'ip_address': fixed['ip_address'],
+                                        'subnet_id': fixed['subnet_id']})
+                    for ip in generated:
+                        key = (ip['subnet_id'], ip['ip_address'])
+                        if key in allocated:
+                            raise q_exc.IpAddressInUse(
+                                net_id=network_id,
+                                ip_address=ip['ip_address'])
+                        allocated.add(key)
+                    port_rows.append(
+                        {'tenant_id': p['tenant_id'],
+                         'name': p['name'],
+                         'id': p['id'],
+                         'network_id': network_id,
+                         'mac_address': p['mac_address'],
+                         'admin_state_up': p['admin_state_up'],
+                         'status': p.get('status',
+                                         constants.PORT_STATUS_ACTIVE),
+                         'device_id': p['device_id'],
+                         'device_owner': p['device_owner']})
+                    ip_rows.extend({'network_id': network_id,
+                                    'port_id': p['id'],
+                                    'ip_address': ip['ip_address'],
+                                    'subnet_id': ip['subnet_id']}
+                                   for ip in ips)
+
+            context.session.execute(models_v2.Port.__table__.insert(),
+                                    port_rows)
+            if ip_rows:
+                context.session.execute(
+                    models_v2.IPAllocation.__table__.insert(), ip_rows)
+            LOG.debug(_("Created %(ports)s ports with %(ips)s IPs"),
+                      {'ports': len(port_rows), 'ips': len(ip_rows)})
+
+            port_qry = context.session.query(models_v2.Port)
+            created = dict((port['id'], port) for port in port_qry.filter(
+                models_v2.Port.id.in_([p['id'] for p in items])))
+        return [self._make_port_dict(created[p['id']],
+                                     process_extensions=False)
+                for p in items]
 
     def create_port(self, context, port):
         p = port['port']
@@ -0,0 +1,48 @@
+# Copyright (c) 2014 OpenStack Foundation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from neutron.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+
+class DeviceRpcCallbackMixin(object):
+    """A mix-in that enable batched device status updates from L2 agents.
+
+    The class using it implements update_device_up and update_device_down.
+    """
+
+    def update_device_list(self, rpc_context, **kwargs):
+        """Devices are up or no longer exist on agent."""
+        devices_up = kwargs.pop('devices_up', None) or []
+        devices_down = kwargs.pop('devices_down', None) or []
+        result = {'devices_up': [], 'failed_devices_up': [],
+                  'devices_down': [], 'failed_devices_down': []}
+        for device in devices_up:
+            try:
+                self.update_device_up(rpc_context, device=device, **kwargs)
+                result['devices_up'].append(device)
+            except Exception:
+                LOG.exception(_("Failed to update device %s up"), device)
+                result['failed_devices_up'].append(device)
+        for device in devices_down:
+            try:
+                result['devices_down'].append(self.update_device_down(
+                    rpc_context, device=device, **kwargs))
+            except Exception:
+                LOG.exception(_("Failed to update device %s down"), device)
+                result['failed_devices_down'].append(device)
+        return result
@@ -13,20 +13,47 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
+
 from oslo.config import cfg
+import sqlalchemy as sa
 
 from neutron.api.v2 import attributes
 from neutron.common import constants
 from neutron.common import exceptions as n_exc
 from neutron.common import utils
+from neutron.db import models_v2
 from neutron.extensions import portbindings
 from neutron import manager
 from neutron.openstack.common.db import exception as db_exc
 from neutron.openstack.common import log as logging
+from neutron.openstack.common import timeutils
 
 
 LOG = logging.getLogger(__name__)
 
+# Seconds subtracted from the changed_since of get_changed_networks_info,
+# covering the transactions committed after the previous call but with an
+# earlier updated_at, and the clock differences between servers
+CHANGED_SINCE_MARGIN = 60
+
+
+def get_changed_network_ids(context, changed_since):
+    """Return the ids of the networks changed since changed_since.
+
+    A network is changed when it, one of its subnets or one of its ports
+    was updated since changed_since.
+    """
+    query = context.session.query
+    network_ids = set()
+    for model, column in ((models_v2.Network, models_v2.Network.id),
+                          (models_v2.Subnet, models_v2.Subnet.network_id),
+                          (models_v2.Port, models_v2.Port.network_id)):
+        network_ids.update(
+            network_id for network_id, in
+            query(column).filter(model.updated_at >= changed_since))
+    return network_ids
+
 
 class DhcpRpcCallbackMixin(object):
     """A mix-in that enable DHCP agent support in plugin implementations."""
@@ -61,6 +88,12 @@ class DhcpRpcCallbackMixin(object):
         host = kwargs.get('host')
         LOG.debug(_('get_active_networks_info from %s'), host)
         networks = self._get_active_networks(context, **kwargs)
+        return self._add_subnets_and_ports(context, networks)
+
+    def _add_subnets_and_ports(self, context, networks):
+        """Add their DHCP enabled subnets and ports to networks."""
+        if not networks:
+            return networks
         plugin = manager.NeutronManager.get_plugin()
         filters = {'network_id': [network['id'] for network in networks]}
         ports = plugin.get_ports(context, filters=filters)
@@ -75,6 +108,52 @@ class DhcpRpcCallbackMixin(object):
 
         return networks
 
+    def _get_counts(self, context, model, network_ids, **filters):
+        """Return the number of rows of model in each network."""
+        query = context.session.query(
+            model.network_id, sa.func.count(model.id)).filter(
+                model.network_id.in_(network_ids)).filter_by(**filters)
+        counts = dict.fromkeys(network_ids, 0)
+        counts.update(query.group_by(model.network_id))
+        return counts
+
+    def get_changed_networks_info(self, context, **kwargs):
+        """Return the active networks changed since the changed_since time.
+
+        The returned dict has:
+        - 'networks': the changed networks with their subnets and ports, all
+          the active networks if changed_since is None.
+        - 'counts': a {network_id: [DHCP enabled subnets, ports]} dict for all
+          the active networks, so that the agent can detect the deletions.
+        - 'timestamp': the changed_since of the next call.
+        """
+        host = kwargs.get('host')
+        changed_since = kwargs.get('changed_since')
+        LOG.debug(_('get_changed_networks_info since %(since)s from '
+                    '%(host)s'), {'since': changed_since, 'host': host})
+        timestamp = timeutils.strtime()
+        networks = self._get_active_networks(context, **kwargs)
+        network_ids = [network['id'] for network in networks]
+        counts = {}
+        if network_ids:
+            subnet_counts = self._get_counts(context, models_v2.Subnet,
+                                             network_ids, enable_dhcp=True)
+            port_counts = self._get_counts(context, models_v2.Port,
+                                           network_ids)
+            counts = dict((network_id, [subnet_counts[network_id],
+                                        port_counts[network_id]])
+                          for network_id in network_ids)
+
+        if changed_since is not None:
+            changed_since = timeutils.parse_strtime(changed_since)
+            changed_since -= datetime.timedelta(seconds=CHANGED_SINCE_MARGIN)
+            changed_ids = get_changed_network_ids(context, changed_since)
+            networks = [network for network in networks
+                        if network['id'] in changed_ids]
+        return {'networks': self._add_subnets_and_ports(context, networks),
+                'counts': counts,
+                'timestamp': timestamp}
+
     def get_network_info(self, context, **kwargs):
         """Retrieve and return a extended information about a network."""
         network_id = kwargs.get('network_id')
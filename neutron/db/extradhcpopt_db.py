@@ -52,6 +52,9 @@ class ExtraDhcpOpt(model_base.BASEV2, models_v2.HasId):
         backref=orm.backref("dhcp_opts", lazy='joined', cascade='delete'))
 
 
+models_v2.register_parent_updated_at(ExtraDhcpOpt, models_v2.Port, 'port_id')
+
+
 class ExtraDhcpOptMixin(object):
     """Mixin class to add extra options to the DHCP opts file
     and associate them to a port.
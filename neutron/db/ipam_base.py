@@ -0,0 +1,90 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import abc
+
+from oslo.config import cfg
+import six
+
+from neutron.openstack.common import importutils
+from neutron.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+_drivers = {}
+
+
+def get_driver():
+    """Return the configured IPAM driver.
+
+    None is returned when no driver is configured; in this case the
+    NeutronDbPluginV2 keeps tracking free addresses in the
+    IPAvailabilityRange table.
+    """
+    driver_class = cfg.CONF.ipam_driver
+    if not driver_class:
+        return None
+    if driver_class not in _drivers:
+        _drivers[driver_class] = importutils.import_object(driver_class)
+        LOG.info(_("Loaded IPAM driver: %s"), driver_class)
+    return _drivers[driver_class]
+
+
+@six.add_metaclass(abc.ABCMeta)
+class IpamDriverBase(object):
+    """Tracks which addresses of the subnet allocation pools are free.
+
+    All the methods are invoked within the transaction of the plugin
+    operation which requires them. IPAllocation records are still managed
+    by the plugin.
+    """
+
+    @abc.abstractmethod
+    def create_pool(self, context, ip_pool):
+        """Set up tracking for a new IPAllocationPool."""
+        pass
+
+    @abc.abstractmethod
+    def generate_ip(self, context, subnets):
+        """Allocate any free address from one of the subnets.
+
+        :returns: a dict with 'ip_address' and 'subnet_id' keys
+        :raises: IpAddressGenerationFailure
+        """
+        pass
+
+    def generate_ips(self, context, subnets, count):
+        """Allocate count free addresses from the subnets.
+
+        Drivers should override this for allocating a batch of addresses
+        at once.
+
+        :returns: a list of dicts with 'ip_address' and 'subnet_id' keys
+        :raises: IpAddressGenerationFailure
+        """
+        return [self.generate_ip(context, subnets) for _i in range(count)]
+
+    @abc.abstractmethod
+    def allocate_specific_ip(self, context, subnet_id, ip_address):
+        """Mark ip_address as in use if it belongs to a pool of the subnet."""
+        pass
+
+    @abc.abstractmethod
+    def release_ip(self, context, subnet_id, ip_address):
+        """Return ip_address to the pool it was allocated from, if any."""
+        pass
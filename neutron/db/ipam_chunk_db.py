@@ -0,0 +1,282 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import random
+
+import netaddr
+from oslo.config import cfg
+
+from neutron.common import exceptions as q_exc
+from neutron.db import ipam_base
+from neutron.db import models_v2
+from neutron.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+chunk_opts = [
+    cfg.IntOpt('ipam_chunk_size', default=256,
+               help=_("Number of addresses tracked by each allocation chunk "
+                      "of the chunk IPAM driver. It must not be changed once "
+                      "subnets have been created")),
+    cfg.IntOpt('ipam_chunk_prefetch', default=16,
+               help=_("Number of chunks created for each allocation pool "
+                      "when the subnet is created. Further chunks are "
+                      "created when the existing ones are exhausted")),
+]
+cfg.CONF.register_opts(chunk_opts)
+
+# Maximum number of chunks with free addresses among which a random one is
+# picked for allocating an address
+MAX_CANDIDATE_CHUNKS = 16
+# Maximum number of addresses looked up by a single query when seeding a
+# chunk from the existing allocations
+MAX_QUERY_ADDRESSES = 256
+
+
+class ChunkIpamDriver(ipam_base.IpamDriverBase):
+    """IPAM driver tracking allocation pools as fixed size bitmap chunks.
+
+    Each chunk is a separate IPAllocationChunk row, and only the row for the
+    chunk an address is taken from is locked for update. Concurrent
+    allocations on the same subnet are spread on different chunks, and
+    therefore do not serialize on a single IPAvailabilityRange row.
+    """
+
+    @property
+    def chunk_size(self):
+        chunk_size = cfg.CONF.ipam_chunk_size
+        if chunk_size < 1:
+            raise q_exc.InvalidConfigurationOption(
+                opt_name='ipam_chunk_size', opt_value=chunk_size)
+        return chunk_size
+
+    def _chunk_bounds(self, ip_pool, ip):
+        """Return the first and last address of the chunk containing ip."""
+        pool_first = int(netaddr.IPAddress(ip_pool['first_ip']))
+        pool_last = int(netaddr.IPAddress(ip_pool['last_ip']))
+        first = (pool_first +
+                 (ip - pool_first) // self.chunk_size * self.chunk_size)
+        return first, min(first + self.chunk_size - 1, pool_last)
+
+    @staticmethod
+    def _get_allocated(context, ip_pool, first, last):
+        """Return the offsets from first of the allocated addresses.
+
+        Addresses are stored as strings, so the addresses of the chunk are
+        looked up by value rather than compared to its bounds.
+        """
+        version = netaddr.IPAddress(ip_pool['first_ip']).version
+        offsets = set()
+        for start in range(first, last + 1, MAX_QUERY_ADDRESSES):
+            addresses = [
+                str(netaddr.IPAddress(ip, version))
+                for ip in range(start,
+                                min(start + MAX_QUERY_ADDRESSES, last + 1))]
+            query = context.session.query(
+                models_v2.IPAllocation.ip_address).filter(
+                    models_v2.IPAllocation.subnet_id == ip_pool['subnet_id'],
+                    models_v2.IPAllocation.ip_address.in_(addresses))
+            for ip_address, in query:
+                offsets.add(int(netaddr.IPAddress(ip_address)) - first)
+        return offsets
+
+    def _add_chunk(self, context, ip_pool, first, last, seed=True):
+        """Create the chunk from first to last.
+
+        Unless seed is False, the addresses already in IPAllocation are
+        marked as allocated: they may have been allocated before the driver
+        was enabled, or before the chunk was created.
+        """
+        version = netaddr.IPAddress(ip_pool['first_ip']).version
+        allocated = (self._get_allocated(context, ip_pool, first, last)
+                     if seed else ())
+        bits = 0
+        for offset in allocated:
+            bits |= 1 << offset
+        chunk = models_v2.IPAllocationChunk(
+            ipallocationpool=ip_pool,
+            first_ip=str(netaddr.IPAddress(first, version)),
+            last_ip=str(netaddr.IPAddress(last, version)),
+            free_count=last - first + 1 - len(allocated),
+            bitmap='%x' % bits)
+        context.session.add(chunk)
+        LOG.debug(_("Created allocation chunk %s"), chunk)
+        return chunk
+
+    @staticmethod
+    def _lock_chunk(context, pool_id, first_ip):
+        query = context.session.query(
+            models_v2.IPAllocationChunk).with_lockmode('update')
+        return query.filter_by(allocation_pool_id=pool_id,
+                               first_ip=first_ip).first()
+
+    @staticmethod
+    def _lock_pools(context, subnet_id):
+        # Eager loads are disabled to avoid outer joins together with
+        # SELECT FOR UPDATE (see lp bug 1215350)
+        query = context.session.query(
+            models_v2.IPAllocationPool).enable_eagerloads(False)
+        return query.filter_by(subnet_id=subnet_id).with_lockmode(
+            'update').all()
+
+    def _find_pool(self, context, subnet_id, ip):
+        query = context.session.query(
+            models_v2.IPAllocationPool).enable_eagerloads(False)
+        for ip_pool in query.filter_by(subnet_id=subnet_id):
+            if (int(netaddr.IPAddress(ip_pool['first_ip'])) <= ip <=
+                    int(netaddr.IPAddress(ip_pool['last_ip']))):
+                return ip_pool
+
+    def _get_chunk(self, context, ip_pool, ip):
+        """Return the chunk containing ip, locked for update.
+
+        The chunk is created if it does not exist yet. The allocation pool
+        row is locked only in this case, in order to prevent concurrent
+        creation of the same chunk.
+        """
+        first, last = self._chunk_bounds(ip_pool, ip)
+        first_ip = str(netaddr.IPAddress(first, netaddr.IPAddress(
+            ip_pool['first_ip']).version))
+        chunk = self._lock_chunk(context, ip_pool['id'], first_ip)
+        if not chunk:
+            context.session.query(models_v2.IPAllocationPool).filter_by(
+                id=ip_pool['id']).enable_eagerloads(False).with_lockmode(
+                    'update').one()
+            chunk = (self._lock_chunk(context, ip_pool['id'], first_ip) or
+                     self._add_chunk(context, ip_pool, first, last))
+        return chunk
+
+    def _reserve_free_chunk(self, context, subnet_id):
+        """Return a chunk with free addresses, locked for update."""
+        candidates = context.session.query(
+            models_v2.IPAllocationChunk.allocation_pool_id,
+            models_v2.IPAllocationChunk.first_ip).join(
+                models_v2.IPAllocationPool).filter(
+                    models_v2.IPAllocationPool.subnet_id == subnet_id,
+                    models_v2.IPAllocationChunk.free_count > 0).limit(
+                        MAX_CANDIDATE_CHUNKS).all()
+        random.shuffle(candidates)
+        for pool_id, first_ip in candidates:
+            chunk = self._lock_chunk(context, pool_id, first_ip)
+            # The chunk might have been exhausted by a concurrent request
+            if chunk and chunk['free_count'] > 0:
+                return chunk
+        # Every existing chunk is full: create the first missing chunk
+        # from the first pool which still has room for it
+        for ip_pool in self._lock_pools(context, subnet_id):
+            existing = set()
+            for chunk in ip_pool.chunks:
+                # A chunk might have been created or released while
+                # waiting for the pool lock
+                if chunk['free_count'] > 0:
+                    return self._lock_chunk(context, ip_pool['id'],
+                                            chunk['first_ip'])
+                existing.add(int(netaddr.IPAddress(chunk['first_ip'])))
+            first = int(netaddr.IPAddress(ip_pool['first_ip']))
+            last_ip = int(netaddr.IPAddress(ip_pool['last_ip']))
+            while first <= last_ip:
+                if first not in existing:
+                    chunk = self._add_chunk(
+                        context, ip_pool, first,
+                        min(first + self.chunk_size - 1, last_ip))
+                    # The addresses of the new chunk might all be in use
+                    if chunk['free_count'] > 0:
+                        return chunk
+                first += self.chunk_size
+
+    def create_pool(self, context, ip_pool):
+        first_ip = int(netaddr.IPAddress(ip_pool['first_ip']))
+        last_ip = int(netaddr.IPAddress(ip_pool['last_ip']))
+        first = first_ip
+        for _i in range(cfg.CONF.ipam_chunk_prefetch):
+            if first > last_ip:
+                break
+            # The subnet of a new pool has no allocated address yet
+            self._add_chunk(context, ip_pool, first,
+                            min(first + self.chunk_size - 1, last_ip),
+                            seed=False)
+            first += self.chunk_size
+
+    def generate_ip(self, context, subnets):
+        for subnet in subnets:
+            chunk = self._reserve_free_chunk(context, subnet['id'])
+            if not chunk:
+                LOG.debug(_("All IPs from subnet %(subnet_id)s (%(cidr)s) "
+                            "allocated"),
+                          {'subnet_id': subnet['id'], 'cidr': subnet['cidr']})
+                continue
+            bits = int(chunk['bitmap'], 16)
+            # Isolate the lowest unset bit
+            offset = (~bits & (bits + 1)).bit_length() - 1
+            chunk['bitmap'] = '%x' % (bits | 1 << offset)
+            chunk['free_count'] -= 1
+            ip_address = str(netaddr.IPAddress(chunk['first_ip']) + offset)
+            LOG.debug(_("Allocated IP - %(ip_address)s from chunk "
+                        "%(first_ip)s - %(last_ip)s"),
+                      {'ip_address': ip_address,
+                       'first_ip': chunk['first_ip'],
+                       'last_ip': chunk['last_ip']})
+            return {'ip_address': ip_address, 'subnet_id': subnet['id']}
+        raise q_exc.IpAddressGenerationFailure(net_id=subnets[0]['network_id'])
+
+    def generate_ips(self, context, subnets, count):
+        ips = []
+        for subnet in subnets:
+            while len(ips) < count:
+                chunk = self._reserve_free_chunk(context, subnet['id'])
+                if not chunk:
+                    break
+                bits = int(chunk['bitmap'], 16)
+                first = netaddr.IPAddress(chunk['first_ip'])
+                taken = min(count - len(ips), chunk['free_count'])
+                for _i in range(taken):
+                    offset = (~bits & (bits + 1)).bit_length() - 1
+                    bits |= 1 << offset
+                    ips.append({'ip_address': str(first + offset),
+                                'subnet_id': subnet['id']})
+                chunk['bitmap'] = '%x' % bits
+                chunk['free_count'] -= taken
+            if len(ips) == count:
+                return ips
+        raise q_exc.IpAddressGenerationFailure(net_id=subnets[0]['network_id'])
+
+    def allocate_specific_ip(self, context, subnet_id, ip_address):
+        ip = int(netaddr.IPAddress(ip_address))
+        ip_pool = self._find_pool(context, subnet_id, ip)
+        if not ip_pool:
+            return
+        chunk = self._get_chunk(context, ip_pool, ip)
+        bit = 1 << (ip - int(netaddr.IPAddress(chunk['first_ip'])))
+        bits = int(chunk['bitmap'], 16)
+        if not bits & bit:
+            chunk['bitmap'] = '%x' % (bits | bit)
+            chunk['free_count'] -= 1
+
+    def release_ip(self, context, subnet_id, ip_address):
+        ip = int(netaddr.IPAddress(ip_address))
+        ip_pool = self._find_pool(context, subnet_id, ip)
+        if not ip_pool:
+            return
+        chunk = self._get_chunk(context, ip_pool, ip)
+        bit = 1 << (ip - int(netaddr.IPAddress(chunk['first_ip'])))
+        bits = int(chunk['bitmap'], 16)
+        if bits & bit:
+            chunk['bitmap'] = '%x' % (bits & ~bit)
+            chunk['free_count'] += 1
+            LOG.debug(_("Recycle %(ip_address)s in chunk %(chunk)s"),
+                      {'ip_address': ip_address, 'chunk': chunk})
@@ -0,0 +1,61 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2014 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""ipam allocation chunks
+
+Revision ID: 2b1d5a3c9e47
+Revises: e197124d4b9
+Create Date: 2014-01-20 11:02:15.328194
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2b1d5a3c9e47'
+down_revision = 'e197124d4b9'
+
+# Change to ['*'] if this migration applies to all plugins
+
+migration_for_plugins = ['*']
+
+from alembic import op
+import sqlalchemy as sa
+
+from neutron.db import migration
+
+
+def upgrade(active_plugins=None, options=None):
+    if not migration.should_run(active_plugins, migration_for_plugins):
+        return
+
+    op.create_table(
+        'ipallocationchunks',
+        sa.Column('allocation_pool_id', sa.String(length=36), nullable=False),
+        sa.Column('first_ip', sa.String(length=64), nullable=False),
+        sa.Column('last_ip', sa.String(length=64), nullable=False),
+        sa.Column('free_count', sa.Integer(), nullable=False),
+        sa.Column('bitmap', sa.Text(), nullable=False),
+        sa.ForeignKeyConstraint(['allocation_pool_id'],
+                                ['ipallocationpools.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('allocation_pool_id', 'first_ip'))
+
+
+def downgrade(active_plugins=None, options=None):
+    if not migration.should_run(active_plugins, migration_for_plugins):
+        return
+
+    op.drop_table('ipallocationchunks')
@@ -0,0 +1,61 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2014 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""networks, subnets and ports updated_at
+
+Revision ID: 3a8e5f1c7d62
+Revises: 4f9b1e8a2c53
+Create Date: 2014-02-03 11:12:37.402817
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3a8e5f1c7d62'
+down_revision = '4f9b1e8a2c53'
+
+# Change to ['*'] if this migration applies to all plugins
+
+migration_for_plugins = ['*']
+
+from alembic import op
+import sqlalchemy as sa
+
+from neutron.db import migration
+
+
+TABLES = ('networks', 'subnets', 'ports')
+
+
+def upgrade(active_plugins=None, options=None):
+    if not migration.should_run(active_plugins, migration_for_plugins):
+        return
+
+    # The existing rows are left NULL: the DHCP agents fetch all their
+    # networks on their first synchronization anyway.
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(),
+                                       nullable=True))
+        op.create_index('ix_%s_updated_at' % table, table, ['updated_at'])
+
+
+def downgrade(active_plugins=None, options=None):
+    if not migration.should_run(active_plugins, migration_for_plugins):
+        return
+
+    for table in TABLES:
+        op.drop_index('ix_%s_updated_at' % table, table)
+        op.drop_column(table, 'updated_at')
@@ -0,0 +1,70 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2014 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""plumgrid director outbox
+
+Revision ID: 4f9b1e8a2c53
+Revises: 2b1d5a3c9e47
+Create Date: 2014-01-27 15:40:51.093012
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4f9b1e8a2c53'
+down_revision = '2b1d5a3c9e47'
+
+# Change to ['*'] if this migration applies to all plugins
+
+migration_for_plugins = [
+    'neutron.plugins.plumgrid.plumgrid_plugin.plumgrid_plugin.'
+    'NeutronPluginPLUMgridV2'
+]
+
+from alembic import op
+import sqlalchemy as sa
+
+from neutron.db import migration
+
+
+def upgrade(active_plugins=None, options=None):
+    if not migration.should_run(active_plugins, migration_for_plugins):
+        return
+
+    op.create_table(
+        'plumgrid_director_outbox',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('resource', sa.String(length=36), nullable=False),
+        sa.Column('resource_id', sa.String(length=36), nullable=False),
+        sa.Column('operation', sa.String(length=64), nullable=False),
+        sa.Column('args', sa.Text(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('last_error', sa.String(length=255), nullable=True),
+        sa.Column('failed', sa.Boolean(), nullable=False),
+        sa.Column('claimed_until', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'))
+    op.create_index('plumgrid_director_outbox_resource',
+                    'plumgrid_director_outbox', ['resource', 'resource_id'])
+
+
+def downgrade(active_plugins=None, options=None):
+    if not migration.should_run(active_plugins, migration_for_plugins):
+        return
+
+    op.drop_index('plumgrid_director_outbox_resource',
+                  'plumgrid_director_outbox')
+    op.drop_table('plumgrid_director_outbox')
@@ -16,9 +16,11 @@
 #    under the License.
 
 import sqlalchemy as sa
+from sqlalchemy import event
 from sqlalchemy import orm
 
 from neutron.db import model_base
+from neutron.openstack.common import timeutils
 from neutron.openstack.common import uuidutils
 
 
@@ -44,6 +46,17 @@ class HasStatusDescription(object):
     status_description = sa.Column(sa.String(255))
 
 
+class HasUpdatedAt(object):
+    """updated_at mixin, set each time a row of the resource is flushed.
+
+    The rows which only describe a resource (e.g.: the fixed IPs of a port)
+    also set the updated_at of their resource, see
+    register_parent_updated_at. Bulk changes must call set_updated_at.
+    """
+
+    updated_at = sa.Column(sa.DateTime, index=True)
+
+
 class IPAvailabilityRange(model_base.BASEV2):
     """Internal representation of available IPs for Neutron subnets.
 
@@ -68,6 +81,31 @@ class IPAvailabilityRange(model_base.BASEV2):
         return "%s - %s" % (self.first_ip, self.last_ip)
 
 
+class IPAllocationChunk(model_base.BASEV2):
+    """Fixed size slice of an allocation pool tracked as a bitmap.
+
+    Used by the chunk IPAM driver instead of IPAvailabilityRange. Bit N of
+    'bitmap' (an hex encoded integer) is set when first_ip + N is allocated.
+    Chunks are created on demand, so that large (e.g.: IPv6) pools only
+    store the slices which are actually in use, and allocations from
+    different chunks of the same pool do not contend for the same row lock.
+    """
+
+    allocation_pool_id = sa.Column(sa.String(36),
+                                   sa.ForeignKey('ipallocationpools.id',
+                                                 ondelete="CASCADE"),
+                                   nullable=False,
+                                   primary_key=True)
+    first_ip = sa.Column(sa.String(64), nullable=False, primary_key=True)
+    last_ip = sa.Column(sa.String(64), nullable=False)
+    free_count = sa.Column(sa.Integer, nullable=False)
+    bitmap = sa.Column(sa.Text, nullable=False)
+
+    def __repr__(self):
+        return "%s - %s (%s free)" % (self.first_ip, self.last_ip,
+                                      self.free_count)
+
+
 class IPAllocationPool(model_base.BASEV2, HasId):
     """Representation of an allocation pool in a Neutron subnet."""
 
@@ -80,6 +118,9 @@ class IPAllocationPool(model_base.BASEV2, HasId):
                                         backref='ipallocationpool',
                                         lazy="joined",
                                         cascade='delete')
+    chunks = orm.relationship(IPAllocationChunk,
+                              backref='ipallocationpool',
+                              cascade='delete')
 
     def __repr__(self):
         return "%s - %s" % (self.first_ip, self.last_ip)
@@ -116,7 +157,7 @@ class SubnetRoute(model_base.BASEV2, Route):
                           primary_key=True)
 
 
-class Port(model_base.BASEV2, HasId, HasTenant):
+class Port(model_base.BASEV2, HasId, HasTenant, HasUpdatedAt):
     """Represents a port on a Neutron v2 network."""
 
     name = sa.Column(sa.String(255))
@@ -140,7 +181,7 @@ class DNSNameServer(model_base.BASEV2):
                           primary_key=True)
 
 
-class Subnet(model_base.BASEV2, HasId, HasTenant):
+class Subnet(model_base.BASEV2, HasId, HasTenant, HasUpdatedAt):
     """Represents a neutron subnet.
 
     When a subnet is created the first and last entries will be created. These
@@ -166,7 +207,7 @@ class Subnet(model_base.BASEV2, HasId, HasTenant):
     shared = sa.Column(sa.Boolean)
 
 
-class Network(model_base.BASEV2, HasId, HasTenant):
+class Network(model_base.BASEV2, HasId, HasTenant, HasUpdatedAt):
     """Represents a v2 neutron network."""
 
     name = sa.Column(sa.String(255))
@@ -175,3 +216,53 @@ class Network(model_base.BASEV2, HasId, HasTenant):
     status = sa.Column(sa.String(16))
     admin_state_up = sa.Column(sa.Boolean)
     shared = sa.Column(sa.Boolean)
+
+
+def _set_updated_at(mapper, connection, target):
+    session = orm.object_session(target)
+    if session is None or session.is_modified(target,
+                                              include_collections=False):
+        target.updated_at = timeutils.utcnow()
+
+
+def set_updated_at(session, model, ids):
+    """Set the updated_at of the rows of model with the given ids.
+
+    Query.update() and Query.delete() bypass the mapper events, so the code
+    changing a resource or its describing rows in bulk calls this instead.
+    """
+    ids = set(ids)
+    ids.discard(None)
+    if ids:
+        session.query(model).filter(model.id.in_(ids)).update(
+            {'updated_at': timeutils.utcnow()}, synchronize_session=False)
+
+
+def register_parent_updated_at(model, parent, parent_key):
+    """Set the updated_at of parent when a row of model is flushed.
+
+    For the rows which only describe a resource, e.g.: the fixed IPs of a
+    port, parent_key being their column referencing the resource.
+    """
+    table = parent.__table__
+
+    def set_parent_updated_at(mapper, connection, target):
+        parent_id = getattr(target, parent_key)
+        if parent_id:
+            connection.execute(table.update().where(
+                table.c.id == parent_id).values(
+                    updated_at=timeutils.utcnow()))
+
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(model, name, set_parent_updated_at)
+
+
+# Networks are not updated on the changes of their ports and subnets, so
+# that the creations of ports on the same network do not contend for the
+# network row
+for resource_model in (Network, Subnet, Port):
+    event.listen(resource_model, 'before_insert', _set_updated_at)
+    event.listen(resource_model, 'before_update', _set_updated_at)
+register_parent_updated_at(IPAllocation, Port, 'port_id')
+register_parent_updated_at(DNSNameServer, Subnet, 'subnet_id')
+register_parent_updated_at(SubnetRoute, Subnet, 'subnet_id')
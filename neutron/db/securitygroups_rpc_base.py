@@ -138,7 +138,29 @@ class SecurityGroupServerRpcCallbackMixin(object):
         :returns: port correspond to the devices with security group rules
         """
         devices = kwargs.get('devices')
+        ports = self._get_ports_for_devices(devices)
+        return self._security_group_rules_for_ports(context, ports)
+
+    def security_group_info_for_devices(self, context, **kwargs):
+        """Return security group information for the devices.
+
+        Unlike security_group_rules_for_devices, the rules and the member
+        IP addresses of each security group are returned only once,
+        whatever the number of ports referencing it. Agents expand the
+        rules of each port locally.
 
+        :params devices: list of devices
+        :returns: a dict with
+            'devices': ports corresponding to the devices, with their
+                       security group ids and provider rules,
+            'security_groups': rules by security group id,
+            'sg_member_ips': IP addresses by ethertype by remote group id
+        """
+        devices = kwargs.get('devices')
+        ports = self._get_ports_for_devices(devices)
+        return self._security_group_info_for_ports(context, ports)
+
+    def _get_ports_for_devices(self, devices):
         ports = {}
         for device in devices:
             port = self.get_port_from_device(device)
@@ -147,7 +169,7 @@ class SecurityGroupServerRpcCallbackMixin(object):
             if port['device_owner'].startswith('network:'):
                 continue
             ports[port['id']] = port
-        return self._security_group_rules_for_ports(context, ports)
+        return ports
 
     def _select_rules_for_ports(self, context, ports):
         if not ports:
@@ -164,6 +186,14 @@ class SecurityGroupServerRpcCallbackMixin(object):
         query = query.filter(sg_binding_port.in_(ports.keys()))
         return query.all()
 
+    def _select_rules_for_security_groups(self, context, sg_ids):
+        if not sg_ids:
+            return []
+        query = context.session.query(sg_db.SecurityGroupRule)
+        query = query.filter(
+            sg_db.SecurityGroupRule.security_group_id.in_(sg_ids))
+        return query.all()
+
     def _select_ips_for_remote_group(self, context, remote_group_ids):
         ips_by_group = {}
         if not remote_group_ids:
@@ -288,25 +318,56 @@ class SecurityGroupServerRpcCallbackMixin(object):
             self._add_ingress_ra_rule(port, ips)
             self._add_ingress_dhcp_rule(port, ips)
 
+    def _make_rule_dict_for_agent(self, rule_in_db):
+        direction = rule_in_db['direction']
+        rule_dict = {
+            'security_group_id': rule_in_db['security_group_id'],
+            'direction': direction,
+            'ethertype': rule_in_db['ethertype'],
+        }
+        for key in ('protocol', 'port_range_min', 'port_range_max',
+                    'remote_ip_prefix', 'remote_group_id'):
+            if rule_in_db.get(key):
+                if key == 'remote_ip_prefix':
+                    direction_ip_prefix = DIRECTION_IP_PREFIX[direction]
+                    rule_dict[direction_ip_prefix] = rule_in_db[key]
+                    continue
+                rule_dict[key] = rule_in_db[key]
+        return rule_dict
+
     def _security_group_rules_for_ports(self, context, ports):
         rules_in_db = self._select_rules_for_ports(context, ports)
         for (binding, rule_in_db) in rules_in_db:
             port_id = binding['port_id']
             port = ports[port_id]
-            direction = rule_in_db['direction']
-            rule_dict = {
-                'security_group_id': rule_in_db['security_group_id'],
-                'direction': direction,
-                'ethertype': rule_in_db['ethertype'],
-            }
-            for key in ('protocol', 'port_range_min', 'port_range_max',
-                        'remote_ip_prefix', 'remote_group_id'):
-                if rule_in_db.get(key):
-                    if key == 'remote_ip_prefix':
-                        direction_ip_prefix = DIRECTION_IP_PREFIX[direction]
-                        rule_dict[direction_ip_prefix] = rule_in_db[key]
-                        continue
-                    rule_dict[key] = rule_in_db[key]
-            port['security_group_rules'].append(rule_dict)
+            port['security_group_rules'].append(
+                self._make_rule_dict_for_agent(rule_in_db))
         self._apply_provider_rule(context, ports)
         return self._convert_remote_group_id_to_ip_prefix(context, ports)
+
+    def _security_group_info_for_ports(self, context, ports):
+        sg_ids = set()
+        for port in ports.values():
+            sg_ids.update(port.get('security_groups', []))
+        security_groups = dict((sg_id, []) for sg_id in sg_ids)
+        remote_group_ids = set()
+        for rule_in_db in self._select_rules_for_security_groups(context,
+                                                                 sg_ids):
+            rule_dict = self._make_rule_dict_for_agent(rule_in_db)
+            security_groups[rule_dict['security_group_id']].append(rule_dict)
+            if rule_dict.get('remote_group_id'):
+                remote_group_ids.add(rule_dict['remote_group_id'])
+        member_ips = {}
+        ips_by_group = self._select_ips_for_remote_group(context,
+                                                         remote_group_ids)
+        for remote_group_id, ips in ips_by_group.iteritems():
+            ips_by_ethertype = {q_const.IPv4: [], q_const.IPv6: []}
+            for ip in ips:
+                ethertype = 'IPv%s' % netaddr.IPNetwork(ip).version
+                ips_by_ethertype[ethertype].append(ip)
+            member_ips[remote_group_id] = ips_by_ethertype
+        # Provider rules depend on the network of each port
+        self._apply_provider_rule(context, ports)
+        return {'devices': ports,
+                'security_groups': security_groups,
+                'sg_member_ips': member_ips}
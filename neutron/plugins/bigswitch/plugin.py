@@ -45,12 +45,17 @@ on port-attach) on an additional PUT to do a bulk dump of all persistent data.
 """
 
 import base64
+import bisect
 import copy
+import datetime
+import functools
 import httplib
 import json
 import socket
+import time
 
 from oslo.config import cfg
+from sqlalchemy import orm
 
 from neutron.api import extensions as neutron_extensions
 from neutron.api.rpc.agentnotifiers import dhcp_rpc_agent_api
@@ -68,6 +73,7 @@ from neutron.db import dhcp_rpc_base
 from neutron.db import external_net_db
 from neutron.db import extradhcpopt_db
 from neutron.db import l3_db
+from neutron.db import models_v2
 from neutron.extensions import external_net
 from neutron.extensions import extra_dhcp_opt as edo_ext
 from neutron.extensions import l3
@@ -75,7 +81,9 @@ from neutron.extensions import portbindings
 from neutron.openstack.common import excutils
 from neutron.openstack.common import importutils
 from neutron.openstack.common import log as logging
+from neutron.openstack.common import loopingcall
 from neutron.openstack.common import rpc
+from neutron.openstack.common import timeutils
 from neutron.plugins.bigswitch.db import porttracker_db
 from neutron.plugins.bigswitch import extensions
 from neutron.plugins.bigswitch import routerrule_db
@@ -99,9 +107,21 @@ restproxy_opts = [
                        "Floodlight controller.")),
     cfg.BoolOpt('sync_data', default=False,
                 help=_("Sync data on connect")),
+    cfg.IntOpt('sync_interval', default=0,
+               help=_("Seconds between the syncs of the networks and "
+                      "routers changed since the last acknowledged sync, 0 "
+                      "to disable them. The objects deleted are only "
+                      "removed from the controller by sync_data.")),
     cfg.IntOpt('server_timeout', default=10,
                help=_("Maximum number of seconds to wait for proxy request "
                       "to connect and complete.")),
+    cfg.IntOpt('server_connections', default=2,
+               help=_("Maximum number of idle connections kept open to "
+                      "each controller and reused by the next requests, 0 "
+                      "to open a new connection for each request.")),
+    cfg.IntOpt('latency_stats_interval', default=0,
+               help=_("Seconds between two logs of the latency of the "
+                      "requests to each controller, 0 to disable them.")),
     cfg.StrOpt('neutron_id', default='neutron-' + utils.get_hostname(),
                deprecated_name='quantum_id',
                help=_("User defined identifier for this Neutron deployment")),
@@ -157,10 +177,18 @@ ATTACHMENT_PATH = "/tenants/%s/networks/%s/ports/%s/attachment"
 ROUTERS_PATH = "/tenants/%s/routers/%s"
 ROUTER_INTF_PATH = "/tenants/%s/routers/%s/interfaces/%s"
 SUCCESS_CODES = range(200, 207)
+# Requests which can be sent again if the response to them is lost
+IDEMPOTENT_ACTIONS = ['GET', 'DELETE']
 FAILURE_CODES = [0, 301, 302, 303, 400, 401, 403, 404, 500, 501, 502, 503,
                  504, 505]
 SYNTAX_ERROR_MESSAGE = _('Syntax error in server config file, aborting plugin')
 BASE_URI = '/networkService/v1.1'
+# Upper bounds in seconds of the buckets of the latency histograms
+LATENCY_BUCKETS = [0.01, 0.05, 0.1, 0.5, 1, 5]
+# Weight of the last request in the average latency of a server
+LATENCY_WEIGHT = 0.2
+# Approximate size of the chunks of the topology sent to the controller
+TOPOLOGY_CHUNK_SIZE = 65536
 ORCHESTRATION_SERVICE_ID = 'Neutron v2.0'
 METADATA_SERVER_IP = '169.254.169.254'
 
@@ -175,11 +203,42 @@ class RemoteRestError(exceptions.NeutronException):
         super(RemoteRestError, self).__init__()
 
 
+def topology_chunks(networks, routers, chunk_size=TOPOLOGY_CHUNK_SIZE):
+    """Yield the JSON of a topology in chunks of about chunk_size bytes.
+
+    The networks and routers are serialized one at a time, so that the
+    whole body of the request is never held in memory.
+    """
+    def pieces():
+        yield '{'
+        for i, (key, items) in enumerate((('networks', networks),
+                                          ('routers', routers))):
+            yield '%s"%s": [' % (', ' if i else '', key)
+            for j, item in enumerate(items):
+                if j:
+                    yield ', '
+                yield json.dumps(item)
+            yield ']'
+        yield '}'
+
+    chunk = []
+    size = 0
+    for piece in pieces():
+        chunk.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield ''.join(chunk)
+
+
 class ServerProxy(object):
     """REST server proxy to a network controller."""
 
     def __init__(self, server, port, ssl, auth, neutron_id, timeout,
-                 base_uri, name):
+                 base_uri, name, max_connections=0):
         self.server = server
         self.port = port
         self.ssl = ssl
@@ -192,10 +251,87 @@ class ServerProxy(object):
         self.failed = False
         if auth:
             self.auth = 'Basic ' + base64.encodestring(auth).strip()
+        # Idle keep-alive connections, the most recently used last
+        self.max_connections = max_connections
+        self.connections = []
+        # Moving average of the latency of the requests, and number of
+        # requests per bucket of LATENCY_BUCKETS, the last one for the
+        # slower requests
+        self.latency = 0.0
+        self.latency_histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def _get_connection(self):
+        """Return an idle connection, or a new one, and whether it's reused.
+
+        An HTTPS connection that is reused also reuses its TLS session.
+        """
+        if self.connections:
+            return self.connections.pop(), True
+        if self.ssl:
+            conn = httplib.HTTPSConnection(
+                self.server, self.port, timeout=self.timeout)
+        else:
+            conn = httplib.HTTPConnection(
+                self.server, self.port, timeout=self.timeout)
+        return conn, False
+
+    def _release_connection(self, conn, response):
+        if (not response.will_close and
+                len(self.connections) < self.max_connections):
+            self.connections.append(conn)
+        else:
+            conn.close()
+
+    def close(self):
+        """Close the idle connections."""
+        while self.connections:
+            self.connections.pop().close()
+
+    def _record_latency(self, latency):
+        self.latency_histogram[bisect.bisect_left(LATENCY_BUCKETS,
+                                                  latency)] += 1
+        if sum(self.latency_histogram) == 1:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_WEIGHT * (latency - self.latency)
+
+    def get_latency_stats(self):
+        """Return the average latency and the histogram of the requests.
+
+        The histogram maps the upper bound of each bucket, in seconds, to
+        the number of requests; None is the bound of the last one.
+        """
+        return {'average': self.latency,
+                'histogram': dict(zip(LATENCY_BUCKETS + [None],
+                                      self.latency_histogram))}
+
+    def _send_request(self, conn, action, uri, body, headers):
+        if not callable(body):
+            conn.request(action, uri, body, headers)
+            return
+        conn.putrequest(action, uri)
+        for header, value in headers.iteritems():
+            conn.putheader(header, value)
+        conn.putheader('Transfer-Encoding', 'chunked')
+        conn.endheaders()
+        for chunk in body():
+            if chunk:
+                conn.send('%x\r\n%s\r\n' % (len(chunk), chunk))
+        conn.send('0\r\n\r\n')
 
     def rest_call(self, action, resource, data, headers):
+        """Send a request to the server and return its response.
+
+        data is either serialized to JSON, or a callable returning the
+        chunks of the JSON body, which are sent with the chunked transfer
+        encoding. It is called again if the request is retried.
+        """
         uri = self.base_uri + resource
-        body = json.dumps(data)
+        if callable(data):
+            body = data
+            data = _('<chunked body>')
+        else:
+            body = json.dumps(data)
         if not headers:
             headers = {}
         headers['Content-type'] = 'application/json'
@@ -214,26 +350,33 @@ class ServerProxy(object):
                     "headers=%(headers)r"),
                   {'resource': resource, 'data': data, 'headers': headers})
 
-        conn = None
-        if self.ssl:
-            conn = httplib.HTTPSConnection(
-                self.server, self.port, timeout=self.timeout)
-            if conn is None:
-                LOG.error(_('ServerProxy: Could not establish HTTPS '
-                            'connection'))
-                return 0, None, None, None
-        else:
-            conn = httplib.HTTPConnection(
-                self.server, self.port, timeout=self.timeout)
-            if conn is None:
-                LOG.error(_('ServerProxy: Could not establish HTTP '
-                            'connection'))
-                return 0, None, None, None
-
-        try:
-            conn.request(action, uri, body, headers)
-            response = conn.getresponse()
-            respstr = response.read()
+        start = time.time()
+        while True:
+            conn, reused = self._get_connection()
+            sent = False
+            try:
+                self._send_request(conn, action, uri, body, headers)
+                sent = True
+                response = conn.getresponse()
+                respstr = response.read()
+            except (socket.error, httplib.HTTPException) as e:
+                conn.close()
+                # The controller may have processed a request which was
+                # sent, only the idempotent ones are sent again
+                if (reused and not isinstance(e, socket.timeout) and
+                        (not sent or action in IDEMPOTENT_ACTIONS)):
+                    # The controller closed the idle connection
+                    LOG.debug(_("ServerProxy: idle connection to "
+                                "%(server)s:%(port)d lost, %(e)r"),
+                              {'server': self.server, 'port': self.port,
+                               'e': e})
+                    continue
+                LOG.error(_('ServerProxy: %(action)s failure, %(e)r'),
+                          {'action': action, 'e': e})
+                ret = 0, None, None, None
+                break
+            self._release_connection(conn, response)
+            self._record_latency(time.time() - start)
             respdata = respstr
             if response.status in self.success_codes:
                 try:
@@ -242,36 +385,41 @@ class ServerProxy(object):
                     # response was not JSON, ignore the exception
                     pass
             ret = (response.status, response.reason, respstr, respdata)
-        except (socket.timeout, socket.error) as e:
-            LOG.error(_('ServerProxy: %(action)s failure, %(e)r'),
-                      {'action': action, 'e': e})
-            ret = 0, None, None, None
-        conn.close()
+            break
         LOG.debug(_("ServerProxy: status=%(status)d, reason=%(reason)r, "
-                    "ret=%(ret)s, data=%(data)r"), {'status': ret[0],
-                                                    'reason': ret[1],
-                                                    'ret': ret[2],
-                                                    'data': ret[3]})
+                    "ret=%(ret)s, data=%(data)r, time=%(time).3f"),
+                  {'status': ret[0], 'reason': ret[1], 'ret': ret[2],
+                   'data': ret[3], 'time': time.time() - start})
         return ret
 
 
 class ServerPool(object):
 
     def __init__(self, servers, ssl, auth, neutron_id, timeout=10,
-                 base_uri='/quantum/v1.0', name='NeutronRestProxy'):
+                 base_uri='/quantum/v1.0', name='NeutronRestProxy',
+                 max_connections=0):
         self.base_uri = base_uri
         self.timeout = timeout
         self.name = name
         self.auth = auth
         self.ssl = ssl
         self.neutron_id = neutron_id
+        self.max_connections = max_connections
+        # The server which answered the last request
+        self.last_server = None
         self.servers = []
         for server_port in servers:
             self.servers.append(self.server_proxy_for(*server_port))
 
     def server_proxy_for(self, server, port):
         return ServerProxy(server, port, self.ssl, self.auth, self.neutron_id,
-                           self.timeout, self.base_uri, self.name)
+                           self.timeout, self.base_uri, self.name,
+                           self.max_connections)
+
+    def get_latency_stats(self):
+        """Return the latency stats of each server, keyed by host:port."""
+        return dict(('%s:%d' % (s.server, s.port), s.get_latency_stats())
+                    for s in self.servers)
 
     def server_failure(self, resp, ignore_codes=[]):
         """Define failure codes as required.
@@ -290,11 +438,16 @@ class ServerPool(object):
 
     @utils.synchronized('bsn-rest-call', external=True)
     def rest_call(self, action, resource, data, headers, ignore_codes):
-        good_first = sorted(self.servers, key=lambda x: x.failed)
+        # The servers that did not fail are tried first, in the configured
+        # order except for the server which answered the last request
+        good_first = sorted(self.servers,
+                            key=lambda x: (x.failed,
+                                           x is not self.last_server))
         for active_server in good_first:
             ret = active_server.rest_call(action, resource, data, headers)
             if not self.server_failure(ret, ignore_codes):
                 active_server.failed = False
+                self.last_server = active_server
                 return ret
             else:
                 LOG.error(_('ServerProxy: %(action)s failure for servers: '
@@ -308,6 +461,7 @@ class ServerPool(object):
                           {'status': ret[0], 'reason': ret[1], 'ret': ret[2],
                            'data': ret[3]})
                 active_server.failed = True
+                active_server.close()
 
         # All servers failed, reset server list and try again next time
         LOG.error(_('ServerProxy: %(action)s failure for all servers: '
@@ -396,6 +550,15 @@ class ServerPool(object):
         errstr = _("Unable to update remote port: %s")
         self.rest_action('PUT', resource, data, errstr)
 
+    def rest_create_or_update_port(self, net, port):
+        resource = PORTS_PATH % (net["tenant_id"], net["id"], port["id"])
+        data = {"port": port}
+        errstr = _("Unable to update remote port: %s")
+        resp = self.rest_action('PUT', resource, data, errstr,
+                                ignore_codes=[404])
+        if resp[0] == 404:
+            self.rest_create_port(net, port)
+
     def rest_delete_port(self, tenant_id, network_id, port_id):
         resource = PORTS_PATH % (tenant_id, network_id, port_id)
         errstr = _("Unable to delete remote port: %s")
@@ -455,6 +618,7 @@ class NeutronRestProxyV2(db_base_plugin_v2.NeutronDbPluginV2,
         server_auth = cfg.CONF.RESTPROXY.server_auth
         server_ssl = cfg.CONF.RESTPROXY.server_ssl
         sync_data = cfg.CONF.RESTPROXY.sync_data
+        sync_interval = cfg.CONF.RESTPROXY.sync_interval
         neutron_id = cfg.CONF.RESTPROXY.neutron_id
         self.add_meta_server_route = cfg.CONF.RESTPROXY.add_meta_server_route
         timeout = cfg.CONF.RESTPROXY.server_timeout
@@ -468,8 +632,9 @@ class NeutronRestProxyV2(db_base_plugin_v2.NeutronDbPluginV2,
         assert all(len(s) == 2 for s in servers), SYNTAX_ERROR_MESSAGE
 
         # init network ctrl connections
-        self.servers = ServerPool(servers, server_ssl, server_auth, neutron_id,
-                                  timeout, BASE_URI)
+        self.servers = ServerPool(
+            servers, server_ssl, server_auth, neutron_id, timeout, BASE_URI,
+            max_connections=cfg.CONF.RESTPROXY.server_connections)
 
         # init dhcp support
         self.topic = topics.PLUGIN
@@ -487,8 +652,22 @@ class NeutronRestProxyV2(db_base_plugin_v2.NeutronDbPluginV2,
                                   fanout=False)
         # Consume from all consumers in a thread
         self.conn.consume_in_thread()
+        # Time of the start of the last sync acknowledged by the controller
+        self._synced_at = None
         if sync_data:
             self._send_all_data()
+        if sync_interval:
+            self._sync_task = loopingcall.FixedIntervalLoopingCall(
+                self._sync_changed_data)
+            self._sync_task.start(interval=sync_interval,
+                                  initial_delay=sync_interval)
+        latency_stats_interval = cfg.CONF.RESTPROXY.latency_stats_interval
+        if latency_stats_interval:
+            self._latency_stats_task = loopingcall.FixedIntervalLoopingCall(
+                self._log_latency_stats)
+            self._latency_stats_task.start(
+                interval=latency_stats_interval,
+                initial_delay=latency_stats_interval)
 
         LOG.debug(_("NeutronRestProxyV2: initialization done"))
 
@@ -1099,68 +1278,191 @@ class NeutronRestProxyV2(db_base_plugin_v2.NeutronDbPluginV2,
             # networks are detected, which isn't supported by the Plugin
             LOG.error(_("NeutronRestProxyV2: too many external networks"))
 
+    def _get_all_data(self, context, network_ids=None):
+        """Return the mapped networks and routers of the topology.
+
+        The networks with their subnets, ports and floating IPs, and the
+        routers with their interfaces, are loaded with a few queries for
+        all the objects. Only the networks in network_ids, and the routers
+        with an interface on them, are returned when it is not None.
+        """
+        net_filters = {}
+        port_filters = {}
+        fip_filters = {}
+        router_ids = None
+        if network_ids is not None:
+            if not network_ids:
+                return [], []
+            network_ids = list(network_ids)
+            net_filters['id'] = network_ids
+            port_filters['network_id'] = network_ids
+            fip_filters['floating_network_id'] = network_ids
+            router_ids = set()
+
+        floatingips = {}
+        for fip in super(NeutronRestProxyV2,
+                         self).get_floatingips(context, filters=fip_filters):
+            floatingips.setdefault(fip['floating_network_id'], []).append(fip)
+
+        ports = {}
+        router_ports = {}
+        for port in super(NeutronRestProxyV2,
+                          self).get_ports(context, filters=port_filters):
+            mapped_port = self._map_state_and_status(port)
+            mapped_port['attachment'] = {
+                'id': port.get('device_id'),
+                'mac': port.get('mac_address'),
+            }
+            ports.setdefault(port['network_id'], []).append(mapped_port)
+            if port['device_owner'] == l3_db.DEVICE_OWNER_ROUTER_INTF:
+                router_ports.setdefault(port['device_id'], []).append(port)
+                if router_ids is not None:
+                    router_ids.add(port['device_id'])
+
+        # The subnets of all the networks are loaded with a single query
+        query = self._get_collection_query(
+            context, models_v2.Network, filters=net_filters).options(
+                orm.subqueryload(models_v2.Network.subnets))
+        networks = []
+        intf_networks = {}
+        subnets = {}
+        for net_db in query:
+            net_subnets = [self._map_state_and_status(
+                self._make_subnet_dict(subnet)) for subnet in net_db.subnets]
+            subnets.update((subnet['id'], subnet) for subnet in net_subnets)
+            network = self._map_network_with_subnets(
+                self._make_network_dict(net_db), net_subnets)
+            intf_networks[network['id']] = network
+            network = dict(network,
+                           floatingips=floatingips.get(network['id'], []),
+                           ports=ports.get(network['id'], []))
+            networks.append(network)
+
+        routers = []
+        if router_ids is None or router_ids:
+            router_filters = {}
+            if router_ids is not None:
+                router_filters['id'] = list(router_ids)
+            for router in super(NeutronRestProxyV2,
+                                self).get_routers(context,
+                                                  filters=router_filters):
+                mapped_router = self._map_state_and_status(router)
+                interfaces = []
+                for port in router_ports.get(router['id'], []):
+                    # we will use the network id as interface's id
+                    net_id = port['network_id']
+                    subnet_id = port['fixed_ips'][0]['subnet_id']
+                    intf_network = intf_networks.get(net_id)
+                    subnet = subnets.get(subnet_id)
+                    if intf_network is None or subnet is None:
+                        # Deleted since the ports were loaded
+                        continue
+                    interfaces.append({'id': net_id,
+                                       'network': intf_network,
+                                       'subnet': subnet})
+                mapped_router['interfaces'] = interfaces
+                routers.append(mapped_router)
+
+        return networks, routers
+
+    def _get_connected_network_ids(self, context, network_ids):
+        """Add the networks of the routers connected to network_ids."""
+        if not network_ids:
+            return set()
+        port = models_v2.Port
+        query = context.session.query(port.device_id).filter(
+            port.device_owner == l3_db.DEVICE_OWNER_ROUTER_INTF)
+        router_ids = [router_id for router_id, in
+                      query.filter(port.network_id.in_(network_ids))]
+        network_ids = set(network_ids)
+        if router_ids:
+            query = context.session.query(port.network_id).filter(
+                port.device_owner == l3_db.DEVICE_OWNER_ROUTER_INTF)
+            network_ids.update(
+                network_id for network_id, in
+                query.filter(port.device_id.in_(router_ids)))
+        return network_ids
+
     def _send_all_data(self):
         """Pushes all data to network ctrl (networks/ports, ports/attachments).
 
         This gives the controller an option to re-sync it's persistent store
-        with neutron's current view of that data.
+        with neutron's current view of that data. The topology is streamed
+        in chunks.
         """
         admin_context = qcontext.get_admin_context()
-        networks = []
-        routers = []
-
-        all_networks = super(NeutronRestProxyV2,
-                             self).get_networks(admin_context) or []
-        for net in all_networks:
-            mapped_network = self._get_mapped_network_with_subnets(net)
-            net_fl_ips = self._get_network_with_floatingips(mapped_network)
-
-            ports = []
-            net_filter = {'network_id': [net.get('id')]}
-            net_ports = super(NeutronRestProxyV2,
-                              self).get_ports(admin_context,
-                                              filters=net_filter) or []
-            for port in net_ports:
-                mapped_port = self._map_state_and_status(port)
-                mapped_port['attachment'] = {
-                    'id': port.get('device_id'),
-                    'mac': port.get('mac_address'),
-                }
-                ports.append(mapped_port)
-            net_fl_ips['ports'] = ports
-
-            networks.append(net_fl_ips)
-
-        all_routers = super(NeutronRestProxyV2,
-                            self).get_routers(admin_context) or []
-        for router in all_routers:
-            interfaces = []
-            mapped_router = self._map_state_and_status(router)
-            router_filter = {
-                'device_owner': ["network:router_interface"],
-                'device_id': [router.get('id')]
-            }
-            router_ports = super(NeutronRestProxyV2,
-                                 self).get_ports(admin_context,
-                                                 filters=router_filter) or []
-            for port in router_ports:
-                net_id = port.get('network_id')
-                subnet_id = port['fixed_ips'][0]['subnet_id']
-                intf_details = self._get_router_intf_details(admin_context,
-                                                             net_id,
-                                                             subnet_id)
-                interfaces.append(intf_details)
-            mapped_router['interfaces'] = interfaces
-
-            routers.append(mapped_router)
+        synced_at = timeutils.utcnow()
+        networks, routers = self._get_all_data(admin_context)
 
         resource = '/topology'
-        data = {
-            'networks': networks,
-            'routers': routers,
-        }
+        data = functools.partial(topology_chunks, networks, routers)
         errstr = _("Unable to update remote topology: %s")
-        return self.servers.rest_action('PUT', resource, data, errstr)
+        resp = self.servers.rest_action('PUT', resource, data, errstr)
+        self._synced_at = synced_at
+        return resp
+
+    def _send_changed_data(self):
+        """Push the networks and routers changed since the last sync.
+
+        A network is sent with its subnets, ports and floating IPs when one
+        of them was updated since the last sync acknowledged by the
+        controller, and so are the routers connected to it and their other
+        networks. The ports updated since the last sync are also sent with
+        their attachments, created if the controller does not have them.
+        All the data is sent when no sync was acknowledged yet.
+        """
+        if self._synced_at is None:
+            return self._send_all_data()
+        admin_context = qcontext.get_admin_context()
+        synced_at = timeutils.utcnow()
+        changed_since = self._synced_at - datetime.timedelta(
+            seconds=dhcp_rpc_base.CHANGED_SINCE_MARGIN)
+        network_ids = self._get_connected_network_ids(
+            admin_context,
+            dhcp_rpc_base.get_changed_network_ids(admin_context,
+                                                  changed_since))
+        networks, routers = self._get_all_data(admin_context, network_ids)
+        port_ids = set(
+            port_id for port_id, in admin_context.session.query(
+                models_v2.Port.id).filter(
+                    models_v2.Port.updated_at >= changed_since))
+        LOG.debug(_("NeutronRestProxyV2: syncing %(networks)d networks, "
+                    "%(ports)d ports and %(routers)d routers changed since "
+                    "%(since)s"),
+                  {'networks': len(networks), 'ports': len(port_ids),
+                   'routers': len(routers), 'since': changed_since})
+        for network in networks:
+            self.servers.rest_update_network(network['tenant_id'],
+                                             network['id'], network)
+            for port in network['ports']:
+                if port['id'] not in port_ids:
+                    continue
+                port = self._extend_port_dict_binding(admin_context,
+                                                      dict(port))
+                attachment = port.pop('attachment')
+                self.servers.rest_create_or_update_port(network, port)
+                if attachment['id']:
+                    self.servers.rest_plug_interface(
+                        network['tenant_id'], network['id'], port,
+                        attachment['id'])
+        for router in routers:
+            self.servers.rest_update_router(router['tenant_id'], router,
+                                            router['id'])
+        self._synced_at = synced_at
+
+    def _sync_changed_data(self):
+        try:
+            self._send_changed_data()
+        except Exception:
+            LOG.exception(_("NeutronRestProxyV2: failed to sync the changed "
+                            "data, retrying at the next sync"))
+
+    def _log_latency_stats(self):
+        for server, stats in sorted(self.servers.get_latency_stats().items()):
+            LOG.info(_("Latency of the requests to %(server)s: average "
+                       "%(average).3f seconds, histogram %(histogram)s"),
+                     {'server': server, 'average': stats['average'],
+                      'histogram': stats['histogram']})
 
     def _add_host_route(self, context, destination, port):
         subnet = {}
@@ -1212,9 +1514,16 @@ class NeutronRestProxyV2(db_base_plugin_v2.NeutronDbPluginV2,
         # if context is not provided, admin context is used
         if context is None:
             context = qcontext.get_admin_context()
-        network = self._map_state_and_status(network)
         subnets = self._get_all_subnets_json_for_network(network['id'],
                                                          context)
+        network = self._map_network_with_subnets(network, subnets)
+        network[external_net.EXTERNAL] = self._network_is_external(
+            context, network['id'])
+
+        return network
+
+    def _map_network_with_subnets(self, network, subnets):
+        network = self._map_state_and_status(network)
         network['subnets'] = subnets
         for subnet in (subnets or []):
             if subnet['gateway_ip']:
@@ -1223,8 +1532,6 @@ class NeutronRestProxyV2(db_base_plugin_v2.NeutronDbPluginV2,
                 break
         else:
             network['gateway'] = ''
-        network[external_net.EXTERNAL] = self._network_is_external(
-            context, network['id'])
 
         return network
 
@@ -62,8 +62,8 @@ class N1kvRpcCallbacks(dhcp_rpc_base.DhcpRpcCallbackMixin,
 
     """Class to handle agent RPC calls."""
 
-    # Set RPC API version to 1.1 by default.
-    RPC_API_VERSION = '1.1'
+    # Set RPC API version to 1.2 by default.
+    RPC_API_VERSION = '1.2'
 
     def __init__(self, notifier):
         self.notifier = notifier
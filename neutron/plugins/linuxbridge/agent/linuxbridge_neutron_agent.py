@@ -34,6 +34,7 @@ import pyudev
 
 from neutron.agent import l2population_rpc as l2pop_rpc
 from neutron.agent.linux import ip_lib
+from neutron.agent.linux import netlink
 from neutron.agent.linux import utils
 from neutron.agent import rpc as agent_rpc
 from neutron.agent import securitygroups_rpc as sg_rpc
@@ -86,6 +87,11 @@ class LinuxBridgeManager:
                               'must be provided'))
         # Store network mapping to segments
         self.network_map = {}
+        self.netlink = None
+        if cfg.CONF.LINUX_BRIDGE.link_backend == 'netlink':
+            self.netlink = netlink.IpRoute(
+                respawn_interval=cfg.CONF.AGENT.
+                netlink_monitor_respawn_interval)
 
         self.udev = pyudev.Context()
         monitor = pyudev.Monitor.from_netlink(self.udev)
@@ -93,6 +99,8 @@ class LinuxBridgeManager:
 
     def device_exists(self, device):
         """Check if ethernet device exists."""
+        if self.netlink:
+            return self.netlink.link_exists(device)
         try:
             utils.execute(['ip', 'link', 'show', 'dev', device],
                           root_helper=self.root_helper)
@@ -230,13 +238,23 @@ class LinuxBridgeManager:
                         "%(physical_interface)s"),
                       {'interface': interface, 'vlan_id': vlan_id,
                        'physical_interface': physical_interface})
-            if utils.execute(['ip', 'link', 'add', 'link',
-                              physical_interface,
-                              'name', interface, 'type', 'vlan', 'id',
-                              vlan_id], root_helper=self.root_helper):
+            if self.netlink:
+                try:
+                    self.netlink.add_vlan(interface, physical_interface,
+                                          vlan_id)
+                except netlink.NetlinkError as e:
+                    LOG.error(_("Unable to create subinterface "
+                                "%(interface)s: %(e)s"),
+                              {'interface': interface, 'e': e})
+                    return
+            elif utils.execute(['ip', 'link', 'add', 'link',
+                                physical_interface,
+                                'name', interface, 'type', 'vlan', 'id',
+                                vlan_id], root_helper=self.root_helper):
                 return
-            if utils.execute(['ip', 'link', 'set',
-                              interface, 'up'], root_helper=self.root_helper):
+            elif utils.execute(['ip', 'link', 'set',
+                                interface, 'up'],
+                               root_helper=self.root_helper):
                 return
             LOG.debug(_("Done creating subinterface %s"), interface)
         return interface
@@ -258,8 +276,19 @@ class LinuxBridgeManager:
                 args['tos'] = cfg.CONF.VXLAN.tos
             if cfg.CONF.VXLAN.l2_population:
                 args['proxy'] = True
-            int_vxlan = self.ip.add_vxlan(interface, segmentation_id, **args)
-            int_vxlan.link.set_up()
+            if self.netlink:
+                try:
+                    self.netlink.add_vxlan(interface, segmentation_id,
+                                           **args)
+                except netlink.NetlinkError as e:
+                    LOG.error(_("Unable to create vxlan interface "
+                                "%(interface)s: %(e)s"),
+                              {'interface': interface, 'e': e})
+                    return
+            else:
+                int_vxlan = self.ip.add_vxlan(interface, segmentation_id,
+                                              **args)
+                int_vxlan.link.set_up()
             LOG.debug(_("Done creating vxlan interface %s"), interface)
         return interface
 
@@ -298,17 +327,25 @@ class LinuxBridgeManager:
             LOG.debug(_("Starting bridge %(bridge_name)s for subinterface "
                         "%(interface)s"),
                       {'bridge_name': bridge_name, 'interface': interface})
-            if utils.execute(['brctl', 'addbr', bridge_name],
-                             root_helper=self.root_helper):
+            if self.netlink:
+                try:
+                    self.netlink.add_bridge(bridge_name)
+                except (netlink.NetlinkError, IOError) as e:
+                    LOG.error(_("Unable to create bridge %(bridge_name)s: "
+                                "%(e)s"),
+                              {'bridge_name': bridge_name, 'e': e})
+                    return
+            elif utils.execute(['brctl', 'addbr', bridge_name],
+                               root_helper=self.root_helper):
                 return
-            if utils.execute(['brctl', 'setfd', bridge_name,
-                              str(0)], root_helper=self.root_helper):
+            elif utils.execute(['brctl', 'setfd', bridge_name,
+                                str(0)], root_helper=self.root_helper):
                 return
-            if utils.execute(['brctl', 'stp', bridge_name,
-                              'off'], root_helper=self.root_helper):
+            elif utils.execute(['brctl', 'stp', bridge_name,
+                                'off'], root_helper=self.root_helper):
                 return
-            if utils.execute(['ip', 'link', 'set', bridge_name,
-                              'up'], root_helper=self.root_helper):
+            elif utils.execute(['ip', 'link', 'set', bridge_name,
+                                'up'], root_helper=self.root_helper):
                 return
             LOG.debug(_("Done starting bridge %(bridge_name)s for "
                         "subinterface %(interface)s"),
@@ -324,13 +361,17 @@ class LinuxBridgeManager:
         if not self.interface_exists_on_bridge(bridge_name, interface):
             try:
                 # Check if the interface is not enslaved in another bridge
-                if self.is_device_on_bridge(interface):
-                    bridge = self.get_bridge_for_tap_device(interface)
-                    utils.execute(['brctl', 'delif', bridge, interface],
-                                  root_helper=self.root_helper)
+                if self.netlink:
+                    # Setting the master moves it from its other bridge
+                    self.netlink.set_master(interface, bridge_name)
+                else:
+                    if self.is_device_on_bridge(interface):
+                        bridge = self.get_bridge_for_tap_device(interface)
+                        utils.execute(['brctl', 'delif', bridge, interface],
+                                      root_helper=self.root_helper)
 
-                utils.execute(['brctl', 'addif', bridge_name, interface],
-                              root_helper=self.root_helper)
+                    utils.execute(['brctl', 'addif', bridge_name,
+                                   interface], root_helper=self.root_helper)
             except Exception as e:
                 LOG.error(_("Unable to add %(interface)s to %(bridge_name)s! "
                             "Exception: %(e)s"),
@@ -394,8 +435,17 @@ class LinuxBridgeManager:
             msg = _("Adding device %(tap_device_name)s to bridge "
                     "%(bridge_name)s") % data
             LOG.debug(msg)
-            if utils.execute(['brctl', 'addif', bridge_name, tap_device_name],
-                             root_helper=self.root_helper):
+            if self.netlink:
+                try:
+                    self.netlink.set_master(tap_device_name, bridge_name)
+                except netlink.NetlinkError as e:
+                    LOG.error(_("Unable to add %(tap_device_name)s to "
+                                "%(bridge_name)s: %(e)s"),
+                              dict(data, e=e))
+                    return False
+            elif utils.execute(['brctl', 'addif', bridge_name,
+                                tap_device_name],
+                               root_helper=self.root_helper):
                 return False
         else:
             data = {'tap_device_name': tap_device_name,
@@ -437,11 +487,14 @@ class LinuxBridgeManager:
                         self.delete_vlan(interface)
 
             LOG.debug(_("Deleting bridge %s"), bridge_name)
-            if utils.execute(['ip', 'link', 'set', bridge_name, 'down'],
-                             root_helper=self.root_helper):
+            if self.netlink:
+                if not self._netlink_delete_link(bridge_name):
+                    return
+            elif utils.execute(['ip', 'link', 'set', bridge_name, 'down'],
+                               root_helper=self.root_helper):
                 return
-            if utils.execute(['brctl', 'delbr', bridge_name],
-                             root_helper=self.root_helper):
+            elif utils.execute(['brctl', 'delbr', bridge_name],
+                               root_helper=self.root_helper):
                 return
             LOG.debug(_("Done deleting bridge %s"), bridge_name)
 
@@ -464,8 +517,18 @@ class LinuxBridgeManager:
                         "%(bridge_name)s"),
                       {'interface_name': interface_name,
                        'bridge_name': bridge_name})
-            if utils.execute(['brctl', 'delif', bridge_name, interface_name],
-                             root_helper=self.root_helper):
+            if self.netlink:
+                try:
+                    self.netlink.set_master(interface_name)
+                except netlink.NetlinkError as e:
+                    LOG.error(_("Unable to remove %(interface_name)s from "
+                                "%(bridge_name)s: %(e)s"),
+                              {'interface_name': interface_name,
+                               'bridge_name': bridge_name, 'e': e})
+                    return False
+            elif utils.execute(['brctl', 'delif', bridge_name,
+                                interface_name],
+                               root_helper=self.root_helper):
                 return False
             LOG.debug(_("Done removing device %(interface_name)s from bridge "
                         "%(bridge_name)s"),
@@ -482,11 +545,14 @@ class LinuxBridgeManager:
     def delete_vlan(self, interface):
         if self.device_exists(interface):
             LOG.debug(_("Deleting subinterface %s for vlan"), interface)
-            if utils.execute(['ip', 'link', 'set', interface, 'down'],
-                             root_helper=self.root_helper):
+            if self.netlink:
+                if not self._netlink_delete_link(interface):
+                    return
+            elif utils.execute(['ip', 'link', 'set', interface, 'down'],
+                               root_helper=self.root_helper):
                 return
-            if utils.execute(['ip', 'link', 'delete', interface],
-                             root_helper=self.root_helper):
+            elif utils.execute(['ip', 'link', 'delete', interface],
+                               root_helper=self.root_helper):
                 return
             LOG.debug(_("Done deleting subinterface %s"), interface)
 
@@ -494,13 +560,43 @@ class LinuxBridgeManager:
         if self.device_exists(interface):
             LOG.debug(_("Deleting vxlan interface %s for vlan"),
                       interface)
-            int_vxlan = self.ip.device(interface)
-            int_vxlan.link.set_down()
-            int_vxlan.link.delete()
+            if self.netlink:
+                if not self._netlink_delete_link(interface):
+                    return
+            else:
+                int_vxlan = self.ip.device(interface)
+                int_vxlan.link.set_down()
+                int_vxlan.link.delete()
             LOG.debug(_("Done deleting vxlan interface %s"), interface)
 
+    def _netlink_delete_link(self, interface):
+        try:
+            self.netlink.set_link_up(interface, up=False)
+            self.netlink.delete_link(interface)
+        except netlink.NetlinkError as e:
+            LOG.error(_("Unable to delete %(interface)s: %(e)s"),
+                      {'interface': interface, 'e': e})
+            return False
+        return True
+
     def update_devices(self, registered_devices):
-        devices = self.udev_get_tap_devices()
+        return self._get_devices_info(self.udev_get_tap_devices(),
+                                      registered_devices)
+
+    def update_devices_from_events(self, registered_devices, events):
+        """Apply the netlink link events to the registered tap devices."""
+        devices = set(registered_devices)
+        for event in events:
+            name = event['name']
+            if not name or not self.is_tap_device(name):
+                continue
+            if event['action'] == netlink.LINK_ADDED:
+                devices.add(name)
+            else:
+                devices.discard(name)
+        return self._get_devices_info(devices, registered_devices)
+
+    def _get_devices_info(self, devices, registered_devices):
         if devices == registered_devices:
             return
         added = devices - registered_devices
@@ -549,12 +645,19 @@ class LinuxBridgeManager:
         LOG.debug(_('Using %s VXLAN mode'), self.vxlan_mode)
 
     def fdb_ip_entry_exists(self, mac, ip, interface):
+        if self.netlink:
+            # Checking the neighbour entries is not needed to replace them
+            return False
         entries = utils.execute(['ip', 'neigh', 'show', 'to', ip,
                                  'dev', interface],
                                 root_helper=self.root_helper)
         return mac in entries
 
     def fdb_bridge_entry_exists(self, mac, interface, agent_ip=None):
+        if self.netlink:
+            entries = self.netlink.get_fdb_entries(interface)
+            return any(entry_mac == mac and agent_ip in (None, dst)
+                       for entry_mac, dst in entries)
         entries = utils.execute(['bridge', 'fdb', 'show', 'dev', interface],
                                 root_helper=self.root_helper)
         if not agent_ip:
@@ -563,30 +666,45 @@ class LinuxBridgeManager:
         return (agent_ip in entries and mac in entries)
 
     def add_fdb_ip_entry(self, mac, ip, interface):
+        if self.netlink:
+            self.netlink.add_neighbours(interface, [(mac, ip)])
+            return
         utils.execute(['ip', 'neigh', 'add', ip, 'lladdr', mac,
                        'dev', interface, 'nud', 'permanent'],
                       root_helper=self.root_helper,
                       check_exit_code=False)
 
     def remove_fdb_ip_entry(self, mac, ip, interface):
+        if self.netlink:
+            self.netlink.delete_neighbours(interface, [(mac, ip)])
+            return
         utils.execute(['ip', 'neigh', 'del', ip, 'lladdr', mac,
                        'dev', interface],
                       root_helper=self.root_helper,
                       check_exit_code=False)
 
     def add_fdb_bridge_entry(self, mac, agent_ip, interface, operation="add"):
+        if self.netlink:
+            self.netlink.add_fdb_entries(interface, [(mac, agent_ip)],
+                                         append=(operation == "append"))
+            return
         utils.execute(['bridge', 'fdb', operation, mac, 'dev', interface,
                        'dst', agent_ip],
                       root_helper=self.root_helper,
                       check_exit_code=False)
 
     def remove_fdb_bridge_entry(self, mac, agent_ip, interface):
+        if self.netlink:
+            self.netlink.delete_fdb_entries(interface, [(mac, agent_ip)])
+            return
         utils.execute(['bridge', 'fdb', 'del', mac, 'dev', interface,
                        'dst', agent_ip],
                       root_helper=self.root_helper,
                       check_exit_code=False)
 
     def add_fdb_entries(self, agent_ip, ports, interface):
+        if self.netlink:
+            return self._netlink_add_fdb_entries(agent_ip, ports, interface)
         for mac, ip in ports:
             if mac != constants.FLOODING_ENTRY[0]:
                 self.add_fdb_ip_entry(mac, ip, interface)
@@ -599,6 +717,9 @@ class LinuxBridgeManager:
                     self.add_fdb_bridge_entry(mac, agent_ip, interface)
 
     def remove_fdb_entries(self, agent_ip, ports, interface):
+        if self.netlink:
+            return self._netlink_remove_fdb_entries(agent_ip, ports,
+                                                    interface)
         for mac, ip in ports:
             if mac != constants.FLOODING_ENTRY[0]:
                 self.remove_fdb_ip_entry(mac, ip, interface)
@@ -606,6 +727,42 @@ class LinuxBridgeManager:
             elif self.vxlan_mode == lconst.VXLAN_UCAST:
                 self.remove_fdb_bridge_entry(mac, agent_ip, interface)
 
+    def _netlink_add_fdb_entries(self, agent_ip, ports, interface):
+        """Send the entries missing from the FDB in batches."""
+        try:
+            existing = self.netlink.get_fdb_entries(interface)
+            neighbours = [(mac, ip) for mac, ip in ports
+                          if mac != constants.FLOODING_ENTRY[0]]
+            self.netlink.add_neighbours(interface, neighbours)
+            self.netlink.add_fdb_entries(
+                interface, [(mac, agent_ip) for mac, _ip in neighbours
+                            if (mac, agent_ip) not in existing])
+            flooding = (constants.FLOODING_ENTRY[0], agent_ip)
+            if (self.vxlan_mode == lconst.VXLAN_UCAST and
+                    len(neighbours) < len(ports) and
+                    flooding not in existing):
+                self.netlink.add_fdb_entries(interface, [flooding],
+                                             append=True)
+        except netlink.NetlinkError as e:
+            LOG.error(_("Unable to add the FDB entries of %(agent_ip)s to "
+                        "%(interface)s: %(e)s"),
+                      {'agent_ip': agent_ip, 'interface': interface, 'e': e})
+
+    def _netlink_remove_fdb_entries(self, agent_ip, ports, interface):
+        try:
+            neighbours = [(mac, ip) for mac, ip in ports
+                          if mac != constants.FLOODING_ENTRY[0]]
+            self.netlink.delete_neighbours(interface, neighbours)
+            entries = [(mac, agent_ip) for mac, _ip in neighbours]
+            if (self.vxlan_mode == lconst.VXLAN_UCAST and
+                    len(neighbours) < len(ports)):
+                entries.append((constants.FLOODING_ENTRY[0], agent_ip))
+            self.netlink.delete_fdb_entries(interface, entries)
+        except netlink.NetlinkError as e:
+            LOG.error(_("Unable to remove the FDB entries of %(agent_ip)s "
+                        "from %(interface)s: %(e)s"),
+                      {'agent_ip': agent_ip, 'interface': interface, 'e': e})
+
 
 class LinuxBridgeRpcCallbacks(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                               l2pop_rpc.L2populationRpcCallBackMixin):
@@ -775,6 +932,9 @@ class LinuxBridgeNeutronAgentRPC(sg_rpc.SecurityGroupAgentRpcMixin):
     def __init__(self, interface_mappings, polling_interval,
                  root_helper):
         self.polling_interval = polling_interval
+        self.minimize_polling = cfg.CONF.AGENT.minimize_polling
+        self.device_rescan_interval = cfg.CONF.AGENT.device_rescan_interval
+        self.rpc_device_batch_size = cfg.CONF.AGENT.rpc_device_batch_size
         self.root_helper = root_helper
         self.setup_linux_bridge(interface_mappings)
         configurations = {'interface_mappings': interface_mappings}
@@ -790,13 +950,16 @@ class LinuxBridgeNeutronAgentRPC(sg_rpc.SecurityGroupAgentRpcMixin):
             'agent_type': constants.AGENT_TYPE_LINUXBRIDGE,
             'start_flag': True}
 
-        self.setup_rpc(interface_mappings.values())
+        # The firewall refresh counters are part of the reported state
         self.init_firewall()
+        self.setup_rpc(interface_mappings.values())
 
     def _report_state(self):
         try:
             devices = len(self.br_mgr.udev_get_tap_devices())
             self.agent_state.get('configurations')['devices'] = devices
+            self.agent_state.get('configurations').update(
+                self.get_refresh_state())
             self.state_rpc.report_state(self.context,
                                         self.agent_state)
             self.agent_state.pop('start_flag', None)
@@ -863,19 +1026,24 @@ class LinuxBridgeNeutronAgentRPC(sg_rpc.SecurityGroupAgentRpcMixin):
     def treat_devices_added(self, devices):
         resync = False
         self.prepare_devices_filter(devices)
-        for device in devices:
-            LOG.debug(_("Port %s added"), device)
+        for batch in q_utils.split_list(devices, self.rpc_device_batch_size):
             try:
-                details = self.plugin_rpc.get_device_details(self.context,
-                                                             device,
-                                                             self.agent_id)
+                devices_details = self.plugin_rpc.get_devices_details_list(
+                    self.context, batch, self.agent_id)
             except Exception as e:
                 LOG.debug(_("Unable to get port details for "
-                            "%(device)s: %(e)s"),
-                          {'device': device, 'e': e})
+                            "%(devices)s: %(e)s"),
+                          {'devices': batch, 'e': e})
                 resync = True
                 continue
-            if 'port_id' in details:
+            devices_up = []
+            devices_down = []
+            for details in devices_details:
+                device = details['device']
+                LOG.debug(_("Port %s added"), device)
+                if 'port_id' not in details:
+                    LOG.info(_("Device %s not defined on plugin"), device)
+                    continue
                 LOG.info(_("Port %(device)s updated. Details: %(details)s"),
                          {'device': device, 'details': details})
                 if details['admin_state_up']:
@@ -893,60 +1061,92 @@ class LinuxBridgeNeutronAgentRPC(sg_rpc.SecurityGroupAgentRpcMixin):
                                                  details['physical_network'],
                                                  segmentation_id,
                                                  details['port_id']):
-
-                        # update plugin about port status
-                        self.plugin_rpc.update_device_up(self.context,
-                                                         device,
-                                                         self.agent_id,
-                                                         cfg.CONF.host)
+                        devices_up.append(device)
                     else:
-                        self.plugin_rpc.update_device_down(self.context,
-                                                           device,
-                                                           self.agent_id,
-                                                           cfg.CONF.host)
+                        devices_down.append(device)
                 else:
                     self.remove_port_binding(details['network_id'],
                                              details['port_id'])
-            else:
-                LOG.info(_("Device %s not defined on plugin"), device)
+            if devices_up or devices_down:
+                # update plugin about port status
+                result = self.plugin_rpc.update_device_list(
+                    self.context, devices_up, devices_down, self.agent_id,
+                    cfg.CONF.host)
+                if (result['failed_devices_up'] or
+                        result['failed_devices_down']):
+                    resync = True
         return resync
 
     def treat_devices_removed(self, devices):
         resync = False
         self.remove_devices_filter(devices)
-        for device in devices:
-            LOG.info(_("Attachment %s removed"), device)
+        for batch in q_utils.split_list(devices, self.rpc_device_batch_size):
+            LOG.info(_("Attachments %s removed"), batch)
             try:
-                details = self.plugin_rpc.update_device_down(self.context,
-                                                             device,
-                                                             self.agent_id,
-                                                             cfg.CONF.host)
+                result = self.plugin_rpc.update_device_list(
+                    self.context, [], batch, self.agent_id, cfg.CONF.host)
             except Exception as e:
-                LOG.debug(_("port_removed failed for %(device)s: %(e)s"),
-                          {'device': device, 'e': e})
+                LOG.debug(_("port_removed failed for %(devices)s: %(e)s"),
+                          {'devices': batch, 'e': e})
                 resync = True
-            if details['exists']:
-                LOG.info(_("Port %s updated."), device)
-            else:
-                LOG.debug(_("Device %s not defined on plugin"), device)
-            self.br_mgr.remove_empty_bridges()
+                continue
+            if result['failed_devices_down']:
+                resync = True
+            for details in result['devices_down']:
+                if details['exists']:
+                    LOG.info(_("Port %s updated."), details['device'])
+                else:
+                    LOG.debug(_("Device %s not defined on plugin"),
+                              details['device'])
+        self.br_mgr.remove_empty_bridges()
         return resync
 
     def daemon_loop(self):
+        monitor = None
+        if self.minimize_polling:
+            monitor = netlink.LinkMonitor(
+                respawn_interval=cfg.CONF.AGENT.
+                netlink_monitor_respawn_interval)
+            try:
+                monitor.start()
+            except Exception:
+                LOG.exception(_("Unable to monitor the link notifications, "
+                                "the devices will be polled"))
+                monitor = None
+        try:
+            self._daemon_loop(monitor)
+        finally:
+            if monitor:
+                monitor.stop()
+
+    def _daemon_loop(self, monitor=None):
         sync = True
         devices = set()
+        last_rescan = 0
 
         LOG.info(_("LinuxBridge Agent RPC Daemon Started!"))
 
         while True:
             start = time.time()
+            # Devices are found from the netlink events when monitored, and
+            # all of them are scanned periodically in case an event was
+            # missed
+            rescan = (not monitor or
+                      start - last_rescan >= self.device_rescan_interval)
             if sync:
                 LOG.info(_("Agent out of sync with plugin!"))
                 devices.clear()
                 sync = False
+                rescan = True
             device_info = {}
             try:
-                device_info = self.br_mgr.update_devices(devices)
+                events = monitor.get_events() if monitor else None
+                if events is None or rescan:
+                    device_info = self.br_mgr.update_devices(devices)
+                    last_rescan = start
+                else:
+                    device_info = self.br_mgr.update_devices_from_events(
+                        devices, events)
             except Exception:
                 LOG.exception(_("Update devices failed"))
                 sync = True
@@ -965,7 +1165,10 @@ class LinuxBridgeNeutronAgentRPC(sg_rpc.SecurityGroupAgentRpcMixin):
             # sleep till end of polling interval
             elapsed = (time.time() - start)
             if (elapsed < self.polling_interval):
-                time.sleep(self.polling_interval - elapsed)
+                if monitor:
+                    monitor.wait_for_events(self.polling_interval - elapsed)
+                else:
+                    time.sleep(self.polling_interval - elapsed)
             else:
                 LOG.debug(_("Loop iteration exceeded interval "
                             "(%(polling_interval)s vs. %(elapsed)s)!"),
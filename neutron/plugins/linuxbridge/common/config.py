@@ -20,6 +20,7 @@
 from oslo.config import cfg
 
 from neutron.agent.common import config
+from neutron.plugins.linuxbridge.common import constants
 
 DEFAULT_VLAN_RANGES = []
 DEFAULT_INTERFACE_MAPPINGS = []
@@ -59,12 +60,35 @@ bridge_opts = [
     cfg.ListOpt('physical_interface_mappings',
                 default=DEFAULT_INTERFACE_MAPPINGS,
                 help=_("List of <physical_network>:<physical_interface>")),
+    cfg.StrOpt('link_backend', default='shell',
+               choices=['shell', 'netlink'],
+               help=_("The backend used to program the links, bridge "
+                      "ports and FDB entries: 'shell' runs ip, brctl and "
+                      "bridge, 'netlink' sends rtnetlink messages and "
+                      "requires the agent to run with the CAP_NET_ADMIN "
+                      "capability")),
 ]
 
 agent_opts = [
     cfg.IntOpt('polling_interval', default=2,
                help=_("The number of seconds the agent will wait between "
                       "polling for local device changes.")),
+    cfg.BoolOpt('minimize_polling', default=False,
+                help=_("Minimize polling by monitoring the netlink link "
+                       "notifications for tap device changes.")),
+    cfg.IntOpt('netlink_monitor_respawn_interval',
+               default=constants.DEFAULT_NETLINK_MONITOR_RESPAWN,
+               help=_("The number of seconds to wait before opening the "
+                      "netlink socket again after an error")),
+    cfg.IntOpt('device_rescan_interval',
+               default=constants.DEFAULT_DEVICE_RESCAN_INTERVAL,
+               help=_("When minimize_polling is set, tap device changes "
+                      "are processed from the netlink notifications, and "
+                      "all the devices are only scanned again after this "
+                      "number of seconds")),
+    cfg.IntOpt('rpc_device_batch_size', default=100,
+               help=_("The number of devices sent in each call of the "
+                      "device list RPCs, 0 to send all of them at once")),
     cfg.BoolOpt('rpc_support_old_agents', default=False,
                 help=_("Enable server RPC compatibility with old agents")),
 ]
@@ -35,6 +35,10 @@ VXLAN_UCAST = 'unicast_flooding'
 # Corresponding minimal kernel versions requirements
 MIN_VXLAN_KVER = {VXLAN_MCAST: '3.8', VXLAN_UCAST: '3.11'}
 
+DEFAULT_NETLINK_MONITOR_RESPAWN = 30
+
+DEFAULT_DEVICE_RESCAN_INTERVAL = 60
+
 
 # TODO(rkukura): Eventually remove this function, which provides
 # temporary backward compatibility with pre-Havana RPC and DB vlan_id
@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import sqlalchemy as sa
 from sqlalchemy.orm import exc
 
 from neutron.db import api as db_api
@@ -27,6 +28,8 @@ from neutron.plugins.ml2 import models
 
 LOG = log.getLogger(__name__)
 
+UUID_LEN = 36
+
 
 def initialize():
     db_api.configure_db()
@@ -60,6 +63,23 @@ def get_network_segments(session, network_id):
                 for record in records]
 
 
+def get_networks_segments(session, network_ids):
+    """Return the segments of each network of network_ids, by network id."""
+    segments = dict((network_id, []) for network_id in network_ids)
+    if not segments:
+        return segments
+    with session.begin(subtransactions=True):
+        records = (session.query(models.NetworkSegment).
+                   filter(models.NetworkSegment.network_id.in_(segments)))
+        for record in records:
+            segments[record.network_id].append(
+                {api.ID: record.id,
+                 api.NETWORK_TYPE: record.network_type,
+                 api.PHYSICAL_NETWORK: record.physical_network,
+                 api.SEGMENTATION_ID: record.segmentation_id})
+    return segments
+
+
 def ensure_port_binding(session, port_id):
     with session.begin(subtransactions=True):
         try:
@@ -93,6 +113,60 @@ def get_port(session, port_id):
             return
 
 
+def ensure_port_bindings(session, port_ids):
+    """Return the bindings of the ports of port_ids, by port id.
+
+    The missing bindings are created, as by ensure_port_binding.
+    """
+    if not port_ids:
+        return {}
+    with session.begin(subtransactions=True):
+        bindings = dict((record.port_id, record) for record in
+                        session.query(models.PortBinding).
+                        filter(models.PortBinding.port_id.in_(port_ids)))
+        for port_id in set(port_ids) - set(bindings):
+            record = models.PortBinding(
+                port_id=port_id,
+                host='',
+                vif_type=portbindings.VIF_TYPE_UNBOUND,
+                cap_port_filter=False)
+            session.add(record)
+            bindings[port_id] = record
+        return bindings
+
+
+def get_ports(session, port_ids):
+    """Get the port records of port ids or port id prefixes.
+
+    :returns: a dict of the records by item of port_ids. The items matching
+              no port, or more than one, are left out.
+    """
+    port_ids = set(port_ids)
+    if not port_ids:
+        return {}
+    full_ids = [port_id for port_id in port_ids
+                if len(port_id) == UUID_LEN]
+    criteria = [models_v2.Port.id.startswith(port_id)
+                for port_id in port_ids if len(port_id) != UUID_LEN]
+    if full_ids:
+        criteria.append(models_v2.Port.id.in_(full_ids))
+    lengths = set(len(port_id) for port_id in port_ids)
+    matches = {}
+    with session.begin(subtransactions=True):
+        for record in session.query(models_v2.Port).filter(sa.or_(*criteria)):
+            for length in lengths:
+                matches.setdefault(record.id[:length], []).append(record)
+    ports = {}
+    for port_id in port_ids:
+        records = matches.get(port_id, [])
+        if len(records) == 1:
+            ports[port_id] = records[0]
+        elif records:
+            LOG.error(_("Multiple ports have port_id starting with %s"),
+                      port_id)
+    return ports
+
+
 def get_port_and_sgs(port_id):
     """Get port from database with security group info."""
 
@@ -237,8 +237,9 @@ class MlnxEswitchNeutronAgent(sg_rpc.SecurityGroupAgentRpcMixin):
             'configurations': interface_mapping,
             'agent_type': q_constants.AGENT_TYPE_MLNX,
             'start_flag': True}
-        self._setup_rpc()
+        # The firewall refresh counters are part of the reported state
         self.init_firewall()
+        self._setup_rpc()
 
     def _setup_eswitches(self, interface_mapping):
         daemon = cfg.CONF.ESWITCH.daemon_endpoint
@@ -249,6 +250,8 @@ class MlnxEswitchNeutronAgent(sg_rpc.SecurityGroupAgentRpcMixin):
         try:
             devices = len(self.eswitch.get_vnics_mac())
             self.agent_state['configurations']['devices'] = devices
+            self.agent_state['configurations'].update(
+                self.get_refresh_state())
             self.state_rpc.report_state(self.context,
                                         self.agent_state)
             self.agent_state.pop('start_flag', None)
@@ -34,7 +34,8 @@ class MlnxRpcCallbacks(dhcp_rpc_base.DhcpRpcCallbackMixin,
                        sg_db_rpc.SecurityGroupServerRpcCallbackMixin):
     # History
     #  1.1 Support Security Group RPC
-    RPC_API_VERSION = '1.1'
+    #  1.2 Support security_group_info_for_devices
+    RPC_API_VERSION = '1.2'
 
     #to be compatible with Linux Bridge Agent on Network Node
     TAP_PREFIX_LEN = 3
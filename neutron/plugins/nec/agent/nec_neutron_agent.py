@@ -174,6 +174,8 @@ class NECNeutronAgent(object):
             # How many devices are likely used by a VM
             num_devices = len(self.cur_ports)
             self.agent_state['configurations']['devices'] = num_devices
+            self.agent_state['configurations'].update(
+                self.sg_agent.get_refresh_state())
             self.state_rpc.report_state(self.context,
                                         self.agent_state)
             self.agent_state.pop('start_flag', None)
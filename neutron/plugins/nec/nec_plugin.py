@@ -661,7 +661,7 @@ class L3RpcCallback(l3_rpc_base.L3RpcCallbackMixin):
 class SecurityGroupServerRpcCallback(
     sg_db_rpc.SecurityGroupServerRpcCallbackMixin):
 
-    RPC_API_VERSION = sg_rpc.SG_RPC_VERSION
+    RPC_API_VERSION = sg_rpc.SG_INFO_RPC_VERSION
 
     @staticmethod
     def get_port_from_device(device):
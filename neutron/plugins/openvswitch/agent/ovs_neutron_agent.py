@@ -22,9 +22,11 @@
 # @author: Seetharama Ayyadevara, Freescale Semiconductor, Inc.
 # @author: Kyle Mestery, Cisco Systems, Inc.
 
+import contextlib
 import distutils.version as dist_version
 import sys
 import time
+import uuid
 
 import eventlet
 from oslo.config import cfg
@@ -32,6 +34,7 @@ from oslo.config import cfg
 from neutron.agent import l2population_rpc
 from neutron.agent.linux import ip_lib
 from neutron.agent.linux import ovs_lib
+from neutron.agent.linux import ovsdb_monitor
 from neutron.agent.linux import polling
 from neutron.agent.linux import utils
 from neutron.agent import rpc as agent_rpc
@@ -56,6 +59,9 @@ LOG = logging.getLogger(__name__)
 # A placeholder for dead vlans.
 DEAD_VLAN_TAG = str(q_const.MAX_VLAN_TAG + 1)
 
+# Flow cookies are 64 bits long
+UINT64_BITMASK = (1 << 64) - 1
+
 
 # A class to represent a VIF (i.e., a port that has 'iface-id' and 'vif-mac'
 # attributes set).
@@ -160,7 +166,9 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                  veth_mtu=None, l2_population=False,
                  minimize_polling=False,
                  ovsdb_monitor_respawn_interval=(
-                     constants.DEFAULT_OVSDBMON_RESPAWN)):
+                     constants.DEFAULT_OVSDBMON_RESPAWN),
+                 port_rescan_interval=(
+                     constants.DEFAULT_PORT_RESCAN_INTERVAL)):
         '''Constructor.
 
         :param integ_br: name of the integration bridge.
@@ -178,11 +186,21 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         :param ovsdb_monitor_respawn_interval: Optional, when using polling
                minimization, the number of seconds to wait before respawning
                the ovsdb monitor.
+        :param port_rescan_interval: Optional, when using polling
+               minimization, the maximum number of seconds between two scans
+               of all the ports of the integration bridge.
         '''
         self.veth_mtu = veth_mtu
         self.root_helper = root_helper
         self.available_local_vlans = set(xrange(q_const.MIN_VLAN_TAG,
                                                 q_const.MAX_VLAN_TAG))
+        # Local VLANs of the previous run of the agent, by net_uuid
+        self.local_vlan_hints = {}
+        self.graceful_restart = cfg.CONF.AGENT.graceful_restart
+        # The flows are tagged with a cookie unique to this run, the ones
+        # of the previous run are removed after the first full sync
+        self.flow_cookie = uuid.uuid4().int & UINT64_BITMASK
+        self.stale_flows_pending = self.graceful_restart
         self.tunnel_types = tunnel_types or []
         self.l2_pop = l2_population
         self.agent_state = {
@@ -200,8 +218,11 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         self.int_br_device_count = 0
 
         self.int_br = ovs_lib.OVSBridge(integ_br, self.root_helper)
+        self.int_br.flow_cookie = self.flow_cookie
         self.setup_rpc()
         self.setup_integration_br()
+        if self.graceful_restart:
+            self.restore_local_vlan_hints()
         self.setup_physical_bridges(bridge_mappings)
         self.local_vlan_map = {}
         self.tun_br_ofports = {constants.TYPE_GRE: {},
@@ -210,6 +231,7 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         self.polling_interval = polling_interval
         self.minimize_polling = minimize_polling
         self.ovsdb_monitor_respawn_interval = ovsdb_monitor_respawn_interval
+        self.port_rescan_interval = port_rescan_interval
 
         if tunnel_types:
             self.enable_tunneling = True
@@ -218,6 +240,7 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         self.local_ip = local_ip
         self.tunnel_count = 0
         self.vxlan_udp_port = cfg.CONF.AGENT.vxlan_udp_port
+        self.rpc_device_batch_size = cfg.CONF.AGENT.rpc_device_batch_size
         self._check_ovs_version()
         if self.enable_tunneling:
             self.setup_tunnel_br(tun_br)
@@ -240,6 +263,11 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         # How many devices are likely used by a VM
         self.agent_state.get('configurations')['devices'] = (
             self.int_br_device_count)
+        # The state is first reported before the security group agent
+        # is created
+        if self.sg_agent:
+            self.agent_state.get('configurations').update(
+                self.sg_agent.get_refresh_state())
         try:
             self.state_rpc.report_state(self.context,
                                         self.agent_state)
@@ -304,9 +332,10 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         network_type = kwargs.get('network_type')
         segmentation_id = kwargs.get('segmentation_id')
         physical_network = kwargs.get('physical_network')
-        self.treat_vif_port(vif_port, port['id'], port['network_id'],
-                            network_type, physical_network,
-                            segmentation_id, port['admin_state_up'])
+        with self._deferred_flows():
+            self.treat_vif_port(vif_port, port['id'], port['network_id'],
+                                network_type, physical_network,
+                                segmentation_id, port['admin_state_up'])
         try:
             if port['admin_state_up']:
                 # update plugin about port status
@@ -456,10 +485,13 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         :param segmentation_id: the VID for 'vlan' or tunnel ID for 'tunnel'
         '''
 
-        if not self.available_local_vlans:
-            LOG.error(_("No local VLAN available for net-id=%s"), net_uuid)
-            return
-        lvid = self.available_local_vlans.pop()
+        lvid = self.local_vlan_hints.pop(net_uuid, None)
+        if lvid is None:
+            if not self.available_local_vlans:
+                LOG.error(_("No local VLAN available for net-id=%s"),
+                          net_uuid)
+                return
+            lvid = self.available_local_vlans.pop()
         LOG.info(_("Assigning %(vlan_id)s as local vlan for "
                    "net-id=%(net_uuid)s"),
                  {'vlan_id': lvid, 'net_uuid': net_uuid})
@@ -617,6 +649,9 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
 
         self.int_br.set_db_attribute("Port", port.port_name, "tag",
                                      str(lvm.vlan))
+        # Allows the local VLAN to be reused after a restart of the agent
+        self.int_br.set_db_attribute("Port", port.port_name,
+                                     "other_config:net_uuid", net_uuid)
         if int(port.ofport) != -1:
             self.int_br.delete_flows(in_port=port.ofport)
 
@@ -655,16 +690,49 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
     def setup_integration_br(self):
         '''Setup the integration bridge.
 
-        Create patch ports and remove all existing flows.
+        Create patch ports and remove all existing flows, unless the agent
+        restarts gracefully.
 
         :param bridge_name: the name of the integration bridge.
         :returns: the integration bridge
         '''
-        self.int_br.delete_port(cfg.CONF.OVS.int_peer_patch_port)
-        self.int_br.remove_all_flows()
+        if not self.graceful_restart:
+            self.int_br.delete_port(cfg.CONF.OVS.int_peer_patch_port)
+            self.int_br.remove_all_flows()
         # switch all traffic using L2 learning
         self.int_br.add_flow(priority=1, actions="normal")
 
+    def restore_local_vlan_hints(self):
+        '''Reserve the local VLANs of the ports of the previous run.
+
+        They are reused when the networks of the ports are provisioned
+        again, so that the existing flows keep matching the ports.
+        '''
+        ports = self.int_br.get_ports_tag_and_other_config()
+        for port_name, (tag, other_config) in ports.iteritems():
+            net_uuid = other_config.get('net_uuid')
+            if not net_uuid or self.local_vlan_hints.get(net_uuid) == tag:
+                continue
+            if net_uuid in self.local_vlan_hints or (
+                    tag not in self.available_local_vlans):
+                LOG.warning(_("Not reusing local VLAN %(vlan)s of port "
+                              "%(port)s for net-id=%(net_uuid)s"),
+                            {'vlan': tag, 'port': port_name,
+                             'net_uuid': net_uuid})
+                continue
+            self.available_local_vlans.remove(tag)
+            self.local_vlan_hints[net_uuid] = tag
+
+    def cleanup_stale_flows(self):
+        '''Remove the flows and local VLANs left by the previous run.'''
+        for bridge in self._flow_bridges():
+            LOG.info(_("Removing the stale flows of bridge %s"),
+                     bridge.br_name)
+            bridge.delete_stale_flows()
+        self.available_local_vlans.update(self.local_vlan_hints.values())
+        self.local_vlan_hints.clear()
+        self.stale_flows_pending = False
+
     def setup_ancillary_bridges(self, integ_br, tun_br):
         '''Setup ancillary bridges - for example br-ex.'''
         ovs_bridges = set(ovs_lib.get_bridges(self.root_helper))
@@ -700,7 +768,11 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         :param tun_br: the name of the tunnel bridge.
         '''
         self.tun_br = ovs_lib.OVSBridge(tun_br, self.root_helper)
-        self.tun_br.reset_bridge()
+        self.tun_br.flow_cookie = self.flow_cookie
+        if self.graceful_restart:
+            self.tun_br.create()
+        else:
+            self.tun_br.reset_bridge()
         self.patch_tun_ofport = self.int_br.add_patch_port(
             cfg.CONF.OVS.int_peer_patch_port, cfg.CONF.OVS.tun_peer_patch_port)
         self.patch_int_ofport = self.tun_br.add_patch_port(
@@ -711,7 +783,8 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                         "of OVS does not support tunnels or patch ports. "
                         "Agent terminated!"))
             exit(1)
-        self.tun_br.remove_all_flows()
+        if not self.graceful_restart:
+            self.tun_br.remove_all_flows()
 
         # Table 0 (default) will sort incoming traffic depending on in_port
         self.tun_br.add_flow(priority=1,
@@ -792,23 +865,33 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                            'bridge': bridge})
                 sys.exit(1)
             br = ovs_lib.OVSBridge(bridge, self.root_helper)
-            br.remove_all_flows()
+            br.flow_cookie = self.flow_cookie
+            if not self.graceful_restart:
+                br.remove_all_flows()
             br.add_flow(priority=1, actions="normal")
             self.phys_brs[physical_network] = br
 
             # create veth to patch physical bridge with integration bridge
             int_veth_name = constants.VETH_INTEGRATION_PREFIX + bridge
-            self.int_br.delete_port(int_veth_name)
             phys_veth_name = constants.VETH_PHYSICAL_PREFIX + bridge
-            br.delete_port(phys_veth_name)
-            if ip_lib.device_exists(int_veth_name, self.root_helper):
-                ip_lib.IPDevice(int_veth_name, self.root_helper).link.delete()
-                # Give udev a chance to process its rules here, to avoid
-                # race conditions between commands launched by udev rules
-                # and the subsequent call to ip_wrapper.add_veth
-                utils.execute(['/sbin/udevadm', 'settle', '--timeout=10'])
-            int_veth, phys_veth = ip_wrapper.add_veth(int_veth_name,
-                                                      phys_veth_name)
+            if (self.graceful_restart and
+                    ip_lib.device_exists(int_veth_name, self.root_helper)):
+                # Keep the veth of the previous run, and so its ofports
+                int_veth = ip_lib.IPDevice(int_veth_name, self.root_helper)
+                phys_veth = ip_lib.IPDevice(phys_veth_name, self.root_helper)
+            else:
+                self.int_br.delete_port(int_veth_name)
+                br.delete_port(phys_veth_name)
+                if ip_lib.device_exists(int_veth_name, self.root_helper):
+                    ip_lib.IPDevice(int_veth_name,
+                                    self.root_helper).link.delete()
+                    # Give udev a chance to process its rules here, to avoid
+                    # race conditions between commands launched by udev
+                    # rules and the subsequent call to ip_wrapper.add_veth
+                    utils.execute(['/sbin/udevadm', 'settle',
+                                   '--timeout=10'])
+                int_veth, phys_veth = ip_wrapper.add_veth(int_veth_name,
+                                                          phys_veth_name)
             self.int_ofports[physical_network] = self.int_br.add_port(int_veth)
             self.phys_ofports[physical_network] = br.add_port(phys_veth)
 
@@ -840,6 +923,50 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                 'added': added,
                 'removed': removed}
 
+    def update_ports_from_events(self, events, registered_ports):
+        """Return the port changes described by ovsdb monitor events.
+
+        The result is the same as the one of update_ports, without scanning
+        all the ports of the integration bridge.
+        """
+        ports = set(registered_ports)
+        added = set()
+        removed = set()
+        bridge_ports = None
+        for event in events:
+            external_ids = event['external_ids']
+            if 'attached-mac' not in external_ids:
+                continue
+            port_id = external_ids.get('iface-id')
+            if not port_id:
+                if 'xs-vif-uuid' in external_ids:
+                    # The port id has to be retrieved from XAPI
+                    return self.update_ports(registered_ports)
+                continue
+            if event['action'] == ovsdb_monitor.INTERFACE_REMOVED:
+                ports.discard(port_id)
+                added.discard(port_id)
+                if port_id in registered_ports:
+                    removed.add(port_id)
+                continue
+            # Ports are only bound once ovs-vswitchd assigned their ofport
+            if port_id in ports or not isinstance(event['ofport'], int):
+                continue
+            if bridge_ports is None:
+                bridge_ports = set(self.int_br.get_port_name_list())
+            if event['name'] not in bridge_ports:
+                continue
+            ports.add(port_id)
+            # A port plugged again is bound again rather than removed
+            removed.discard(port_id)
+            added.add(port_id)
+        if not added and not removed:
+            return
+        self.int_br_device_count = len(ports)
+        return {'current': ports,
+                'added': added,
+                'removed': removed}
+
     def update_ancillary_ports(self, registered_ports):
         ports = set()
         for bridge in self.ancillary_brs:
@@ -916,101 +1043,143 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                     self.tun_br.delete_port(port_name)
                     self.tun_br_ofports[tunnel_type].pop(remote_ip, None)
 
+    def _flow_bridges(self):
+        """Return the bridges whose flows are programmed by the agent."""
+        bridges = [self.int_br] + self.phys_brs.values()
+        if self.enable_tunneling:
+            bridges.append(self.tun_br)
+        return bridges
+
+    def _shadow_flows_lost(self):
+        """Return True if a bridge lost the flows programmed by the agent."""
+        lost = False
+        for bridge in self._flow_bridges():
+            if bridge.shadow_flows_lost():
+                LOG.warning(_("Bridge %s lost its flows"), bridge.br_name)
+                lost = True
+        return lost
+
+    @contextlib.contextmanager
+    def _deferred_flows(self):
+        """Apply the flows programmed in the block in batches.
+
+        The flows of each bridge are applied with one ovs-ofctl command per
+        run of additions, modifications or deletions.
+        """
+        bridges = self._flow_bridges()
+        for bridge in bridges:
+            bridge.defer_apply_on()
+        try:
+            yield
+        finally:
+            for bridge in bridges:
+                bridge.defer_apply_off()
+
     def treat_devices_added(self, devices):
         resync = False
         self.sg_agent.prepare_devices_filter(devices)
-        for device in devices:
-            LOG.info(_("Port %s added"), device)
+        for batch in q_utils.split_list(devices, self.rpc_device_batch_size):
             try:
-                details = self.plugin_rpc.get_device_details(self.context,
-                                                             device,
-                                                             self.agent_id)
+                devices_details = self.plugin_rpc.get_devices_details_list(
+                    self.context, batch, self.agent_id)
             except Exception as e:
                 LOG.debug(_("Unable to get port details for "
-                            "%(device)s: %(e)s"),
-                          {'device': device, 'e': e})
+                            "%(devices)s: %(e)s"),
+                          {'devices': batch, 'e': e})
                 resync = True
                 continue
-            port = self.int_br.get_vif_port_by_id(details['device'])
-            if 'port_id' in details:
-                LOG.info(_("Port %(device)s updated. Details: %(details)s"),
-                         {'device': device, 'details': details})
-                self.treat_vif_port(port, details['port_id'],
-                                    details['network_id'],
-                                    details['network_type'],
-                                    details['physical_network'],
-                                    details['segmentation_id'],
-                                    details['admin_state_up'])
-
+            devices_up = []
+            with self._deferred_flows():
+                for details in devices_details:
+                    device = details['device']
+                    LOG.info(_("Port %s added"), device)
+                    port = self.int_br.get_vif_port_by_id(device)
+                    if 'port_id' in details:
+                        LOG.info(_("Port %(device)s updated. Details: "
+                                   "%(details)s"),
+                                 {'device': device, 'details': details})
+                        self.treat_vif_port(port, details['port_id'],
+                                            details['network_id'],
+                                            details['network_type'],
+                                            details['physical_network'],
+                                            details['segmentation_id'],
+                                            details['admin_state_up'])
+                        devices_up.append(device)
+                    else:
+                        LOG.debug(_("Device %s not defined on plugin"),
+                                  device)
+                        if (port and int(port.ofport) != -1):
+                            self.port_dead(port)
+            if devices_up:
                 # update plugin about port status
-                self.plugin_rpc.update_device_up(self.context,
-                                                 device,
-                                                 self.agent_id,
-                                                 cfg.CONF.host)
-            else:
-                LOG.debug(_("Device %s not defined on plugin"), device)
-                if (port and int(port.ofport) != -1):
-                    self.port_dead(port)
+                result = self.plugin_rpc.update_device_list(
+                    self.context, devices_up, [], self.agent_id,
+                    cfg.CONF.host)
+                if result['failed_devices_up']:
+                    resync = True
         return resync
 
     def treat_ancillary_devices_added(self, devices):
         resync = False
-        for device in devices:
-            LOG.info(_("Ancillary Port %s added"), device)
+        for batch in q_utils.split_list(devices, self.rpc_device_batch_size):
+            LOG.info(_("Ancillary Ports %s added"), batch)
             try:
-                self.plugin_rpc.get_device_details(self.context, device,
-                                                   self.agent_id)
+                self.plugin_rpc.get_devices_details_list(self.context, batch,
+                                                         self.agent_id)
             except Exception as e:
                 LOG.debug(_("Unable to get port details for "
-                            "%(device)s: %(e)s"),
-                          {'device': device, 'e': e})
+                            "%(devices)s: %(e)s"),
+                          {'devices': batch, 'e': e})
                 resync = True
                 continue
 
             # update plugin about port status
-            self.plugin_rpc.update_device_up(self.context,
-                                             device,
-                                             self.agent_id,
-                                             cfg.CONF.host)
+            result = self.plugin_rpc.update_device_list(
+                self.context, batch, [], self.agent_id, cfg.CONF.host)
+            if result['failed_devices_up']:
+                resync = True
         return resync
 
-    def treat_devices_removed(self, devices):
+    def _update_devices_down(self, devices):
+        """Report devices as down, in batches.
+
+        :returns: the update_device_down replies of the devices updated, and
+                  whether a resync is needed for the others.
+        """
         resync = False
-        self.sg_agent.remove_devices_filter(devices)
-        for device in devices:
-            LOG.info(_("Attachment %s removed"), device)
+        devices_down = []
+        for batch in q_utils.split_list(devices, self.rpc_device_batch_size):
+            LOG.info(_("Attachments %s removed"), batch)
             try:
-                self.plugin_rpc.update_device_down(self.context,
-                                                   device,
-                                                   self.agent_id,
-                                                   cfg.CONF.host)
+                result = self.plugin_rpc.update_device_list(
+                    self.context, [], batch, self.agent_id, cfg.CONF.host)
             except Exception as e:
-                LOG.debug(_("port_removed failed for %(device)s: %(e)s"),
-                          {'device': device, 'e': e})
+                LOG.debug(_("port_removed failed for %(devices)s: %(e)s"),
+                          {'devices': batch, 'e': e})
                 resync = True
                 continue
-            self.port_unbound(device)
+            if result['failed_devices_down']:
+                resync = True
+            devices_down.extend(result['devices_down'])
+        return devices_down, resync
+
+    def treat_devices_removed(self, devices):
+        self.sg_agent.remove_devices_filter(devices)
+        devices_down, resync = self._update_devices_down(devices)
+        with self._deferred_flows():
+            for details in devices_down:
+                self.port_unbound(details['device'])
         return resync
 
     def treat_ancillary_devices_removed(self, devices):
-        resync = False
-        for device in devices:
-            LOG.info(_("Attachment %s removed"), device)
-            try:
-                details = self.plugin_rpc.update_device_down(self.context,
-                                                             device,
-                                                             self.agent_id,
-                                                             cfg.CONF.host)
-            except Exception as e:
-                LOG.debug(_("port_removed failed for %(device)s: %(e)s"),
-                          {'device': device, 'e': e})
-                resync = True
-                continue
+        devices_down, resync = self._update_devices_down(devices)
+        for details in devices_down:
             if details['exists']:
-                LOG.info(_("Port %s updated."), device)
+                LOG.info(_("Port %s updated."), details['device'])
                 # Nothing to do regarding local networking
             else:
-                LOG.debug(_("Device %s not defined on plugin"), device)
+                LOG.debug(_("Device %s not defined on plugin"),
+                          details['device'])
         return resync
 
     def process_network_ports(self, port_info):
@@ -1087,6 +1256,7 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         ports = set()
         ancillary_ports = set()
         tunnel_sync = True
+        last_rescan = 0
         while True:
             try:
                 start = time.time()
@@ -1094,11 +1264,22 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                               'ancillary': {'added': 0, 'removed': 0}}
                 LOG.debug(_("Agent rpc_loop - iteration:%d started"),
                           self.iter_num)
+                # Ports are found from the ovsdb monitor events when
+                # possible, and all of them are scanned periodically in case
+                # an event was missed
+                rescan = start - last_rescan >= self.port_rescan_interval
+                if rescan and not sync and self._shadow_flows_lost():
+                    sync = True
                 if sync:
                     LOG.info(_("Agent out of sync with plugin!"))
+                    # All the flows of the ports are programmed again
+                    for bridge in self._flow_bridges():
+                        bridge.clear_shadow_flows()
                     ports.clear()
                     ancillary_ports.clear()
                     sync = False
+                    rescan = True
+                if rescan:
                     polling_manager.force_polling()
 
                 # Notify the plugin of tunnel IP
@@ -1110,7 +1291,13 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                                 "starting polling. Elapsed:%(elapsed).3f"),
                               {'iter_num': self.iter_num,
                                'elapsed': time.time() - start})
-                    port_info = self.update_ports(ports)
+                    events = polling_manager.get_events()
+                    if events is None or rescan:
+                        port_info = self.update_ports(ports)
+                        last_rescan = start
+                    else:
+                        port_info = self.update_ports_from_events(events,
+                                                                  ports)
                     LOG.debug(_("Agent rpc_loop - iteration:%(iter_num)d - "
                                 "port information retrieved. "
                                 "Elapsed:%(elapsed).3f"),
@@ -1156,6 +1343,11 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                             sync = sync | rc
 
                     polling_manager.polling_completed()
+                    # The flows of the previous run are kept until all the
+                    # ports and tunnels have been processed again
+                    if (self.stale_flows_pending and rescan and not sync and
+                            not (self.enable_tunneling and tunnel_sync)):
+                        self.cleanup_stale_flows()
 
             except Exception:
                 LOG.exception(_("Error in agent event loop"))
@@ -1171,7 +1363,8 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                        'port_stats': port_stats,
                        'elapsed': elapsed})
             if (elapsed < self.polling_interval):
-                time.sleep(self.polling_interval - elapsed)
+                polling_manager.wait_for_updates(self.polling_interval -
+                                                 elapsed)
             else:
                 LOG.debug(_("Loop iteration exceeded interval "
                             "(%(polling_interval)s vs. %(elapsed)s)!"),
@@ -1245,6 +1438,7 @@ def create_agent_config_map(config):
         root_helper=config.AGENT.root_helper,
         polling_interval=config.AGENT.polling_interval,
         minimize_polling=config.AGENT.minimize_polling,
+        port_rescan_interval=config.AGENT.port_rescan_interval,
         tunnel_types=config.AGENT.tunnel_types,
         veth_mtu=config.AGENT.veth_mtu,
         l2_population=config.AGENT.l2_population,
@@ -70,6 +70,18 @@ agent_opts = [
                default=constants.DEFAULT_OVSDBMON_RESPAWN,
                help=_("The number of seconds to wait before respawning the "
                       "ovsdb monitor after losing communication with it")),
+    cfg.IntOpt('port_rescan_interval',
+               default=constants.DEFAULT_PORT_RESCAN_INTERVAL,
+               help=_("When minimize_polling is set, port changes are "
+                      "processed from the ovsdb monitor events, and all the "
+                      "ports of the integration bridge are only scanned "
+                      "again after this number of seconds")),
+    cfg.IntOpt('rpc_device_batch_size', default=100,
+               help=_("The number of devices sent in each call of the "
+                      "device list RPCs, 0 to send all of them at once")),
+    cfg.BoolOpt('graceful_restart', default=False,
+                help=_("Keep the flows of the previous run of the agent "
+                       "until the first full sync of the ports completes")),
     cfg.ListOpt('tunnel_types', default=DEFAULT_TUNNEL_TYPES,
                 help=_("Network types supported by the agent "
                        "(gre and/or vxlan)")),
@@ -51,3 +51,7 @@ TUN_TABLE = {TYPE_GRE: GRE_TUN_TO_LV, TYPE_VXLAN: VXLAN_TUN_TO_LV}
 
 # The default respawn interval for the ovsdb monitor
 DEFAULT_OVSDBMON_RESPAWN = 30
+
+# The default interval between two scans of all the ports when the changes
+# are otherwise found from the ovsdb monitor events
+DEFAULT_PORT_RESCAN_INTERVAL = 60
@@ -27,6 +27,7 @@ from neutron.extensions import securitygroup as ext_sg
 from neutron import manager
 from neutron.openstack.common.db import exception as db_exc
 from neutron.openstack.common import log as logging
+from neutron.openstack.common import timeutils
 from neutron.plugins.openvswitch.common import constants
 from neutron.plugins.openvswitch import ovs_models_v2
 
@@ -317,6 +318,22 @@ def get_port(port_id):
     return port
 
 
+def get_ports_and_network_bindings(port_ids):
+    """Return the ports of port_ids with the bindings of their networks.
+
+    :returns: a list of (port, network binding) tuples, the binding being
+              None for a network without binding.
+    """
+    if not port_ids:
+        return []
+    session = db.get_session()
+    binding_network_id = ovs_models_v2.NetworkBinding.network_id
+    query = session.query(models_v2.Port, ovs_models_v2.NetworkBinding)
+    query = query.outerjoin(ovs_models_v2.NetworkBinding,
+                            models_v2.Port.network_id == binding_network_id)
+    return query.filter(models_v2.Port.id.in_(port_ids)).all()
+
+
 def get_port_from_device(port_id):
     """Get port from database."""
     LOG.debug(_("get_port_with_securitygroups() called:port_id=%s"), port_id)
@@ -354,6 +371,18 @@ def set_port_status(port_id, status):
         raise q_exc.PortNotFound(port_id=port_id)
 
 
+def set_ports_status(port_ids, status):
+    """Set the status of the ports of port_ids in a single update."""
+    if not port_ids:
+        return
+    session = db.get_session()
+    with session.begin(subtransactions=True):
+        (session.query(models_v2.Port).
+         filter(models_v2.Port.id.in_(port_ids)).
+         update({'status': status, 'updated_at': timeutils.utcnow()},
+                synchronize_session=False))
+
+
 def get_tunnel_endpoints():
     session = db.get_session()
 
@@ -38,6 +38,7 @@ from neutron.db import agents_db
 from neutron.db import agentschedulers_db
 from neutron.db import allowedaddresspairs_db as addr_pair_db
 from neutron.db import db_base_plugin_v2
+from neutron.db import device_rpc_base
 from neutron.db import dhcp_rpc_base
 from neutron.db import external_net_db
 from neutron.db import extradhcpopt_db
@@ -68,14 +69,17 @@ LOG = logging.getLogger(__name__)
 
 
 class OVSRpcCallbacks(dhcp_rpc_base.DhcpRpcCallbackMixin,
+                      device_rpc_base.DeviceRpcCallbackMixin,
                       l3_rpc_base.L3RpcCallbackMixin,
                       sg_db_rpc.SecurityGroupServerRpcCallbackMixin):
 
     # history
     #   1.0 Initial version
     #   1.1 Support Security Group RPC
+    #   1.2 Support security_group_info_for_devices
+    #   1.3 Support get_devices_details_list and update_device_list
 
-    RPC_API_VERSION = '1.1'
+    RPC_API_VERSION = '1.3'
 
     def __init__(self, notifier, tunnel_type):
         self.notifier = notifier
@@ -97,6 +101,21 @@ class OVSRpcCallbacks(dhcp_rpc_base.DhcpRpcCallbackMixin,
             port['device'] = device
         return port
 
+    @staticmethod
+    def _get_device_details(device, port, binding):
+        return {'device': device,
+                'network_id': port['network_id'],
+                'port_id': port['id'],
+                'admin_state_up': port['admin_state_up'],
+                'network_type': binding.network_type,
+                'segmentation_id': binding.segmentation_id,
+                'physical_network': binding.physical_network}
+
+    @staticmethod
+    def _get_new_status(port):
+        return (q_const.PORT_STATUS_ACTIVE if port['admin_state_up']
+                else q_const.PORT_STATUS_DOWN)
+
     def get_device_details(self, rpc_context, **kwargs):
         """Agent requests device details."""
         agent_id = kwargs.get('agent_id')
@@ -106,15 +125,8 @@ class OVSRpcCallbacks(dhcp_rpc_base.DhcpRpcCallbackMixin,
         port = ovs_db_v2.get_port(device)
         if port:
             binding = ovs_db_v2.get_network_binding(None, port['network_id'])
-            entry = {'device': device,
-                     'network_id': port['network_id'],
-                     'port_id': port['id'],
-                     'admin_state_up': port['admin_state_up'],
-                     'network_type': binding.network_type,
-                     'segmentation_id': binding.segmentation_id,
-                     'physical_network': binding.physical_network}
-            new_status = (q_const.PORT_STATUS_ACTIVE if port['admin_state_up']
-                          else q_const.PORT_STATUS_DOWN)
+            entry = self._get_device_details(device, port, binding)
+            new_status = self._get_new_status(port)
             if port['status'] != new_status:
                 ovs_db_v2.set_port_status(port['id'], new_status)
         else:
@@ -122,6 +134,35 @@ class OVSRpcCallbacks(dhcp_rpc_base.DhcpRpcCallbackMixin,
             LOG.debug(_("%s can not be found in database"), device)
         return entry
 
+    def get_devices_details_list(self, rpc_context, **kwargs):
+        """Agent requests the details of a list of devices.
+
+        The ports and their network bindings are read in a single query, and
+        the status of the ports changed in one update per status.
+        """
+        agent_id = kwargs.get('agent_id')
+        devices = kwargs.get('devices') or []
+        LOG.debug(_("Details of %(count)d devices requested from "
+                    "%(agent_id)s"),
+                  {'count': len(devices), 'agent_id': agent_id})
+        ports = dict((port['id'], (port, binding)) for port, binding in
+                     ovs_db_v2.get_ports_and_network_bindings(devices))
+        entries = []
+        status_updates = {}
+        for device in devices:
+            port, binding = ports.get(device, (None, None))
+            if not binding:
+                entries.append({'device': device})
+                LOG.debug(_("%s can not be found in database"), device)
+                continue
+            entries.append(self._get_device_details(device, port, binding))
+            new_status = self._get_new_status(port)
+            if port['status'] != new_status:
+                status_updates.setdefault(new_status, []).append(port['id'])
+        for status, port_ids in status_updates.items():
+            ovs_db_v2.set_ports_status(port_ids, status)
+        return entries
+
     def update_device_down(self, rpc_context, **kwargs):
         """Device no longer exists on agent."""
         agent_id = kwargs.get('agent_id')
@@ -29,3 +29,7 @@ class PLUMgridException(base_exec.NeutronException):
 
 class PLUMgridConnectionFailed(PLUMgridException):
     message = _("Connection failed with PLUMgrid Director: %(err_msg)s")
+
+
+class PLUMgridCallTimeout(PLUMgridException):
+    message = _("PLUMgrid Director call timed out after %(timeout)s seconds")
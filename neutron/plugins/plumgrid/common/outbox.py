@@ -0,0 +1,274 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2014 PLUMgrid, Inc. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Write-behind queue for the PLUMgrid Director calls.
+
+When the asynchronous mode is enabled the plugin stores the Director calls
+in the plumgrid_director_outbox table, within the transaction of the API
+operation, and returns as soon as the transaction is committed. The
+DirectorOutbox looping call then replays the calls in order:
+
+- consecutive updates of the same resource are coalesced, and updates
+  followed by the deletion of the resource are dropped;
+- consecutive port creations are sent with a single create_ports call;
+- on failure processing stops, the entry is kept for a later attempt and
+  the worker backs off exponentially, up to max_backoff seconds;
+- an entry refused max_attempts times is marked as failed and skipped, and
+  its network or port is put in ERROR status. A later update or deletion
+  of the resource supersedes its failed calls.
+
+The Director is called outside of the database transactions: entries are
+claimed for CLAIM_TIMEOUT seconds in a first transaction, and removed or
+released in a second one.
+
+Networks and ports are kept in BUILD status until all their calls have
+been performed.
+"""
+
+import netaddr
+
+from neutron.common import constants
+from neutron import context as n_context
+from neutron.db import models_v2
+from neutron.openstack.common import jsonutils
+from neutron.openstack.common import log as logging
+from neutron.openstack.common import loopingcall
+from neutron.openstack.common import timeutils
+from neutron.plugins.plumgrid.db import outbox_db
+
+LOG = logging.getLogger(__name__)
+
+# Updates which carry the whole state of the resource, and can therefore
+# be superseded by a later call for the same resource
+COALESCED_OPS = ('update_network', 'update_port', 'update_router',
+                 'update_floatingip')
+
+# Resources whose status reflects the pending Director calls
+STATUS_MODELS = {'network': models_v2.Network,
+                 'port': models_v2.Port}
+
+IPNET_KEY = '__ipnet__'
+
+# Seconds after which the entries claimed by a server which did not
+# release them (e.g. because it died) can be processed by another one
+CLAIM_TIMEOUT = 600
+
+
+def _encode_arg(arg):
+    if isinstance(arg, netaddr.IPNetwork):
+        return {IPNET_KEY: str(arg)}
+    return jsonutils.to_primitive(arg)
+
+
+def _decode_arg(arg):
+    if isinstance(arg, dict) and IPNET_KEY in arg:
+        return netaddr.IPNetwork(arg[IPNET_KEY])
+    return arg
+
+
+def _start_loopingcall(max_interval, func):
+    """Start a loopingcall for draining the outbox."""
+    outbox_drainer = loopingcall.DynamicLoopingCall(func)
+    outbox_drainer.start(periodic_interval_max=max_interval)
+    return outbox_drainer
+
+
+class DirectorOutbox(object):
+
+    def __init__(self, plumlib, sync_interval, batch_size, max_backoff,
+                 max_attempts=0):
+        self._plumlib = plumlib
+        self._sync_interval = sync_interval
+        self._batch_size = batch_size
+        self._max_backoff = max(max_backoff, sync_interval)
+        self._max_attempts = max_attempts
+        self._backoff = sync_interval
+        self._looping_call = None
+
+    def start(self):
+        self._looping_call = _start_loopingcall(self._max_backoff,
+                                                self._drain)
+
+    def stop(self):
+        if self._looping_call:
+            self._looping_call.stop()
+            self._looping_call = None
+
+    def enqueue(self, context, operation, resource, resource_id, args):
+        """Store a Director call in the transaction of context."""
+        outbox_db.add_entry(context.session, resource, resource_id,
+                            operation,
+                            jsonutils.dumps([_encode_arg(a) for a in args]))
+        model = STATUS_MODELS.get(resource)
+        if model and not operation.startswith('delete_'):
+            context.session.query(model).filter_by(id=resource_id).update(
+                {'status': constants.NET_STATUS_BUILD,
+                 'updated_at': timeutils.utcnow()},
+                synchronize_session=False)
+            return constants.NET_STATUS_BUILD
+
+    def get_pending(self, context, resource=None):
+        return outbox_db.get_pending_resources(context.session, resource)
+
+    def _coalesce(self, entries):
+        """Split entries in superseded ones and calls to perform."""
+        superseded = []
+        calls = []
+        last = {}
+        for entry in entries:
+            key = (entry.resource, entry.resource_id)
+            prev = last.get(key)
+            if (prev is not None and prev.operation in COALESCED_OPS and
+                (entry.operation == prev.operation or
+                 entry.operation == 'delete_%s' % entry.resource)):
+                calls.remove(prev)
+                superseded.append(prev)
+            last[key] = entry
+            calls.append(entry)
+        return superseded, calls
+
+    def _batches(self, calls):
+        """Group consecutive port creations in a single batch."""
+        batch = []
+        for entry in calls:
+            if entry.operation == 'create_port':
+                batch.append(entry)
+                continue
+            if batch:
+                yield 'create_ports', batch
+                batch = []
+            yield entry.operation, [entry]
+        if batch:
+            yield 'create_ports', batch
+
+    def _call(self, operation, entries):
+        args = [[_decode_arg(a) for a in jsonutils.loads(entry.args)]
+                for entry in entries]
+        LOG.debug(_("PLUMgrid Library: %(operation)s() called for "
+                    "%(count)d outbox entries"),
+                  {'operation': operation, 'count': len(entries)})
+        if operation == 'create_ports':
+            self._plumlib.create_ports([tuple(a) for a in args])
+        else:
+            getattr(self._plumlib, operation)(*args[0])
+
+    def _update_status(self, session, resources):
+        for resource, resource_id in resources:
+            model = STATUS_MODELS.get(resource)
+            if not model:
+                continue
+            query = session.query(model).filter_by(id=resource_id)
+            if outbox_db.has_entries(session, resource, resource_id,
+                                     failed=True):
+                query.update({'status': constants.NET_STATUS_ERROR,
+                              'updated_at': timeutils.utcnow()},
+                             synchronize_session=False)
+            elif not outbox_db.has_entries(session, resource, resource_id):
+                query = query.filter(model.status.in_(
+                    [constants.NET_STATUS_BUILD, constants.NET_STATUS_ERROR]))
+                query.update({'status': constants.NET_STATUS_ACTIVE,
+                              'updated_at': timeutils.utcnow()},
+                             synchronize_session=False)
+
+    def _record_failure(self, entries, error):
+        """Count a failed attempt, and fail the entries after the last."""
+        failed = False
+        for entry in entries:
+            entry.attempts += 1
+            entry.last_error = unicode(error)[:255]
+            entry.claimed_until = None
+            if self._max_attempts and entry.attempts >= self._max_attempts:
+                LOG.error(_("Giving up %(operation)s of %(resource)s "
+                            "%(resource_id)s on the PLUMgrid Director "
+                            "after %(attempts)d attempts: %(error)s"),
+                          {'operation': entry.operation,
+                           'resource': entry.resource,
+                           'resource_id': entry.resource_id,
+                           'attempts': entry.attempts, 'error': error})
+                entry.failed = True
+                failed = True
+        return failed
+
+    def process_batch(self):
+        """Perform the oldest pending Director calls.
+
+        :returns: the number of entries removed from the outbox or failed
+        :raises: the exception of the failed Director call, if it is to be
+                 attempted again
+        """
+        context = n_context.get_admin_context()
+        session = context.session
+        with session.begin(subtransactions=True):
+            entries = outbox_db.claim_entries(session, self._batch_size,
+                                              CLAIM_TIMEOUT)
+            superseded, calls = self._coalesce(entries)
+            for entry in superseded:
+                session.delete(entry)
+
+        # The Director is called with no transaction open, so that the
+        # entries are neither locked nor kept in a transaction meanwhile
+        done = []
+        failed_batch = []
+        failure = None
+        for operation, batch in self._batches(calls):
+            try:
+                self._call(operation, batch)
+            except Exception as e:
+                # Entries are kept for a later attempt, in order not to
+                # reorder the calls for the resource
+                failed_batch = batch
+                failure = e
+                break
+            done.extend(batch)
+
+        with session.begin(subtransactions=True):
+            for entry in done:
+                session.delete(entry)
+            failed = failure and self._record_failure(failed_batch, failure)
+            for entry in calls[len(done) + len(failed_batch):]:
+                entry.claimed_until = None
+            session.flush()
+            for entry in done:
+                # Failed calls superseded by a successful one are dropped,
+                # as for the coalesced entries
+                if entry.operation in COALESCED_OPS:
+                    outbox_db.delete_failed_entries(
+                        session, entry.resource, entry.resource_id, entry.id,
+                        operation=entry.operation)
+                elif entry.operation == 'delete_%s' % entry.resource:
+                    outbox_db.delete_failed_entries(
+                        session, entry.resource, entry.resource_id, entry.id)
+            self._update_status(session, set(
+                (entry.resource, entry.resource_id)
+                for entry in done + failed_batch))
+        if failure and not failed:
+            raise failure
+        return len(superseded) + len(done) + len(failed_batch)
+
+    def _drain(self):
+        while True:
+            try:
+                processed = self.process_batch()
+            except Exception:
+                interval = self._backoff
+                self._backoff = min(self._backoff * 2, self._max_backoff)
+                LOG.exception(_("An error occurred while sending pending "
+                                "calls to the PLUMgrid Director. Will retry "
+                                "in %d seconds"), interval)
+                return interval
+            self._backoff = self._sync_interval
+            if processed < self._batch_size:
+                return self._sync_interval
@@ -0,0 +1,251 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2014 PLUMgrid, Inc. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+
+from neutron import context
+from neutron.db import l3_db
+from neutron.db import models_v2
+from neutron.openstack.common import log
+from neutron.openstack.common import loopingcall
+from neutron.plugins.plumgrid.db import outbox_db
+
+LOG = log.getLogger(__name__)
+
+# Resources are reconciled in this order, so that networks exist on the
+# Director before their ports are pushed
+RESOURCES = ('network', 'router', 'port', 'floatingip')
+
+ROUTER_GATEWAY = 'network:router_gateway'
+
+# Attributes compared between a Neutron resource and its Director object,
+# when the Director object has them
+COMPARED_ATTRIBUTES = {
+    'network': ('name', 'admin_state_up', 'shared', 'tenant_id'),
+    'router': ('name', 'admin_state_up', 'tenant_id',
+               'external_gateway_info'),
+    'port': ('name', 'admin_state_up', 'network_id', 'tenant_id',
+             'mac_address', 'device_id', 'device_owner', 'fixed_ips'),
+    'floatingip': ('floating_network_id', 'floating_ip_address',
+                   'fixed_ip_address', 'port_id', 'router_id', 'tenant_id'),
+}
+
+
+def _start_loopingcall(interval, func):
+    """Start a loopingcall for the reconciliation task."""
+    synchronizer = loopingcall.DynamicLoopingCall(func)
+    synchronizer.start(periodic_interval_max=interval)
+    return synchronizer
+
+
+def _differs(resource, item, director_item):
+    return any(director_item[attr] != item.get(attr)
+               for attr in COMPARED_ATTRIBUTES[resource]
+               if attr in director_item)
+
+
+class PLUMgridSynchronizer(object):
+    """Reconcile Neutron resources with the PLUMgrid Director.
+
+    Director objects are fetched in chunks of chunk_size items, ordered by
+    id, together with the Neutron resources in the same id range. A
+    resource is pushed when it is missing on the Director, or when its
+    COMPARED_ATTRIBUTES differ, and Director objects without a Neutron
+    counterpart are deleted.
+
+    A difference is only repaired once it has been found for grace_period
+    seconds: the Director is called within the transaction of the Neutron
+    change, so an object can exist on the Director before its Neutron row
+    is committed, or the other way around on deletion. Each run stops
+    after time_budget seconds, and the next one resumes from the same
+    chunk.
+    """
+
+    def __init__(self, plugin, plumlib, interval, chunk_size, time_budget,
+                 grace_period):
+        self._plugin = plugin
+        self._plumlib = plumlib
+        self._interval = interval
+        self._chunk_size = chunk_size
+        self._time_budget = time_budget
+        self._grace_period = grace_period
+        self._backoff = 1
+        # Maps a resource to the time each difference was first found, by id
+        self._differences = dict((resource, {}) for resource in RESOURCES)
+        # Marker of the next chunk for the resource being reconciled
+        self._resource = RESOURCES[0]
+        self._marker = None
+        self._seen = set()
+        self._sync_looping_call = _start_loopingcall(interval,
+                                                     self._synchronize_state)
+
+    def _get_neutron_chunk(self, ctx, resource, marker, upper):
+        """Return Neutron dicts of resource with marker < id <= upper."""
+        model, make_dict = {
+            'network': (models_v2.Network,
+                        self._plugin._make_network_dict),
+            'port': (models_v2.Port, self._plugin._make_port_dict),
+            'router': (l3_db.Router, self._plugin._make_router_dict),
+            'floatingip': (l3_db.FloatingIP,
+                           self._plugin._make_floatingip_dict)}[resource]
+        query = ctx.session.query(model).order_by(model.id)
+        if marker:
+            query = query.filter(model.id > marker)
+        if upper:
+            query = query.filter(model.id <= upper)
+        return [make_dict(item) for item in query.limit(self._chunk_size)]
+
+    def _push(self, ctx, resource, operation, item):
+        """Perform the plumlib operation for resource item."""
+        plumlib = self._plumlib
+        res_id = item['id']
+        if resource == 'network':
+            if operation == 'create':
+                plumlib.create_network(item['tenant_id'], item)
+            elif operation == 'update':
+                plumlib.update_network(item['tenant_id'], res_id)
+            else:
+                plumlib.delete_network(item, res_id)
+        elif resource == 'port':
+            router = None
+            if (operation != 'delete' and
+                    item['device_owner'] == ROUTER_GATEWAY):
+                router = self._plugin._get_router(ctx, item['device_id'])
+            if operation == 'create':
+                plumlib.create_port(item, router)
+            elif operation == 'update':
+                plumlib.update_port(item, router)
+            else:
+                plumlib.delete_port(item, router)
+        elif resource == 'router':
+            if operation == 'create':
+                plumlib.create_router(item['tenant_id'], item)
+            elif operation == 'update':
+                plumlib.update_router(item, res_id)
+            else:
+                plumlib.delete_router(item.get('tenant_id'), res_id)
+        elif resource == 'floatingip':
+            net = {'id': item.get('floating_network_id')}
+            if operation != 'delete':
+                net = self._plugin.get_network(
+                    ctx, item['floating_network_id'])
+            if operation == 'create':
+                plumlib.create_floatingip(net, item)
+            elif operation == 'update':
+                plumlib.update_floatingip(net, item, res_id)
+            else:
+                plumlib.delete_floatingip(net, item, res_id)
+
+    def _try_push(self, ctx, resource, operation, item):
+        LOG.debug(_("Reconciling %(resource)s %(id)s: %(operation)s"),
+                  {'resource': resource, 'id': item['id'],
+                   'operation': operation})
+        try:
+            self._push(ctx, resource, operation, item)
+        except Exception:
+            LOG.exception(_("Unable to %(operation)s %(resource)s "
+                            "%(id)s on the PLUMgrid Director"),
+                          {'resource': resource, 'id': item['id'],
+                           'operation': operation})
+            return False
+        return True
+
+    def _repair(self, ctx, resource, operation, item):
+        """Push item if its difference is older than the grace period."""
+        differences = self._differences[resource]
+        found_at = differences.setdefault(item['id'], time.time())
+        if time.time() - found_at < self._grace_period:
+            return
+        if self._try_push(ctx, resource, operation, item):
+            del differences[item['id']]
+
+    def synchronize_chunk(self, ctx, resource, marker):
+        """Reconcile the chunk of resource after marker.
+
+        :returns: the marker of the next chunk, None if this was the last
+        """
+        director_items = self._plumlib.get_resources(resource, marker,
+                                                     self._chunk_size)
+        upper = None
+        if len(director_items) >= self._chunk_size:
+            upper = director_items[-1]['id']
+        neutron_items = self._get_neutron_chunk(ctx, resource, marker, upper)
+        if len(neutron_items) >= self._chunk_size:
+            upper = neutron_items[-1]['id']
+        if upper:
+            director_items = [i for i in director_items if i['id'] <= upper]
+        if not marker:
+            self._seen = set()
+        self._seen.update(i['id'] for i in neutron_items)
+        self._seen.update(i['id'] for i in director_items)
+        # Resources with calls pending in the outbox are left to it
+        pending = set(p['resource_id'] for p in
+                      outbox_db.get_pending_resources(
+                          ctx.session, resource, include_failed=False))
+        differences = self._differences[resource]
+        director = dict((i['id'], i) for i in director_items)
+        for item in neutron_items:
+            res_id = item['id']
+            director_item = director.pop(res_id, None)
+            if res_id in pending:
+                differences.pop(res_id, None)
+            elif director_item is None:
+                self._repair(ctx, resource, 'create', item)
+            elif _differs(resource, item, director_item):
+                self._repair(ctx, resource, 'update', item)
+            else:
+                differences.pop(res_id, None)
+        for res_id, item in director.iteritems():
+            if res_id in pending:
+                differences.pop(res_id, None)
+            else:
+                self._repair(ctx, resource, 'delete', item)
+        if not upper:
+            # Forget the resources which disappeared during the pass
+            for res_id in set(differences) - self._seen:
+                del differences[res_id]
+        return upper
+
+    def _synchronize_state(self):
+        # If the plugin has been destroyed, stop the LoopingCall
+        if not self._plugin:
+            raise loopingcall.LoopingCallDone
+        start = time.time()
+        ctx = context.get_admin_context()
+        LOG.debug(_("Running PLUMgrid reconciliation from %(resource)s "
+                    "%(marker)s"),
+                  {'resource': self._resource, 'marker': self._marker})
+        while time.time() - start < self._time_budget:
+            try:
+                self._marker = self.synchronize_chunk(ctx, self._resource,
+                                                      self._marker)
+            except Exception:
+                sleep_interval = self._backoff
+                # Retry before the next regular run, backing off
+                # exponentially up to the reconciliation interval
+                self._backoff = min(self._backoff * 2, self._interval)
+                LOG.exception(_("An error occurred while reconciling with "
+                                "the PLUMgrid Director. Will retry in %d "
+                                "seconds"), sleep_interval)
+                return sleep_interval
+            self._backoff = 1
+            if self._marker is None:
+                index = RESOURCES.index(self._resource) + 1
+                self._resource = RESOURCES[index % len(RESOURCES)]
+                if not index % len(RESOURCES):
+                    LOG.info(_("PLUMgrid reconciliation pass completed"))
+                    break
+        return self._interval
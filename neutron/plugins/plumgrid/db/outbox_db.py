@@ -0,0 +1,143 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2014 PLUMgrid, Inc. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+
+import sqlalchemy as sa
+
+from neutron.db import model_base
+from neutron.openstack.common import timeutils
+
+
+class DirectorOutboxEntry(model_base.BASEV2):
+    """A PLUMgrid Director call not yet performed.
+
+    Entries are added in the same transaction as the Neutron resource
+    change they refer to, and removed once the Director accepted the call.
+    Entries still refused after the maximum number of attempts are marked
+    as failed and kept for inspection, without blocking the others.
+    """
+    __tablename__ = 'plumgrid_director_outbox'
+
+    id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
+    resource = sa.Column(sa.String(36), nullable=False)
+    resource_id = sa.Column(sa.String(36), nullable=False)
+    operation = sa.Column(sa.String(64), nullable=False)
+    # JSON encoded list of the arguments for the plumlib call
+    args = sa.Column(sa.Text, nullable=False)
+    attempts = sa.Column(sa.Integer, nullable=False, default=0)
+    last_error = sa.Column(sa.String(255))
+    failed = sa.Column(sa.Boolean, nullable=False, default=False)
+    # Entries being sent by a server are not processed by the others
+    # until this time
+    claimed_until = sa.Column(sa.DateTime)
+    created_at = sa.Column(sa.DateTime, nullable=False)
+
+    __table_args__ = (sa.Index('plumgrid_director_outbox_resource',
+                               'resource', 'resource_id'),)
+
+    def __repr__(self):
+        return "<DirectorOutboxEntry(%s,%s,%s,%s)>" % (self.id,
+                                                       self.operation,
+                                                       self.resource,
+                                                       self.resource_id)
+
+
+def add_entry(session, resource, resource_id, operation, args):
+    with session.begin(subtransactions=True):
+        entry = DirectorOutboxEntry(resource=resource,
+                                    resource_id=resource_id,
+                                    operation=operation,
+                                    args=args,
+                                    attempts=0,
+                                    failed=False,
+                                    created_at=timeutils.utcnow())
+        session.add(entry)
+    return entry
+
+
+def claim_entries(session, limit, claim_timeout):
+    """Claim the oldest entries not failed for claim_timeout seconds.
+
+    Identifiers are selected first and then locked by primary key, so that
+    only the returned rows are locked. The rows are only locked while they
+    are claimed: the Director is called after the transaction is committed.
+    Nothing is returned while another server holds a claim on the oldest
+    entries, so that the calls are performed in order.
+    """
+    with session.begin(subtransactions=True):
+        ids = [entry_id for entry_id, in session.query(
+            DirectorOutboxEntry.id).filter_by(failed=False).order_by(
+                DirectorOutboxEntry.id).limit(limit)]
+        if not ids:
+            return []
+        query = session.query(DirectorOutboxEntry).with_lockmode('update')
+        entries = query.filter(DirectorOutboxEntry.id.in_(ids)).order_by(
+            DirectorOutboxEntry.id).all()
+        now = timeutils.utcnow()
+        if any(entry.claimed_until and entry.claimed_until > now
+               for entry in entries):
+            return []
+        claimed_until = now + datetime.timedelta(seconds=claim_timeout)
+        for entry in entries:
+            entry.claimed_until = claimed_until
+    return entries
+
+
+def has_entries(session, resource, resource_id, failed=False):
+    query = session.query(DirectorOutboxEntry.id).filter_by(
+        resource=resource, resource_id=resource_id, failed=failed)
+    return query.first() is not None
+
+
+def delete_failed_entries(session, resource, resource_id, before_id,
+                          operation=None):
+    """Delete the failed entries of a resource superseded by a later call."""
+    query = session.query(DirectorOutboxEntry).filter_by(
+        resource=resource, resource_id=resource_id, failed=True).filter(
+            DirectorOutboxEntry.id < before_id)
+    if operation:
+        query = query.filter_by(operation=operation)
+    query.delete(synchronize_session=False)
+
+
+def get_pending_resources(session, resource=None, include_failed=True):
+    """Return the resources with calls still pending in the outbox.
+
+    Resources whose calls all failed are only returned with include_failed.
+    """
+    query = session.query(DirectorOutboxEntry).order_by(DirectorOutboxEntry.id)
+    if resource:
+        query = query.filter_by(resource=resource)
+    if not include_failed:
+        query = query.filter_by(failed=False)
+    pending = {}
+    for entry in query:
+        key = (entry.resource, entry.resource_id)
+        if key not in pending:
+            pending[key] = {'resource': entry.resource,
+                            'resource_id': entry.resource_id,
+                            'operations': [],
+                            'attempts': 0,
+                            'last_error': None,
+                            'failed': False,
+                            'pending_since': entry.created_at}
+        item = pending[key]
+        item['operations'].append(entry.operation)
+        item['attempts'] = max(item['attempts'], entry.attempts)
+        item['last_error'] = entry.last_error or item['last_error']
+        item['failed'] = item['failed'] or entry.failed
+    return sorted(pending.values(), key=lambda item: item['pending_since'])
@@ -33,11 +33,19 @@ class Plumlib():
         pass
 
     def director_conn(self, director_plumgrid, director_port, timeout,
-                      director_admin, director_password):
+                      director_admin, director_password, pool_size=1,
+                      idle_timeout=0, call_timeout=0, validate_interval=0,
+                      stats_interval=0):
         LOG.info(_('Fake Director: %s'),
                  director_plumgrid + ':' + director_port)
         pass
 
+    def pool_stats(self):
+        return {}
+
+    def supports_listing(self):
+        return True
+
     def create_network(self, tenant_id, net_db):
         pass
 
@@ -59,6 +67,9 @@ class Plumlib():
     def create_port(self, port_db, router_db):
         pass
 
+    def create_ports(self, port_list):
+        pass
+
     def update_port(self, port_db, router_db):
         pass
 
@@ -88,3 +99,6 @@ class Plumlib():
 
     def delete_floatingip(self, net_db, floating_ip_org, id):
         pass
+
+    def get_resources(self, resource, marker, limit):
+        return []
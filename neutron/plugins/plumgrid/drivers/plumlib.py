@@ -24,6 +24,7 @@ to the PLUMgrid Network Management System called Director
 from plumgridlib import plumlib
 
 from neutron.openstack.common import log as logging
+from neutron.plugins.plumgrid.drivers import pool
 
 LOG = logging.getLogger(__name__)
 
@@ -38,60 +39,116 @@ class Plumlib(object):
         LOG.info(_('Python PLUMgrid Library Started '))
 
     def director_conn(self, director_plumgrid, director_port, timeout,
-                      director_admin, director_password):
-        self.plumlib = plumlib.Plumlib(director_plumgrid,
-                                       director_port,
-                                       timeout,
-                                       director_admin,
-                                       director_password)
+                      director_admin, director_password, pool_size=1,
+                      idle_timeout=0, call_timeout=0, validate_interval=0,
+                      stats_interval=0):
+        def connect():
+            LOG.debug(_('Opening connection to PLUMgrid Director %s'),
+                      director_plumgrid)
+            return plumlib.Plumlib(director_plumgrid,
+                                   director_port,
+                                   timeout,
+                                   director_admin,
+                                   director_password)
+
+        # The HTTP session, and its keep-alive, is managed by the library;
+        # pooled connections can only be checked if it can ping the Director
+        validate = None
+        if hasattr(plumlib.Plumlib, 'ping'):
+            validate = lambda conn: conn.ping()
+        else:
+            LOG.warning(_("The PLUMgrid library cannot check its Director "
+                          "connections; idle connections are only "
+                          "reopened after connection_idle_timeout"))
+        self._pool = pool.DirectorConnectionPool(
+            connect, pool_size, idle_timeout, call_timeout, validate=validate,
+            validate_interval=validate_interval,
+            stats_interval=stats_interval)
+
+    def pool_stats(self):
+        return self._pool.stats
+
+    def supports_listing(self):
+        """Return whether the library can list the Director objects."""
+        return hasattr(plumlib.Plumlib, 'get_resources')
 
     def create_network(self, tenant_id, net_db):
-        self.plumlib.create_network(tenant_id, net_db)
+        with self._pool.connection() as conn:
+            conn.create_network(tenant_id, net_db)
 
     def update_network(self, tenant_id, net_id):
-        self.plumlib.update_network(tenant_id, net_id)
+        with self._pool.connection() as conn:
+            conn.update_network(tenant_id, net_id)
 
     def delete_network(self, net_db, net_id):
-        self.plumlib.delete_network(net_db, net_id)
+        with self._pool.connection() as conn:
+            conn.delete_network(net_db, net_id)
 
     def create_subnet(self, sub_db, net_db, ipnet):
-        self.plumlib.create_subnet(sub_db, net_db, ipnet)
+        with self._pool.connection() as conn:
+            conn.create_subnet(sub_db, net_db, ipnet)
 
     def update_subnet(self, org_sub_db, new_sub_db, ipnet):
-        self.plumlib.update_subnet(org_sub_db, new_sub_db, ipnet)
+        with self._pool.connection() as conn:
+            conn.update_subnet(org_sub_db, new_sub_db, ipnet)
 
     def delete_subnet(self, tenant_id, net_db, net_id):
-        self.plumlib.delete_subnet(tenant_id, net_db, net_id)
+        with self._pool.connection() as conn:
+            conn.delete_subnet(tenant_id, net_db, net_id)
 
     def create_port(self, port_db, router_db):
-        self.plumlib.create_port(port_db, router_db)
+        with self._pool.connection() as conn:
+            conn.create_port(port_db, router_db)
+
+    def create_ports(self, port_list):
+        with self._pool.connection() as conn:
+            # Libraries without batch support get one call per port
+            if hasattr(conn, 'create_ports'):
+                conn.create_ports(port_list)
+            else:
+                for port_db, router_db in port_list:
+                    conn.create_port(port_db, router_db)
 
     def update_port(self, port_db, router_db):
-        self.plumlib.update_port(port_db, router_db)
+        with self._pool.connection() as conn:
+            conn.update_port(port_db, router_db)
 
     def delete_port(self, port_db, router_db):
-        self.plumlib.delete_port(port_db, router_db)
+        with self._pool.connection() as conn:
+            conn.delete_port(port_db, router_db)
 
     def create_router(self, tenant_id, router_db):
-        self.plumlib.create_router(tenant_id, router_db)
+        with self._pool.connection() as conn:
+            conn.create_router(tenant_id, router_db)
 
     def update_router(self, router_db, router_id):
-        self.plumlib.update_router(router_db, router_id)
+        with self._pool.connection() as conn:
+            conn.update_router(router_db, router_id)
 
     def delete_router(self, tenant_id, router_id):
-        self.plumlib.delete_router(tenant_id, router_id)
+        with self._pool.connection() as conn:
+            conn.delete_router(tenant_id, router_id)
 
     def add_router_interface(self, tenant_id, router_id, port_db, ipnet):
-        self.plumlib.add_router_interface(tenant_id, router_id, port_db, ipnet)
+        with self._pool.connection() as conn:
+            conn.add_router_interface(tenant_id, router_id, port_db, ipnet)
 
     def remove_router_interface(self, tenant_id, net_id, router_id):
-        self.plumlib.remove_router_interface(tenant_id, net_id, router_id)
+        with self._pool.connection() as conn:
+            conn.remove_router_interface(tenant_id, net_id, router_id)
 
     def create_floatingip(self, net_db, floating_ip):
-        self.plumlib.create_floatingip(net_db, floating_ip)
+        with self._pool.connection() as conn:
+            conn.create_floatingip(net_db, floating_ip)
 
     def update_floatingip(self, net_db, floating_ip, id):
-        self.plumlib.update_floatingip(net_db, floating_ip, id)
+        with self._pool.connection() as conn:
+            conn.update_floatingip(net_db, floating_ip, id)
 
     def delete_floatingip(self, net_db, floating_ip_org, id):
-        self.plumlib.delete_floatingip(net_db, floating_ip_org, id)
+        with self._pool.connection() as conn:
+            conn.delete_floatingip(net_db, floating_ip_org, id)
+
+    def get_resources(self, resource, marker, limit):
+        with self._pool.connection() as conn:
+            return conn.get_resources(resource, marker, limit)
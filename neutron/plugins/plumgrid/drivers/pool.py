@@ -0,0 +1,146 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2014 PLUMgrid, Inc. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import contextlib
+import time
+
+import eventlet.semaphore
+import eventlet.timeout
+
+from neutron.openstack.common import log as logging
+from neutron.plugins.plumgrid.common import exceptions as plum_excep
+
+LOG = logging.getLogger(__name__)
+
+
+class DirectorConnectionPool(object):
+    """Pool of PLUMgrid Director library connections.
+
+    At most size connections are open at the same time; callers block
+    when all of them are in use. Idle connections are kept open and reused
+    by the following calls, unless they have been idle for more than
+    idle_timeout seconds. A connection idle for validate_interval seconds
+    or more is checked with validate before being reused, and discarded if
+    validate raises or returns False. Connections used by a failed or timed
+    out call are discarded, since their state is unknown. The stats are
+    logged every stats_interval seconds.
+    """
+
+    def __init__(self, factory, size, idle_timeout=0, call_timeout=0,
+                 validate=None, validate_interval=0, stats_interval=0):
+        self._factory = factory
+        self._size = max(size, 1)
+        self._idle_timeout = idle_timeout
+        self._call_timeout = call_timeout
+        self._validate = validate
+        self._validate_interval = validate_interval
+        self._stats_interval = stats_interval
+        self._stats_logged = time.time()
+        self._semaphore = eventlet.semaphore.Semaphore(self._size)
+        # Idle connections, as (last_used, connection) tuples
+        self._idle = []
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+        self.invalid = 0
+
+    @property
+    def stats(self):
+        return {'size': self._size,
+                'idle': len(self._idle),
+                'hits': self.hits,
+                'misses': self.misses,
+                'discarded': self.discarded,
+                'invalid': self.invalid}
+
+    def _is_valid(self, conn):
+        valid = False
+        try:
+            with eventlet.timeout.Timeout(self._call_timeout or None, False):
+                valid = self._validate(conn) is not False
+        except Exception as e:
+            LOG.debug(_("Director connection check failed: %s"), e)
+        return valid
+
+    def _acquire(self):
+        self._semaphore.acquire()
+        now = time.time()
+        while self._idle:
+            last_used, conn = self._idle.pop()
+            if self._idle_timeout and now - last_used > self._idle_timeout:
+                LOG.debug(_("Director connection idle for %0.2f seconds; "
+                            "reconnecting"), now - last_used)
+                self.discarded += 1
+                continue
+            if (self._validate and
+                    now - last_used >= self._validate_interval and
+                    not self._is_valid(conn)):
+                LOG.debug(_("Director connection no longer valid; "
+                            "reconnecting"))
+                self.discarded += 1
+                self.invalid += 1
+                continue
+            self.hits += 1
+            return conn
+        self.misses += 1
+        try:
+            return self._factory()
+        except Exception:
+            self._semaphore.release()
+            raise
+
+    def _log_stats(self):
+        now = time.time()
+        if (self._stats_interval and
+                now - self._stats_logged >= self._stats_interval):
+            self._stats_logged = now
+            LOG.info(_("Director connection pool stats: %s"), self.stats)
+
+    def _release(self, conn):
+        self._idle.append((time.time(), conn))
+        self._semaphore.release()
+        self._log_stats()
+
+    def _discard(self, conn):
+        self.discarded += 1
+        self._semaphore.release()
+        self._log_stats()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Check out a connection for the duration of a Director call.
+
+        The call is aborted with PLUMgridCallTimeout if it lasts more than
+        call_timeout seconds. Unlike eventlet.timeout.Timeout, it is caught
+        by the callers handling the failures of the Director calls.
+        """
+        conn = self._acquire()
+        timer = None
+        if self._call_timeout:
+            timer = eventlet.timeout.Timeout(
+                self._call_timeout,
+                plum_excep.PLUMgridCallTimeout(timeout=self._call_timeout))
+        try:
+            yield conn
+        except Exception:
+            LOG.warn(_("Director call failed; discarding its connection"))
+            self._discard(conn)
+            raise
+        else:
+            self._release(conn)
+        finally:
+            if timer:
+                timer.cancel()
@@ -32,9 +32,12 @@ from neutron.db import l3_db
 from neutron.db import portbindings_db
 from neutron.db import quota_db  # noqa
 from neutron.extensions import portbindings
+from neutron.openstack.common import excutils
 from neutron.openstack.common import importutils
 from neutron.openstack.common import log as logging
 from neutron.plugins.plumgrid.common import exceptions as plum_excep
+from neutron.plugins.plumgrid.common import outbox
+from neutron.plugins.plumgrid.common import sync
 from neutron.plugins.plumgrid.plumgrid_plugin.plugin_ver import VERSION
 
 LOG = logging.getLogger(__name__)
@@ -51,7 +54,58 @@ director_server_opts = [
     cfg.StrOpt('password', default='password', secret=True,
                help=_("PLUMgrid Director admin password")),
     cfg.IntOpt('servertimeout', default=5,
-               help=_("PLUMgrid Director server timeout")), ]
+               help=_("PLUMgrid Director server timeout")),
+    cfg.IntOpt('connection_pool_size', default=4,
+               help=_("Maximum number of concurrent connections to the "
+                      "PLUMgrid Director")),
+    cfg.IntOpt('connection_idle_timeout', default=300,
+               help=_("Seconds after which an idle connection to the "
+                      "PLUMgrid Director is reopened instead of reused. "
+                      "0 keeps idle connections forever")),
+    cfg.IntOpt('connection_validate_interval', default=30,
+               help=_("Seconds after which an idle connection to the "
+                      "PLUMgrid Director is checked before being reused, "
+                      "when the PLUMgrid library supports it. 0 checks it "
+                      "on every use")),
+    cfg.IntOpt('connection_stats_interval', default=300,
+               help=_("Seconds between two logs of the statistics of the "
+                      "PLUMgrid Director connection pool, 0 to disable")),
+    cfg.IntOpt('call_timeout', default=30,
+               help=_("Maximum seconds for a PLUMgrid Director call, "
+                      "0 to disable")),
+    cfg.IntOpt('reconcile_interval', default=0,
+               help=_("Seconds between two runs of the reconciliation of "
+                      "Neutron resources with the PLUMgrid Director. "
+                      "0 disables the reconciliation")),
+    cfg.IntOpt('reconcile_grace_period', default=60,
+               help=_("Seconds a difference between Neutron and the "
+                      "PLUMgrid Director must be found for before the "
+                      "reconciliation repairs it, so that it does not undo "
+                      "changes in progress")),
+    cfg.IntOpt('reconcile_chunk_size', default=500,
+               help=_("Number of Director objects of a type fetched at "
+                      "once by the reconciliation")),
+    cfg.IntOpt('reconcile_time_budget', default=10,
+               help=_("Maximum seconds spent by each run of the "
+                      "reconciliation. The next run resumes where the "
+                      "previous one stopped")),
+    cfg.BoolOpt('async_sync', default=False,
+                help=_("Commit changes locally and send them to the "
+                       "PLUMgrid Director in background. Networks and "
+                       "ports stay in BUILD status until they are synced")),
+    cfg.IntOpt('sync_interval', default=2,
+               help=_("Seconds between two runs of the background sync "
+                      "with the PLUMgrid Director")),
+    cfg.IntOpt('sync_batch_size', default=100,
+               help=_("Maximum number of pending changes sent to the "
+                      "PLUMgrid Director in a single run")),
+    cfg.IntOpt('sync_max_backoff', default=64,
+               help=_("Maximum seconds to wait before retrying after a "
+                      "failure of the background sync")),
+    cfg.IntOpt('sync_max_attempts', default=10,
+               help=_("Number of attempts after which a change refused by "
+                      "the PLUMgrid Director is given up, and its network "
+                      "or port put in ERROR status (0 to retry forever)")), ]
 
 cfg.CONF.register_opts(director_server_opts, "plumgriddirector")
 
@@ -67,6 +121,10 @@ class NeutronPluginPLUMgridV2(db_base_plugin_v2.NeutronDbPluginV2,
     binding_view = "extension:port_binding:view"
     binding_set = "extension:port_binding:set"
 
+    # Ports are created in bulk with a single call to the Director, networks
+    # and subnets one at a time
+    __native_bulk_support = True
+
     def __init__(self):
         LOG.info(_('Neutron PLUMgrid Director: Starting Plugin'))
 
@@ -74,6 +132,8 @@ class NeutronPluginPLUMgridV2(db_base_plugin_v2.NeutronDbPluginV2,
         db.configure_db()
 
         self.plumgrid_init()
+        self.outbox_init()
+        self.sync_init()
 
         LOG.debug(_('Neutron PLUMgrid Director: Neutron server with '
                     'PLUMgrid Plugin has started'))
@@ -89,8 +149,41 @@ class NeutronPluginPLUMgridV2(db_base_plugin_v2.NeutronDbPluginV2,
         # PLUMgrid Director info validation
         LOG.info(_('Neutron PLUMgrid Director: %s'), director_plumgrid)
         self._plumlib = importutils.import_object(PLUM_DRIVER)
-        self._plumlib.director_conn(director_plumgrid, director_port, timeout,
-                                    director_admin, director_password)
+        self._plumlib.director_conn(
+            director_plumgrid, director_port, timeout, director_admin,
+            director_password,
+            pool_size=cfg.CONF.plumgriddirector.connection_pool_size,
+            idle_timeout=cfg.CONF.plumgriddirector.connection_idle_timeout,
+            call_timeout=cfg.CONF.plumgriddirector.call_timeout,
+            validate_interval=(
+                cfg.CONF.plumgriddirector.connection_validate_interval),
+            stats_interval=cfg.CONF.plumgriddirector.connection_stats_interval)
+
+    def outbox_init(self):
+        """Start the background sync if the asynchronous mode is enabled."""
+        self._outbox = None
+        if cfg.CONF.plumgriddirector.async_sync:
+            LOG.info(_('Neutron PLUMgrid Director: asynchronous sync enabled'))
+            self._outbox = outbox.DirectorOutbox(
+                self._plumlib, cfg.CONF.plumgriddirector.sync_interval,
+                cfg.CONF.plumgriddirector.sync_batch_size,
+                cfg.CONF.plumgriddirector.sync_max_backoff,
+                cfg.CONF.plumgriddirector.sync_max_attempts)
+            self._outbox.start()
+
+    def sync_init(self):
+        """Start the periodic reconciliation with the Director."""
+        self._synchronizer = None
+        interval = cfg.CONF.plumgriddirector.reconcile_interval
+        if interval and not self._plumlib.supports_listing():
+            LOG.warning(_("The PLUMgrid library does not support listing "
+                          "Director objects; reconciliation disabled"))
+        elif interval:
+            self._synchronizer = sync.PLUMgridSynchronizer(
+                self, self._plumlib, interval,
+                cfg.CONF.plumgriddirector.reconcile_chunk_size,
+                cfg.CONF.plumgriddirector.reconcile_time_budget,
+                cfg.CONF.plumgriddirector.reconcile_grace_period)
 
     def create_network(self, context, network):
         """Create Neutron network.
@@ -111,17 +204,22 @@ class NeutronPluginPLUMgridV2(db_base_plugin_v2.NeutronDbPluginV2,
             # Propagate all L3 data into DB
             self._process_l3_create(context, net_db, network['network'])
 
-            try:
-                LOG.debug(_('PLUMgrid Library: create_network() called'))
-                self._plumlib.create_network(tenant_id, net_db)
-
-            except Exception:
-                LOG.error(ERR_MESSAGE)
-                raise plum_excep.PLUMgridException(err_msg=ERR_MESSAGE)
+            self._director_call(context, 'create_network', 'network', net_db,
+                                tenant_id, net_db)
 
         # Return created network
         return net_db
 
+    def create_network_bulk(self, context, networks):
+        """Create several Neutron networks.
+
+        Networks are created one at a time, and those already created are
+        deleted if a later one fails.
+        """
+        LOG.debug(_("Neutron PLUMgrid Director: create_network_bulk() "
+                    "called"))
+        return self._create_bulk_with_rollback(context, 'network', networks)
+
     def update_network(self, context, net_id, network):
         """Update Neutron network.
 
@@ -138,13 +236,8 @@ class NeutronPluginPLUMgridV2(db_base_plugin_v2.NeutronDbPluginV2,
                 NeutronPluginPLUMgridV2, self).update_network(context,
                                                               net_id, network)
 
-            try:
-                LOG.debug(_("PLUMgrid Library: update_network() called"))
-                self._plumlib.update_network(tenant_id, net_id)
-
-            except Exception:
-                LOG.error(ERR_MESSAGE)
-                raise plum_excep.PLUMgridException(err_msg=ERR_MESSAGE)
+            self._director_call(context, 'update_network', 'network', net_db,
+                                tenant_id, net_id)
 
         # Return updated network
         return net_db
@@ -164,13 +257,8 @@ class NeutronPluginPLUMgridV2(db_base_plugin_v2.NeutronDbPluginV2,
             super(NeutronPluginPLUMgridV2, self).delete_network(context,
                                                                 net_id)
 
-            try:
-                LOG.debug(_("PLUMgrid Library: update_network() called"))
-                self._plumlib.delete_network(net_db, net_id)
-
-            except Exception:
-                LOG.error(ERR_MESSAGE)
-                raise plum_excep.PLUMgridException(err_msg=ERR_MESSAGE)
+            self._director_call(context, 'delete_network', 'network', net_id,
+                                net_db, net_id)
 
     def create_port(self, context, port):
         """Create Neutron port.
@@ -196,17 +284,46 @@ class NeutronPluginPLUMgridV2(db_base_plugin_v2.NeutronDbPluginV2,
             else:
                 router_db = None
 
-            try:
-                LOG.debug(_("PLUMgrid Library: create_port() called"))
-                self._plumlib.create_port(port_db, router_db)
-
-            except Exception:
-                LOG.error(ERR_MESSAGE)
-                raise plum_excep.PLUMgridException(err_msg=ERR_MESSAGE)
+            self._director_call(context, 'create_port', 'port', port_db,
+                                port_db, router_db)
 
         # Plugin DB - Port Create and Return port
         return self._port_viftype_binding(context, port_db)
 
+    def create_port_bulk(self, context, ports):
+        """Create several Neutron ports.
+
+        Ports are allocated in the DB with set based queries and then
+        pushed to the PLUMgrid Director with a single call.
+        """
+        LOG.debug(_("Neutron PLUMgrid Director: create_port_bulk() called"))
+
+        for port in ports["ports"]:
+            port["port"]["admin_state_up"] = True
+
+        with context.session.begin(subtransactions=True):
+            ports_db = self._create_ports_bulk_db(context, ports)
+            port_list = []
+            for port_db in ports_db:
+                if port_db["device_owner"] == "network:router_gateway":
+                    router_db = self._get_router(context,
+                                                 port_db["device_id"])
+                else:
+                    router_db = None
+                port_list.append((port_db, router_db))
+
+            if self._outbox:
+                # The outbox batches the creations again when syncing
+                for port_db, router_db in port_list:
+                    self._director_call(context, 'create_port', 'port',
+                                        port_db, port_db, router_db)
+            else:
+                self._director_call(context, 'create_ports', 'port', None,
+                                    port_list)
+
+        return [self._port_viftype_binding(context, port_db)
+                for port_db in ports_db]
+
     def update_port(self, context, port_id, port):
         """Update Neutron port.
 
@@ -224,13 +341,8 @@ class NeutronPluginPLUMgridV2(db_base_plugin_v2.NeutronDbPluginV2,
                 router_db = self._get_router(context, device_id)
             else:
                 router_db = None
-            try:
-                LOG.debug(_("PLUMgrid Library: create_port() called"))
-                self._plumlib.update_port(port_db, router_db)
-
-            except Exception:
-                LOG.error(ERR_MESSAGE)
-                raise plum_excep.PLUMgridException(err_msg=ERR_MESSAGE)
+            self._director_call(context, 'update_port', 'port', port_db,
+                                port_db, router_db)
 
         # Plugin DB - Port Update
         return self._port_viftype_binding(context, port_db)
@@ -256,13 +368,8 @@ class NeutronPluginPLUMgridV2(db_base_plugin_v2.NeutronDbPluginV2,
                 router_db = self._get_router(context, device_id)
             else:
                 router_db = None
-            try:
-                LOG.debug(_("PLUMgrid Library: delete_port() called"))
-                self._plumlib.delete_port(port_db, router_db)
-
-            except Exception:
-                LOG.error(ERR_MESSAGE)
-                raise plum_excep.PLUMgridException(err_msg=ERR_MESSAGE)
+            self._director_call(context, 'delete_port', 'port', port_id,
+                                port_db, router_db)
 
     def get_port(self, context, id, fields=None):
         with context.session.begin(subtransactions=True):
@@ -310,15 +417,20 @@ class NeutronPluginPLUMgridV2(db_base_plugin_v2.NeutronDbPluginV2,
             sub_db = super(NeutronPluginPLUMgridV2, self).create_subnet(
                 context, subnet)
 
-            try:
-                LOG.debug(_("PLUMgrid Library: create_subnet() called"))
-                self._plumlib.create_subnet(sub_db, net_db, ipnet)
-            except Exception:
-                LOG.error(ERR_MESSAGE)
-                raise plum_excep.PLUMgridException(err_msg=ERR_MESSAGE)
+            self._director_call(context, 'create_subnet', 'subnet',
+                                sub_db['id'], sub_db, net_db, ipnet)
 
         return sub_db
 
+    def create_subnet_bulk(self, context, subnets):
+        """Create several Neutron subnets.
+
+        Subnets are created one at a time, and those already created are
+        deleted if a later one fails.
+        """
+        LOG.debug(_("Neutron PLUMgrid Director: create_subnet_bulk() called"))
+        return self._create_bulk_with_rollback(context, 'subnet', subnets)
+
     def delete_subnet(self, context, subnet_id):
         """Delete subnet core Neutron API."""
 
@@ -333,12 +445,8 @@ class NeutronPluginPLUMgridV2(db_base_plugin_v2.NeutronDbPluginV2,
             # Plugin DB - Subnet Delete
             super(NeutronPluginPLUMgridV2, self).delete_subnet(
                 context, subnet_id)
-            try:
-                LOG.debug(_("PLUMgrid Library: delete_subnet() called"))
-                self._plumlib.delete_subnet(tenant_id, net_db, net_id)
-            except Exception:
-                LOG.error(ERR_MESSAGE)
-                raise plum_excep.PLUMgridException(err_msg=ERR_MESSAGE)
+            self._director_call(context, 'delete_subnet', 'subnet', subnet_id,
+                                tenant_id, net_db, net_id)
 
     def update_subnet(self, context, subnet_id, subnet):
         """Update subnet core Neutron API."""
@@ -353,14 +461,8 @@ class NeutronPluginPLUMgridV2(db_base_plugin_v2.NeutronDbPluginV2,
                                self).update_subnet(context, subnet_id, subnet)
             ipnet = netaddr.IPNetwork(new_sub_db['cidr'])
 
-            try:
-                # PLUMgrid Server does not support updating resources yet
-                LOG.debug(_("PLUMgrid Library: update_network() called"))
-                self._plumlib.update_subnet(org_sub_db, new_sub_db, ipnet)
-
-            except Exception:
-                LOG.error(ERR_MESSAGE)
-                raise plum_excep.PLUMgridException(err_msg=ERR_MESSAGE)
+            self._director_call(context, 'update_subnet', 'subnet', subnet_id,
+                                org_sub_db, new_sub_db, ipnet)
 
         return new_sub_db
 
@@ -378,13 +480,8 @@ class NeutronPluginPLUMgridV2(db_base_plugin_v2.NeutronDbPluginV2,
             router_db = super(NeutronPluginPLUMgridV2,
                               self).create_router(context, router)
             # Create router on the network controller
-            try:
-                # Add Router to VND
-                LOG.debug(_("PLUMgrid Library: create_router() called"))
-                self._plumlib.create_router(tenant_id, router_db)
-            except Exception:
-                LOG.error(ERR_MESSAGE)
-                raise plum_excep.PLUMgridException(err_msg=ERR_MESSAGE)
+            self._director_call(context, 'create_router', 'router',
+                                router_db['id'], tenant_id, router_db)
 
         # Return created router
         return router_db
@@ -396,12 +493,8 @@ class NeutronPluginPLUMgridV2(db_base_plugin_v2.NeutronDbPluginV2,
         with context.session.begin(subtransactions=True):
             router_db = super(NeutronPluginPLUMgridV2,
                               self).update_router(context, router_id, router)
-            try:
-                LOG.debug(_("PLUMgrid Library: update_router() called"))
-                self._plumlib.update_router(router_db, router_id)
-            except Exception:
-                LOG.error(ERR_MESSAGE)
-                raise plum_excep.PLUMgridException(err_msg=ERR_MESSAGE)
+            self._director_call(context, 'update_router', 'router', router_id,
+                                router_db, router_id)
 
         # Return updated router
         return router_db
@@ -416,13 +509,8 @@ class NeutronPluginPLUMgridV2(db_base_plugin_v2.NeutronDbPluginV2,
             super(NeutronPluginPLUMgridV2, self).delete_router(context,
                                                                router_id)
 
-            try:
-                LOG.debug(_("PLUMgrid Library: delete_router() called"))
-                self._plumlib.delete_router(tenant_id, router_id)
-
-            except Exception:
-                LOG.error(ERR_MESSAGE)
-                raise plum_excep.PLUMgridException(err_msg=ERR_MESSAGE)
+            self._director_call(context, 'delete_router', 'router', router_id,
+                                tenant_id, router_id)
 
     def add_router_interface(self, context, router_id, interface_info):
 
@@ -445,14 +533,9 @@ class NeutronPluginPLUMgridV2(db_base_plugin_v2.NeutronDbPluginV2,
             ipnet = netaddr.IPNetwork(subnet_db['cidr'])
 
             # Create interface on the network controller
-            try:
-                LOG.debug(_("PLUMgrid Library: add_router_interface() called"))
-                self._plumlib.add_router_interface(tenant_id, router_id,
-                                                   port_db, ipnet)
-
-            except Exception:
-                LOG.error(ERR_MESSAGE)
-                raise plum_excep.PLUMgridException(err_msg=ERR_MESSAGE)
+            self._director_call(context, 'add_router_interface', 'router',
+                                router_id, tenant_id, router_id, port_db,
+                                ipnet)
 
         return int_router
 
@@ -479,15 +562,9 @@ class NeutronPluginPLUMgridV2(db_base_plugin_v2.NeutronDbPluginV2,
                                                                  router_id,
                                                                  int_info)
 
-            try:
-                LOG.debug(_("PLUMgrid Library: "
-                            "remove_router_interface() called"))
-                self._plumlib.remove_router_interface(tenant_id,
-                                                      net_id, router_id)
-
-            except Exception:
-                LOG.error(ERR_MESSAGE)
-                raise plum_excep.PLUMgridException(err_msg=ERR_MESSAGE)
+            self._director_call(context, 'remove_router_interface',
+                                'router', router_id, tenant_id, net_id,
+                                router_id)
 
         return del_int_router
 
@@ -503,13 +580,8 @@ class NeutronPluginPLUMgridV2(db_base_plugin_v2.NeutronDbPluginV2,
             net_db = super(NeutronPluginPLUMgridV2,
                            self).get_network(context, net_id)
 
-            try:
-                LOG.debug(_("PLUMgrid Library: create_floatingip() called"))
-                self._plumlib.create_floatingip(net_db, floating_ip)
-
-            except Exception:
-                LOG.error(ERR_MESSAGE)
-                raise plum_excep.PLUMgridException(err_msg=ERR_MESSAGE)
+            self._director_call(context, 'create_floatingip', 'floatingip',
+                                floating_ip['id'], net_db, floating_ip)
 
         return floating_ip
 
@@ -526,13 +598,8 @@ class NeutronPluginPLUMgridV2(db_base_plugin_v2.NeutronDbPluginV2,
             net_db = super(NeutronPluginPLUMgridV2,
                            self).get_network(context, net_id)
 
-            try:
-                LOG.debug(_("PLUMgrid Library: update_floatingip() called"))
-                self._plumlib.update_floatingip(net_db, floating_ip, id)
-
-            except Exception:
-                LOG.error(ERR_MESSAGE)
-                raise plum_excep.PLUMgridException(err_msg=ERR_MESSAGE)
+            self._director_call(context, 'update_floatingip', 'floatingip', id,
+                                net_db, floating_ip, id)
 
         return floating_ip
 
@@ -549,13 +616,8 @@ class NeutronPluginPLUMgridV2(db_base_plugin_v2.NeutronDbPluginV2,
                            self).get_network(context, net_id)
             super(NeutronPluginPLUMgridV2, self).delete_floatingip(context, id)
 
-            try:
-                LOG.debug(_("PLUMgrid Library: delete_floatingip() called"))
-                self._plumlib.delete_floatingip(net_db, floating_ip_org, id)
-
-            except Exception:
-                LOG.error(ERR_MESSAGE)
-                raise plum_excep.PLUMgridException(err_msg=ERR_MESSAGE)
+            self._director_call(context, 'delete_floatingip', 'floatingip', id,
+                                net_db, floating_ip_org, id)
 
     """
     Internal PLUMgrid Fuctions
@@ -564,6 +626,53 @@ class NeutronPluginPLUMgridV2(db_base_plugin_v2.NeutronDbPluginV2,
     def _get_plugin_version(self):
         return VERSION
 
+    def _director_call(self, context, operation, resource, res, *args):
+        """Perform the plumlib operation with args.
+
+        In asynchronous mode the call is stored in the Director outbox in
+        the transaction of context instead. res is the id of the Neutron
+        resource, or its dict whose status is updated in this case.
+        """
+        if self._outbox:
+            res_id = res['id'] if isinstance(res, dict) else res
+            status = self._outbox.enqueue(context, operation, resource,
+                                          res_id, args)
+            if status and isinstance(res, dict):
+                res['status'] = status
+            return
+        try:
+            LOG.debug(_("PLUMgrid Library: %s() called"), operation)
+            getattr(self._plumlib, operation)(*args)
+        except Exception:
+            LOG.error(ERR_MESSAGE)
+            raise plum_excep.PLUMgridException(err_msg=ERR_MESSAGE)
+
+    def _create_bulk_with_rollback(self, context, resource, request_items):
+        """Create the items of a bulk request in their own transactions.
+
+        The native bulk create of the DB base plugin only rolls back the DB
+        on failure, leaving the objects already pushed to the Director
+        behind. They are deleted here instead, as the API does when it
+        emulates bulk operations.
+        """
+        objects = []
+        try:
+            for item in request_items['%ss' % resource]:
+                objects.append(getattr(self, 'create_%s' % resource)(context,
+                                                                     item))
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                for obj in objects:
+                    try:
+                        getattr(self, 'delete_%s' % resource)(context,
+                                                              obj['id'])
+                    except Exception:
+                        LOG.exception(_("Unable to undo add for "
+                                        "%(resource)s %(id)s"),
+                                      {'resource': resource,
+                                       'id': obj['id']})
+        return objects
+
     def _port_viftype_binding(self, context, port):
         port[portbindings.VIF_TYPE] = portbindings.VIF_TYPE_IOVISOR
         port[portbindings.CAPABILITIES] = {
@@ -358,6 +358,47 @@ def check_if_exists(context, action, target):
     return policy.check(*(_prepare_check(context, action, target)))
 
 
+def _check_without_target(rule, credentials):
+    if isinstance(rule, (policy.TrueCheck, policy.FalseCheck,
+                         policy.RoleCheck)):
+        return rule({}, credentials)
+    if isinstance(rule, policy.RuleCheck):
+        try:
+            rule = policy._rules[rule.match]
+        except KeyError:
+            return False
+        return _check_without_target(rule, credentials)
+    if isinstance(rule, policy.NotCheck):
+        result = _check_without_target(rule.rule, credentials)
+        return None if result is None else not result
+    if isinstance(rule, (policy.AndCheck, policy.OrCheck)):
+        decisive = isinstance(rule, policy.OrCheck)
+        results = [_check_without_target(r, credentials) for r in rule.rules]
+        if decisive in results:
+            return decisive
+        return None if None in results else not decisive
+    # The other checks, e.g. on the tenant_id, depend on the target
+    return None
+
+
+def check_without_target(context, action, must_exist=False):
+    """Verify if the action is valid in this context whatever its target.
+
+    Return None when the result depends on the target, e.g. on its
+    tenant_id, and check() must be called for each target. The result is
+    known without target when the rules that decide it, e.g. on the
+    roles, do not look at the target.
+
+    :raises neutron.exceptions.PolicyRuleNotFound: if must_exist is True
+        and the action is not defined in the policy engine.
+    """
+    init()
+    if must_exist and (not policy._rules or action not in policy._rules):
+        raise exceptions.PolicyRuleNotFound(rule=action)
+    match_rule, _target, credentials = _prepare_check(context, action, {})
+    return _check_without_target(match_rule, credentials)
+
+
 def enforce(context, action, target, plugin=None):
     """Verifies that the action is valid on the target in this context.
 
@@ -15,9 +15,11 @@
 #    under the License.
 
 import eventlet.event
+import eventlet.timeout
 import mock
 
 from neutron.agent.linux import ovsdb_monitor
+from neutron.openstack.common import jsonutils
 from neutron.tests import base
 
 
@@ -110,3 +112,67 @@ class TestSimpleInterfaceMonitor(base.BaseTestCase):
                 return_value=output):
             self.monitor._read_stdout()
         self.assertFalse(self.monitor.data_received)
+
+    def _output(self, *rows):
+        return jsonutils.dumps({
+            'data': list(rows),
+            'headings': ['row', 'action', 'name', 'ofport', 'external_ids']})
+
+    def _read_output(self, output):
+        with mock.patch(
+                'neutron.agent.linux.ovsdb_monitor.OvsdbMonitor._read_stdout',
+                return_value=output):
+            self.monitor._read_stdout()
+
+    def mock_is_active(self, active=True):
+        target = ('neutron.agent.linux.ovsdb_monitor.SimpleInterfaceMonitor'
+                  '.is_active')
+        return mock.patch(target,
+                          new_callable=mock.PropertyMock(return_value=active))
+
+    def test_get_events(self):
+        external_ids = ['map', [['iface-id', 'port1'],
+                                ['attached-mac', 'fa:16:3e:00:00:01']]]
+        self._read_output(self._output(
+            ['uuid1', 'insert', 'tap1', ['set', []], external_ids]))
+        self._read_output(self._output(
+            ['uuid1', 'old', '', ['set', []], ''],
+            ['uuid1', 'new', 'tap1', 3, external_ids],
+            ['uuid2', 'delete', 'tap2', 4, ['map', []]]))
+        with self.mock_is_active():
+            events = self.monitor.get_events()
+            self.assertEqual([], self.monitor.get_events())
+        ids = {'iface-id': 'port1', 'attached-mac': 'fa:16:3e:00:00:01'}
+        self.assertEqual(
+            [{'action': ovsdb_monitor.INTERFACE_ADDED, 'name': 'tap1',
+              'ofport': [], 'external_ids': ids},
+             {'action': ovsdb_monitor.INTERFACE_UPDATED, 'name': 'tap1',
+              'ofport': 3, 'external_ids': ids},
+             {'action': ovsdb_monitor.INTERFACE_REMOVED, 'name': 'tap2',
+              'ofport': 4, 'external_ids': {}}],
+            events)
+
+    def test_get_events_returns_none_after_initial_output(self):
+        self._read_output(self._output(
+            ['uuid1', 'initial', 'tap1', 1, ['map', []]]))
+        with self.mock_is_active():
+            self.assertIsNone(self.monitor.get_events())
+            self.assertEqual([], self.monitor.get_events())
+
+    def test_get_events_returns_none_for_invalid_output(self):
+        self._read_output('foo')
+        with self.mock_is_active():
+            self.assertIsNone(self.monitor.get_events())
+
+    def test_get_events_returns_none_if_not_active(self):
+        with self.mock_is_active(False):
+            self.assertIsNone(self.monitor.get_events())
+
+    def test_wait_for_events_returns_on_output(self):
+        self._read_output(self._output())
+        with eventlet.timeout.Timeout(1):
+            self.monitor.wait_for_events(5)
+
+    def test_wait_for_events_times_out(self):
+        with eventlet.timeout.Timeout(1):
+            self.monitor.wait_for_events(0.01)
@@ -86,6 +86,16 @@ class TestAlwaysPoll(base.BaseTestCase):
         pm = polling.AlwaysPoll()
         self.assertTrue(pm.is_polling_required)
 
+    def test_get_events_returns_none(self):
+        pm = polling.AlwaysPoll()
+        self.assertIsNone(pm.get_events())
+
+    def test_wait_for_updates_sleeps(self):
+        pm = polling.AlwaysPoll()
+        with mock.patch('time.sleep') as mock_sleep:
+            pm.wait_for_updates(2)
+        mock_sleep.assert_called_once_with(2)
+
 
 class TestInterfacePollingMinimizer(base.BaseTestCase):
 
@@ -114,3 +124,15 @@ class TestInterfacePollingMinimizer(base.BaseTestCase):
     def test__is_polling_required_returns_when_updates_are_present(self):
         with self.mock_has_updates(True):
             self.assertTrue(self.pm._is_polling_required())
+
+    def test_get_events_calls_monitor_get_events(self):
+        with mock.patch.object(self.pm._monitor,
+                               'get_events') as mock_get_events:
+            self.assertEqual(mock_get_events.return_value,
+                             self.pm.get_events())
+
+    def test_wait_for_updates_waits_for_monitor_events(self):
+        with mock.patch.object(self.pm._monitor,
+                               'wait_for_events') as mock_wait:
+            self.pm.wait_for_updates(2)
+        mock_wait.assert_called_once_with(2)
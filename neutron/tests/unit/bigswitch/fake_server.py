@@ -17,10 +17,13 @@
 # @author: Kevin Benton, <kevin.benton@bigswitch.com>
 #
 
+import httplib
+
 
 class HTTPResponseMock():
     status = 200
     reason = 'OK'
+    will_close = False
 
     def __init__(self, sock, debuglevel=0, strict=0, method=None,
                  buffering=False):
@@ -54,17 +57,24 @@ class HTTPConnectionMock():
 
     def __init__(self, server, port, timeout):
         self.response = None
+        self.chunked_request = None
         self.broken = False
         # Port 9000 is the broken server
         if port == 9000:
             self.broken = True
             errmsg = "This server is broken, please try another"
-            self.response = HTTPResponseMock500(None, errmsg=errmsg)
+            self.broken_response = HTTPResponseMock500(None, errmsg=errmsg)
 
     def request(self, action, uri, body, headers):
         if self.broken and "ExceptOnBadServer" in uri:
             raise Exception("Broken server got an unexpected request")
-        if self.response:
+        if self.broken:
+            self.response = self.broken_response
+            return
+        # The connections kept open by the plugin also fail while the
+        # tests make the new ones fail
+        if httplib.HTTPConnection is HTTPConnectionMock500:
+            self.response = HTTPResponseMock500(None)
             return
 
         # detachment may return 404 and plugin shouldn't die
@@ -82,7 +92,23 @@ class HTTPConnectionMock():
 
         return
 
+    def putrequest(self, action, uri):
+        self.chunked_request = (action, uri, [], {})
+
+    def putheader(self, header, value):
+        self.chunked_request[3][header] = value
+
+    def endheaders(self):
+        pass
+
+    def send(self, data):
+        self.chunked_request[2].append(data)
+
     def getresponse(self):
+        if self.chunked_request:
+            action, uri, body, headers = self.chunked_request
+            self.chunked_request = None
+            self.request(action, uri, ''.join(body), headers)
         return self.response
 
     def close(self):
@@ -92,5 +118,7 @@ class HTTPConnectionMock():
 class HTTPConnectionMock500(HTTPConnectionMock):
 
     def __init__(self, server, port, timeout):
-        self.response = HTTPResponseMock500(None)
+        self.response = None
+        self.chunked_request = None
         self.broken = True
+        self.broken_response = HTTPResponseMock500(None)
@@ -15,14 +15,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import contextlib
+import httplib
+import json
+import socket
+
+import mock
 from mock import patch
 from oslo.config import cfg
 import webob.exc
 
 from neutron import context
+from neutron.db import dhcp_rpc_base
+from neutron.db import models_v2
 from neutron.extensions import portbindings
 from neutron.manager import NeutronManager
+from neutron.openstack.common import timeutils
+from neutron.plugins.bigswitch import plugin
 from neutron.plugins.bigswitch.plugin import RemoteRestError
+from neutron.tests import base
 from neutron.tests.unit import _test_extension_portbindings as test_bindings
 from neutron.tests.unit.bigswitch import fake_server
 from neutron.tests.unit.bigswitch import test_base
@@ -280,3 +291,270 @@ class TestBigSwitchProxySync(BigSwitchProxyPluginV2TestCase):
         plugin_obj = NeutronManager.get_plugin()
         result = plugin_obj._send_all_data()
         self.assertEqual(result[0], 200)
+
+    def test_send_data_chunked(self):
+        plugin_obj = NeutronManager.get_plugin()
+        with self.port() as port:
+            with patch.object(plugin_obj.servers,
+                              'rest_action') as rest_action:
+                plugin_obj._send_all_data()
+        action, resource, body = rest_action.call_args[0][:3]
+        self.assertEqual(('PUT', '/topology'), (action, resource))
+        topology = json.loads(''.join(body()))
+        self.assertEqual([], topology['routers'])
+        [network] = topology['networks']
+        self.assertEqual(port['port']['network_id'], network['id'])
+        self.assertEqual({'id': port['port']['device_id'],
+                          'mac': port['port']['mac_address']},
+                         network['ports'][0]['attachment'])
+        self.assertEqual(network['subnets'][0]['gateway_ip'],
+                         network['gateway'])
+        self.assertIsNotNone(plugin_obj._synced_at)
+
+    def test_latency_stats_logged(self):
+        plugin_obj = NeutronManager.get_plugin()
+        server = plugin_obj.servers.servers[0]
+        server._record_latency(0.2)
+        with patch.object(plugin.LOG, 'info') as log_info:
+            plugin_obj._log_latency_stats()
+        # One line per controller
+        self.assertEqual(len(plugin_obj.servers.servers),
+                         log_info.call_count)
+        log_info.assert_any_call(
+            mock.ANY, {'server': '%s:%d' % (server.server, server.port),
+                       'average': 0.2,
+                       'histogram': server.get_latency_stats()['histogram']})
+
+    def test_get_all_data_routers(self):
+        plugin_obj = NeutronManager.get_plugin()
+        ctx = context.get_admin_context()
+        with self.subnet() as subnet:
+            router = plugin_obj.create_router(ctx, {'router': {
+                'name': 'router1', 'admin_state_up': True,
+                'tenant_id': subnet['subnet']['tenant_id']}})
+            intf = {'subnet_id': subnet['subnet']['id']}
+            plugin_obj.add_router_interface(ctx, router['id'], intf)
+            try:
+                networks, routers = plugin_obj._get_all_data(ctx)
+            finally:
+                plugin_obj.remove_router_interface(ctx, router['id'], intf)
+                plugin_obj.delete_router(ctx, router['id'])
+        [interface] = routers[0]['interfaces']
+        self.assertEqual(subnet['subnet']['network_id'], interface['id'])
+        self.assertEqual(subnet['subnet']['id'], interface['subnet']['id'])
+        self.assertEqual(subnet['subnet']['gateway_ip'],
+                         interface['network']['gateway'])
+        self.assertNotIn('ports', interface['network'])
+        self.assertEqual(1, len(networks[0]['ports']))
+
+    def test_get_all_data_network_deleted(self):
+        plugin_obj = NeutronManager.get_plugin()
+        ctx = context.get_admin_context()
+        get_query = plugin_obj._get_collection_query
+
+        def get_deleted_network_query(context, model, *args, **kwargs):
+            query = get_query(context, model, *args, **kwargs)
+            if model is models_v2.Network:
+                # The network is deleted after its ports are loaded
+                query = query.filter(models_v2.Network.id == 'deleted')
+            return query
+
+        with self.subnet() as subnet:
+            router = plugin_obj.create_router(ctx, {'router': {
+                'name': 'router1', 'admin_state_up': True,
+                'tenant_id': subnet['subnet']['tenant_id']}})
+            intf = {'subnet_id': subnet['subnet']['id']}
+            plugin_obj.add_router_interface(ctx, router['id'], intf)
+            try:
+                with patch.object(plugin_obj, '_get_collection_query',
+                                  side_effect=get_deleted_network_query):
+                    networks, routers = plugin_obj._get_all_data(ctx)
+            finally:
+                plugin_obj.remove_router_interface(ctx, router['id'], intf)
+                plugin_obj.delete_router(ctx, router['id'])
+        self.assertEqual([], networks)
+        self.assertEqual([], routers[0]['interfaces'])
+
+    def test_send_changed_data_without_sync(self):
+        plugin_obj = NeutronManager.get_plugin()
+        with patch.object(plugin_obj, '_send_all_data') as send_all_data:
+            plugin_obj._send_changed_data()
+        send_all_data.assert_called_once_with()
+
+    def test_send_changed_data(self):
+        plugin_obj = NeutronManager.get_plugin()
+        with self.network():
+            plugin_obj._synced_at = synced_at = timeutils.utcnow()
+            with self.network() as net2:
+                with contextlib.nested(
+                    patch.object(dhcp_rpc_base, 'CHANGED_SINCE_MARGIN', 0),
+                    patch.object(plugin_obj.servers, 'rest_update_network')
+                ) as (margin, update_network):
+                    plugin_obj._send_changed_data()
+        net2 = net2['network']
+        update_network.assert_called_once_with(net2['tenant_id'], net2['id'],
+                                               mock.ANY)
+        self.assertGreater(plugin_obj._synced_at, synced_at)
+
+    def test_send_changed_data_ports(self):
+        plugin_obj = NeutronManager.get_plugin()
+        with self.subnet() as subnet:
+            with self.port(subnet=subnet):
+                plugin_obj._synced_at = timeutils.utcnow()
+                with self.port(subnet=subnet, device_id='vm1') as port2:
+                    with contextlib.nested(
+                        patch.object(dhcp_rpc_base, 'CHANGED_SINCE_MARGIN',
+                                     0),
+                        patch.object(plugin_obj.servers, 'rest_action',
+                                     return_value=(404, None, None, None))
+                    ) as (margin, rest_action):
+                        plugin_obj._send_changed_data()
+        port2 = port2['port']
+        port_path = plugin.PORTS_PATH % (port2['tenant_id'],
+                                         port2['network_id'], port2['id'])
+        net_args = (port2['tenant_id'], port2['network_id'])
+        calls = [call[0][:2] for call in rest_action.call_args_list]
+        self.assertEqual(
+            [('PUT', plugin.NETWORKS_PATH % net_args),
+             ('PUT', port_path),
+             ('POST', plugin.PORT_RESOURCE_PATH % net_args),
+             ('PUT', plugin.ATTACHMENT_PATH % (net_args + (port2['id'],)))],
+            calls)
+        attachment = rest_action.call_args_list[3][0][2]['attachment']
+        self.assertEqual({'id': 'vm1', 'mac': port2['mac_address']},
+                         attachment)
+
+    def test_create_or_update_port_existing(self):
+        plugin_obj = NeutronManager.get_plugin()
+        net = {'tenant_id': 'tenant', 'id': 'net'}
+        with patch.object(plugin_obj.servers, 'rest_action',
+                          return_value=(200, None, None, None)) as rest_action:
+            plugin_obj.servers.rest_create_or_update_port(net, {'id': 'port'})
+        rest_action.assert_called_once_with(
+            'PUT', plugin.PORTS_PATH % ('tenant', 'net', 'port'),
+            {'port': {'id': 'port'}}, mock.ANY, ignore_codes=[404])
+
+
+class TestServerProxy(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestServerProxy, self).setUp()
+        self.conn_cls = patch('httplib.HTTPConnection').start()
+        self.addCleanup(patch.stopall)
+        self.conn_cls.return_value.getresponse.return_value = (
+            fake_server.HTTPResponseMock(None))
+        self.server = plugin.ServerProxy('localhost', 8800, False, None,
+                                         'neutron-id', 10, '/base', 'name',
+                                         max_connections=1)
+
+    def test_connection_reused(self):
+        self.assertEqual(200, self.server.rest_call('GET', '/a', '', {})[0])
+        self.assertEqual(200, self.server.rest_call('GET', '/b', '', {})[0])
+        self.assertEqual(1, self.conn_cls.call_count)
+        self.assertFalse(self.conn_cls.return_value.close.called)
+        self.server.close()
+        self.conn_cls.return_value.close.assert_called_once_with()
+        self.assertEqual(2, sum(self.server.latency_histogram))
+
+    def test_connection_closed_by_server(self):
+        response = fake_server.HTTPResponseMock(None)
+        response.will_close = True
+        self.conn_cls.return_value.getresponse.return_value = response
+        self.server.rest_call('GET', '/a', '', {})
+        self.server.rest_call('GET', '/b', '', {})
+        self.assertEqual(2, self.conn_cls.call_count)
+        self.assertEqual(2, self.conn_cls.return_value.close.call_count)
+
+    def test_idle_connection_lost(self):
+        self.server.rest_call('GET', '/a', '', {})
+        stale_conn = self.conn_cls.return_value
+        stale_conn.request.side_effect = httplib.BadStatusLine('')
+        self.conn_cls.return_value = new_conn = mock.Mock()
+        new_conn.getresponse.return_value = fake_server.HTTPResponseMock(None)
+        self.assertEqual(200, self.server.rest_call('GET', '/b', '', {})[0])
+        stale_conn.close.assert_called_once_with()
+        self.assertEqual([new_conn], self.server.connections)
+
+    def test_idle_connection_lost_after_sending(self):
+        self.server.rest_call('GET', '/a', '', {})
+        stale_conn = self.conn_cls.return_value
+        stale_conn.getresponse.side_effect = httplib.BadStatusLine('')
+        # The controller may have created the object, it is not sent again
+        self.assertEqual(0, self.server.rest_call('POST', '/b', {}, {})[0])
+        self.assertEqual(1, self.conn_cls.call_count)
+        self.assertEqual(2, stale_conn.request.call_count)
+
+    def test_idle_connection_lost_before_sending(self):
+        self.server.rest_call('GET', '/a', '', {})
+        stale_conn = self.conn_cls.return_value
+        stale_conn.request.side_effect = socket.error()
+        self.conn_cls.return_value = new_conn = mock.Mock()
+        new_conn.getresponse.return_value = fake_server.HTTPResponseMock(None)
+        self.assertEqual(200, self.server.rest_call('POST', '/b', {}, {})[0])
+        new_conn.request.assert_called_once_with('POST', '/base/b', '{}',
+                                                 mock.ANY)
+
+    def test_new_connection_error(self):
+        self.conn_cls.return_value.request.side_effect = socket.error()
+        self.assertEqual(0, self.server.rest_call('GET', '/a', '', {})[0])
+        self.assertEqual(1, self.conn_cls.call_count)
+        self.assertEqual([], self.server.connections)
+
+    def test_chunked_body(self):
+        self.server.rest_call('PUT', '/a',
+                              lambda: iter(['{"a": ', '', '1}']), {})
+        conn = self.conn_cls.return_value
+        self.assertFalse(conn.request.called)
+        conn.putrequest.assert_called_once_with('PUT', '/base/a')
+        conn.putheader.assert_any_call('Transfer-Encoding', 'chunked')
+        self.assertEqual([mock.call('6\r\n{"a": \r\n'),
+                          mock.call('2\r\n1}\r\n'),
+                          mock.call('0\r\n\r\n')],
+                         conn.send.call_args_list)
+
+    def test_topology_chunks(self):
+        networks = [{'id': 'net%d' % i} for i in range(3)]
+        routers = [{'id': 'router1'}]
+        chunks = list(plugin.topology_chunks(networks, routers,
+                                             chunk_size=20))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual({'networks': networks, 'routers': routers},
+                         json.loads(''.join(chunks)))
+        self.assertEqual({'networks': [], 'routers': []},
+                         json.loads(''.join(plugin.topology_chunks([], []))))
+
+    def test_latency_stats(self):
+        for latency in (0.001, 0.2, 7):
+            self.server._record_latency(latency)
+        stats = self.server.get_latency_stats()
+        self.assertEqual({0.01: 1, 0.05: 0, 0.1: 0, 0.5: 1, 1: 0, 5: 0,
+                          None: 1}, stats['histogram'])
+        self.assertAlmostEqual(1.43264, stats['average'])
+
+    def test_server_pool_keeps_configured_order(self):
+        pool = plugin.ServerPool([('master', 1), ('standby', 2)],
+                                 False, None, 'neutron-id')
+        # A slower master is still tried first
+        pool.servers[0].latency = 1
+        pool.servers[1].latency = 0.1
+        for server in pool.servers:
+            server.rest_call = mock.Mock(return_value=(200, 'OK', '', ''))
+        pool.rest_call('GET', '/a', '', {}, [])
+        self.assertTrue(pool.servers[0].rest_call.called)
+        self.assertFalse(pool.servers[1].rest_call.called)
+        self.assertIn('standby:2', pool.get_latency_stats())
+
+    def test_server_pool_prefers_last_server(self):
+        pool = plugin.ServerPool([('master', 1), ('standby', 2)],
+                                 False, None, 'neutron-id')
+        master, standby = pool.servers
+        master.rest_call = mock.Mock(return_value=(503, None, None, None))
+        standby.rest_call = mock.Mock(return_value=(200, 'OK', '', ''))
+        pool.rest_call('GET', '/a', '', {}, [])
+        self.assertIs(standby, pool.last_server)
+        # The failed master recovered, the standby still answers
+        master.failed = False
+        master.rest_call.reset_mock()
+        pool.rest_call('GET', '/b', '', {}, [])
+        self.assertFalse(master.rest_call.called)
+        self.assertEqual(2, standby.rest_call.call_count)
@@ -15,6 +15,7 @@
 #    under the License.
 
 import contextlib
+import errno
 import os
 
 import mock
@@ -22,6 +23,7 @@ from oslo.config import cfg
 import testtools
 
 from neutron.agent.linux import ip_lib
+from neutron.agent.linux import netlink
 from neutron.agent.linux import utils
 from neutron.common import constants
 from neutron.openstack.common.rpc import common as rpc_common
@@ -128,6 +130,22 @@ class TestLinuxBridgeAgent(base.BaseTestCase):
                     agent.daemon_loop()
                 self.assertEqual(3, log.call_count)
 
+    def test_report_state(self):
+        agent = linuxbridge_neutron_agent.LinuxBridgeNeutronAgentRPC({},
+                                                                     0,
+                                                                     None)
+        agent.refresh_stats['requested'] = 2
+        with contextlib.nested(
+            mock.patch.object(agent.br_mgr, 'udev_get_tap_devices',
+                              return_value=['tap1']),
+            mock.patch.object(agent.state_rpc, 'report_state')
+        ) as (get_tap_devices, report_state):
+            agent._report_state()
+            configurations = report_state.call_args[0][1]['configurations']
+            self.assertEqual(1, configurations['devices'])
+            self.assertEqual(2,
+                             configurations['firewall_refreshes_requested'])
+
     def test_process_network_devices_failed(self):
         device_info = {'current': [1, 2, 3]}
         agent = linuxbridge_neutron_agent.LinuxBridgeNeutronAgentRPC({},
@@ -154,6 +172,92 @@ class TestLinuxBridgeAgent(base.BaseTestCase):
                     agent.daemon_loop()
                 self.assertEqual(3, log.call_count)
 
+    def test_daemon_loop_from_events(self):
+        cfg.CONF.set_override('minimize_polling', True, 'AGENT')
+        self.addCleanup(cfg.CONF.reset)
+        agent = linuxbridge_neutron_agent.LinuxBridgeNeutronAgentRPC({},
+                                                                     0,
+                                                                     None)
+        monitor = mock.Mock()
+        events = [{'action': netlink.LINK_ADDED, 'index': 5,
+                   'name': 'tap2'}]
+        monitor.get_events.side_effect = [None, events, RuntimeError]
+        with contextlib.nested(
+            mock.patch.object(netlink, 'LinkMonitor', return_value=monitor),
+            mock.patch.object(agent.br_mgr, 'udev_get_tap_devices',
+                              return_value=set(['tap1'])),
+            mock.patch.object(agent, 'process_network_devices',
+                              return_value=False),
+            mock.patch.object(linuxbridge_neutron_agent.LOG, 'exception',
+                              side_effect=RuntimeError)
+        ) as (_monitor_cls, get_tap_devices, process_network_devices, _log):
+            with testtools.ExpectedException(RuntimeError):
+                agent.daemon_loop()
+        # Only the first iteration scans the devices
+        get_tap_devices.assert_called_once_with()
+        self.assertEqual(
+            [mock.call({'current': set(['tap1']), 'added': set(['tap1']),
+                        'removed': set()}),
+             mock.call({'current': set(['tap1', 'tap2']),
+                        'added': set(['tap2']), 'removed': set()})],
+            process_network_devices.call_args_list)
+        monitor.start.assert_called_once_with()
+        monitor.stop.assert_called_once_with()
+
+    def _get_agent(self):
+        agent = linuxbridge_neutron_agent.LinuxBridgeNeutronAgentRPC({},
+                                                                     0,
+                                                                     None)
+        agent.prepare_devices_filter = mock.Mock()
+        agent.remove_devices_filter = mock.Mock()
+        agent.plugin_rpc = mock.Mock()
+        return agent
+
+    def test_treat_devices_added_in_batches(self):
+        agent = self._get_agent()
+        agent.rpc_device_batch_size = 2
+        details = dict((device, {'device': device, 'port_id': device,
+                                 'network_id': 'net', 'network_type': 'flat',
+                                 'segmentation_id': None,
+                                 'physical_network': 'physnet1',
+                                 'admin_state_up': True})
+                       for device in ('tap1', 'tap2', 'tap3'))
+        agent.plugin_rpc.get_devices_details_list.side_effect = (
+            lambda ctx, batch, agent_id: [details[d] for d in batch])
+        agent.plugin_rpc.update_device_list.return_value = {
+            'failed_devices_up': [], 'failed_devices_down': []}
+        with mock.patch.object(agent.br_mgr, 'add_interface',
+                               side_effect=[True, False, True]):
+            self.assertFalse(agent.treat_devices_added(['tap1', 'tap2',
+                                                        'tap3']))
+        self.assertEqual(2, agent.plugin_rpc.get_devices_details_list.
+                         call_count)
+        self.assertEqual(
+            [mock.call(agent.context, ['tap1'], ['tap2'], agent.agent_id,
+                       cfg.CONF.host),
+             mock.call(agent.context, ['tap3'], [], agent.agent_id,
+                       cfg.CONF.host)],
+            agent.plugin_rpc.update_device_list.call_args_list)
+
+    def test_treat_devices_added_returns_true_for_missing_device(self):
+        agent = self._get_agent()
+        agent.plugin_rpc.get_devices_details_list.side_effect = Exception()
+        self.assertTrue(agent.treat_devices_added(['tap1']))
+        self.assertFalse(agent.plugin_rpc.update_device_list.called)
+
+    def test_treat_devices_removed(self):
+        agent = self._get_agent()
+        agent.plugin_rpc.update_device_list.return_value = {
+            'devices_down': [{'device': 'tap1', 'exists': True}],
+            'failed_devices_down': ['tap2']}
+        with mock.patch.object(agent.br_mgr,
+                               'remove_empty_bridges') as remove_bridges:
+            self.assertTrue(agent.treat_devices_removed(['tap1', 'tap2']))
+        agent.plugin_rpc.update_device_list.assert_called_once_with(
+            agent.context, [], ['tap1', 'tap2'], agent.agent_id,
+            cfg.CONF.host)
+        remove_bridges.assert_called_once_with()
+
 
 class TestLinuxBridgeManager(base.BaseTestCase):
     def setUp(self):
@@ -609,6 +713,19 @@ class TestLinuxBridgeManager(base.BaseTestCase):
                               "removed": set(["dev3"])
                               })
 
+    def test_update_devices_from_events(self):
+        events = [{'action': netlink.LINK_ADDED, 'name': 'tap1'},
+                  {'action': netlink.LINK_ADDED, 'name': 'eth1'},
+                  {'action': netlink.LINK_REMOVED, 'name': 'tap3'},
+                  {'action': netlink.LINK_ADDED, 'name': None}]
+        self.assertEqual(
+            {'current': set(['tap1', 'tap2']), 'added': set(['tap1']),
+             'removed': set(['tap3'])},
+            self.lbm.update_devices_from_events(set(['tap2', 'tap3']),
+                                                events))
+        self.assertIsNone(self.lbm.update_devices_from_events(
+            set(['tap1']), [{'action': netlink.LINK_ADDED, 'name': 'tap1'}]))
+
     def _check_vxlan_support(self, kernel_version, vxlan_proxy_supported,
                              fdb_append_supported, l2_population,
                              expected_mode):
@@ -664,6 +781,92 @@ class TestLinuxBridgeManager(base.BaseTestCase):
                                   expected_mode=lconst.VXLAN_NONE)
 
 
+class TestLinuxBridgeManagerNetlink(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestLinuxBridgeManagerNetlink, self).setUp()
+        cfg.CONF.set_override('link_backend', 'netlink', 'LINUX_BRIDGE')
+        self.addCleanup(cfg.CONF.reset)
+        self.lbm = linuxbridge_neutron_agent.LinuxBridgeManager(
+            {'physnet1': 'eth1'}, cfg.CONF.AGENT.root_helper)
+        self.lbm.netlink = mock.Mock()
+        self.execute = mock.patch.object(utils, 'execute').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_ensure_bridge(self):
+        self.lbm.netlink.link_exists.return_value = False
+        with contextlib.nested(
+            mock.patch.object(self.lbm, 'update_interface_ip_details'),
+            mock.patch.object(self.lbm, 'interface_exists_on_bridge',
+                              return_value=False)
+        ):
+            self.assertEqual('br0', self.lbm.ensure_bridge('br0', 'eth0'))
+        self.lbm.netlink.add_bridge.assert_called_once_with('br0')
+        self.lbm.netlink.set_master.assert_called_once_with('eth0', 'br0')
+        self.assertFalse(self.execute.called)
+
+    def test_ensure_vlan(self):
+        self.lbm.netlink.link_exists.return_value = False
+        self.assertEqual('eth1.5', self.lbm.ensure_vlan('eth1', 5))
+        self.lbm.netlink.add_vlan.assert_called_once_with('eth1.5', 'eth1',
+                                                          5)
+        self.lbm.netlink.add_vlan.side_effect = netlink.NetlinkError(
+            errno.EPERM)
+        self.assertIsNone(self.lbm.ensure_vlan('eth1', 5))
+        self.assertFalse(self.execute.called)
+
+    def test_remove_interface_and_delete_vlan(self):
+        with mock.patch.object(self.lbm, 'is_device_on_bridge',
+                               return_value=True):
+            self.assertTrue(self.lbm.remove_interface('br0', 'eth1.5'))
+        self.lbm.netlink.set_master.assert_called_once_with('eth1.5')
+        self.lbm.delete_vlan('eth1.5')
+        self.lbm.netlink.set_link_up.assert_called_once_with('eth1.5',
+                                                             up=False)
+        self.lbm.netlink.delete_link.assert_called_once_with('eth1.5')
+        self.assertFalse(self.execute.called)
+
+    def test_add_fdb_entries(self):
+        self.lbm.vxlan_mode = lconst.VXLAN_UCAST
+        flooding = constants.FLOODING_ENTRY[0]
+        self.lbm.netlink.get_fdb_entries.return_value = set(
+            [('fa:16:3e:00:00:01', '10.0.0.2')])
+        self.lbm.add_fdb_entries(
+            '10.0.0.2', [[flooding, '10.0.0.2'],
+                         ['fa:16:3e:00:00:01', '192.168.0.1'],
+                         ['fa:16:3e:00:00:02', '192.168.0.2']], 'vxlan-1')
+        self.lbm.netlink.add_neighbours.assert_called_once_with(
+            'vxlan-1', [('fa:16:3e:00:00:01', '192.168.0.1'),
+                        ('fa:16:3e:00:00:02', '192.168.0.2')])
+        # Only the missing FDB entries are sent
+        self.assertEqual(
+            [mock.call('vxlan-1', [('fa:16:3e:00:00:02', '10.0.0.2')]),
+             mock.call('vxlan-1', [(flooding, '10.0.0.2')], append=True)],
+            self.lbm.netlink.add_fdb_entries.call_args_list)
+        self.assertFalse(self.execute.called)
+
+    def test_remove_fdb_entries(self):
+        self.lbm.vxlan_mode = lconst.VXLAN_UCAST
+        flooding = constants.FLOODING_ENTRY[0]
+        self.lbm.remove_fdb_entries(
+            '10.0.0.2', [[flooding, '10.0.0.2'],
+                         ['fa:16:3e:00:00:01', '192.168.0.1']], 'vxlan-1')
+        self.lbm.netlink.delete_neighbours.assert_called_once_with(
+            'vxlan-1', [('fa:16:3e:00:00:01', '192.168.0.1')])
+        self.lbm.netlink.delete_fdb_entries.assert_called_once_with(
+            'vxlan-1', [('fa:16:3e:00:00:01', '10.0.0.2'),
+                        (flooding, '10.0.0.2')])
+        self.assertFalse(self.execute.called)
+
+    def test_fdb_entries_error(self):
+        self.lbm.netlink.get_fdb_entries.side_effect = netlink.NetlinkError(
+            errno.ENODEV)
+        with mock.patch.object(linuxbridge_neutron_agent.LOG,
+                               'error') as log:
+            self.lbm.add_fdb_entries('10.0.0.2', [], 'vxlan-1')
+        self.assertTrue(log.called)
+
+
 class TestLinuxBridgeRpcCallbacks(base.BaseTestCase):
     def setUp(self):
         cfg.CONF.set_override('local_ip', LOCAL_IP, 'VXLAN')
@@ -13,6 +13,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
+
 from neutron.extensions import portbindings
 from neutron import manager
 from neutron.plugins.ml2 import config as config
@@ -76,3 +78,22 @@ class PortBindingTestCase(test_plugin.NeutronDbPluginV2TestCase):
         self._test_port_binding("host-bridge-filter",
                                 portbindings.VIF_TYPE_BRIDGE,
                                 True, True)
+
+    def test_get_devices_details_list(self):
+        host_arg = {portbindings.HOST_ID: "host-ovs-no_filter"}
+        with self.subnet() as subnet:
+            with contextlib.nested(
+                self.port(subnet=subnet, arg_list=(portbindings.HOST_ID,),
+                          **host_arg),
+                self.port(subnet=subnet)
+            ) as (bound_port, unbound_port):
+                devices = ['tap' + bound_port['port']['id'][:11],
+                           unbound_port['port']['id'], 'fake_device']
+                details = self.plugin.callbacks.get_devices_details_list(
+                    None, agent_id="theAgentId", devices=devices)
+                self.assertEqual(devices, [d['device'] for d in details])
+                self.assertEqual('local', details[0]['network_type'])
+                self.assertEqual(bound_port['port']['id'],
+                                 details[0]['port_id'])
+                self.assertNotIn('network_type', details[1])
+                self.assertNotIn('network_type', details[2])
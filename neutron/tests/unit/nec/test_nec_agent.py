@@ -249,7 +249,10 @@ class TestNecAgent(TestNecAgentBase):
                 'binary': 'neutron-nec-agent',
                 'host': 'dummy-host',
                 'topic': 'N/A',
-                'configurations': {'devices': 0},
+                'configurations': {'devices': 0,
+                                   'firewall_refreshes_requested': 0,
+                                   'firewall_refreshes_coalesced': 0,
+                                   'firewall_refreshes_executed': 0},
                 'agent_type': 'NEC plugin agent'}
             expected_state['configurations']['devices'] = num_ports
             if i == 0 or fail_mode:
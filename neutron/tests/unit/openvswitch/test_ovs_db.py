@@ -15,6 +15,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import contextlib
+import datetime
+
 import mock
 from oslo.config import cfg
 import testtools
@@ -22,8 +25,11 @@ from testtools import matchers
 
 from neutron.common import exceptions as q_exc
 from neutron.db import api as db
+from neutron.db import models_v2
+from neutron import manager
 from neutron.openstack.common.db import exception as db_exc
 from neutron.openstack.common.db.sqlalchemy import session
+from neutron.openstack.common import timeutils
 from neutron.plugins.openvswitch import ovs_db_v2
 from neutron.plugins.openvswitch import ovs_models_v2 as ovs_models
 from neutron.tests import base
@@ -319,3 +325,41 @@ class NetworkBindingsTest(test_plugin.NeutronDbPluginV2TestCase):
             self.assertEqual(binding.network_type, 'vlan')
             self.assertEqual(binding.physical_network, PHYS_NET)
             self.assertEqual(binding.segmentation_id, 1234)
+
+    def test_get_devices_details_list(self):
+        params = {'provider:network_type': 'vlan',
+                  'provider:physical_network': PHYS_NET,
+                  'provider:segmentation_id': 1234}
+        params['arg_list'] = tuple(params.keys())
+        callbacks = manager.NeutronManager.get_plugin().callbacks
+        with self.network(**params) as network:
+            with self.subnet(network) as subnet:
+                with contextlib.nested(
+                    self.port(subnet=subnet),
+                    self.port(subnet=subnet, admin_state_up=False)
+                ) as (port1, port2):
+                    port_ids = [port1['port']['id'], port2['port']['id']]
+                    entries = callbacks.get_devices_details_list(
+                        None, devices=port_ids + ['fake_device'],
+                        agent_id='fake_agent_id')
+                    self.assertEqual(port_ids + ['fake_device'],
+                                     [e['device'] for e in entries])
+                    self.assertNotIn('port_id', entries[2])
+                    self.assertEqual('vlan', entries[0]['network_type'])
+                    self.assertEqual(1234, entries[0]['segmentation_id'])
+                    self.assertFalse(entries[1]['admin_state_up'])
+                    self.assertEqual(
+                        ['ACTIVE', 'DOWN'],
+                        [ovs_db_v2.get_port(port_id).status
+                         for port_id in port_ids])
+
+    def test_set_ports_status_updated_at(self):
+        with self.port() as port:
+            port_id = port['port']['id']
+            now = datetime.datetime(2014, 2, 3, 10, 0)
+            timeutils.set_time_override(now)
+            self.addCleanup(timeutils.clear_time_override)
+            ovs_db_v2.set_ports_status([port_id], 'ACTIVE')
+            port_db = self.session.query(models_v2.Port).get(port_id)
+            self.assertEqual('ACTIVE', port_db.status)
+            self.assertEqual(now, port_db.updated_at)
@@ -19,6 +19,7 @@ import mock
 import testtools
 
 from neutron.agent.linux import ovs_lib
+from neutron.agent.linux import ovsdb_client
 from neutron.agent.linux import utils
 from neutron.openstack.common import jsonutils
 from neutron.openstack.common import uuidutils
@@ -242,6 +243,25 @@ class OVS_Lib_Test(base.BaseTestCase):
             root_helper=self.root_helper,
             process_input=None)
 
+    def test_delete_stale_flows(self):
+        self.br.flow_cookie = 0x2a
+        self.execute.return_value = (
+            'NXST_FLOW reply (xid=0x4):\n'
+            ' cookie=0x2a, duration=1s, table=0, priority=1 actions=NORMAL\n'
+            ' cookie=0x0, duration=9s, table=0, priority=0 actions=drop\n'
+            ' cookie=0x1f, duration=9s, table=0, priority=1 actions=NORMAL\n')
+        self.br.delete_stale_flows()
+        self.execute.assert_has_calls([
+            mock.call(["ovs-ofctl", "dump-flows", self.BR_NAME],
+                      process_input=None, root_helper=self.root_helper),
+            mock.call(["ovs-ofctl", "del-flows", self.BR_NAME,
+                       "cookie=0x0/-1"],
+                      process_input=None, root_helper=self.root_helper),
+            mock.call(["ovs-ofctl", "del-flows", self.BR_NAME,
+                       "cookie=0x1f/-1"],
+                      process_input=None, root_helper=self.root_helper)])
+        self.assertEqual(3, self.execute.call_count)
+
     def test_delete_flow(self):
         ofport = "5"
         lsw_id = 40
@@ -288,6 +308,110 @@ class OVS_Lib_Test(base.BaseTestCase):
             mock.call('del-flows', ['-'], 'deleted_flow_1\n')
         ])
 
+    def test_defer_apply_flows_in_order(self):
+        run_ofctl = mock.patch.object(self.br, 'run_ofctl').start()
+        self.br.defer_apply_on()
+        self.br.add_flow(priority=1, dl_vlan=1, actions='drop')
+        self.br.delete_flows(dl_vlan=1)
+        self.br.add_flow(priority=1, dl_vlan=1, actions='normal')
+        self.br.add_flow(priority=1, dl_vlan=2, actions='normal')
+        self.br.defer_apply_off()
+        run_ofctl.assert_has_calls([
+            mock.call('add-flows', ['-'],
+                      'hard_timeout=0,idle_timeout=0,priority=1,dl_vlan=1,'
+                      'actions=drop\n'),
+            mock.call('del-flows', ['-'], 'dl_vlan=1\n'),
+            mock.call('add-flows', ['-'],
+                      'hard_timeout=0,idle_timeout=0,priority=1,dl_vlan=1,'
+                      'actions=normal\n'
+                      'hard_timeout=0,idle_timeout=0,priority=1,dl_vlan=2,'
+                      'actions=normal\n')])
+        self.assertEqual(3, run_ofctl.call_count)
+
+    def test_add_flow_skips_programmed_flow(self):
+        run_ofctl = mock.patch.object(self.br, 'run_ofctl').start()
+        self.br.add_flow(priority=1, in_port=1, actions='normal')
+        self.br.add_flow(priority=1, in_port='1', actions='normal')
+        self.assertEqual(1, run_ofctl.call_count)
+        self.br.add_flow(priority=1, in_port=1, actions='drop')
+        self.assertEqual(2, run_ofctl.call_count)
+
+    def test_add_flow_after_delete(self):
+        run_ofctl = mock.patch.object(self.br, 'run_ofctl').start()
+        self.br.add_flow(priority=1, in_port=1, dl_vlan=3, actions='normal')
+        # The deletion selects the flow even if not all its fields match
+        self.br.delete_flows(in_port=1)
+        self.br.add_flow(priority=1, in_port=1, dl_vlan=3, actions='normal')
+        self.assertEqual(3, run_ofctl.call_count)
+
+    def test_add_flow_after_remove_all_flows(self):
+        run_ofctl = mock.patch.object(self.br, 'run_ofctl').start()
+        self.br.add_flow(priority=1, actions='normal')
+        self.br.remove_all_flows()
+        self.br.add_flow(priority=1, actions='normal')
+        self.assertEqual(3, run_ofctl.call_count)
+
+    def test_add_flow_after_clear_shadow_flows(self):
+        run_ofctl = mock.patch.object(self.br, 'run_ofctl').start()
+        self.br.add_flow(priority=1, actions='normal')
+        self.br.clear_shadow_flows()
+        self.br.add_flow(priority=1, actions='normal')
+        self.assertEqual(2, run_ofctl.call_count)
+
+    def test_shadow_flows_lost(self):
+        self.br.flow_cookie = 0x2a
+        self.assertFalse(self.br.shadow_flows_lost())
+        self.br.add_flow(priority=1, actions='normal')
+        self.execute.return_value = (
+            'NXST_FLOW reply (xid=0x4):\n'
+            ' cookie=0x2a, duration=1s, table=0, priority=1 actions=NORMAL\n')
+        self.assertFalse(self.br.shadow_flows_lost())
+        self.execute.return_value = 'NXST_FLOW reply (xid=0x4):\n'
+        self.assertTrue(self.br.shadow_flows_lost())
+
+    def test_add_flow_after_failure(self):
+        run_ofctl = mock.patch.object(self.br, 'run_ofctl',
+                                      return_value=None).start()
+        self.br.add_flow(priority=1, actions='normal')
+        self.br.add_flow(priority=1, actions='normal')
+        self.assertEqual(2, run_ofctl.call_count)
+
+    def test_add_flow_with_timeout(self):
+        run_ofctl = mock.patch.object(self.br, 'run_ofctl').start()
+        self.br.add_flow(priority=1, idle_timeout=10, actions='normal')
+        self.br.add_flow(priority=1, idle_timeout=10, actions='normal')
+        self.assertEqual(2, run_ofctl.call_count)
+
+    def test_mod_flow_skips_programmed_flow(self):
+        run_ofctl = mock.patch.object(self.br, 'run_ofctl').start()
+        self.br.mod_flow(table=2, dl_vlan=1, actions='output:1')
+        self.br.mod_flow(table=2, dl_vlan=1, actions='output:1')
+        self.assertEqual(1, run_ofctl.call_count)
+        self.br.mod_flow(table=2, dl_vlan=1, actions='output:1,output:2')
+        self.assertEqual(2, run_ofctl.call_count)
+
+    def test_mod_flow_selecting_other_flows(self):
+        run_ofctl = mock.patch.object(self.br, 'run_ofctl').start()
+        self.br.add_flow(table=2, dl_vlan=1, actions='output:1')
+        self.br.add_flow(table=2, dl_vlan=1, dl_dst='aa:bb:cc:dd:ee:ff',
+                         actions='output:2')
+        self.br.mod_flow(table=2, dl_vlan=1, actions='output:1')
+        self.assertEqual(3, run_ofctl.call_count)
+
+    def test_add_flow_with_cookie(self):
+        self.br.flow_cookie = 0x1234
+        self.br.add_flow(priority=1, actions='normal')
+        self.br.add_flow(priority=2, cookie=0, actions='drop')
+        self.execute.assert_has_calls([
+            mock.call(["ovs-ofctl", "add-flow", self.BR_NAME,
+                       "cookie=4660,hard_timeout=0,idle_timeout=0,"
+                       "priority=1,actions=normal"],
+                      process_input=None, root_helper=self.root_helper),
+            mock.call(["ovs-ofctl", "add-flow", self.BR_NAME,
+                       "cookie=0,hard_timeout=0,idle_timeout=0,"
+                       "priority=2,actions=drop"],
+                      process_input=None, root_helper=self.root_helper)])
+
     def test_add_tunnel_port(self):
         pname = "tap99"
         local_ip = "1.1.1.1"
@@ -338,8 +462,9 @@ class OVS_Lib_Test(base.BaseTestCase):
 
         # Each element is a tuple of (expected mock call, return_value)
         expected_calls_and_values = [
-            (mock.call(["ovs-vsctl", self.TO, "add-port",
-                        self.BR_NAME, pname], root_helper=self.root_helper),
+            (mock.call(["ovs-vsctl", self.TO, "--", "--may-exist",
+                        "add-port", self.BR_NAME, pname],
+                       root_helper=self.root_helper),
              None),
             (mock.call(["ovs-vsctl", self.TO, "set", "Interface",
                         pname, "type=patch"], root_helper=self.root_helper),
@@ -415,8 +540,13 @@ class OVS_Lib_Test(base.BaseTestCase):
                     ovs_row.append(cell)
                 elif isinstance(cell, dict):
                     ovs_row.append(["map", cell.items()])
+                elif isinstance(cell, int):
+                    ovs_row.append(cell)
+                elif isinstance(cell, list):
+                    ovs_row.append(["set", cell])
                 else:
-                    raise TypeError('%r not str or dict' % type(cell))
+                    raise TypeError('%r not str, dict, int or list' %
+                                    type(cell))
         return jsonutils.dumps(r)
 
     def _test_get_vif_port_set(self, is_xen):
@@ -501,6 +631,27 @@ class OVS_Lib_Test(base.BaseTestCase):
         self.assertEqual(set(), self.br.get_vif_port_set())
         tools.verify_mock_calls(self.execute, expected_calls_and_values)
 
+    def test_get_ports_tag_and_other_config(self):
+        headings = ['name', 'tag', 'other_config']
+        data = [['tap99', 5, {'net_uuid': 'net1'}],
+                ['tap88', 6, {'net_uuid': 'net2'}],
+                ['tun22', [], {}]]
+        expected_calls_and_values = [
+            (mock.call(["ovs-vsctl", self.TO, "list-ports", self.BR_NAME],
+                       root_helper=self.root_helper),
+             'tap99\ntun22'),
+            (mock.call(["ovs-vsctl", self.TO, "--format=json",
+                        "--", "--columns=name,tag,other_config",
+                        "list", "Port"],
+                       root_helper=self.root_helper),
+             self._encode_ovs_json(headings, data)),
+        ]
+        tools.setup_mock_calls(self.execute, expected_calls_and_values)
+        self.assertEqual({'tap99': (5, {'net_uuid': 'net1'}),
+                          'tun22': (None, {})},
+                         self.br.get_ports_tag_and_other_config())
+        tools.verify_mock_calls(self.execute, expected_calls_and_values)
+
     def test_clear_db_attribute(self):
         pname = "tap77"
         self.br.clear_db_attribute("Port", pname, "tag")
@@ -587,3 +738,110 @@ class OVS_Lib_Test(base.BaseTestCase):
                         return_value=mock.Mock(address=None)):
             with testtools.ExpectedException(Exception):
                 self.br.get_local_port_mac()
+
+
+class OVS_Lib_Native_Test(base.BaseTestCase):
+    """Test the OVSBridge methods reading the replica of the native client."""
+
+    def setUp(self):
+        super(OVS_Lib_Native_Test, self).setUp()
+        self.br = ovs_lib.OVSBridge('br-int', 'sudo')
+        self.execute = mock.patch.object(utils, "execute").start()
+        self.ovsdb = ovsdb_client.OvsdbClient('unix:/db.sock')
+        self.ovsdb.connected = True
+        mock.patch.object(ovsdb_client, 'get_client',
+                          return_value=self.ovsdb).start()
+        self.addCleanup(mock.patch.stopall)
+        self.ovsdb._apply_updates({
+            'Bridge': {
+                'br1': {'new': {'name': 'br-int',
+                                'ports': ['set', [['uuid', 'p1'],
+                                                  ['uuid', 'p2']]]}},
+                'br2': {'new': {'name': 'br-tun',
+                                'ports': ['uuid', 'p3']}}},
+            'Port': {
+                'p1': {'new': {'name': 'tap1', 'interfaces': 'i1'}},
+                'p2': {'new': {'name': 'patch-tun', 'interfaces': 'i2'}},
+                'p3': {'new': {'name': 'tap3', 'interfaces': 'i3'}}},
+            'Interface': {
+                'i1': {'new': {'name': 'tap1', 'ofport': 1,
+                               'external_ids': ['map', [
+                                   ['iface-id', 'id1'],
+                                   ['attached-mac', 'fa:16:3e:00:00:01']]]}},
+                'i2': {'new': {'name': 'patch-tun', 'ofport': 2,
+                               'external_ids': ['map', []]}},
+                'i3': {'new': {'name': 'tap3', 'ofport': ['set', []],
+                               'external_ids': ['map', [
+                                   ['iface-id', 'id3'],
+                                   ['attached-mac', 'fa:16:3e:00:00:03']]]}}},
+        })
+
+    def test_get_port_name_list(self):
+        self.assertEqual(['patch-tun', 'tap1'], self.br.get_port_name_list())
+        self.assertFalse(self.execute.called)
+
+    def test_db_get_map(self):
+        self.assertEqual({'iface-id': 'id1',
+                          'attached-mac': 'fa:16:3e:00:00:01'},
+                         self.br.db_get_map('Interface', 'tap1',
+                                            'external_ids'))
+        self.assertEqual({}, self.br.db_get_map('Interface', 'tap2',
+                                                'external_ids'))
+        self.assertFalse(self.execute.called)
+
+    def test_db_get_map_unmonitored_column(self):
+        self.execute.return_value = '{rx_packets=3}'
+        self.assertEqual({'rx_packets': '3'}, self.br.get_port_stats('tap1'))
+        self.execute.assert_called_once_with(
+            ["ovs-vsctl", "--timeout=2", "get", "Interface", "tap1",
+             "statistics"], root_helper='sudo')
+
+    def test_get_vif_ports(self):
+        ports = self.br.get_vif_ports()
+        self.assertEqual(1, len(ports))
+        self.assertEqual('tap1', ports[0].port_name)
+        self.assertEqual('1', ports[0].ofport)
+        self.assertEqual('id1', ports[0].vif_id)
+        self.assertEqual('fa:16:3e:00:00:01', ports[0].vif_mac)
+        self.assertFalse(self.execute.called)
+
+    def test_get_vif_port_set(self):
+        self.assertEqual(set(['id1']), self.br.get_vif_port_set())
+        self.assertFalse(self.execute.called)
+
+    def test_get_vif_port_by_id(self):
+        port = self.br.get_vif_port_by_id('id1')
+        self.assertEqual('tap1', port.port_name)
+        self.assertEqual(1, port.ofport)
+        self.assertEqual('fa:16:3e:00:00:01', port.vif_mac)
+        # No ofport assigned yet
+        self.assertIsNone(self.br.get_vif_port_by_id('id3'))
+        self.assertIsNone(self.br.get_vif_port_by_id('id4'))
+        self.assertFalse(self.execute.called)
+
+    def test_set_db_attribute(self):
+        with mock.patch.object(self.ovsdb, 'set_column',
+                               return_value=True) as set_column:
+            self.br.set_db_attribute('Port', 'tap1', 'tag', 5)
+        set_column.assert_called_once_with('Port', 'tap1', 'tag', 5)
+        self.assertFalse(self.execute.called)
+
+    def test_set_db_attribute_falls_back_to_vsctl(self):
+        with mock.patch.object(self.ovsdb, 'set_column', return_value=False):
+            self.br.set_db_attribute('Open_vSwitch', '.',
+                                     'other_config:foo', 'bar')
+        self.execute.assert_called_once_with(
+            ["ovs-vsctl", "--timeout=2", "set", "Open_vSwitch", ".",
+             "other_config:foo=bar"], root_helper='sudo')
+
+    def test_set_db_attribute_connection_lost(self):
+        def set_column(*args):
+            self.ovsdb.connected = False
+            raise ovsdb_client.OvsdbError()
+
+        with mock.patch.object(self.ovsdb, 'set_column',
+                               side_effect=set_column):
+            self.br.set_db_attribute('Port', 'tap1', 'tag', 5)
+        self.execute.assert_called_once_with(
+            ["ovs-vsctl", "--timeout=2", "set", "Port", "tap1", "tag=5"],
+            root_helper='sudo')
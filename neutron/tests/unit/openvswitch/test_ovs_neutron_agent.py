@@ -23,6 +23,7 @@ import testtools
 
 from neutron.agent.linux import ip_lib
 from neutron.agent.linux import ovs_lib
+from neutron.agent.linux import ovsdb_monitor
 from neutron.agent.linux import utils
 from neutron.common import constants as n_const
 from neutron.openstack.common.rpc import common as rpc_common
@@ -144,6 +145,49 @@ class TestOvsNeutronAgent(base.BaseTestCase):
     def test_port_bound_ignores_flows_for_invalid_ofport(self):
         self._mock_port_bound(ofport=-1)
 
+    def test_port_bound_records_net_uuid(self):
+        port = mock.Mock(port_name='tap1', ofport=1)
+        with mock.patch.object(self.agent.int_br,
+                               'set_db_attribute') as set_db_attribute:
+            self.agent.port_bound(port, 'my-net-uuid', 'local', None, None)
+        lvid = self.agent.local_vlan_map['my-net-uuid'].vlan
+        set_db_attribute.assert_has_calls([
+            mock.call('Port', 'tap1', 'tag', str(lvid)),
+            mock.call('Port', 'tap1', 'other_config:net_uuid',
+                      'my-net-uuid')])
+
+    def test_restore_local_vlan_hints(self):
+        ports = {'tap1': (10, {'net_uuid': 'net1'}),
+                 'tap2': (10, {'net_uuid': 'net1'}),
+                 'tap3': (10, {'net_uuid': 'net2'}),
+                 'tap4': (None, {}),
+                 'tap5': (int(ovs_neutron_agent.DEAD_VLAN_TAG),
+                          {'net_uuid': 'net3'})}
+        with mock.patch.object(self.agent.int_br,
+                               'get_ports_tag_and_other_config',
+                               return_value=ports):
+            self.agent.restore_local_vlan_hints()
+        self.assertEqual({'net1': 10}, self.agent.local_vlan_hints)
+        self.assertNotIn(10, self.agent.available_local_vlans)
+
+        self.agent.provision_local_vlan('net1', 'local', None, None)
+        self.assertEqual(10, self.agent.local_vlan_map['net1'].vlan)
+        self.assertEqual({}, self.agent.local_vlan_hints)
+        self.agent.provision_local_vlan('net2', 'local', None, None)
+        self.assertNotEqual(10, self.agent.local_vlan_map['net2'].vlan)
+
+    def test_cleanup_stale_flows(self):
+        self.agent.stale_flows_pending = True
+        self.agent.local_vlan_hints = {'net1': 10}
+        self.agent.available_local_vlans.remove(10)
+        with mock.patch.object(self.agent.int_br,
+                               'delete_stale_flows') as delete_stale_flows:
+            self.agent.cleanup_stale_flows()
+        delete_stale_flows.assert_called_once_with()
+        self.assertFalse(self.agent.stale_flows_pending)
+        self.assertEqual({}, self.agent.local_vlan_hints)
+        self.assertIn(10, self.agent.available_local_vlans)
+
     def test_port_dead(self):
         with mock.patch('neutron.agent.linux.ovs_lib.OVSBridge.'
                         'set_db_attribute',
@@ -168,10 +212,156 @@ class TestOvsNeutronAgent(base.BaseTestCase):
         actual = self.mock_update_ports(vif_port_set, registered_ports)
         self.assertEqual(expected, actual)
 
+    def _event(self, action, port_id, name=None, ofport=1):
+        return {'action': action, 'name': name or 'tap-%s' % port_id,
+                'ofport': ofport,
+                'external_ids': {'iface-id': port_id,
+                                 'attached-mac': 'fa:16:3e:00:00:01'}}
+
+    def mock_update_ports_from_events(self, events, registered_ports,
+                                      bridge_ports=None):
+        if bridge_ports is None:
+            bridge_ports = [event['name'] for event in events]
+        with mock.patch.object(self.agent.int_br, 'get_port_name_list',
+                               return_value=bridge_ports):
+            return self.agent.update_ports_from_events(events,
+                                                       registered_ports)
+
+    def test_update_ports_from_events(self):
+        events = [self._event(ovsdb_monitor.INTERFACE_ADDED, 'p3'),
+                  self._event(ovsdb_monitor.INTERFACE_REMOVED, 'p2'),
+                  # Already registered
+                  self._event(ovsdb_monitor.INTERFACE_UPDATED, 'p1')]
+        expected = dict(current=set(['p1', 'p3']), added=set(['p3']),
+                        removed=set(['p2']))
+        self.assertEqual(expected, self.mock_update_ports_from_events(
+            events, set(['p1', 'p2'])))
+
+    def test_update_ports_from_events_returns_none_for_no_change(self):
+        events = [self._event(ovsdb_monitor.INTERFACE_UPDATED, 'p1'),
+                  self._event(ovsdb_monitor.INTERFACE_REMOVED, 'p2')]
+        self.assertIsNone(self.mock_update_ports_from_events(
+            events, set(['p1'])))
+
+    def test_update_ports_from_events_ignores_other_interfaces(self):
+        events = [self._event(ovsdb_monitor.INTERFACE_ADDED, 'p1'),
+                  # On another bridge
+                  self._event(ovsdb_monitor.INTERFACE_ADDED, 'p2'),
+                  # Without ofport yet
+                  self._event(ovsdb_monitor.INTERFACE_ADDED, 'p3',
+                              ofport=[]),
+                  {'action': ovsdb_monitor.INTERFACE_ADDED, 'name': 'tun',
+                   'ofport': 3, 'external_ids': {}}]
+        expected = dict(current=set(['p1']), added=set(['p1']),
+                        removed=set())
+        self.assertEqual(expected, self.mock_update_ports_from_events(
+            events, set(), bridge_ports=['tap-p1', 'tap-p3', 'tun']))
+
+    def test_update_ports_from_events_port_plugged_again(self):
+        events = [self._event(ovsdb_monitor.INTERFACE_REMOVED, 'p1'),
+                  self._event(ovsdb_monitor.INTERFACE_ADDED, 'p1', ofport=2),
+                  self._event(ovsdb_monitor.INTERFACE_ADDED, 'p2'),
+                  self._event(ovsdb_monitor.INTERFACE_REMOVED, 'p2')]
+        expected = dict(current=set(['p1']), added=set(['p1']),
+                        removed=set())
+        self.assertEqual(expected, self.mock_update_ports_from_events(
+            events, set(['p1'])))
+
+    def test_update_ports_from_events_xen_port(self):
+        events = [{'action': ovsdb_monitor.INTERFACE_ADDED, 'name': 'vif1',
+                   'ofport': 1,
+                   'external_ids': {'xs-vif-uuid': 'uuid',
+                                    'attached-mac': 'fa:16:3e:00:00:01'}}]
+        with mock.patch.object(self.agent, 'update_ports') as update_ports:
+            self.assertEqual(update_ports.return_value,
+                             self.agent.update_ports_from_events(
+                                 events, set(['p1'])))
+        update_ports.assert_called_once_with(set(['p1']))
+
+    def _test_rpc_loop(self, events, rescan_interval=60):
+        self.agent.port_rescan_interval = rescan_interval
+        pm = mock.Mock()
+        pm.is_polling_required = True
+        pm.get_events.side_effect = events
+        pm.wait_for_updates.side_effect = [None, RuntimeError('stop')]
+        with contextlib.nested(
+            mock.patch.object(self.agent, 'update_ports',
+                              return_value=None),
+            mock.patch.object(self.agent, 'update_ports_from_events',
+                              return_value=None),
+        ) as (update_ports, update_ports_from_events):
+            self.assertRaises(RuntimeError, self.agent.rpc_loop, pm)
+        return update_ports, update_ports_from_events
+
+    def test_rpc_loop_processes_events(self):
+        events = [self._event(ovsdb_monitor.INTERFACE_ADDED, 'p1')]
+        update_ports, update_ports_from_events = self._test_rpc_loop(
+            [events, events])
+        # The first iteration is a full sync
+        update_ports.assert_called_once_with(set())
+        update_ports_from_events.assert_called_once_with(events, set())
+
+    def test_rpc_loop_rescans_periodically(self):
+        update_ports, update_ports_from_events = self._test_rpc_loop(
+            [[], []], rescan_interval=0)
+        self.assertEqual(2, update_ports.call_count)
+        self.assertFalse(update_ports_from_events.called)
+
+    def test_rpc_loop_cleans_up_stale_flows_after_full_sync(self):
+        self.agent.stale_flows_pending = True
+        with mock.patch.object(self.agent,
+                               'cleanup_stale_flows') as cleanup_stale_flows:
+            self._test_rpc_loop([[], []])
+        cleanup_stale_flows.assert_called_once_with()
+
+    def test_rpc_loop_keeps_stale_flows_on_resync(self):
+        self.agent.stale_flows_pending = True
+        with contextlib.nested(
+            mock.patch.object(self.agent, 'cleanup_stale_flows'),
+            mock.patch.object(self.agent, 'process_network_ports',
+                              return_value=True)
+        ) as (cleanup_stale_flows, process_network_ports):
+            self.agent.port_rescan_interval = 60
+            pm = mock.Mock()
+            pm.is_polling_required = True
+            pm.get_events.return_value = []
+            pm.wait_for_updates.side_effect = [None, RuntimeError('stop')]
+            with mock.patch.object(self.agent, 'update_ports',
+                                   return_value={'current': set(['p1']),
+                                                 'added': set(['p1'])}):
+                self.assertRaises(RuntimeError, self.agent.rpc_loop, pm)
+        self.assertEqual(2, process_network_ports.call_count)
+        self.assertFalse(cleanup_stale_flows.called)
+
+    def test_rpc_loop_clears_shadow_flows_on_resync(self):
+        with mock.patch.object(self.agent.int_br,
+                               'clear_shadow_flows') as clear_shadow_flows:
+            self._test_rpc_loop([[], []])
+        # Only the first iteration is a full sync
+        clear_shadow_flows.assert_called_once_with()
+
+    def test_rpc_loop_resyncs_when_flows_lost(self):
+        with contextlib.nested(
+            mock.patch.object(self.agent.int_br, 'shadow_flows_lost',
+                              return_value=True),
+            mock.patch.object(self.agent.int_br, 'clear_shadow_flows')
+        ) as (shadow_flows_lost, clear_shadow_flows):
+            update_ports, update_ports_from_events = self._test_rpc_loop(
+                [[], []], rescan_interval=0)
+        self.assertEqual(2, clear_shadow_flows.call_count)
+        update_ports.assert_has_calls([mock.call(set()), mock.call(set())])
+
+    def test_rpc_loop_rescans_unknown_changes(self):
+        update_ports, update_ports_from_events = self._test_rpc_loop(
+            [[], None])
+        self.assertEqual(2, update_ports.call_count)
+        self.assertFalse(update_ports_from_events.called)
+
     def test_treat_devices_added_returns_true_for_missing_device(self):
-        with mock.patch.object(self.agent.plugin_rpc, 'get_device_details',
+        with mock.patch.object(self.agent.plugin_rpc,
+                               'get_devices_details_list',
                                side_effect=Exception()):
-            self.assertTrue(self.agent.treat_devices_added([{}]))
+            self.assertTrue(self.agent.treat_devices_added(['tap1']))
 
     def _mock_treat_devices_added(self, details, port, func_name):
         """Mock treat devices added.
@@ -182,27 +372,29 @@ class TestOvsNeutronAgent(base.BaseTestCase):
         :returns: whether the named function was called
         """
         with contextlib.nested(
-            mock.patch.object(self.agent.plugin_rpc, 'get_device_details',
-                              return_value=details),
+            mock.patch.object(self.agent.plugin_rpc,
+                              'get_devices_details_list',
+                              return_value=[details]),
             mock.patch.object(self.agent.int_br, 'get_vif_port_by_id',
                               return_value=port),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_up'),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              return_value={'failed_devices_up': []}),
             mock.patch.object(self.agent, func_name)
-        ) as (get_dev_fn, get_vif_func, upd_dev_up, func):
-            self.assertFalse(self.agent.treat_devices_added([{}]))
+        ) as (get_dev_fn, get_vif_func, upd_dev_list, func):
+            self.assertFalse(self.agent.treat_devices_added(['tap1']))
         return func.called
 
     def test_treat_devices_added_ignores_invalid_ofport(self):
         port = mock.Mock()
         port.ofport = -1
-        self.assertFalse(self._mock_treat_devices_added(mock.MagicMock(), port,
-                                                        'port_dead'))
+        self.assertFalse(self._mock_treat_devices_added({'device': 'tap1'},
+                                                        port, 'port_dead'))
 
     def test_treat_devices_added_marks_unknown_port_as_dead(self):
         port = mock.Mock()
         port.ofport = 1
-        self.assertTrue(self._mock_treat_devices_added(mock.MagicMock(), port,
-                                                       'port_dead'))
+        self.assertTrue(self._mock_treat_devices_added({'device': 'tap1'},
+                                                       port, 'port_dead'))
 
     def test_treat_devices_added_updates_known_port(self):
         details = mock.MagicMock()
@@ -211,18 +403,95 @@ class TestOvsNeutronAgent(base.BaseTestCase):
                                                        mock.Mock(),
                                                        'treat_vif_port'))
 
+    def test_treat_devices_added_in_batches(self):
+        self.agent.rpc_device_batch_size = 2
+        devices = ['tap1', 'tap2', 'tap3']
+        details = dict((device, {'device': device, 'port_id': device,
+                                 'network_id': 'net', 'network_type': 'vlan',
+                                 'physical_network': 'physnet',
+                                 'segmentation_id': 1,
+                                 'admin_state_up': True})
+                       for device in devices)
+        with contextlib.nested(
+            mock.patch.object(self.agent.plugin_rpc,
+                              'get_devices_details_list',
+                              side_effect=lambda ctx, batch, agent_id: [
+                                  details[device] for device in batch]),
+            mock.patch.object(self.agent.int_br, 'get_vif_port_by_id'),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              return_value={'failed_devices_up': []}),
+            mock.patch.object(self.agent, 'treat_vif_port')
+        ) as (get_dev_fn, get_vif_func, upd_dev_list, treat_vif_port):
+            self.assertFalse(self.agent.treat_devices_added(devices))
+        self.assertEqual([mock.call(self.agent.context, ['tap1', 'tap2'],
+                                    self.agent.agent_id),
+                          mock.call(self.agent.context, ['tap3'],
+                                    self.agent.agent_id)],
+                         get_dev_fn.call_args_list)
+        self.assertEqual([mock.call(self.agent.context, ['tap1', 'tap2'], [],
+                                    self.agent.agent_id, cfg.CONF.host),
+                          mock.call(self.agent.context, ['tap3'], [],
+                                    self.agent.agent_id, cfg.CONF.host)],
+                         upd_dev_list.call_args_list)
+        self.assertEqual(3, treat_vif_port.call_count)
+
+    def test_treat_devices_added_defers_flows(self):
+        details = {'device': 'tap1', 'port_id': 'tap1', 'network_id': 'net',
+                   'network_type': 'local', 'physical_network': None,
+                   'segmentation_id': None, 'admin_state_up': True}
+        parent = mock.Mock()
+        with contextlib.nested(
+            mock.patch.object(self.agent.plugin_rpc,
+                              'get_devices_details_list',
+                              return_value=[details]),
+            mock.patch.object(self.agent.int_br, 'get_vif_port_by_id'),
+            mock.patch.object(self.agent.int_br, 'defer_apply_on'),
+            mock.patch.object(self.agent.int_br, 'defer_apply_off'),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              return_value={'failed_devices_up': []}),
+            mock.patch.object(self.agent, 'treat_vif_port')
+        ) as (get_dev_fn, get_vif_func, defer_on, defer_off, upd_dev_list,
+              treat_vif_port):
+            parent.attach_mock(defer_on, 'defer_apply_on')
+            parent.attach_mock(treat_vif_port, 'treat_vif_port')
+            parent.attach_mock(defer_off, 'defer_apply_off')
+            parent.attach_mock(upd_dev_list, 'update_device_list')
+            self.agent.treat_devices_added(['tap1'])
+        self.assertEqual(['defer_apply_on', 'treat_vif_port',
+                          'defer_apply_off', 'update_device_list'],
+                         [call[0] for call in parent.mock_calls])
+
+    def test_treat_devices_added_returns_true_for_failed_update(self):
+        with contextlib.nested(
+            mock.patch.object(self.agent.plugin_rpc,
+                              'get_devices_details_list',
+                              return_value=[{'device': 'tap1',
+                                             'port_id': 'tap1',
+                                             'network_id': 'net',
+                                             'network_type': 'local',
+                                             'physical_network': None,
+                                             'segmentation_id': None,
+                                             'admin_state_up': True}]),
+            mock.patch.object(self.agent.int_br, 'get_vif_port_by_id'),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              return_value={'failed_devices_up': ['tap1']}),
+            mock.patch.object(self.agent, 'treat_vif_port')
+        ):
+            self.assertTrue(self.agent.treat_devices_added(['tap1']))
+
     def test_treat_devices_removed_returns_true_for_missing_device(self):
-        with mock.patch.object(self.agent.plugin_rpc, 'update_device_down',
+        with mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
                                side_effect=Exception()):
-            self.assertTrue(self.agent.treat_devices_removed([{}]))
+            self.assertTrue(self.agent.treat_devices_removed(['tap1']))
 
     def _mock_treat_devices_removed(self, port_exists):
-        details = dict(exists=port_exists)
-        with mock.patch.object(self.agent.plugin_rpc, 'update_device_down',
-                               return_value=details):
+        details = dict(device='tap1', exists=port_exists)
+        with mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                               return_value={'devices_down': [details],
+                                             'failed_devices_down': []}):
             with mock.patch.object(self.agent, 'port_unbound') as port_unbound:
-                self.assertFalse(self.agent.treat_devices_removed([{}]))
-        self.assertTrue(port_unbound.called)
+                self.assertFalse(self.agent.treat_devices_removed(['tap1']))
+        port_unbound.assert_called_once_with('tap1')
 
     def test_treat_devices_removed_unbinds_port(self):
         self._mock_treat_devices_removed(True)
@@ -230,6 +499,14 @@ class TestOvsNeutronAgent(base.BaseTestCase):
     def test_treat_devices_removed_ignores_missing_port(self):
         self._mock_treat_devices_removed(False)
 
+    def test_treat_devices_removed_keeps_failed_port(self):
+        with mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                               return_value={'devices_down': [],
+                                             'failed_devices_down': ['tap1']}):
+            with mock.patch.object(self.agent, 'port_unbound') as port_unbound:
+                self.assertTrue(self.agent.treat_devices_removed(['tap1']))
+        self.assertFalse(port_unbound.called)
+
     def test_process_network_ports(self):
         reply = {'current': set(['tap0']),
                  'removed': set(['eth0']),
@@ -246,6 +523,8 @@ class TestOvsNeutronAgent(base.BaseTestCase):
         with mock.patch.object(self.agent.state_rpc,
                                "report_state") as report_st:
             self.agent.int_br_device_count = 5
+            self.agent.sg_agent.get_refresh_state.return_value = {
+                'firewall_refreshes_requested': 0}
             self.agent._report_state()
             report_st.assert_called_with(self.agent.context,
                                          self.agent.agent_state)
@@ -254,6 +533,9 @@ class TestOvsNeutronAgent(base.BaseTestCase):
                 self.agent.agent_state["configurations"]["devices"],
                 self.agent.int_br_device_count
             )
+            self.assertEqual(
+                0, self.agent.agent_state["configurations"][
+                    "firewall_refreshes_requested"])
 
     def test_network_delete(self):
         with contextlib.nested(
@@ -366,6 +648,30 @@ class TestOvsNeutronAgent(base.BaseTestCase):
             self.assertEqual(self.agent.phys_ofports["physnet1"],
                              "int_ofport")
 
+    def test_setup_physical_bridges_graceful_restart(self):
+        self.agent.graceful_restart = True
+        with contextlib.nested(
+            mock.patch.object(ip_lib, "device_exists", return_value=True),
+            mock.patch.object(ovs_lib.OVSBridge, "remove_all_flows"),
+            mock.patch.object(ovs_lib.OVSBridge, "add_flow"),
+            mock.patch.object(ovs_lib.OVSBridge, "add_port",
+                              return_value="phys_ofport"),
+            mock.patch.object(ovs_lib.OVSBridge, "delete_port"),
+            mock.patch.object(self.agent.int_br, "add_port",
+                              return_value="int_ofport"),
+            mock.patch.object(ip_lib.IPWrapper, "add_veth"),
+            mock.patch.object(ip_lib.IpLinkCommand, "set_up")
+        ) as (devex_fn, remflows_fn, ovs_addfl_fn, ovs_addport_fn,
+              ovs_delport_fn, br_addport_fn, addveth_fn, linkset_fn):
+            self.agent.setup_physical_bridges({"physnet1": "br-eth"})
+        self.assertFalse(remflows_fn.called)
+        self.assertFalse(ovs_delport_fn.called)
+        self.assertFalse(addveth_fn.called)
+        self.assertEqual(self.agent.flow_cookie,
+                         self.agent.phys_brs["physnet1"].flow_cookie)
+        self.assertEqual("int_ofport", self.agent.int_ofports["physnet1"])
+        self.assertEqual("phys_ofport", self.agent.phys_ofports["physnet1"])
+
     def test_port_unbound(self):
         with mock.patch.object(self.agent, "reclaim_local_vlan") as reclvl_fn:
             self.agent.enable_tunneling = True
@@ -30,11 +30,12 @@ from neutron.tests import base
 
 class rpcApiTestCase(base.BaseTestCase):
 
-    def _test_ovs_api(self, rpcapi, topic, method, rpc_method, **kwargs):
+    def _test_ovs_api(self, rpcapi, topic, method, rpc_method, version=None,
+                      **kwargs):
         ctxt = context.RequestContext('fake_user', 'fake_project')
         expected_retval = 'foo' if method == 'call' else None
         expected_msg = rpcapi.make_msg(method, **kwargs)
-        expected_msg['version'] = rpcapi.BASE_RPC_API_VERSION
+        expected_msg['version'] = version or rpcapi.BASE_RPC_API_VERSION
         if rpc_method == 'cast' and method == 'run_instance':
             kwargs['call'] = False
 
@@ -118,3 +119,21 @@ class rpcApiTestCase(base.BaseTestCase):
                            device='fake_device',
                            agent_id='fake_agent_id',
                            host='fake_host')
+
+    def test_devices_details_list(self):
+        rpcapi = agent_rpc.PluginApi(topics.PLUGIN)
+        self._test_ovs_api(rpcapi, topics.PLUGIN,
+                           'get_devices_details_list', rpc_method='call',
+                           version=rpcapi.DEVICE_LIST_RPC_API_VERSION,
+                           devices=['fake_device1', 'fake_device2'],
+                           agent_id='fake_agent_id')
+
+    def test_update_device_list(self):
+        rpcapi = agent_rpc.PluginApi(topics.PLUGIN)
+        self._test_ovs_api(rpcapi, topics.PLUGIN,
+                           'update_device_list', rpc_method='call',
+                           version=rpcapi.DEVICE_LIST_RPC_API_VERSION,
+                           devices_up=['fake_device1'],
+                           devices_down=['fake_device2'],
+                           agent_id='fake_agent_id',
+                           host='fake_host')
@@ -418,6 +418,8 @@ class TunnelTest(base.BaseTestCase):
         self.mock_int_bridge_expected += [
             mock.call.set_db_attribute('Port', VIF_PORT.port_name,
                                        'tag', str(LVM.vlan)),
+            mock.call.set_db_attribute('Port', VIF_PORT.port_name,
+                                       'other_config:net_uuid', NET_UUID),
             mock.call.delete_flows(in_port=VIF_PORT.ofport)
         ]
 
@@ -535,6 +537,11 @@ class TunnelTest(base.BaseTestCase):
             mock.call(set()),
             mock.call(set(['tap0']))
         ])
+        # The full sync of the first iteration programs all the flows again
+        for expected in (self.mock_int_bridge_expected,
+                         self.mock_map_tun_bridge_expected,
+                         self.mock_tun_bridge_expected):
+            expected.append(mock.call.clear_shadow_flows())
         process_network_ports.assert_has_calls([
             mock.call({'current': set(['tap0']),
                        'removed': set([]),
@@ -19,11 +19,21 @@
 Test cases for  Neutron PLUMgrid Plug-in
 """
 
+import contextlib
+
 import mock
+import netaddr
+from oslo.config import cfg
+import webob.exc
 
+from neutron import context as n_context
 from neutron.extensions import portbindings
 from neutron.manager import NeutronManager
 from neutron.openstack.common import importutils
+from neutron.plugins.plumgrid.common import exceptions as plum_excep
+from neutron.plugins.plumgrid.common import outbox
+from neutron.plugins.plumgrid.common import sync
+from neutron.plugins.plumgrid.db import outbox_db
 from neutron.plugins.plumgrid.plumgrid_plugin import plumgrid_plugin
 from neutron.tests.unit import _test_extension_portbindings as test_bindings
 from neutron.tests.unit import test_db_plugin as test_plugin
@@ -54,6 +64,9 @@ class PLUMgridPluginV2TestCase(test_plugin.NeutronDbPluginV2TestCase):
                                         director_username,
                                         director_password)
 
+        patch_sync = mock.patch.object(sync, '_start_loopingcall')
+        patch_sync.start()
+        self.addCleanup(patch_sync.stop)
         with mock.patch.object(plumgrid_plugin.NeutronPluginPLUMgridV2,
                                'plumgrid_init', new=mocked_plumlib_init):
             super(PLUMgridPluginV2TestCase, self).setUp(self._plugin_name)
@@ -64,7 +77,19 @@ class PLUMgridPluginV2TestCase(test_plugin.NeutronDbPluginV2TestCase):
 
 class TestPlumgridPluginNetworksV2(test_plugin.TestNetworksV2,
                                    PLUMgridPluginV2TestCase):
-    pass
+    def test_create_networks_bulk_director_failure(self):
+        plugin = NeutronManager.get_plugin()
+        with contextlib.nested(
+            mock.patch.object(plugin._plumlib, 'create_network',
+                              side_effect=[None, Exception]),
+            mock.patch.object(plugin._plumlib, 'delete_network')
+        ) as (create_network, delete_network):
+            res = self._create_network_bulk(self.fmt, 2, 'test', True)
+            self._validate_behavior_on_bulk_failure(
+                res, 'networks', webob.exc.HTTPInternalServerError.code)
+            self.assertEqual(create_network.call_count, 2)
+            # The network created in the Director is deleted
+            self.assertEqual(delete_network.call_count, 1)
 
 
 class TestPlumgridV2HTTPResponse(test_plugin.TestV2HTTPResponse,
@@ -77,6 +102,43 @@ class TestPlumgridPluginPortsV2(test_plugin.TestPortsV2,
     def test_range_allocation(self):
         self.skipTest("Plugin does not support Neutron allocation process")
 
+    def test_create_ports_bulk_emulated_plugin_failure(self):
+        self.skipTest("Plugin does not create bulk ports with create_port")
+
+    def test_create_ports_bulk_native_plugin_failure(self):
+        # Bulk creation does not go through create_port: the failure is
+        # injected in the Director call instead
+        plugin = NeutronManager.get_plugin()
+        with mock.patch.object(plugin._plumlib, 'create_ports',
+                               side_effect=Exception):
+            with self.network() as net:
+                res = self._create_port_bulk(self.fmt, 2,
+                                             net['network']['id'],
+                                             'test', True)
+                self._validate_behavior_on_bulk_failure(
+                    res, 'ports', webob.exc.HTTPInternalServerError.code)
+
+    def test_create_ports_bulk_single_director_call(self):
+        plugin = NeutronManager.get_plugin()
+        with contextlib.nested(
+            mock.patch.object(plugin._plumlib, 'create_ports'),
+            mock.patch.object(plugin._plumlib, 'create_port')
+        ) as (create_ports, create_port):
+            with self.network() as net:
+                res = self._create_port_bulk(self.fmt, 3,
+                                             net['network']['id'],
+                                             'test', True)
+                ports = self.deserialize(self.fmt, res)['ports']
+                self.assertEqual(create_ports.call_count, 1)
+                self.assertFalse(create_port.called)
+                port_list = create_ports.call_args[0][0]
+                self.assertEqual([p['id'] for p, r in port_list],
+                                 [p['id'] for p in ports])
+                for p in ports:
+                    self.assertEqual(p[portbindings.VIF_TYPE],
+                                     portbindings.VIF_TYPE_IOVISOR)
+                    self._delete('ports', p['id'])
+
 
 class TestPlumgridPluginSubnetsV2(test_plugin.TestSubnetsV2,
                                   PLUMgridPluginV2TestCase):
@@ -93,6 +155,22 @@ class TestPlumgridPluginSubnetsV2(test_plugin.TestSubnetsV2,
     def test_update_subnet_gateway_in_allocation_pool_returns_409(self):
         self.skipTest("Plugin does not support Neutron allocation process")
 
+    def test_create_subnets_bulk_director_failure(self):
+        plugin = NeutronManager.get_plugin()
+        with contextlib.nested(
+            mock.patch.object(plugin._plumlib, 'create_subnet',
+                              side_effect=[None, Exception]),
+            mock.patch.object(plugin._plumlib, 'delete_subnet')
+        ) as (create_subnet, delete_subnet):
+            with self.network() as net:
+                res = self._create_subnet_bulk(self.fmt, 2,
+                                               net['network']['id'], 'test')
+                self._validate_behavior_on_bulk_failure(
+                    res, 'subnets', webob.exc.HTTPInternalServerError.code)
+                self.assertEqual(create_subnet.call_count, 2)
+                # The subnet created in the Director is deleted
+                self.assertEqual(delete_subnet.call_count, 1)
+
 
 class TestPlumgridPluginPortBinding(PLUMgridPluginV2TestCase,
                                     test_bindings.PortBindingsTestCase):
@@ -127,3 +205,338 @@ class TestPlumgridAllocationPool(PLUMgridPluginV2TestCase):
         plugin = NeutronManager.get_plugin()
         pool = plugin._allocate_pools_for_subnet(context, subnet)
         self.assertEqual(allocation_pool, pool)
+
+
+class TestPlumgridAsyncSync(PLUMgridPluginV2TestCase):
+
+    def setUp(self):
+        cfg.CONF.set_override('async_sync', True, 'plumgriddirector')
+        patch_sync = mock.patch.object(outbox, '_start_loopingcall')
+        patch_sync.start()
+        self.addCleanup(patch_sync.stop)
+        super(TestPlumgridAsyncSync, self).setUp()
+        self.plugin = NeutronManager.get_plugin()
+        self.ctx = n_context.get_admin_context()
+
+    def _show_status(self, resource, res_id):
+        res = self._show('%ss' % resource, res_id)
+        return res[resource]['status']
+
+    def test_network_pending_until_synced(self):
+        with mock.patch.object(self.plugin._plumlib,
+                               'create_network') as create_network:
+            with self.network() as net:
+                net_id = net['network']['id']
+                self.assertEqual(net['network']['status'], 'BUILD')
+                self.assertFalse(create_network.called)
+                pending = self.plugin._outbox.get_pending(self.ctx)
+                self.assertEqual([(p['resource_id'], p['operations'])
+                                  for p in pending],
+                                 [(net_id, ['create_network'])])
+                self.assertEqual(self.plugin._outbox.process_batch(), 1)
+                self.assertEqual(create_network.call_count, 1)
+                self.assertEqual(create_network.call_args[0][1]['id'],
+                                 net_id)
+                self.assertEqual(self._show_status('network', net_id),
+                                 'ACTIVE')
+                self.assertEqual(self.plugin._outbox.get_pending(self.ctx),
+                                 [])
+
+    def test_updates_coalesced(self):
+        with self.port() as port:
+            port_id = port['port']['id']
+            self.plugin._outbox.process_batch()
+            with mock.patch.object(self.plugin._plumlib,
+                                   'update_port') as update_port:
+                for name in ('first', 'second'):
+                    self._update('ports', port_id, {'port': {'name': name}})
+                self.assertEqual(self._show_status('port', port_id), 'BUILD')
+                self.assertEqual(self.plugin._outbox.process_batch(), 2)
+                self.assertEqual(update_port.call_count, 1)
+                self.assertEqual(update_port.call_args[0][0]['name'],
+                                 'second')
+                self.assertEqual(self._show_status('port', port_id),
+                                 'ACTIVE')
+
+    def test_port_creations_batched(self):
+        with contextlib.nested(
+            mock.patch.object(self.plugin._plumlib, 'create_ports'),
+            mock.patch.object(self.plugin._plumlib, 'create_subnet')
+        ) as (create_ports, create_subnet):
+            with self.subnet() as subnet:
+                net_id = subnet['subnet']['network_id']
+                res = self._create_port_bulk(self.fmt, 3, net_id, 'test',
+                                             True)
+                ports = self.deserialize(self.fmt, res)['ports']
+                self.assertFalse(create_ports.called)
+                self.plugin._outbox.process_batch()
+                self.assertEqual(create_ports.call_count, 1)
+                port_list = create_ports.call_args[0][0]
+                self.assertEqual([p['id'] for p, r in port_list],
+                                 [p['id'] for p in ports])
+                ipnet = create_subnet.call_args[0][2]
+                self.assertEqual(ipnet, netaddr.IPNetwork('10.0.0.0/24'))
+                for p in ports:
+                    self._delete('ports', p['id'])
+
+    def test_failed_call_retried(self):
+        failure = plum_excep.PLUMgridConnectionFailed(err_msg='unreachable')
+        with mock.patch.object(self.plugin._plumlib, 'create_network',
+                               side_effect=failure):
+            with self.network() as net:
+                net_id = net['network']['id']
+                self.assertRaises(plum_excep.PLUMgridConnectionFailed,
+                                  self.plugin._outbox.process_batch)
+                pending = self.plugin._outbox.get_pending(self.ctx)
+                self.assertEqual(pending[0]['attempts'], 1)
+                self.assertIn('unreachable', pending[0]['last_error'])
+                self.assertEqual(self._show_status('network', net_id),
+                                 'BUILD')
+                self.plugin._plumlib.create_network.side_effect = None
+                self.plugin._outbox.process_batch()
+                self.assertEqual(self._show_status('network', net_id),
+                                 'ACTIVE')
+
+    def test_updates_dropped_before_delete(self):
+        with self.network() as net:
+            net_id = net['network']['id']
+            self.plugin._outbox.process_batch()
+            self._update('networks', net_id, {'network': {'name': 'new'}})
+        with mock.patch.object(self.plugin._plumlib,
+                               'update_network') as update_network:
+            self.assertEqual(self.plugin._outbox.process_batch(), 2)
+            self.assertFalse(update_network.called)
+
+    def test_backoff_not_capped_by_sync_interval(self):
+        self.assertEqual(outbox._start_loopingcall.call_args[0][0],
+                         cfg.CONF.plumgriddirector.sync_max_backoff)
+
+    def test_failed_call_given_up(self):
+        self.plugin._outbox._max_attempts = 2
+        failure = plum_excep.PLUMgridConnectionFailed(err_msg='refused')
+        with mock.patch.object(self.plugin._plumlib, 'create_network',
+                               side_effect=[failure, failure, None]):
+            with contextlib.nested(self.network(),
+                                   self.network()) as (net1, net2):
+                net1_id = net1['network']['id']
+                net2_id = net2['network']['id']
+                self.assertRaises(plum_excep.PLUMgridConnectionFailed,
+                                  self.plugin._outbox.process_batch)
+                self.assertEqual(self.plugin._outbox.process_batch(), 1)
+                self.assertEqual(self._show_status('network', net1_id),
+                                 'ERROR')
+                # The failed entry does not block the following ones
+                self.assertEqual(self.plugin._outbox.process_batch(), 1)
+                self.assertEqual(self._show_status('network', net2_id),
+                                 'ACTIVE')
+                pending = self.plugin._outbox.get_pending(self.ctx)
+                self.assertEqual([(p['resource_id'], p['failed'])
+                                  for p in pending], [(net1_id, True)])
+                self.assertEqual(self.plugin._outbox.process_batch(), 0)
+
+                # An update does not supersede the failed creation
+                self._update('networks', net1_id,
+                             {'network': {'name': 'new'}})
+                self.plugin._outbox.process_batch()
+                self.assertEqual(self._show_status('network', net1_id),
+                                 'ERROR')
+
+    def test_failed_update_superseded(self):
+        self.plugin._outbox._max_attempts = 1
+        with self.port() as port:
+            port_id = port['port']['id']
+            self.plugin._outbox.process_batch()
+            failure = plum_excep.PLUMgridConnectionFailed(err_msg='refused')
+            with mock.patch.object(self.plugin._plumlib, 'update_port',
+                                   side_effect=[failure, None]):
+                self._update('ports', port_id, {'port': {'name': 'first'}})
+                self.plugin._outbox.process_batch()
+                self.assertEqual(self._show_status('port', port_id), 'ERROR')
+                self._update('ports', port_id, {'port': {'name': 'second'}})
+                self.plugin._outbox.process_batch()
+            self.assertEqual(self._show_status('port', port_id), 'ACTIVE')
+            self.assertEqual(self.plugin._outbox.get_pending(self.ctx), [])
+
+    def test_director_called_outside_transaction(self):
+        ctx = n_context.get_admin_context()
+
+        def create_network(tenant_id, net_db):
+            self.assertIsNone(ctx.session.transaction)
+
+        with contextlib.nested(
+            mock.patch.object(outbox.n_context, 'get_admin_context',
+                              return_value=ctx),
+            mock.patch.object(self.plugin._plumlib, 'create_network',
+                              side_effect=create_network)
+        ) as (get_admin_context, create_network_mock):
+            with self.network():
+                self.assertEqual(self.plugin._outbox.process_batch(), 1)
+                self.assertEqual(create_network_mock.call_count, 1)
+
+    def test_claimed_entries_skipped(self):
+        with mock.patch.object(self.plugin._plumlib,
+                               'create_network') as create_network:
+            with self.network():
+                # Another server is sending the entries
+                outbox_db.claim_entries(self.ctx.session, 10,
+                                        outbox.CLAIM_TIMEOUT)
+                self.assertEqual(self.plugin._outbox.process_batch(), 0)
+                self.assertFalse(create_network.called)
+
+
+class TestPlumgridReconciliation(PLUMgridPluginV2TestCase):
+
+    def setUp(self):
+        cfg.CONF.set_override('reconcile_interval', 120, 'plumgriddirector')
+        cfg.CONF.set_override('reconcile_grace_period', 0,
+                              'plumgriddirector')
+        super(TestPlumgridReconciliation, self).setUp()
+        self.plugin = NeutronManager.get_plugin()
+        self.synchronizer = self.plugin._synchronizer
+        self.ctx = n_context.get_admin_context()
+        self.director = {}
+
+        def get_resources(resource, marker, limit):
+            items = sorted(self.director.get(resource, {}).values(),
+                           key=lambda item: item['id'])
+            return [item for item in items
+                    if not marker or item['id'] > marker][:limit]
+
+        patch_get = mock.patch.object(self.plugin._plumlib, 'get_resources',
+                                      side_effect=get_resources)
+        patch_get.start()
+        self.addCleanup(patch_get.stop)
+
+    def _director_network(self, net):
+        net = dict(net)
+        net['subnets'] = []
+        self.director.setdefault('network', {})[net['id']] = net
+        return net
+
+    def _sync_networks(self):
+        return self.synchronizer.synchronize_chunk(self.ctx, 'network', None)
+
+    def test_missing_resource_created(self):
+        with self.network() as net:
+            with mock.patch.object(self.plugin._plumlib,
+                                   'create_network') as create_network:
+                self.assertIsNone(self._sync_networks())
+                self.assertEqual(create_network.call_count, 1)
+                self.assertEqual(create_network.call_args[0][1]['id'],
+                                 net['network']['id'])
+
+    def test_only_changed_resources_pushed(self):
+        with self.network() as net:
+            self._director_network(net['network'])
+            with mock.patch.object(self.plugin._plumlib,
+                                   'update_network') as update_network:
+                self._sync_networks()
+                self._sync_networks()
+                self.assertFalse(update_network.called)
+                self._update('networks', net['network']['id'],
+                             {'network': {'name': 'changed'}})
+                update_network.reset_mock()
+                self._sync_networks()
+                self.assertEqual(update_network.call_count, 1)
+                # The Director now has the new version
+                self._director_network(
+                    self._show('networks', net['network']['id'])['network'])
+                self._sync_networks()
+                self._sync_networks()
+                self.assertEqual(update_network.call_count, 1)
+
+    def test_director_change_pushed(self):
+        with self.network() as net:
+            director_net = self._director_network(net['network'])
+            self._sync_networks()
+            director_net['name'] = 'drifted'
+            with mock.patch.object(self.plugin._plumlib,
+                                   'update_network') as update_network:
+                self._sync_networks()
+                self.assertEqual(update_network.call_count, 1)
+
+    def test_drift_found_on_first_pass(self):
+        with self.network() as net:
+            self._director_network(net['network'])['admin_state_up'] = False
+            with mock.patch.object(self.plugin._plumlib,
+                                   'update_network') as update_network:
+                self._sync_networks()
+                self.assertEqual(update_network.call_count, 1)
+
+    def test_not_compared_attributes_ignored(self):
+        with self.network() as net:
+            director_net = self._director_network(net['network'])
+            director_net['status'] = 'DOWN'
+            director_net['internal'] = 'value'
+            with mock.patch.object(self.plugin._plumlib,
+                                   'update_network') as update_network:
+                self._sync_networks()
+                self.assertFalse(update_network.called)
+
+    def test_director_orphan_deleted(self):
+        self.director['network'] = {'orphan': {'id': 'orphan'}}
+        with mock.patch.object(self.plugin._plumlib,
+                               'delete_network') as delete_network:
+            self._sync_networks()
+            delete_network.assert_called_once_with({'id': 'orphan'},
+                                                   'orphan')
+
+    def test_difference_repaired_after_grace_period(self):
+        self.synchronizer._grace_period = 60
+        self.director['network'] = {'orphan': {'id': 'orphan'}}
+        with contextlib.nested(
+            mock.patch.object(sync.time, 'time', return_value=1000),
+            mock.patch.object(self.plugin._plumlib, 'delete_network')
+        ) as (time, delete_network):
+            self._sync_networks()
+            time.return_value = 1059
+            self._sync_networks()
+            self.assertFalse(delete_network.called)
+            time.return_value = 1060
+            self._sync_networks()
+            self.assertEqual(delete_network.call_count, 1)
+
+    def test_resolved_difference_forgotten(self):
+        self.synchronizer._grace_period = 60
+        with self.network() as net:
+            with contextlib.nested(
+                mock.patch.object(sync.time, 'time', return_value=1000),
+                mock.patch.object(self.plugin._plumlib, 'create_network')
+            ) as (time, create_network):
+                self._sync_networks()
+                # The creation committed on the Director in the meantime
+                self._director_network(net['network'])
+                time.return_value = 1100
+                self._sync_networks()
+                del self.director['network'][net['network']['id']]
+                self._sync_networks()
+                self.assertFalse(create_network.called)
+
+    def test_resources_reconciled_in_chunks(self):
+        self.synchronizer._chunk_size = 2
+        with contextlib.nested(self.network(), self.network(),
+                               self.network()) as nets:
+            ids = sorted(net['network']['id'] for net in nets)
+            with mock.patch.object(self.plugin._plumlib,
+                                   'create_network') as create_network:
+                marker = self._sync_networks()
+                self.assertEqual(marker, ids[1])
+                self.assertIsNone(self.synchronizer.synchronize_chunk(
+                    self.ctx, 'network', marker))
+                self.assertEqual(
+                    [c[0][1]['id'] for c in create_network.call_args_list],
+                    ids)
+
+    def test_time_budget_exhausted(self):
+        self.synchronizer._time_budget = 0
+        with mock.patch.object(self.synchronizer,
+                               'synchronize_chunk') as synchronize_chunk:
+            self.assertEqual(self.synchronizer._synchronize_state(),
+                             self.synchronizer._interval)
+            self.assertFalse(synchronize_chunk.called)
+
+    def test_not_started_without_listing_support(self):
+        with mock.patch.object(self.plugin._plumlib, 'supports_listing',
+                               return_value=False):
+            self.plugin.sync_init()
+        self.assertIsNone(self.plugin._synchronizer)
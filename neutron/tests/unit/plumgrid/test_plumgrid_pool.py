@@ -0,0 +1,179 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2014 PLUMgrid, Inc. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import eventlet
+import mock
+import testtools
+
+from neutron.plugins.plumgrid.common import exceptions as plum_excep
+from neutron.plugins.plumgrid.drivers import pool
+from neutron.tests import base
+
+
+class TestDirectorConnectionPool(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestDirectorConnectionPool, self).setUp()
+        self.factory = mock.Mock(side_effect=lambda: mock.Mock())
+
+    def test_connection_reused(self):
+        conn_pool = pool.DirectorConnectionPool(self.factory, 2)
+        with conn_pool.connection() as conn:
+            first = conn
+        with conn_pool.connection() as conn:
+            self.assertIs(conn, first)
+        self.assertEqual(self.factory.call_count, 1)
+        self.assertEqual(conn_pool.stats['hits'], 1)
+        self.assertEqual(conn_pool.stats['misses'], 1)
+
+    def test_concurrent_calls_use_distinct_connections(self):
+        conn_pool = pool.DirectorConnectionPool(self.factory, 2)
+        with conn_pool.connection() as conn1:
+            with conn_pool.connection() as conn2:
+                self.assertIsNot(conn1, conn2)
+        self.assertEqual(conn_pool.stats['idle'], 2)
+        self.assertEqual(conn_pool.stats['misses'], 2)
+
+    def test_callers_block_when_pool_exhausted(self):
+        conn_pool = pool.DirectorConnectionPool(self.factory, 1)
+        calls = []
+
+        def director_call(name):
+            with conn_pool.connection():
+                calls.append(name)
+                eventlet.sleep(0)
+                calls.append(name)
+
+        threads = [eventlet.spawn(director_call, name)
+                   for name in ('a', 'b')]
+        for thread in threads:
+            thread.wait()
+        self.assertEqual(calls, ['a', 'a', 'b', 'b'])
+        self.assertEqual(self.factory.call_count, 1)
+
+    def test_failed_connection_discarded(self):
+        conn_pool = pool.DirectorConnectionPool(self.factory, 1)
+        with testtools.ExpectedException(ValueError):
+            with conn_pool.connection():
+                raise ValueError()
+        with conn_pool.connection():
+            pass
+        self.assertEqual(self.factory.call_count, 2)
+        self.assertEqual(conn_pool.stats['discarded'], 1)
+
+    def test_idle_connection_reopened(self):
+        conn_pool = pool.DirectorConnectionPool(self.factory, 1,
+                                                idle_timeout=10)
+        with mock.patch.object(pool.time, 'time', return_value=100):
+            with conn_pool.connection():
+                pass
+        with mock.patch.object(pool.time, 'time', return_value=120):
+            with conn_pool.connection():
+                pass
+        self.assertEqual(self.factory.call_count, 2)
+        self.assertEqual(conn_pool.stats['hits'], 0)
+
+    def test_call_timeout(self):
+        conn_pool = pool.DirectorConnectionPool(self.factory, 1,
+                                                call_timeout=0.01)
+        with testtools.ExpectedException(plum_excep.PLUMgridCallTimeout):
+            with conn_pool.connection():
+                eventlet.sleep(1)
+        self.assertEqual(conn_pool.stats['discarded'], 1)
+
+    def test_hung_call_does_not_kill_caller(self):
+        conn_pool = pool.DirectorConnectionPool(self.factory, 1,
+                                                call_timeout=0.01)
+        results = []
+
+        def sync_loop():
+            # Like the sync greenthreads, which only catch Exception
+            for _i in range(2):
+                try:
+                    with conn_pool.connection():
+                        eventlet.sleep(1)
+                except Exception as e:
+                    results.append(e)
+
+        eventlet.spawn(sync_loop).wait()
+        self.assertEqual(2, len(results))
+        self.assertIsInstance(results[0], plum_excep.PLUMgridCallTimeout)
+
+    def test_factory_failure_releases_slot(self):
+        self.factory.side_effect = [Exception(), mock.Mock()]
+        conn_pool = pool.DirectorConnectionPool(self.factory, 1)
+        with testtools.ExpectedException(Exception):
+            with conn_pool.connection():
+                pass
+        with conn_pool.connection():
+            pass
+        self.assertEqual(self.factory.call_count, 2)
+
+    def test_invalid_connection_reopened(self):
+        validate = mock.Mock(side_effect=[False])
+        conn_pool = pool.DirectorConnectionPool(self.factory, 1,
+                                                validate=validate)
+        with conn_pool.connection() as conn:
+            first = conn
+        with conn_pool.connection() as conn:
+            self.assertIsNot(conn, first)
+        validate.assert_called_once_with(first)
+        self.assertEqual(self.factory.call_count, 2)
+        self.assertEqual(conn_pool.stats['invalid'], 1)
+
+    def test_failed_validation_reopens_connection(self):
+        validate = mock.Mock(side_effect=Exception())
+        conn_pool = pool.DirectorConnectionPool(self.factory, 1,
+                                                validate=validate)
+        with conn_pool.connection():
+            pass
+        with conn_pool.connection():
+            pass
+        self.assertEqual(self.factory.call_count, 2)
+        self.assertEqual(conn_pool.stats['hits'], 0)
+
+    def test_recently_used_connection_not_validated(self):
+        validate = mock.Mock(return_value=True)
+        conn_pool = pool.DirectorConnectionPool(self.factory, 1,
+                                                validate=validate,
+                                                validate_interval=10)
+        with mock.patch.object(pool.time, 'time', return_value=100):
+            with conn_pool.connection():
+                pass
+        with mock.patch.object(pool.time, 'time', return_value=105):
+            with conn_pool.connection():
+                pass
+        self.assertFalse(validate.called)
+        with mock.patch.object(pool.time, 'time', return_value=120):
+            with conn_pool.connection():
+                pass
+        self.assertEqual(validate.call_count, 1)
+        self.assertEqual(self.factory.call_count, 1)
+        self.assertEqual(conn_pool.stats['hits'], 2)
+
+    def test_stats_logged(self):
+        with mock.patch.object(pool.time, 'time', return_value=100):
+            conn_pool = pool.DirectorConnectionPool(self.factory, 1,
+                                                    stats_interval=60)
+        with mock.patch.object(pool.LOG, 'info') as log_info:
+            with mock.patch.object(pool.time, 'time', return_value=130):
+                with conn_pool.connection():
+                    pass
+            self.assertFalse(log_info.called)
+            with mock.patch.object(pool.time, 'time', return_value=170):
+                with conn_pool.connection():
+                    pass
+            log_info.assert_called_once_with(mock.ANY, conn_pool.stats)
@@ -79,6 +79,68 @@ class AgentUtilsExecuteTest(base.BaseTestCase):
         self.assertEqual(result, expected)
 
 
+class AgentUtilsExecuteDaemonTest(base.BaseTestCase):
+    def setUp(self):
+        super(AgentUtilsExecuteDaemonTest, self).setUp()
+        self.client = mock.Mock()
+        self.client.execute.return_value = (0, 'out', '')
+        get_client_p = mock.patch.object(utils, 'get_rootwrap_client',
+                                         return_value=self.client)
+        get_client_p.start()
+        self.addCleanup(get_client_p.stop)
+        self.mock_popen_p = mock.patch("subprocess.Popen.communicate")
+        self.mock_popen = self.mock_popen_p.start()
+        self.addCleanup(self.mock_popen_p.stop)
+
+    def test_with_helper_uses_daemon(self):
+        result = utils.execute(["ip", "link"], "sudo", process_input='in')
+        self.assertEqual('out', result)
+        self.client.execute.assert_called_once_with(['ip', 'link'], 'in')
+        self.assertFalse(self.mock_popen.called)
+
+    def test_daemon_error(self):
+        self.client.execute.return_value = (1, '', 'error')
+        self.assertRaises(RuntimeError, utils.execute, ["ip", "link"],
+                          "sudo")
+
+    def test_without_helper_does_not_use_daemon(self):
+        self.mock_popen.return_value = ["out", ""]
+        utils.execute(["ls"])
+        self.assertFalse(self.client.execute.called)
+
+    def test_addl_env_does_not_use_daemon(self):
+        self.mock_popen.return_value = ["out", ""]
+        utils.execute(["ls"], "echo", addl_env={'foo': 'bar'})
+        self.assertFalse(self.client.execute.called)
+
+
+class RootwrapDaemonClientTest(base.BaseTestCase):
+    def setUp(self):
+        super(RootwrapDaemonClientTest, self).setUp()
+        self.client = utils.RootwrapDaemonClient('sudo daemon')
+        self.client._token = 'token'
+        for name in ('_ensure_started', '_request'):
+            patcher = mock.patch.object(self.client, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client._request.return_value = {'returncode': 0,
+                                             'stdout': u'\xff',
+                                             'stderr': u''}
+
+    def _test_execute(self, process_input, sent):
+        result = self.client.execute(['cat'], process_input)
+        self.assertEqual((0, '\xff', ''), result)
+        self.client._request.assert_called_once_with(
+            {'token': 'token', 'cmd': ['cat'], 'stdin': sent})
+
+    def test_execute_bytes_input(self):
+        self._test_execute('\xe9', u'\xe9')
+
+    def test_execute_unicode_input(self):
+        # Sent as its UTF-8 encoding
+        self._test_execute(u'\u20ac', u'\xe2\x82\xac')
+
+
 class AgentUtilsGetInterfaceMAC(base.BaseTestCase):
     def test_get_interface_mac(self):
         expect_val = '01:02:03:04:05:06'
@@ -19,6 +19,7 @@ import mock
 
 from neutron.agent import rpc
 from neutron.openstack.common import context
+from neutron.openstack.common.rpc import common as rpc_common
 from neutron.tests import base
 
 
@@ -46,6 +47,65 @@ class AgentRPCPluginApi(base.BaseTestCase):
         self._test_rpc_call('tunnel_sync')
 
 
+class AgentRPCPluginApiDeviceList(base.BaseTestCase):
+    def setUp(self):
+        super(AgentRPCPluginApiDeviceList, self).setUp()
+        self.agent = rpc.PluginApi('fake_topic')
+        self.ctxt = context.RequestContext('fake_user', 'fake_project')
+        call_p = mock.patch.object(self.agent, 'call')
+        self.call = call_p.start()
+        self.addCleanup(call_p.stop)
+
+    def _reject_device_list(self, exc_type):
+        def call(context, msg, topic, version=None):
+            if version == self.agent.DEVICE_LIST_RPC_API_VERSION:
+                raise rpc_common.RemoteError(exc_type)
+            if msg['method'] == 'update_device_down':
+                return {'device': msg['args']['device'], 'exists': True}
+            if msg['args']['device'] == 'failed_device':
+                raise rpc_common.Timeout()
+            return {'device': msg['args']['device']}
+        self.call.side_effect = call
+
+    def test_get_devices_details_list(self):
+        self.call.return_value = [{'device': 'dev1'}]
+        self.assertEqual([{'device': 'dev1'}],
+                         self.agent.get_devices_details_list(
+                             self.ctxt, ['dev1'], 'fake_agent_id'))
+        self.assertEqual(self.agent.DEVICE_LIST_RPC_API_VERSION,
+                         self.call.call_args[1]['version'])
+
+    def test_get_devices_details_list_fallback(self):
+        self._reject_device_list('UnsupportedRpcVersion')
+        self.assertEqual([{'device': 'dev1'}, {'device': 'dev2'}],
+                         self.agent.get_devices_details_list(
+                             self.ctxt, ['dev1', 'dev2'], 'fake_agent_id'))
+        self.assertFalse(self.agent.use_device_list)
+        # The device list method is not tried again
+        self.agent.get_devices_details_list(self.ctxt, ['dev1'],
+                                            'fake_agent_id')
+        self.assertEqual(4, self.call.call_count)
+
+    def test_get_devices_details_list_error(self):
+        self._reject_device_list('ValueError')
+        self.assertRaises(rpc_common.RemoteError,
+                          self.agent.get_devices_details_list,
+                          self.ctxt, ['dev1'], 'fake_agent_id')
+        self.assertTrue(self.agent.use_device_list)
+
+    def test_update_device_list_fallback(self):
+        self._reject_device_list('AttributeError')
+        self.assertEqual(
+            {'devices_up': ['dev1'], 'failed_devices_up': ['failed_device'],
+             'devices_down': [{'device': 'dev2', 'exists': True}],
+             'failed_devices_down': []},
+            self.agent.update_device_list(self.ctxt,
+                                          ['dev1', 'failed_device'],
+                                          ['dev2'], 'fake_agent_id',
+                                          'fake_host'))
+        self.assertFalse(self.agent.use_device_list)
+
+
 class AgentPluginReportState(base.BaseTestCase):
     def test_plugin_report_state_use_call(self):
         topic = 'test'
@@ -36,6 +36,7 @@ from neutron.manager import NeutronManager
 from neutron.openstack.common.notifier import api as notifer_api
 from neutron.openstack.common import policy as common_policy
 from neutron.openstack.common import uuidutils
+from neutron import policy
 from neutron import quota
 from neutron.tests import base
 from neutron.tests.unit import testlib_api
@@ -1252,6 +1253,32 @@ class V2Views(base.BaseTestCase):
                 'ip_version', 'cidr', 'enable_dhcp')
         self._view(keys, 'subnets', 'subnet')
 
+    def _view_with_policy(self, authz_check):
+        attr_info = attributes.RESOURCE_ATTRIBUTE_MAP['networks']
+        controller = v2_base.Controller(None, 'networks', 'network',
+                                        attr_info)
+        ctx = context.Context('', 'tenant')
+        with mock.patch.object(policy, 'check_without_target',
+                               return_value=authz_check) as check:
+            with mock.patch.object(policy, 'check_if_exists',
+                                   return_value=True) as check_if_exists:
+                view = controller._get_view(ctx, fields_to_strip=['name'])
+                res = [view({'id': i, 'name': 'net', 'shared': False})
+                       for i in range(3)]
+        check.assert_called_once_with(ctx, 'get_network:shared',
+                                      must_exist=True)
+        return res, check_if_exists.call_count
+
+    def test_view_policy_checked_once(self):
+        res, object_checks = self._view_with_policy(False)
+        self.assertEqual([{'id': i} for i in range(3)], res)
+        self.assertEqual(0, object_checks)
+
+    def test_view_policy_checked_per_object(self):
+        res, object_checks = self._view_with_policy(None)
+        self.assertEqual([{'id': i, 'shared': False} for i in range(3)], res)
+        self.assertEqual(3, object_checks)
+
 
 class NotificationTest(APIv2TestBase):
     def _resource_op_notifier(self, opname, resource, expected_errors=False,
@@ -287,3 +287,16 @@ class TestParseVlanRangeList(UtilTestParseVlanRanges):
                                       (1000, 1099)],
                              "net2": [(200, 299)]}
         self.assertEqual(self.parse_list(config_list), expected_networks)
+
+
+class TestSplitList(base.BaseTestCase):
+    def test_split_list(self):
+        self.assertEqual([[1, 2], [3, 4], [5]],
+                         utils.split_list([1, 2, 3, 4, 5], 2))
+
+    def test_split_list_no_limit(self):
+        self.assertEqual([[1, 2, 3]], utils.split_list(set([1, 2, 3]), 0))
+
+    def test_split_empty_list(self):
+        self.assertEqual([], utils.split_list([], 2))
+        self.assertEqual([], utils.split_list([], 0))
@@ -37,6 +37,7 @@ from neutron.common import config
 from neutron.common import exceptions as q_exc
 from neutron.common.test_lib import test_config
 from neutron import context
+from neutron.db import agents_db
 from neutron.db import api as db
 from neutron.db import db_base_plugin_v2
 from neutron.db import models_v2
@@ -859,6 +860,87 @@ class TestPortsV2(NeutronDbPluginV2TestCase):
             for p in self.deserialize(self.fmt, res)['ports']:
                 self._delete('ports', p['id'])
 
+    def test_create_ports_bulk_native_allocates_addresses(self):
+        if self._skip_native_bulk:
+            self.skipTest("Plugin does not support native bulk port create")
+        with self.subnet(cidr='10.0.0.0/24') as subnet:
+            subnet_id = subnet['subnet']['id']
+            overrides = {1: {'fixed_ips': [{'subnet_id': subnet_id,
+                                            'ip_address': '10.0.0.100'}]},
+                         2: {'mac_address': '00:00:00:00:00:01'}}
+            res = self._create_port_bulk(self.fmt, 4,
+                                         subnet['subnet']['network_id'],
+                                         'test', True, override=overrides)
+            self.assertEqual(res.status_int, webob.exc.HTTPCreated.code)
+            ports = self.deserialize(self.fmt, res)['ports']
+            self.assertEqual([p['name'] for p in ports],
+                             ['test_0', 'test_1', 'test_2', 'test_3'])
+            ips = [p['fixed_ips'][0]['ip_address'] for p in ports]
+            self.assertEqual(len(set(ips)), 4)
+            self.assertEqual(ips[1], '10.0.0.100')
+            self.assertEqual(len(set(p['mac_address'] for p in ports)), 4)
+            self.assertEqual(ports[2]['mac_address'], '00:00:00:00:00:01')
+            for p in ports:
+                self._delete('ports', p['id'])
+
+    def test_create_ports_bulk_native_duplicate_mac(self):
+        if self._skip_native_bulk:
+            self.skipTest("Plugin does not support native bulk port create")
+        with self.network() as net:
+            overrides = {0: {'mac_address': '00:00:00:00:00:01'},
+                         1: {'mac_address': '00:00:00:00:00:01'}}
+            res = self._create_port_bulk(self.fmt, 2, net['network']['id'],
+                                         'test', True, override=overrides)
+            self._validate_behavior_on_bulk_failure(
+                res, 'ports', webob.exc.HTTPConflict.code)
+
+    def test_create_ports_bulk_native_duplicate_ip(self):
+        if self._skip_native_bulk:
+            self.skipTest("Plugin does not support native bulk port create")
+        with self.subnet(cidr='10.0.0.0/24') as subnet:
+            fixed_ips = [{'subnet_id': subnet['subnet']['id'],
+                          'ip_address': '10.0.0.100'}]
+            overrides = {0: {'fixed_ips': fixed_ips},
+                         1: {'fixed_ips': fixed_ips}}
+            res = self._create_port_bulk(self.fmt, 2,
+                                         subnet['subnet']['network_id'],
+                                         'test', True, override=overrides)
+            self._validate_behavior_on_bulk_failure(
+                res, 'ports', webob.exc.HTTPConflict.code)
+
+    def test_create_ports_bulk_native_requested_ip_not_generated(self):
+        if self._skip_native_bulk:
+            self.skipTest("Plugin does not support native bulk port create")
+        plugin = NeutronManager.get_plugin()
+        if (getattr(plugin.create_port, 'im_func', None) is not
+                db_base_plugin_v2.NeutronDbPluginV2.create_port.im_func):
+            self.skipTest("Plugin creates the ports of a batch one by one")
+        with self.subnet(cidr='10.0.0.0/24') as subnet:
+            # 10.0.0.2 would be generated for the first port of the batch
+            fixed_ips = [{'subnet_id': subnet['subnet']['id'],
+                          'ip_address': '10.0.0.2'}]
+            overrides = {1: {'fixed_ips': fixed_ips}}
+            res = self._create_port_bulk(self.fmt, 2,
+                                         subnet['subnet']['network_id'],
+                                         'test', True, override=overrides)
+            self.assertEqual(res.status_int, webob.exc.HTTPCreated.code)
+            ports = self.deserialize(self.fmt, res)['ports']
+            ips = [p['fixed_ips'][0]['ip_address'] for p in ports]
+            self.assertEqual('10.0.0.2', ips[1])
+            self.assertNotEqual(ips[0], ips[1])
+            for p in ports:
+                self._delete('ports', p['id'])
+
+    def test_create_ports_bulk_native_ip_exhaustion(self):
+        if self._skip_native_bulk:
+            self.skipTest("Plugin does not support native bulk port create")
+        with self.subnet(cidr='10.0.0.0/29') as subnet:
+            res = self._create_port_bulk(self.fmt, 6,
+                                         subnet['subnet']['network_id'],
+                                         'test', True)
+            self._validate_behavior_on_bulk_failure(
+                res, 'ports', webob.exc.HTTPConflict.code)
+
     def test_create_ports_bulk_emulated(self):
         real_has_attr = hasattr
 
@@ -3594,7 +3676,7 @@ class DbModelTestCase(base.BaseTestCase):
         actual_repr_output = repr(network)
         exp_start_with = "<neutron.db.models_v2.Network"
         exp_middle = "[object at %x]" % id(network)
-        exp_end_with = (" {tenant_id=None, id=None, "
+        exp_end_with = (" {tenant_id=None, id=None, updated_at=None, "
                         "name='net_net', status='OK', "
                         "admin_state_up=True, shared=None}>")
         final_exp = exp_start_with + exp_middle + exp_end_with
@@ -3636,6 +3718,149 @@ class NeutronDbPluginV2AsMixinTestCase(base.BaseTestCase):
         net = self.plugin.create_network(self.context, self.net_data)
         self.assertEqual(net['status'], 'BUILD')
 
+    def test_get_networks_fields_from_columns(self):
+        self.plugin.create_network(self.context, self.net_data)
+        with mock.patch.object(self.plugin,
+                               '_apply_dict_extend_functions') as extend:
+            nets = self.plugin.get_networks(
+                self.context, fields=['id', 'name', 'tenant_id', 'id'])
+        self.assertFalse(extend.called)
+        self.assertEqual([{'id': 'fake-id', 'name': 'net1',
+                           'tenant_id': 'test-tenant'}], nets)
+
+    def test_get_networks_fields_overridden_dict_func(self):
+        class OverridingPlugin(db_base_plugin_v2.NeutronDbPluginV2):
+            def _make_network_dict(self, network, fields=None,
+                                   process_extensions=True):
+                res = super(OverridingPlugin, self)._make_network_dict(
+                    network, process_extensions=process_extensions)
+                res['name'] = res['name'].upper()
+                return self._fields(res, fields)
+
+        plugin = OverridingPlugin()
+        plugin.create_network(self.context, self.net_data)
+        nets = plugin.get_networks(self.context, fields=['id', 'name'])
+        self.assertEqual([{'id': 'fake-id', 'name': 'NET1'}], nets)
+
+    def test_get_networks_fields_not_projected(self):
+        self.plugin.create_network(self.context, self.net_data)
+        with mock.patch.object(self.plugin,
+                               '_apply_dict_extend_functions') as extend:
+            self.plugin.get_networks(self.context, fields=['id', 'subnets'])
+        self.assertTrue(extend.called)
+
+    def _assert_projected_equal_full(self, get_collection, fields_list):
+        full = get_collection(self.context)
+        self.assertTrue(full)
+        for fields in fields_list:
+            self.assertEqual(
+                [self.plugin._fields(item, fields) for item in full],
+                get_collection(self.context, fields=fields))
+
+    def test_get_collections_fields_projected_equal_full(self):
+        self.plugin.create_network(self.context, self.net_data)
+        self.plugin.create_subnet(self.context, {'subnet': {
+            'network_id': 'fake-id', 'tenant_id': 'test-tenant', 'name': 's',
+            'cidr': '10.0.0.0/24', 'ip_version': 4, 'enable_dhcp': True,
+            'gateway_ip': ATTR_NOT_SPECIFIED, 'shared': False,
+            'allocation_pools': ATTR_NOT_SPECIFIED,
+            'dns_nameservers': ATTR_NOT_SPECIFIED,
+            'host_routes': ATTR_NOT_SPECIFIED}})
+        self.plugin.create_port(self.context, {'port': {
+            'network_id': 'fake-id', 'tenant_id': 'test-tenant', 'name': 'p',
+            'admin_state_up': True, 'device_id': 'dev', 'device_owner': '',
+            'mac_address': ATTR_NOT_SPECIFIED,
+            'fixed_ips': ATTR_NOT_SPECIFIED}})
+        for resource, get_collection in (
+                (models_v2.Network, self.plugin.get_networks),
+                (models_v2.Subnet, self.plugin.get_subnets),
+                (models_v2.Port, self.plugin.get_ports)):
+            projected = list(self.plugin._projected_columns[resource][1])
+            self._assert_projected_equal_full(
+                get_collection,
+                [projected, projected[:2], ['id', 'name', 'status', 'cidr',
+                                            'fixed_ips', 'subnets']])
+
+    def test_get_agents_fields_projected_equal_full(self):
+        class AgentPlugin(db_base_plugin_v2.NeutronDbPluginV2,
+                          agents_db.AgentDbMixin):
+            pass
+
+        plugin = AgentPlugin()
+        plugin.create_or_update_agent(self.context, {
+            'agent_type': 'Open vSwitch agent', 'binary': 'agent',
+            'host': 'host1', 'topic': 'N/A', 'configurations': {'a': 1}})
+        agents = plugin.get_agents(self.context,
+                                   fields=['id', 'configurations'])
+        self.assertEqual({'a': 1}, agents[0]['configurations'])
+        self._assert_projected_equal_full(
+            plugin.get_agents,
+            [['id', 'configurations'], ['id', 'host', 'agent_type'],
+             ['alive', 'heartbeat_timestamp']])
+
+    def test_get_networks_fields_not_columns(self):
+        self.plugin.create_network(self.context, self.net_data)
+        nets = self.plugin.get_networks(self.context,
+                                        fields=['id', 'subnets'])
+        self.assertEqual([{'id': 'fake-id', 'subnets': []}], nets)
+
+    def _get_updated_at(self, model, id):
+        return self.context.session.query(model.updated_at).filter_by(
+            id=id).scalar()
+
+    def test_updated_at(self):
+        created_at = datetime.datetime(2014, 2, 3, 10, 0)
+        timeutils.set_time_override(created_at)
+        self.addCleanup(timeutils.clear_time_override)
+        self.plugin.create_network(self.context, self.net_data)
+        subnet = self.plugin.create_subnet(self.context, {'subnet': {
+            'network_id': 'fake-id', 'tenant_id': 'test-tenant', 'name': '',
+            'cidr': '10.0.0.0/24', 'ip_version': 4, 'enable_dhcp': True,
+            'gateway_ip': ATTR_NOT_SPECIFIED, 'shared': False,
+            'allocation_pools': ATTR_NOT_SPECIFIED,
+            'dns_nameservers': ATTR_NOT_SPECIFIED,
+            'host_routes': ATTR_NOT_SPECIFIED}})
+        port = self.plugin.create_port(self.context, {'port': {
+            'network_id': 'fake-id', 'tenant_id': 'test-tenant', 'name': '',
+            'admin_state_up': True, 'device_id': '', 'device_owner': '',
+            'mac_address': ATTR_NOT_SPECIFIED,
+            'fixed_ips': ATTR_NOT_SPECIFIED}})
+        for model, id in ((models_v2.Network, 'fake-id'),
+                          (models_v2.Subnet, subnet['id']),
+                          (models_v2.Port, port['id'])):
+            self.assertEqual(created_at, self._get_updated_at(model, id))
+
+        # Changing a fixed IP updates the port, not its network
+        timeutils.advance_time_seconds(300)
+        self.plugin.update_port(self.context, port['id'], {'port': {
+            'fixed_ips': [{'subnet_id': subnet['id'],
+                           'ip_address': '10.0.0.10'}]}})
+        self.assertEqual(timeutils.utcnow(),
+                         self._get_updated_at(models_v2.Port, port['id']))
+        self.assertEqual(created_at,
+                         self._get_updated_at(models_v2.Network, 'fake-id'))
+
+        # Removing a fixed IP updates the port
+        timeutils.advance_time_seconds(300)
+        self.plugin.update_port(self.context, port['id'], {'port': {
+            'fixed_ips': []}})
+        self.assertEqual(timeutils.utcnow(),
+                         self._get_updated_at(models_v2.Port, port['id']))
+
+        # Changing a DNS server updates the subnet
+        timeutils.advance_time_seconds(300)
+        self.plugin.update_subnet(self.context, subnet['id'], {'subnet': {
+            'dns_nameservers': ['8.8.8.8']}})
+        self.assertEqual(timeutils.utcnow(),
+                         self._get_updated_at(models_v2.Subnet, subnet['id']))
+
+        # Removing it as well
+        timeutils.advance_time_seconds(300)
+        self.plugin.update_subnet(self.context, subnet['id'], {'subnet': {
+            'dns_nameservers': []}})
+        self.assertEqual(timeutils.utcnow(),
+                         self._get_updated_at(models_v2.Subnet, subnet['id']))
+
 
 class TestBasicGetXML(TestBasicGet):
     fmt = 'xml'
@@ -13,10 +13,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
+
 import mock
 
+from neutron.api.v2 import attributes
 from neutron.common import exceptions as n_exc
+from neutron import context
+from neutron.db import api as db
+from neutron.db import device_rpc_base
 from neutron.db import dhcp_rpc_base
+from neutron.openstack.common import importutils
+from neutron.openstack.common import timeutils
 from neutron.tests import base
 
 
@@ -197,3 +205,103 @@ class TestDhcpRpcCallackMixin(base.BaseTestCase):
                                                        device_id=['devid'])),
             mock.call.update_port(mock.ANY, 'port_id',
                                   dict(port=port_update))])
+
+
+class TestDhcpRpcChangedNetworks(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestDhcpRpcChangedNetworks, self).setUp()
+        self.plugin = importutils.import_object(
+            'neutron.db.db_base_plugin_v2.NeutronDbPluginV2')
+        self.addCleanup(db.clear_db)
+        mock.patch('neutron.manager.NeutronManager.get_plugin',
+                   return_value=self.plugin).start()
+        self.addCleanup(mock.patch.stopall)
+        self.context = context.get_admin_context()
+        self.callbacks = dhcp_rpc_base.DhcpRpcCallbackMixin()
+
+        self.created_at = datetime.datetime(2014, 2, 3, 10, 0)
+        timeutils.set_time_override(self.created_at)
+        self.addCleanup(timeutils.clear_time_override)
+        for network_id in ('net1', 'net2'):
+            self.plugin.create_network(self.context, {'network': {
+                'id': network_id, 'name': '', 'admin_state_up': True,
+                'tenant_id': 'tenant', 'shared': False}})
+        self.port = self.plugin.create_port(self.context, {'port': {
+            'network_id': 'net2', 'tenant_id': 'tenant', 'name': '',
+            'admin_state_up': True, 'device_id': '', 'device_owner': '',
+            'mac_address': attributes.ATTR_NOT_SPECIFIED,
+            'fixed_ips': attributes.ATTR_NOT_SPECIFIED}})
+
+    def _get_changed_networks_info(self, changed_since):
+        return self.callbacks.get_changed_networks_info(
+            self.context, host='host', changed_since=changed_since)
+
+    def test_all_networks(self):
+        changes = self._get_changed_networks_info(None)
+        self.assertEqual(['net1', 'net2'],
+                         sorted(n['id'] for n in changes['networks']))
+        self.assertEqual({'net1': [0, 0], 'net2': [0, 1]}, changes['counts'])
+        self.assertEqual(timeutils.strtime(self.created_at),
+                         changes['timestamp'])
+
+    def test_changed_networks(self):
+        timeutils.advance_time_seconds(600)
+        since = timeutils.strtime()
+        changes = self._get_changed_networks_info(since)
+        self.assertEqual([], changes['networks'])
+        self.assertEqual({'net1': [0, 0], 'net2': [0, 1]}, changes['counts'])
+
+        self.plugin.update_port(self.context, self.port['id'],
+                                {'port': {'name': 'renamed'}})
+        changes = self._get_changed_networks_info(since)
+        self.assertEqual(['net2'], [n['id'] for n in changes['networks']])
+        self.assertEqual(['renamed'],
+                         [p['name'] for p in changes['networks'][0]['ports']])
+
+    def test_changed_networks_margin(self):
+        # Changes committed shortly before changed_since are returned
+        since = timeutils.strtime(self.created_at + datetime.timedelta(
+            seconds=dhcp_rpc_base.CHANGED_SINCE_MARGIN - 1))
+        changes = self._get_changed_networks_info(since)
+        self.assertEqual(['net1', 'net2'],
+                         sorted(n['id'] for n in changes['networks']))
+
+
+class TestDeviceRpcCallbackMixin(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestDeviceRpcCallbackMixin, self).setUp()
+        self.callbacks = device_rpc_base.DeviceRpcCallbackMixin()
+        self.callbacks.update_device_up = mock.Mock()
+        self.callbacks.update_device_down = mock.Mock(
+            side_effect=lambda ctx, device, **kwargs: {'device': device,
+                                                       'exists': True})
+
+    def test_update_device_list(self):
+        result = self.callbacks.update_device_list(
+            mock.sentinel.ctx, devices_up=['up1', 'up2'],
+            devices_down=['down1'], agent_id='agent', host='host')
+        self.assertEqual({'devices_up': ['up1', 'up2'],
+                          'failed_devices_up': [],
+                          'devices_down': [{'device': 'down1',
+                                            'exists': True}],
+                          'failed_devices_down': []}, result)
+        self.callbacks.update_device_up.assert_has_calls([
+            mock.call(mock.sentinel.ctx, device='up1', agent_id='agent',
+                      host='host'),
+            mock.call(mock.sentinel.ctx, device='up2', agent_id='agent',
+                      host='host')])
+        self.callbacks.update_device_down.assert_called_once_with(
+            mock.sentinel.ctx, device='down1', agent_id='agent', host='host')
+
+    def test_update_device_list_failures(self):
+        self.callbacks.update_device_up.side_effect = [Exception(), None]
+        self.callbacks.update_device_down.side_effect = Exception()
+        result = self.callbacks.update_device_list(
+            mock.sentinel.ctx, devices_up=['up1', 'up2'],
+            devices_down=['down1'])
+        self.assertEqual({'devices_up': ['up2'],
+                          'failed_devices_up': ['up1'],
+                          'devices_down': [],
+                          'failed_devices_down': ['down1']}, result)
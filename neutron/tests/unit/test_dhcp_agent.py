@@ -15,6 +15,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
 import copy
 import os
 import sys
@@ -32,6 +33,7 @@ from neutron.agent.linux import dhcp
 from neutron.agent.linux import interface
 from neutron.common import constants as const
 from neutron.common import exceptions
+from neutron.openstack.common import lockutils
 from neutron.openstack.common.rpc import common
 from neutron.tests import base
 
@@ -189,11 +191,14 @@ class TestDhcpAgent(base.BaseTestCase):
             dhcp = dhcp_agent.DhcpAgent(HOSTNAME)
             attrs_to_mock = dict(
                 [(a, mock.DEFAULT) for a in
-                 ['sync_state', 'periodic_resync']])
+                 ['sync_state', 'periodic_resync',
+                  'start_network_events_processing']])
             with mock.patch.multiple(dhcp, **attrs_to_mock) as mocks:
                 dhcp.run()
                 mocks['sync_state'].assert_called_once_with()
                 mocks['periodic_resync'].assert_called_once_with()
+                mocks['start_network_events_processing'].\
+                    assert_called_once_with()
 
     def test_call_driver(self):
         network = mock.Mock()
@@ -237,7 +242,10 @@ class TestDhcpAgent(base.BaseTestCase):
     def _test_sync_state_helper(self, known_networks, active_networks):
         with mock.patch(DHCP_PLUGIN) as plug:
             mock_plugin = mock.Mock()
-            mock_plugin.get_active_networks_info.return_value = active_networks
+            mock_plugin.get_changed_networks_info.return_value = {
+                'networks': [],
+                'counts': dict((net_id, [1, 1]) for net_id in active_networks),
+                'timestamp': 'now'}
             plug.return_value = mock_plugin
 
             dhcp = dhcp_agent.DhcpAgent(HOSTNAME)
@@ -248,6 +256,7 @@ class TestDhcpAgent(base.BaseTestCase):
 
             with mock.patch.multiple(dhcp, **attrs_to_mock) as mocks:
                 mocks['cache'].get_network_ids.return_value = known_networks
+                mocks['cache'].get_network_by_id.return_value = None
                 dhcp.sync_state()
 
                 exp_refresh = [
@@ -257,8 +266,11 @@ class TestDhcpAgent(base.BaseTestCase):
                 exp_disable = [mock.call(net_id) for net_id in diff]
 
                 mocks['cache'].assert_has_calls([mock.call.get_network_ids()])
-                mocks['refresh_dhcp_helper'].assert_has_called(exp_refresh)
-                mocks['disable_dhcp_helper'].assert_has_called(exp_disable)
+                mocks['refresh_dhcp_helper'].assert_has_calls(exp_refresh)
+                mocks['disable_dhcp_helper'].assert_has_calls(exp_disable)
+                mock_plugin.get_changed_networks_info.assert_called_once_with(
+                    None)
+                self.assertEqual('now', dhcp.sync_timestamp)
 
     def test_sync_state_initial(self):
         self._test_sync_state_helper([], ['a'])
@@ -269,10 +281,67 @@ class TestDhcpAgent(base.BaseTestCase):
     def test_sync_state_disabled_net(self):
         self._test_sync_state_helper(['b'], ['a'])
 
+    def _test_sync_state_changes(self, needs_resync=False):
+        changed = dhcp.NetModel(True, dict(id='a', subnets=[], ports=[]))
+        with mock.patch(DHCP_PLUGIN) as plug:
+            mock_plugin = mock.Mock()
+            mock_plugin.get_changed_networks_info.return_value = {
+                'networks': [changed],
+                'counts': {'a': [1, 1], 'b': [1, 2], 'c': [0, 1]},
+                'timestamp': 'now'}
+            plug.return_value = mock_plugin
+
+            dhcp_agt = dhcp_agent.DhcpAgent(HOSTNAME)
+            dhcp_agt.sync_timestamp = 'before'
+
+            def configure(network):
+                dhcp_agt.needs_resync = needs_resync
+
+            with contextlib.nested(
+                mock.patch.object(dhcp_agt, 'safe_configure_dhcp_for_network',
+                                  side_effect=configure),
+                mock.patch.object(dhcp_agt, 'refresh_dhcp_helper'),
+                mock.patch.object(dhcp_agt, '_is_cached_network_complete',
+                                  side_effect=lambda net_id, *c: net_id == 'c')
+            ) as (configure, refresh, complete):
+                dhcp_agt.sync_state()
+
+                mock_plugin.get_changed_networks_info.assert_called_once_with(
+                    'before')
+                configure.assert_called_once_with(changed)
+                # a is changed and c is complete
+                refresh.assert_called_once_with('b')
+                complete.assert_has_calls([mock.call('b', 1, 2),
+                                           mock.call('c', 0, 1)],
+                                          any_order=True)
+        return dhcp_agt
+
+    def test_sync_state_changes(self):
+        dhcp_agt = self._test_sync_state_changes()
+        self.assertEqual('now', dhcp_agt.sync_timestamp)
+
+    def test_sync_state_changes_failure_keeps_timestamp(self):
+        dhcp_agt = self._test_sync_state_changes(needs_resync=True)
+        self.assertEqual('before', dhcp_agt.sync_timestamp)
+
+    def test_is_cached_network_complete(self):
+        dhcp_agt = dhcp_agent.DhcpAgent(HOSTNAME)
+        network = dhcp.NetModel(True, dict(
+            id='a',
+            subnets=[dict(id='s1', enable_dhcp=True),
+                     dict(id='s2', enable_dhcp=False)],
+            ports=[dict(id='p1')]))
+        dhcp_agt.cache.put(network)
+        self.assertTrue(dhcp_agt._is_cached_network_complete('a', 1, 1))
+        self.assertFalse(dhcp_agt._is_cached_network_complete('a', 2, 1))
+        self.assertFalse(dhcp_agt._is_cached_network_complete('a', 1, 2))
+        self.assertTrue(dhcp_agt._is_cached_network_complete('b', 0, 3))
+        self.assertFalse(dhcp_agt._is_cached_network_complete('b', 1, 3))
+
     def test_sync_state_plugin_error(self):
         with mock.patch(DHCP_PLUGIN) as plug:
             mock_plugin = mock.Mock()
-            mock_plugin.get_active_networks_info.side_effect = Exception
+            mock_plugin.get_changed_networks_info.side_effect = Exception
             plug.return_value = mock_plugin
 
             with mock.patch.object(dhcp_agent.LOG, 'exception') as log:
@@ -679,6 +748,20 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
             self.dhcp.network_delete_end(None, payload)
             disable.assertCalledOnceWith(fake_network.id)
 
+    def test_safe_configure_dhcp_for_cached_network(self):
+        self.cache.get_network_by_id.return_value = fake_network
+        self.dhcp.safe_configure_dhcp_for_network(fake_network)
+        self.call_driver.assert_called_once_with('reload_allocations',
+                                                 fake_network)
+        self.cache.assert_has_calls([mock.call.put(fake_network)])
+
+    def test_safe_configure_dhcp_for_network_found_on_disk(self):
+        network = dhcp.NetModel(True, dict(id=fake_network.id,
+                                           subnets=[], ports=[]))
+        self.cache.get_network_by_id.return_value = network
+        self.dhcp.safe_configure_dhcp_for_network(fake_network)
+        self.call_driver.assert_called_once_with('enable', fake_network)
+
     def test_refresh_dhcp_helper_no_dhcp_enabled_networks(self):
         network = dhcp.NetModel(True, dict(id='net-id',
                                 tenant_id='aaaaaaaa-aaaa-aaaa-aaaaaaaaaaaa',
@@ -719,6 +802,7 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
         self.plugin.get_network_info.return_value = fake_network
 
         self.dhcp.subnet_update_end(None, payload)
+        self.dhcp.process_network_events()
 
         self.cache.assert_has_calls([mock.call.put(fake_network)])
         self.call_driver.assert_called_once_with('reload_allocations',
@@ -736,6 +820,7 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
         self.plugin.get_network_info.return_value = new_state
 
         self.dhcp.subnet_update_end(None, payload)
+        self.dhcp.process_network_events()
 
         self.cache.assert_has_calls([mock.call.put(new_state)])
         self.call_driver.assert_called_once_with('restart',
@@ -754,6 +839,7 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
         self.plugin.get_network_info.return_value = fake_network
 
         self.dhcp.subnet_delete_end(None, payload)
+        self.dhcp.process_network_events()
 
         self.cache.assert_has_calls([
             mock.call.get_network_by_subnet_id(
@@ -768,6 +854,7 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
         self.cache.get_network_by_id.return_value = fake_network
         self.cache.get_port_by_id.return_value = fake_port2
         self.dhcp.port_update_end(None, payload)
+        self.dhcp.process_network_events()
         self.cache.assert_has_calls(
             [mock.call.get_network_by_id(fake_port2.network_id),
              mock.call.get_port_by_id(fake_port2.id),
@@ -782,6 +869,7 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
         updated_fake_port1.fixed_ips[0].ip_address = '172.9.9.99'
         self.cache.get_port_by_id.return_value = updated_fake_port1
         self.dhcp.port_update_end(None, payload)
+        self.dhcp.process_network_events()
         self.cache.assert_has_calls(
             [mock.call.get_network_by_id(fake_port1.network_id),
              mock.call.get_port_by_id(fake_port1.id),
@@ -801,6 +889,7 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
         self.cache.get_port_by_id.return_value = fake_port2
 
         self.dhcp.port_delete_end(None, payload)
+        self.dhcp.process_network_events()
         removed_ips = [fixed_ip.ip_address
                        for fixed_ip in fake_port2.fixed_ips]
         self.cache.assert_has_calls(
@@ -814,6 +903,98 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
                                    mac_address=fake_port2.mac_address,
                                    removed_ips=removed_ips)])
 
+    def test_network_events_merged(self):
+        self.cache.get_network_by_id.return_value = fake_network
+        self.cache.get_port_by_id.return_value = None
+        for port in (fake_port1, fake_port2):
+            self.dhcp.port_update_end(None, dict(port=vars(port)))
+        self.assertEqual({'network_events_queued': 1,
+                          'network_events_latency': 0},
+                         self.dhcp.get_network_events_state())
+        self.assertFalse(self.call_driver.called)
+
+        self.dhcp.process_network_events()
+        self.call_driver.assert_called_once_with('reload_allocations',
+                                                 fake_network)
+        self.assertEqual({}, self.dhcp.network_events)
+
+    def test_network_events_refresh_supersedes_reload(self):
+        self.cache.get_network_by_id.return_value = fake_network
+        self.cache.get_port_by_id.return_value = None
+        self.plugin.get_network_info.return_value = fake_network
+        self.dhcp.port_update_end(None, dict(port=vars(fake_port1)))
+        self.dhcp.subnet_update_end(
+            None, dict(subnet=dict(network_id=fake_network.id)))
+        self.dhcp.process_network_events()
+        self.plugin.get_network_info.assert_called_once_with(fake_network.id)
+        self.call_driver.assert_called_once_with('reload_allocations',
+                                                 fake_network)
+
+    def test_network_events_processed_without_lock(self):
+        self.cache.get_network_by_id.return_value = fake_network
+        self.cache.get_port_by_id.return_value = None
+        self.dhcp.port_update_end(None, dict(port=vars(fake_port1)))
+        locked = []
+
+        def process_network_event(network_id, event):
+            sem = lockutils._semaphores.get('dhcp-agent')
+            locked.append(sem is not None and sem.locked())
+
+        with mock.patch.object(self.dhcp, '_process_network_event',
+                               side_effect=process_network_event):
+            self.dhcp.process_network_events()
+        self.assertEqual([False], locked)
+
+    def test_network_deleted_during_refresh(self):
+        self.cache.get_network_by_id.return_value = fake_network
+        self.dhcp.subnet_update_end(
+            None, dict(subnet=dict(network_id=fake_network.id)))
+
+        def get_network_info(network_id):
+            # The network is deleted while it is fetched
+            self.dhcp.network_delete_end(None,
+                                         dict(network_id=fake_network.id))
+            self.cache.get_network_by_id.return_value = None
+            return fake_network
+
+        self.plugin.get_network_info.side_effect = get_network_info
+        self.dhcp.process_network_events()
+        self.call_driver.assert_called_once_with('disable', fake_network)
+        self.assertFalse(self.cache.put.called)
+        # The network is fetched again, and found deleted on the server
+        self.assertTrue(self.dhcp.network_events[fake_network.id].refresh)
+        self.plugin.get_network_info.side_effect = None
+        self.plugin.get_network_info.return_value = None
+        self.dhcp.process_network_events()
+        self.call_driver.assert_called_once_with('disable', fake_network)
+        self.assertEqual({}, self.dhcp.network_events)
+
+    def test_port_updated_during_refresh(self):
+        self.cache.get_network_by_id.return_value = fake_network
+        self.cache.get_port_by_id.return_value = None
+        self.dhcp.subnet_update_end(
+            None, dict(subnet=dict(network_id=fake_network.id)))
+
+        def get_network_info(network_id):
+            self.dhcp.port_update_end(None, dict(port=vars(fake_port2)))
+            return fake_network
+
+        self.plugin.get_network_info.side_effect = get_network_info
+        self.dhcp.process_network_events()
+        # The older fetched network does not replace the updated cache
+        self.assertFalse(self.call_driver.called)
+        self.assertFalse(self.cache.put.called)
+        self.assertTrue(self.dhcp.network_events[fake_network.id].refresh)
+
+    def test_network_events_of_deleted_network(self):
+        self.cache.get_network_by_id.return_value = fake_network
+        self.cache.get_port_by_id.return_value = None
+        self.dhcp.port_update_end(None, dict(port=vars(fake_port1)))
+        with mock.patch.object(self.dhcp, 'disable_dhcp_helper'):
+            self.dhcp.network_delete_end(
+                None, dict(network_id=fake_network.id))
+        self.assertEqual({}, self.dhcp.network_events)
+
     def test_port_delete_end_unknown_port(self):
         payload = dict(port_id='unknown')
         self.cache.get_port_by_id.return_value = None
@@ -864,6 +1045,31 @@ class TestDhcpPluginApiProxy(base.BaseTestCase):
         self.make_msg.assert_called_once_with('get_active_networks_info',
                                               host='foo')
 
+    def test_get_changed_networks_info(self):
+        self.call.return_value = {'networks': [dict(id='a')],
+                                  'counts': {'a': [0, 0]},
+                                  'timestamp': 'now'}
+        changes = self.proxy.get_changed_networks_info('before')
+        self.make_msg.assert_called_once_with('get_changed_networks_info',
+                                              changed_since='before',
+                                              host='foo')
+        self.assertEqual('a', changes['networks'][0].id)
+        self.assertEqual({'a': [0, 0]}, changes['counts'])
+        self.assertEqual('now', changes['timestamp'])
+
+    def test_get_changed_networks_info_unsupported(self):
+        network = dict(id='a', ports=[dict(id='p1')],
+                       subnets=[dict(id='s1', enable_dhcp=True),
+                                dict(id='s2', enable_dhcp=False)])
+        self.call.side_effect = [common.RemoteError(exc_type='AttributeError'),
+                                 [network]]
+        changes = self.proxy.get_changed_networks_info('before')
+        self.make_msg.assert_called_with('get_active_networks_info',
+                                         host='foo')
+        self.assertEqual('a', changes['networks'][0].id)
+        self.assertEqual({'a': [1, 1]}, changes['counts'])
+        self.assertIsNone(changes['timestamp'])
+
     def test_create_dhcp_port(self):
         port_body = (
             {'port':
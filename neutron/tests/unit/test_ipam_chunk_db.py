@@ -0,0 +1,200 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+import netaddr
+from oslo.config import cfg
+
+from neutron import context
+from neutron.db import ipam_chunk_db
+from neutron.db import models_v2
+from neutron.manager import NeutronManager
+from neutron.tests.unit import test_db_plugin
+
+CHUNK_IPAM_DRIVER = 'neutron.db.ipam_chunk_db.ChunkIpamDriver'
+
+
+class ChunkIpamTestCase(test_db_plugin.NeutronDbPluginV2TestCase):
+
+    def setUp(self):
+        super(ChunkIpamTestCase, self).setUp()
+        cfg.CONF.set_override('ipam_driver', CHUNK_IPAM_DRIVER)
+
+    def _get_chunks(self, subnet_id):
+        ctx = context.get_admin_context()
+        query = ctx.session.query(models_v2.IPAllocationChunk).join(
+            models_v2.IPAllocationPool).filter(
+                models_v2.IPAllocationPool.subnet_id == subnet_id)
+        return dict((c['first_ip'], c) for c in query)
+
+
+class TestChunkIpamPortsV2(ChunkIpamTestCase, test_db_plugin.TestPortsV2):
+
+    def _test_recycle_ip_address(self, ip_to_recycle, allocation_pools=None):
+        plugin = NeutronManager.get_plugin()
+        if not allocation_pools:
+            allocation_pools = [{"start": '10.0.0.10',
+                                 "end": '10.0.0.50'}]
+        with self.subnet(cidr='10.0.0.0/24',
+                         allocation_pools=allocation_pools) as subnet:
+            network_id = subnet['subnet']['network_id']
+            subnet_id = subnet['subnet']['id']
+            fixed_ips = [{"subnet_id": subnet_id,
+                          "ip_address": ip_to_recycle}]
+            with self.port(subnet=subnet, fixed_ips=fixed_ips) as port:
+                ctx = context.Context('', port['port']['tenant_id'])
+                ip_address = port['port']['fixed_ips'][0]['ip_address']
+                plugin._recycle_ip(ctx, network_id, subnet_id, ip_address)
+
+                q = ctx.session.query(models_v2.IPAllocation)
+                q = q.filter_by(subnet_id=subnet_id)
+                self.assertEqual(q.count(), 0)
+                for chunk in self._get_chunks(subnet_id).values():
+                    self.assertEqual(chunk['bitmap'], '0')
+
+
+class TestChunkIpamSubnetsV2(ChunkIpamTestCase, test_db_plugin.TestSubnetsV2):
+    pass
+
+
+class TestChunkIpamAllocation(ChunkIpamTestCase):
+
+    def setUp(self):
+        super(TestChunkIpamAllocation, self).setUp()
+        cfg.CONF.import_opt('ipam_chunk_size', 'neutron.db.ipam_chunk_db')
+        cfg.CONF.set_override('ipam_chunk_size', 4)
+        cfg.CONF.set_override('ipam_chunk_prefetch', 2)
+
+    def test_chunks_prefetched_on_subnet_create(self):
+        with self.subnet(cidr='10.0.0.0/24') as subnet:
+            chunks = self._get_chunks(subnet['subnet']['id'])
+            self.assertEqual(sorted(chunks.keys()), ['10.0.0.2', '10.0.0.6'])
+            self.assertEqual(chunks['10.0.0.2']['last_ip'], '10.0.0.5')
+            self.assertEqual(chunks['10.0.0.2']['free_count'], 4)
+
+    def test_chunk_created_when_exhausted(self):
+        with self.subnet(cidr='10.0.0.0/24') as subnet:
+            subnet_id = subnet['subnet']['id']
+            res = self._create_port(
+                self.fmt, net_id=subnet['subnet']['network_id'],
+                fixed_ips=[{'subnet_id': subnet_id}] * 5)
+            port = self.deserialize(self.fmt, res)
+            # Addresses are taken from any of the prefetched chunks
+            for ip in port['port']['fixed_ips']:
+                self.assertIn(netaddr.IPAddress(ip['ip_address']),
+                              netaddr.IPRange('10.0.0.2', '10.0.0.9'))
+            res = self._create_port(
+                self.fmt, net_id=subnet['subnet']['network_id'],
+                fixed_ips=[{'subnet_id': subnet_id}] * 4)
+            port2 = self.deserialize(self.fmt, res)
+            chunks = self._get_chunks(subnet_id)
+            self.assertEqual(len(chunks), 3)
+            self.assertEqual(chunks['10.0.0.10']['free_count'], 3)
+            self._delete('ports', port['port']['id'])
+            self._delete('ports', port2['port']['id'])
+            chunks = self._get_chunks(subnet_id)
+            self.assertEqual(sum(c['free_count'] for c in chunks.values()),
+                             12)
+
+    def test_specific_ip_in_lazily_created_chunk(self):
+        with self.subnet(cidr='10.0.0.0/24') as subnet:
+            subnet_id = subnet['subnet']['id']
+            fixed_ips = [{'subnet_id': subnet_id,
+                          'ip_address': '10.0.0.200'}]
+            with self.port(subnet=subnet, fixed_ips=fixed_ips):
+                chunk = self._get_chunks(subnet_id)['10.0.0.198']
+                self.assertEqual(chunk['last_ip'], '10.0.0.201')
+                self.assertEqual(chunk['free_count'], 3)
+                self.assertEqual(chunk['bitmap'], '4')
+            chunk = self._get_chunks(subnet_id)['10.0.0.198']
+            self.assertEqual(chunk['free_count'], 4)
+
+    def test_v6_pool_chunks_created_on_demand(self):
+        with self.subnet(cidr='2607:f0d0:1002:51::/64',
+                         ip_version=6) as subnet:
+            chunks = self._get_chunks(subnet['subnet']['id'])
+            self.assertEqual(len(chunks), 2)
+            with self.port(subnet=subnet) as port:
+                ips = port['port']['fixed_ips']
+                self.assertIn(ips[0]['ip_address'],
+                              ['2607:f0d0:1002:51::2', '2607:f0d0:1002:51::6'])
+
+    def test_driver_enabled_after_ports_created(self):
+        cfg.CONF.set_override('ipam_driver', None)
+        with self.subnet(cidr='10.0.0.0/24') as subnet:
+            subnet_id = subnet['subnet']['id']
+            net_id = subnet['subnet']['network_id']
+            res = self._create_port(
+                self.fmt, net_id=net_id,
+                fixed_ips=[{'subnet_id': subnet_id}] * 4 +
+                [{'subnet_id': subnet_id, 'ip_address': '10.0.0.8'}])
+            port = self.deserialize(self.fmt, res)
+            ips = set(ip['ip_address'] for ip in port['port']['fixed_ips'])
+            self.assertEqual(set(['10.0.0.2', '10.0.0.3', '10.0.0.4',
+                                  '10.0.0.5', '10.0.0.8']), ips)
+            self.assertEqual({}, self._get_chunks(subnet_id))
+
+            cfg.CONF.set_override('ipam_driver', CHUNK_IPAM_DRIVER)
+            res = self._create_port(
+                self.fmt, net_id=net_id,
+                fixed_ips=[{'subnet_id': subnet_id}] * 3)
+            port2 = self.deserialize(self.fmt, res)
+            ips2 = [ip['ip_address'] for ip in port2['port']['fixed_ips']]
+            self.assertEqual(['10.0.0.6', '10.0.0.7', '10.0.0.9'],
+                             sorted(ips2, key=netaddr.IPAddress))
+            chunks = self._get_chunks(subnet_id)
+            # The first chunk was created full, and skipped
+            self.assertEqual(chunks['10.0.0.2']['free_count'], 0)
+            self.assertEqual(chunks['10.0.0.2']['bitmap'], 'f')
+            self.assertEqual(chunks['10.0.0.6']['free_count'], 0)
+            self._delete('ports', port['port']['id'])
+            self._delete('ports', port2['port']['id'])
+            chunks = self._get_chunks(subnet_id)
+            self.assertEqual(sum(c['free_count'] for c in chunks.values()),
+                             8)
+
+    def test_allocated_addresses_of_chunk(self):
+        cfg.CONF.set_override('ipam_driver', None)
+        with self.subnet(cidr='10.0.0.0/24') as subnet:
+            subnet_id = subnet['subnet']['id']
+            fixed_ips = [{'subnet_id': subnet_id, 'ip_address': ip}
+                         for ip in ('10.0.0.2', '10.0.0.5', '10.0.0.6',
+                                    '10.0.0.9')]
+            with self.port(subnet=subnet, fixed_ips=fixed_ips):
+                driver = ipam_chunk_db.ChunkIpamDriver()
+                ip_pool = {'subnet_id': subnet_id, 'first_ip': '10.0.0.2'}
+                first = int(netaddr.IPAddress('10.0.0.2'))
+                # The addresses are looked up in several queries
+                with mock.patch.object(ipam_chunk_db, 'MAX_QUERY_ADDRESSES',
+                                       2):
+                    self.assertEqual(
+                        set([0, 3, 4]),
+                        driver._get_allocated(context.get_admin_context(),
+                                              ip_pool, first, first + 4))
+
+    def test_subnet_exhausted(self):
+        with self.subnet(cidr='10.0.0.0/29') as subnet:
+            subnet_id = subnet['subnet']['id']
+            res = self._create_port(
+                self.fmt, net_id=subnet['subnet']['network_id'],
+                fixed_ips=[{'subnet_id': subnet_id}] * 5)
+            port = self.deserialize(self.fmt, res)
+            res = self._create_port(
+                self.fmt, net_id=subnet['subnet']['network_id'],
+                fixed_ips=[{'subnet_id': subnet_id}])
+            self.assertEqual(res.status_int, 409)
+            self._delete('ports', port['port']['id'])
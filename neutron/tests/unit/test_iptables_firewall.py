@@ -23,6 +23,7 @@ from oslo.config import cfg
 
 from neutron.agent.common import config as a_cfg
 from neutron.agent.linux.iptables_firewall import IptablesFirewallDriver
+from neutron.agent import securitygroups_rpc as sg_cfg
 from neutron.common import constants
 from neutron.tests import base
 from neutron.tests.unit import test_api_v2
@@ -39,6 +40,7 @@ class IptablesFirewallTestCase(base.BaseTestCase):
     def setUp(self):
         super(IptablesFirewallTestCase, self).setUp()
         cfg.CONF.register_opts(a_cfg.ROOT_HELPER_OPTS, 'AGENT')
+        cfg.CONF.register_opts(sg_cfg.security_group_opts, 'SECURITYGROUP')
         self.utils_exec_p = mock.patch(
             'neutron.agent.linux.utils.execute')
         self.utils_exec = self.utils_exec_p.start()
@@ -1134,3 +1136,97 @@ class IptablesFirewallTestCase(base.BaseTestCase):
                  call.add_rule('ofake_dev', '-j $sg-fallback'),
                  call.add_rule('sg-chain', '-j ACCEPT')]
         self.v4filter_inst.assert_has_calls(calls)
+
+
+class IptablesFirewallIpsetTestCase(IptablesFirewallTestCase):
+    def setUp(self):
+        cfg.CONF.register_opts(sg_cfg.security_group_opts, 'SECURITYGROUP')
+        cfg.CONF.set_override('enable_ipset', True, 'SECURITYGROUP')
+        super(IptablesFirewallIpsetTestCase, self).setUp()
+        self.ipset = mock.Mock()
+        self.ipset.get_name.side_effect = lambda id, ethertype: (
+            'N%s%s' % (ethertype, id))
+        self.firewall.ipset = self.ipset
+
+    def test_defer_apply(self):
+        with self.firewall.defer_apply():
+            pass
+        self.iptables_inst.assert_has_calls(
+            [call.defer_apply_on(), call.defer_apply_off(apply=False)])
+
+    def test_filter_defer_with_exception(self):
+        try:
+            with self.firewall.defer_apply():
+                raise Exception("same exception")
+        except Exception:
+            pass
+        self.iptables_inst.assert_has_calls(
+            [call.defer_apply_on(), call.defer_apply_off(apply=False)])
+
+    def _remote_group_port(self, member_ips):
+        port = self._fake_port()
+        port['security_group_rules'] = [
+            {'ethertype': 'IPv4', 'direction': 'ingress',
+             'protocol': 'tcp', 'port_range_min': 22, 'port_range_max': 22,
+             'remote_group_id': 'sg1', 'source_ip_prefix': '%s/32' % ip}
+            for ip in member_ips]
+        return port
+
+    def test_remote_group_single_rule(self):
+        port = self._remote_group_port(['10.0.0.2', '10.0.0.3'])
+        self.firewall.prepare_port_filter(port)
+        self.ipset.set_members.assert_called_once_with(
+            'sg1', 'IPv4', set(['10.0.0.2/32', '10.0.0.3/32']))
+        rule = ('-p tcp -m tcp --dport 22 -m set --match-set NIPv4sg1 src '
+                '-j RETURN')
+        self.assertEqual(
+            1, self.v4filter_inst.add_rule.call_args_list.count(
+                call('ifake_dev', rule)))
+        for args, kwargs in self.v4filter_inst.add_rule.call_args_list:
+            self.assertNotIn('10.0.0.2', args[1])
+
+    def test_member_update_does_not_rewrite_chains(self):
+        self.firewall.prepare_port_filter(
+            self._remote_group_port(['10.0.0.2']))
+        self.v4filter_inst.reset_mock()
+        self.iptables_inst.reset_mock()
+        self.ipset.reset_mock()
+        self.firewall.update_port_filter(
+            self._remote_group_port(['10.0.0.2', '10.0.0.3']))
+        self.ipset.set_members.assert_called_once_with(
+            'sg1', 'IPv4', set(['10.0.0.2/32', '10.0.0.3/32']))
+        self.assertFalse(self.v4filter_inst.add_rule.called)
+        self.assertFalse(self.v4filter_inst.ensure_remove_chain.called)
+        self.assertFalse(self.iptables_inst.apply.called)
+
+    def test_member_update_deferred_does_not_apply(self):
+        self.firewall.prepare_port_filter(
+            self._remote_group_port(['10.0.0.2']))
+        self.v4filter_inst.reset_mock()
+        self.iptables_inst.reset_mock()
+        with self.firewall.defer_apply():
+            self.firewall.update_port_filter(
+                self._remote_group_port(['10.0.0.3']))
+        self.assertFalse(self.v4filter_inst.add_rule.called)
+        self.iptables_inst.assert_has_calls(
+            [call.defer_apply_on(), call.defer_apply_off(apply=False)])
+        self.ipset.set_members.assert_called_with(
+            'sg1', 'IPv4', set(['10.0.0.3/32']))
+
+    def test_rule_update_rewrites_chains(self):
+        self.firewall.prepare_port_filter(
+            self._remote_group_port(['10.0.0.2']))
+        self.v4filter_inst.reset_mock()
+        port = self._remote_group_port(['10.0.0.2'])
+        port['security_group_rules'][0]['port_range_max'] = 23
+        self.firewall.update_port_filter(port)
+        self.v4filter_inst.add_rule.assert_any_call(
+            'ifake_dev',
+            '-p tcp -m tcp -m multiport --dports 22:23 '
+            '-m set --match-set NIPv4sg1 src -j RETURN')
+
+    def test_unused_sets_destroyed_after_apply(self):
+        port = self._remote_group_port(['10.0.0.2'])
+        self.firewall.prepare_port_filter(port)
+        self.firewall.remove_port_filter(port)
+        self.ipset.destroy_unused.assert_called_with([])
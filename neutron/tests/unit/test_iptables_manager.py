@@ -21,6 +21,7 @@ import inspect
 import os
 
 import mock
+from oslo.config import cfg
 
 from neutron.agent.linux import iptables_manager
 from neutron.tests import base
@@ -556,3 +557,141 @@ class IptablesManagerStateLessTestCase(base.BaseTestCase):
 
     def test_nat_not_found(self):
         self.assertNotIn('nat', self.iptables.ipv4)
+
+
+class IptablesManagerIncrementalTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(IptablesManagerIncrementalTestCase, self).setUp()
+        cfg.CONF.set_override('iptables_incremental_apply', True)
+        self.iptables = iptables_manager.IptablesManager(state_less=True)
+        self.kernel_dump = FILTER_DUMP
+        self.execute = mock.patch.object(self.iptables, 'execute').start()
+        self.execute.side_effect = self._execute
+        self.addCleanup(mock.patch.stopall)
+        self.iptables.apply()
+        self.execute.reset_mock()
+
+    def _execute(self, args, process_input=None, root_helper=None):
+        if args[0].endswith('-save'):
+            return self.kernel_dump
+        if args[1] == '-n':
+            self._restore_noflush(process_input)
+        return ''
+
+    def _restore_noflush(self, process_input):
+        """Apply an iptables-restore --noflush input to the kernel dump."""
+        dump = self.kernel_dump.split('\n')
+        for line in process_input.split('\n'):
+            if line.startswith('*'):
+                table = dump.index(line)
+                commit = dump.index('COMMIT', table)
+            elif line.startswith(':'):
+                name = line.split()[0][1:]
+                prefix = '[0:0] -A %s ' % name
+                rules = [i for i, l in enumerate(dump)
+                         if table < i < commit and l.startswith(prefix)]
+                for i in reversed(rules):
+                    del dump[i]
+                commit -= len(rules)
+                if line not in dump[table:commit]:
+                    dump.insert(table + 1, line)
+                    commit += 1
+            elif line.startswith('-A '):
+                dump.insert(commit, '[0:0] ' + line)
+                commit += 1
+            elif line.startswith('-X '):
+                dump.remove(':%s - [0:0]' % line.split()[1])
+                commit -= 1
+        self.kernel_dump = '\n'.join(dump)
+
+    def _restores(self):
+        return [c for c in self.execute.call_args_list
+                if c[0][0][0].endswith('-restore')]
+
+    def test_first_apply_restores_everything(self):
+        iptables = iptables_manager.IptablesManager(state_less=True)
+        with mock.patch.object(iptables, 'execute',
+                               side_effect=self._execute) as execute:
+            iptables.apply()
+            self.assertEqual(execute.call_args_list[0][0][0],
+                             ['iptables-save', '-c'])
+            self.assertEqual(execute.call_args_list[1][0][0],
+                             ['iptables-restore', '-c'])
+
+    def test_unchanged_rules_not_restored(self):
+        self.iptables.apply()
+        self.execute.assert_called_once_with(['iptables-save', '-c'],
+                                             process_input=None,
+                                             root_helper=None)
+
+    def test_incremental_apply_saves_once(self):
+        for rule in ('-j DROP', '-j ACCEPT'):
+            self.execute.reset_mock()
+            self.iptables.ipv4['filter'].add_rule('INPUT', rule)
+            self.iptables.apply()
+            self.assertEqual([['iptables-save', '-c'],
+                              ['iptables-restore', '-n']],
+                             [c[0][0] for c in self.execute.call_args_list])
+
+    def test_kernel_change_saves_once(self):
+        self.kernel_dump = FILTER_DUMP.replace(
+            '[0:0] -A INPUT -j %(bn)s-INPUT\n' % IPTABLES_ARG, '')
+        self.iptables.apply()
+        self.assertEqual([['iptables-save', '-c'],
+                          ['iptables-restore', '-c']],
+                         [c[0][0] for c in self.execute.call_args_list])
+
+    def test_only_changed_chains_restored(self):
+        self.iptables.ipv4['filter'].add_chain('filter')
+        self.iptables.ipv4['filter'].add_rule('filter', '-j DROP')
+        self.iptables.ipv4['filter'].add_rule('INPUT', '-s 0/0 -d 192.168.0.2')
+        self.iptables.apply()
+        restores = self._restores()
+        self.assertEqual(len(restores), 1)
+        self.assertEqual(restores[0][0][0], ['iptables-restore', '-n'])
+        self.assertEqual(restores[0][1]['process_input'],
+                         '*filter\n'
+                         ':%(bn)s-INPUT - [0:0]\n'
+                         ':%(bn)s-filter - [0:0]\n'
+                         '-A %(bn)s-INPUT -s 0/0 -d 192.168.0.2\n'
+                         '-A %(bn)s-filter -j DROP\n'
+                         'COMMIT\n' % IPTABLES_ARG)
+
+    def test_removed_chain_deleted(self):
+        self.iptables.ipv4['filter'].add_chain('filter')
+        self.iptables.ipv4['filter'].add_rule('filter', '-j DROP')
+        self.iptables.ipv4['filter'].add_rule('INPUT', '-j $filter')
+        self.iptables.apply()
+        self.execute.reset_mock()
+        self.iptables.ipv4['filter'].remove_chain('filter')
+        self.iptables.apply()
+        restores = self._restores()
+        self.assertEqual(restores[0][1]['process_input'],
+                         '*filter\n'
+                         ':%(bn)s-INPUT - [0:0]\n'
+                         ':%(bn)s-filter - [0:0]\n'
+                         '-X %(bn)s-filter\n'
+                         'COMMIT\n' % IPTABLES_ARG)
+
+    def test_kernel_change_restores_everything(self):
+        self.kernel_dump = FILTER_DUMP.replace(
+            '[0:0] -A INPUT -j %(bn)s-INPUT\n' % IPTABLES_ARG, '')
+        self.iptables.ipv4['filter'].add_rule('INPUT', '-j DROP')
+        self.iptables.apply()
+        restores = self._restores()
+        self.assertEqual(restores[0][0][0], ['iptables-restore', '-c'])
+
+    def test_unwrapped_change_restores_everything(self):
+        self.iptables.ipv4['filter'].add_rule('FORWARD', '-j DROP',
+                                              wrap=False)
+        self.iptables.apply()
+        restores = self._restores()
+        self.assertEqual(restores[0][0][0], ['iptables-restore', '-c'])
+
+    def test_counters_ignored_by_checksum(self):
+        self.kernel_dump = FILTER_DUMP.replace(
+            ':%(bn)s-INPUT - [0:0]' % IPTABLES_ARG,
+            ':%(bn)s-INPUT - [42:4242]' % IPTABLES_ARG)
+        self.iptables.apply()
+        self.assertEqual(self._restores(), [])
@@ -15,7 +15,9 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
 import copy
+import datetime
 
 import mock
 from oslo.config import cfg
@@ -26,6 +28,7 @@ from neutron.agent import l3_agent
 from neutron.agent.linux import interface
 from neutron.common import config as base_config
 from neutron.common import constants as l3_constants
+from neutron.openstack.common import timeutils
 from neutron.openstack.common import uuidutils
 from neutron.tests import base
 
@@ -35,6 +38,64 @@ HOSTNAME = 'myhost'
 FAKE_ID = _uuid()
 
 
+class TestRouterProcessingQueue(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestRouterProcessingQueue, self).setUp()
+        self.queue = l3_agent.RouterProcessingQueue()
+        self.now = datetime.datetime(2014, 2, 3, 10, 0)
+
+    def _update(self, router_id, priority, seconds=0, **kwargs):
+        return l3_agent.RouterUpdate(
+            router_id, priority,
+            timestamp=self.now + datetime.timedelta(seconds=seconds),
+            **kwargs)
+
+    def test_priority(self):
+        self.queue.add(self._update('a', l3_agent.PRIORITY_SYNC_ROUTERS_TASK))
+        self.queue.add(self._update('b', l3_agent.PRIORITY_RPC, 1))
+        self.assertEqual('b', self.queue.get().id)
+        self.assertEqual('a', self.queue.get().id)
+
+    def test_updates_merged(self):
+        sync = self._update('a', l3_agent.PRIORITY_SYNC_ROUTERS_TASK,
+                            router={'id': 'a'})
+        self.queue.add(sync)
+        self.queue.add(self._update('a', l3_agent.PRIORITY_RPC, 1))
+        self.queue.add(self._update('b', l3_agent.PRIORITY_RPC, 2))
+        self.assertEqual(2, len(self.queue))
+        update = self.queue.get()
+        # The newest update is kept, with the highest priority
+        self.assertEqual('a', update.id)
+        self.assertIsNone(update.router)
+        self.assertEqual(l3_agent.PRIORITY_RPC, update.priority)
+        self.assertIsNone(self.queue.done('a'))
+        self.assertEqual('b', self.queue.get().id)
+        self.assertEqual(0, len(self.queue))
+
+    def test_older_update_merged(self):
+        self.queue.add(self._update('a', l3_agent.PRIORITY_SYNC_ROUTERS_TASK,
+                                    1, router={'id': 'a'}))
+        self.queue.add(self._update('a', l3_agent.PRIORITY_RPC))
+        update = self.queue.get()
+        self.assertEqual({'id': 'a'}, update.router)
+        self.assertEqual(l3_agent.PRIORITY_RPC, update.priority)
+
+    def test_router_in_progress(self):
+        self.queue.add(self._update('a', l3_agent.PRIORITY_RPC))
+        self.assertEqual('a', self.queue.get().id)
+        self.queue.add(self._update('a', l3_agent.PRIORITY_RPC, 1,
+                                    action=l3_agent.DELETE_ROUTER))
+        self.queue.add(self._update('b', l3_agent.PRIORITY_RPC, 2))
+        # a is in progress, its update is returned once it is done
+        self.assertEqual('b', self.queue.get().id)
+        update = self.queue.done('a')
+        self.assertEqual(l3_agent.DELETE_ROUTER, update.action)
+        self.assertIsNone(self.queue.done('a'))
+        self.queue.add(self._update('a', l3_agent.PRIORITY_RPC, 3))
+        self.assertEqual('a', self.queue.get().id)
+
+
 class TestBasicRouterOperations(base.BaseTestCase):
 
     def setUp(self):
@@ -422,8 +483,7 @@ class TestBasicRouterOperations(base.BaseTestCase):
         IPDevice.return_value = device = mock.Mock()
         device.addr.list.return_value = []
 
-        ri = mock.MagicMock()
-        ri.router.get.return_value = [fip]
+        ri = self._floating_ips_router_info([fip])
 
         agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
 
@@ -432,18 +492,28 @@ class TestBasicRouterOperations(base.BaseTestCase):
         device.addr.add.assert_called_once_with(4, '15.1.2.3/32', '15.1.2.3')
 
         nat = ri.iptables_manager.ipv4['nat']
-        nat.clear_rules_by_tag.assert_called_once_with('floating_ip')
+        self.assertFalse(nat.remove_rule.called)
         rules = agent.floating_forward_rules('15.1.2.3', '192.168.0.1')
         for chain, rule in rules:
             nat.add_rule.assert_any_call(chain, rule, tag='floating_ip')
+        self.assertEqual({'15.1.2.3': '192.168.0.1'}, ri.floating_ips)
+        self.assertEqual(set(['15.1.2.3/32']), ri.floating_ip_cidrs)
+
+    def _floating_ips_router_info(self, fips, floating_ips=None,
+                                  floating_ip_cidrs=None):
+        ri = mock.MagicMock()
+        ri.router.get.return_value = fips
+        ri.floating_ips = floating_ips or {}
+        ri.floating_ip_cidrs = floating_ip_cidrs
+        return ri
 
     @mock.patch('neutron.agent.linux.ip_lib.IPDevice')
     def test_process_router_floating_ip_remove(self, IPDevice):
         IPDevice.return_value = device = mock.Mock()
         device.addr.list.return_value = [{'cidr': '15.1.2.3/32'}]
 
-        ri = mock.MagicMock()
-        ri.router.get.return_value = []
+        ri = self._floating_ips_router_info(
+            [], floating_ips={'15.1.2.3': '192.168.0.1'})
 
         agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
 
@@ -452,8 +522,12 @@ class TestBasicRouterOperations(base.BaseTestCase):
         device.addr.delete.assert_called_once_with(4, '15.1.2.3/32')
 
         nat = ri.iptables_manager.ipv4['nat']
-        nat = ri.iptables_manager.ipv4['nat']
-        nat.clear_rules_by_tag.assert_called_once_with('floating_ip')
+        self.assertFalse(nat.add_rule.called)
+        rules = agent.floating_forward_rules('15.1.2.3', '192.168.0.1')
+        for chain, rule in rules:
+            nat.remove_rule.assert_any_call(chain, rule)
+        self.assertEqual({}, ri.floating_ips)
+        self.assertEqual(set(), ri.floating_ip_cidrs)
 
     @mock.patch('neutron.agent.linux.ip_lib.IPDevice')
     def test_process_router_floating_ip_remap(self, IPDevice):
@@ -465,9 +539,8 @@ class TestBasicRouterOperations(base.BaseTestCase):
 
         IPDevice.return_value = device = mock.Mock()
         device.addr.list.return_value = [{'cidr': '15.1.2.3/32'}]
-        ri = mock.MagicMock()
-
-        ri.router.get.return_value = [fip]
+        ri = self._floating_ips_router_info(
+            [fip], floating_ips={'15.1.2.3': '192.168.0.1'})
 
         agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
 
@@ -477,11 +550,56 @@ class TestBasicRouterOperations(base.BaseTestCase):
         self.assertFalse(device.addr.delete.called)
 
         nat = ri.iptables_manager.ipv4['nat']
-        nat.clear_rules_by_tag.assert_called_once_with('floating_ip')
+        rules = agent.floating_forward_rules('15.1.2.3', '192.168.0.1')
+        for chain, rule in rules:
+            nat.remove_rule.assert_any_call(chain, rule)
         rules = agent.floating_forward_rules('15.1.2.3', '192.168.0.2')
         for chain, rule in rules:
             nat.add_rule.assert_any_call(chain, rule, tag='floating_ip')
 
+    @mock.patch('neutron.agent.linux.ip_lib.IPDevice')
+    def test_process_router_floating_ip_unchanged(self, IPDevice):
+        fip = {
+            'id': _uuid(), 'port_id': _uuid(),
+            'floating_ip_address': '15.1.2.3',
+            'fixed_ip_address': '192.168.0.1'
+        }
+        IPDevice.return_value = device = mock.Mock()
+        ri = self._floating_ips_router_info(
+            [fip], floating_ips={'15.1.2.3': '192.168.0.1'},
+            floating_ip_cidrs=set(['15.1.2.3/32']))
+
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+
+        agent.process_router_floating_ips(ri, {'id': _uuid()})
+
+        # The addresses are not listed, nothing is changed
+        self.assertFalse(device.addr.list.called)
+        self.assertFalse(device.addr.add.called)
+        self.assertFalse(device.addr.delete.called)
+        nat = ri.iptables_manager.ipv4['nat']
+        self.assertFalse(nat.add_rule.called)
+        self.assertFalse(nat.remove_rule.called)
+
+    @mock.patch('neutron.agent.linux.ip_lib.IPDevice')
+    def test_process_router_floating_ip_add_failure(self, IPDevice):
+        fip = {
+            'id': _uuid(), 'port_id': _uuid(),
+            'floating_ip_address': '15.1.2.3',
+            'fixed_ip_address': '192.168.0.1'
+        }
+        IPDevice.return_value = device = mock.Mock()
+        device.addr.add.side_effect = RuntimeError
+        ri = self._floating_ips_router_info([fip],
+                                            floating_ip_cidrs=set())
+
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+
+        self.assertRaises(RuntimeError, agent.process_router_floating_ips,
+                          ri, {'id': _uuid()})
+        # The addresses are listed again on the next processing
+        self.assertIsNone(ri.floating_ip_cidrs)
+
     def test_process_router_snat_disabled(self):
         agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
         router = self._prepare_router_data(enable_snat=True)
@@ -574,6 +692,19 @@ class TestBasicRouterOperations(base.BaseTestCase):
         self._verify_snat_rules(nat_rules_delta, router, negate=True)
         self.send_arp.assert_called_once()
 
+    def test_handle_router_snat_rules_unchanged(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        ri = mock.MagicMock()
+        port = {'fixed_ips': [{'ip_address': '192.168.1.4'}]}
+        ri.snat_rules = agent.external_gateway_nat_rules(
+            '192.168.1.4', ['10.0.0.0/24'], 'iface')
+
+        agent._handle_router_snat_rules(ri, port, ['10.0.0.0/24'], 'iface',
+                                        'add_rules')
+
+        self.assertFalse(ri.iptables_manager.ipv4['nat'].empty_chain.called)
+        self.assertFalse(ri.iptables_manager.apply.called)
+
     def test_handle_router_snat_rules_add_back_jump(self):
         agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
         ri = mock.MagicMock()
@@ -626,29 +757,197 @@ class TestBasicRouterOperations(base.BaseTestCase):
         agent._process_routers(routers)
         self.assertNotIn(routers[0]['id'], agent.router_info)
 
+    def _assert_queued(self, agent, router_id, action=None):
+        update = agent._queue.get()
+        self.assertEqual(router_id, update.id)
+        self.assertEqual(l3_agent.PRIORITY_RPC, update.priority)
+        self.assertEqual(action, update.action)
+        self.assertIsNone(update.router)
+
     def test_router_deleted(self):
         agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
         agent.router_deleted(None, FAKE_ID)
-        # verify that will set fullsync
-        self.assertIn(FAKE_ID, agent.removed_routers)
+        self._assert_queued(agent, FAKE_ID, l3_agent.DELETE_ROUTER)
 
     def test_routers_updated(self):
         agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
         agent.routers_updated(None, [FAKE_ID])
-        # verify that will set fullsync
-        self.assertIn(FAKE_ID, agent.updated_routers)
+        self._assert_queued(agent, FAKE_ID)
 
     def test_removed_from_agent(self):
         agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
         agent.router_removed_from_agent(None, {'router_id': FAKE_ID})
-        # verify that will set fullsync
-        self.assertIn(FAKE_ID, agent.removed_routers)
+        self._assert_queued(agent, FAKE_ID, l3_agent.DELETE_ROUTER)
 
     def test_added_to_agent(self):
         agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
         agent.router_added_to_agent(None, [FAKE_ID])
-        # verify that will set fullsync
-        self.assertIn(FAKE_ID, agent.updated_routers)
+        self._assert_queued(agent, FAKE_ID)
+
+    def test_process_router_update_fetches_router(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        router = {'id': FAKE_ID}
+        self.plugin_api.get_routers.return_value = [router]
+        with mock.patch.object(agent, '_process_routers') as process:
+            agent._process_router_update(
+                l3_agent.RouterUpdate(FAKE_ID, l3_agent.PRIORITY_RPC))
+        self.plugin_api.get_routers.assert_called_once_with(agent.context,
+                                                            [FAKE_ID])
+        process.assert_called_once_with([router])
+        self.assertIn(FAKE_ID, agent._router_timestamps)
+
+    def test_process_router_update_with_router(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        router = {'id': FAKE_ID}
+        with mock.patch.object(agent, '_process_routers') as process:
+            agent._process_router_update(l3_agent.RouterUpdate(
+                FAKE_ID, l3_agent.PRIORITY_SYNC_ROUTERS_TASK, router=router))
+        self.assertFalse(self.plugin_api.get_routers.called)
+        process.assert_called_once_with([router])
+
+    def test_process_router_update_router_gone(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        agent.router_info[FAKE_ID] = mock.Mock()
+        self.plugin_api.get_routers.return_value = []
+        with mock.patch.object(agent, '_router_removed') as removed:
+            agent._process_router_update(
+                l3_agent.RouterUpdate(FAKE_ID, l3_agent.PRIORITY_RPC))
+        removed.assert_called_once_with(FAKE_ID)
+
+    def test_process_router_update_skips_stale_update(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        now = timeutils.utcnow()
+        agent._router_timestamps[FAKE_ID] = now
+        with mock.patch.object(agent, '_router_removed') as removed:
+            agent._process_router_update(l3_agent.RouterUpdate(
+                FAKE_ID, l3_agent.PRIORITY_SYNC_ROUTERS_TASK,
+                action=l3_agent.DELETE_ROUTER,
+                timestamp=now - datetime.timedelta(seconds=1)))
+        self.assertFalse(removed.called)
+
+    def test_process_router_update_failure(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        agent.fullsync = False
+        self.plugin_api.get_routers.side_effect = Exception
+        agent._process_router_update(
+            l3_agent.RouterUpdate(FAKE_ID, l3_agent.PRIORITY_RPC))
+        self.assertTrue(agent.fullsync)
+        self.assertNotIn(FAKE_ID, agent._router_timestamps)
+
+    def test_process_router_updates_until_done(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        agent.routers_updated(None, [FAKE_ID])
+
+        def process(update):
+            if not process.called:
+                process.called = True
+                agent.router_deleted(None, FAKE_ID)
+        process.called = False
+
+        with mock.patch.object(agent, '_process_router_update',
+                               side_effect=process) as process_update:
+            agent._process_router_updates()
+        self.assertEqual([None, l3_agent.DELETE_ROUTER],
+                         [c[0][0].action
+                          for c in process_update.call_args_list])
+        self.assertEqual(0, len(agent._queue))
+
+    def _verify_router_info(self):
+        ri = l3_agent.RouterInfo(FAKE_ID, self.conf.root_helper,
+                                 self.conf.use_namespaces, None)
+        ri.internal_ports = [{'id': 'p1'}, {'id': 'p2'}]
+        ri.ex_gw_port = {'id': 'gw'}
+        ri.floating_ip_cidrs = set(['15.1.2.3/32'])
+        return ri
+
+    @mock.patch('neutron.agent.linux.ip_lib.IPDevice')
+    def test_verify_router(self, IPDevice):
+        IPDevice.return_value.addr.list.return_value = [
+            {'cidr': '15.1.2.1/24'}, {'cidr': '15.1.2.3/32'}]
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        ri = self._verify_router_info()
+        self.device_exists.return_value = True
+
+        agent._verify_router(ri)
+
+        self.assertEqual(2, len(ri.internal_ports))
+        self.assertEqual({'id': 'gw'}, ri.ex_gw_port)
+        self.assertEqual(set(['15.1.2.3/32']), ri.floating_ip_cidrs)
+
+    @mock.patch('neutron.agent.linux.ip_lib.IPDevice')
+    def test_verify_router_mismatch(self, IPDevice):
+        IPDevice.return_value.addr.list.return_value = []
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        ri = self._verify_router_info()
+        missing = agent.get_internal_device_name('p2')
+        self.device_exists.side_effect = lambda name, **kwargs: (
+            name != missing)
+
+        agent._verify_router(ri)
+
+        self.assertEqual([{'id': 'p1'}], ri.internal_ports)
+        self.assertEqual({'id': 'gw'}, ri.ex_gw_port)
+        self.assertIsNone(ri.floating_ip_cidrs)
+
+    def test_verify_router_gateway_missing(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        ri = self._verify_router_info()
+        gateway = agent.get_external_device_name('gw')
+        self.device_exists.side_effect = lambda name, **kwargs: (
+            name != gateway)
+
+        agent._verify_router(ri)
+
+        self.assertIsNone(ri.ex_gw_port)
+        self.assertIsNone(ri.floating_ip_cidrs)
+
+    def test_verify_routers_task(self):
+        self.conf.set_override('router_verify_interval', 60)
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        ri = mock.Mock()
+        agent.router_info = {FAKE_ID: ri, 'unprocessed': mock.Mock()}
+        timestamp = timeutils.utcnow()
+        agent._router_timestamps[FAKE_ID] = timestamp
+
+        agent._verify_routers_task(agent.context)
+        self.assertEqual(0, len(agent._queue))
+
+        agent._verified_at -= 60
+        agent._verify_routers_task(agent.context)
+        self.assertEqual(1, len(agent._queue))
+        update = agent._queue.get()
+        self.assertEqual(FAKE_ID, update.id)
+        self.assertTrue(update.verify)
+        self.assertEqual(ri.router, update.router)
+        self.assertEqual(timestamp, update.timestamp)
+
+    def test_process_router_update_verify(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        ri = agent.router_info[FAKE_ID] = mock.Mock()
+        with contextlib.nested(
+            mock.patch.object(agent, '_verify_router'),
+            mock.patch.object(agent, '_process_routers')
+        ) as (verify, process):
+            agent._process_router_update(l3_agent.RouterUpdate(
+                FAKE_ID, l3_agent.PRIORITY_SYNC_ROUTERS_TASK,
+                router=ri.router, verify=True))
+        verify.assert_called_once_with(ri)
+        process.assert_called_once_with([ri.router])
+
+    def test_sync_routers_task(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        agent.router_info['removed'] = mock.Mock()
+        router = {'id': FAKE_ID}
+        self.plugin_api.get_routers.return_value = [router]
+        agent._sync_routers_task(agent.context)
+        self.assertFalse(agent.fullsync)
+        updates = dict((u.id, u) for u in (agent._queue.get(),
+                                           agent._queue.get()))
+        self.assertEqual(router, updates[FAKE_ID].router)
+        self.assertEqual(l3_agent.DELETE_ROUTER, updates['removed'].action)
+        for update in updates.values():
+            self.assertEqual(l3_agent.PRIORITY_SYNC_ROUTERS_TASK,
+                             update.priority)
 
     def test_process_router_delete(self):
         agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
@@ -665,8 +964,9 @@ class TestBasicRouterOperations(base.BaseTestCase):
             'gw_port': ex_gw_port}
         agent._router_added(router['id'], router)
         agent.router_deleted(None, router['id'])
-        agent._process_router_delete()
-        self.assertFalse(list(agent.removed_routers))
+        agent._process_router_updates()
+        self.assertNotIn(router['id'], agent.router_info)
+        self.assertEqual(0, len(agent._queue))
 
     def test_destroy_namespace(self):
 
@@ -15,8 +15,10 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
 import os
 
+import fixtures
 import mock
 from oslo.config import cfg
 
@@ -349,6 +351,9 @@ class TestBase(base.BaseTestCase):
         self.execute_p = mock.patch('neutron.agent.linux.utils.execute')
         self.safe = self.replace_p.start()
         self.execute = self.execute_p.start()
+        for attr in ('_conf_file_contents', '_pending_reloads',
+                     '_last_reloads'):
+            mock.patch.dict(getattr(dhcp.Dnsmasq, attr), clear=True).start()
         self.addCleanup(mock.patch.stopall)
 
 
@@ -985,6 +990,94 @@ tag:tag1,249,%s,%s""".lstrip() % (fake_v6,
                                         mock.call(exp_opt_name, exp_opt_data)])
             mock_open.assert_called_once_with('/proc/5/cmdline', 'r')
 
+    def _reload_allocations(self, dm):
+        with contextlib.nested(
+            mock.patch.object(dhcp.Dnsmasq, 'active'),
+            mock.patch.object(dhcp.Dnsmasq, 'pid'),
+            mock.patch.object(dhcp.Dnsmasq, '_make_subnet_interface_ip_map',
+                              return_value={})
+        ) as (active, pid, ip_map):
+            active.__get__ = mock.Mock(return_value=True)
+            pid.__get__ = mock.Mock(return_value=5)
+            dm.reload_allocations()
+
+    def test_reload_allocations_unchanged(self):
+        self.conf.set_override('dnsmasq_reload_interval', 0)
+        network = FakeDualNetwork()
+        self._reload_allocations(dhcp.Dnsmasq(self.conf, network,
+                                              version=float(2.59)))
+        self._reload_allocations(dhcp.Dnsmasq(self.conf, network,
+                                              version=float(2.59)))
+        self.assertEqual(2, self.safe.call_count)
+        self.execute.assert_called_once_with(['kill', '-HUP', 5], 'sudo')
+
+    def test_reload_allocations_coalesced(self):
+        network = FakeDualNetwork()
+        network.ports = list(network.ports)
+        dm = dhcp.Dnsmasq(self.conf, network, version=float(2.59))
+        with mock.patch.object(dhcp.eventlet, 'spawn_after') as spawn_after:
+            self._reload_allocations(dm)
+            self.execute.assert_called_once_with(['kill', '-HUP', 5], 'sudo')
+            for port in (FakePort1(), FakePort2()):
+                network.ports.append(port)
+                self._reload_allocations(dm)
+        self.assertEqual(1, self.execute.call_count)
+        spawn_after.assert_called_once_with(mock.ANY, dm._deferred_reload)
+        self.assertIn(network.id, dhcp.Dnsmasq._pending_reloads)
+
+        with mock.patch.object(dhcp.Dnsmasq, 'active') as active:
+            active.__get__ = mock.Mock(return_value=False)
+            dm._deferred_reload()
+        self.assertNotIn(network.id, dhcp.Dnsmasq._pending_reloads)
+        self.assertEqual(1, self.execute.call_count)
+
+    def test_reload_allocations_hostsdir(self):
+        self.conf.set_override('dnsmasq_reload_interval', 0)
+        self.conf.set_override('dhcp_confs',
+                               self.useFixture(fixtures.TempDir()).path)
+        self.replace_p.stop()
+        network = FakeV4Network()
+        network.ports = [FakePort1(), FakePort2()]
+        hosts_dir = os.path.join(self.conf.dhcp_confs, network.id, 'hostsdir')
+        dm = dhcp.Dnsmasq(self.conf, network, version=float(2.73))
+        with mock.patch.object(dhcp.Dnsmasq, '_output_opts_file'):
+            # The files of new ports are read without reload
+            self._reload_allocations(dm)
+            self.assertEqual(sorted(p.id for p in network.ports),
+                             sorted(os.listdir(hosts_dir)))
+            self.assertFalse(self.execute.called)
+
+            network.ports[0].mac_address = '00:00:80:aa:bb:dd'
+            self._reload_allocations(dm)
+            self.execute.assert_called_once_with(['kill', '-HUP', 5], 'sudo')
+            with open(os.path.join(hosts_dir, network.ports[0].id)) as f:
+                self.assertEqual('00:00:80:aa:bb:dd,host-192-168-0-2.'
+                                 'openstacklocal,192.168.0.2\n', f.read())
+
+            removed = network.ports.pop()
+            self._reload_allocations(dm)
+            self.assertEqual(2, self.execute.call_count)
+            self.assertNotIn(removed.id, os.listdir(hosts_dir))
+
+    def test_disable_forgets_config_files(self):
+        network = FakeV4Network()
+        dm = dhcp.Dnsmasq(self.conf, network, version=float(2.59))
+        pending = mock.Mock()
+        dhcp.Dnsmasq._pending_reloads[network.id] = pending
+        dhcp.Dnsmasq._conf_file_contents[
+            dm.get_conf_file_name('host')] = 'hosts'
+        with contextlib.nested(
+            mock.patch.object(dhcp.Dnsmasq, 'active'),
+            mock.patch.object(dhcp.Dnsmasq, 'pid'),
+            mock.patch('shutil.rmtree')
+        ) as (active, pid, rmtree):
+            active.__get__ = mock.Mock(return_value=False)
+            pid.__get__ = mock.Mock(return_value=None)
+            dm.disable()
+        pending.cancel.assert_called_once_with()
+        self.assertEqual({}, dhcp.Dnsmasq._pending_reloads)
+        self.assertEqual({}, dhcp.Dnsmasq._conf_file_contents)
+
     def test_make_subnet_interface_ip_map(self):
         with mock.patch('neutron.agent.linux.ip_lib.IPDevice') as ip_dev:
             ip_dev.return_value.addr.list.return_value = [
@@ -0,0 +1,73 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from neutron.agent.linux import ipset_manager
+from neutron.tests import base
+
+SG_ID = 'fake_sgid'
+SET_NAME = 'NIPv4fake_sgid'
+
+
+class IpsetManagerTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(IpsetManagerTestCase, self).setUp()
+        self.execute = mock.Mock()
+        self.ipset = ipset_manager.IpsetManager(execute=self.execute,
+                                                root_helper='sudo')
+
+    def _assert_restore(self, lines):
+        self.execute.assert_called_once_with(
+            ['ipset', 'restore', '-exist'],
+            process_input='\n'.join(lines) + '\n',
+            root_helper='sudo')
+
+    def test_get_name_truncated(self):
+        name = self.ipset.get_name('a' * 36, 'IPv6')
+        self.assertEqual(ipset_manager.MAX_NAME_LEN, len(name))
+        self.assertTrue(name.startswith('NIPv6aaa'))
+
+    def test_set_members_creates_set(self):
+        self.ipset.set_members(SG_ID, 'IPv4', ['10.0.0.2', '10.0.0.1'])
+        self._assert_restore(['create %s hash:net family inet' % SET_NAME,
+                              'flush %s' % SET_NAME,
+                              'add %s 10.0.0.1' % SET_NAME,
+                              'add %s 10.0.0.2' % SET_NAME])
+
+    def test_set_members_applies_difference(self):
+        self.ipset.set_members(SG_ID, 'IPv4', ['10.0.0.1', '10.0.0.2'])
+        self.execute.reset_mock()
+        self.ipset.set_members(SG_ID, 'IPv4', ['10.0.0.2', '10.0.0.3'])
+        self._assert_restore(['add %s 10.0.0.3' % SET_NAME,
+                              'del %s 10.0.0.1' % SET_NAME])
+
+    def test_set_members_unchanged(self):
+        self.ipset.set_members(SG_ID, 'IPv4', ['10.0.0.1'])
+        self.execute.reset_mock()
+        self.ipset.set_members(SG_ID, 'IPv4', ['10.0.0.1'])
+        self.assertFalse(self.execute.called)
+
+    def test_destroy_unused(self):
+        self.ipset.set_members(SG_ID, 'IPv4', ['10.0.0.1'])
+        self.ipset.set_members(SG_ID, 'IPv6', ['fe80::1'])
+        self.execute.reset_mock()
+        self.ipset.destroy_unused(['NIPv6fake_sgid'])
+        self.execute.assert_called_once_with(
+            ['ipset', 'destroy', SET_NAME], root_helper='sudo')
+        self.assertEqual(['NIPv6fake_sgid'], self.ipset.sets.keys())
@@ -0,0 +1,373 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import errno
+import struct
+
+import eventlet
+import eventlet.event
+from eventlet.green import socket
+import mock
+
+from neutron.agent.linux import netlink
+from neutron.tests import base
+
+
+def _message(msg_type, payload, seq=0):
+    return netlink.message(msg_type, 0, seq, payload)
+
+
+def _link_message(msg_type, index, name):
+    return _message(msg_type,
+                    netlink.IFINFOMSG.pack(0, 1, index, 0, 0) +
+                    netlink.attr(netlink.IFLA_IFNAME, name + '\0'))
+
+
+def _fdb_message(msg_type, index, mac, dst, seq=0):
+    return _message(msg_type,
+                    netlink.NDMSG.pack(netlink.AF_BRIDGE, index,
+                                       netlink.NUD_PERMANENT,
+                                       netlink.NTF_SELF, 0) +
+                    netlink.attr(netlink.NDA_LLADDR,
+                                 netlink._mac_to_bytes(mac)) +
+                    netlink.attr(netlink.NDA_DST, socket.inet_aton(dst)),
+                    seq)
+
+
+class TestNetlinkParsing(base.BaseTestCase):
+
+    def test_parse_messages(self):
+        data = (_link_message(netlink.RTM_NEWLINK, 5, 'tap1') +
+                _message(netlink.NLMSG_DONE, '\0' * 4))
+        messages = netlink.parse_messages(data)
+        self.assertEqual([netlink.RTM_NEWLINK, netlink.NLMSG_DONE],
+                         [msg_type for msg_type, _seq, _payload in messages])
+        self.assertEqual((5, 'tap1'), netlink.parse_link(messages[0][2]))
+
+    def test_parse_messages_truncated(self):
+        data = _link_message(netlink.RTM_NEWLINK, 5, 'tap1')
+        self.assertEqual([], netlink.parse_messages(data[:-4]))
+
+    def test_parse_attrs(self):
+        data = (netlink.attr(1, 'abc') +
+                netlink.attr(netlink.IFLA_IFNAME, 'tap1\0'))
+        self.assertEqual({1: 'abc', netlink.IFLA_IFNAME: 'tap1\0'},
+                         netlink.parse_attrs(data))
+
+    def test_parse_neigh(self):
+        payload = netlink.parse_messages(
+            _fdb_message(netlink.RTM_NEWNEIGH, 7, 'fa:16:3e:00:00:01',
+                         '10.0.0.2'))[0][2]
+        self.assertEqual(
+            (netlink.AF_BRIDGE, 7, 'fa:16:3e:00:00:01', '10.0.0.2'),
+            netlink.parse_neigh(payload))
+
+
+class TestLinkMonitor(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestLinkMonitor, self).setUp()
+        monitor_sock, self.kernel_sock = socket.socketpair(socket.AF_UNIX,
+                                                           socket.SOCK_DGRAM)
+        self.addCleanup(self.kernel_sock.close)
+        self.addCleanup(monitor_sock.close)
+        self.monitor = netlink.LinkMonitor()
+        self.addCleanup(self.monitor.stop)
+        with mock.patch.object(self.monitor, '_open',
+                               return_value=monitor_sock):
+            self.monitor.start()
+
+    def test_get_events(self):
+        self.assertEqual([], self.monitor.get_events())
+        self.kernel_sock.send(_link_message(netlink.RTM_NEWLINK, 5, 'tap1') +
+                              _link_message(netlink.RTM_DELLINK, 4, 'tap2'))
+        self.monitor.wait_for_events(5)
+        self.assertEqual(
+            [{'action': netlink.LINK_ADDED, 'index': 5, 'name': 'tap1'},
+             {'action': netlink.LINK_REMOVED, 'index': 4, 'name': 'tap2'}],
+            self.monitor.get_events())
+        self.assertEqual([], self.monitor.get_events())
+
+    def test_events_lost(self):
+        errors = [socket.error(errno.ENOBUFS, 'No buffer space available')]
+
+        def recv(size):
+            if errors:
+                raise errors.pop()
+            # Block until the monitor is stopped
+            eventlet.event.Event().wait()
+
+        self.monitor._sock = mock.Mock()
+        self.monitor._sock.recv.side_effect = recv
+        self.monitor.wait_for_events(5)
+        self.assertIsNone(self.monitor.get_events())
+        self.assertEqual([], self.monitor.get_events())
+
+    def test_socket_error(self):
+        self.monitor._sock = sock = mock.Mock()
+        sock.recv.side_effect = socket.error(errno.EBADF, 'Bad descriptor')
+        self.monitor.wait_for_events(5)
+        self.assertFalse(self.monitor.is_active)
+        self.assertIsNone(self.monitor.get_events())
+        sock.close.assert_called_once_with()
+
+    def test_events_lost_while_reopening(self):
+        self.monitor.respawn_interval = 0
+        self.monitor._sock = mock.Mock()
+        self.monitor._sock.recv.side_effect = socket.error(errno.EBADF,
+                                                           'Bad descriptor')
+        reopened = eventlet.event.Event()
+
+        def recv(size):
+            reopened.send()
+            # Block until the monitor is stopped
+            eventlet.event.Event().wait()
+
+        def reopen():
+            # The consumer finds the closed socket before the monitor
+            # reopens it: the notifications sent meanwhile are lost
+            self.assertIsNone(self.monitor.get_events())
+            new_sock = mock.Mock()
+            new_sock.recv.side_effect = recv
+            return new_sock
+
+        with mock.patch.object(self.monitor, '_open', side_effect=reopen):
+            reopened.wait()
+        self.assertIsNone(self.monitor.get_events())
+        self.assertEqual([], self.monitor.get_events())
+
+
+class FakeNetlinkSocket(object):
+    """Acknowledge the requests sent to it, failing the given ones."""
+
+    def __init__(self):
+        self.sent = []
+        self.errors = {}
+        # (index, MAC, destination) of the FDB entries dumped
+        self.dump_replies = []
+        self._replies = []
+        self._count = 0
+
+    def sendall(self, data):
+        self.sent.append(data)
+        for msg_type, seq, payload in netlink.parse_messages(data):
+            if msg_type == netlink.RTM_GETNEIGH:
+                for index, mac, dst in self.dump_replies:
+                    self._replies.append(_fdb_message(
+                        netlink.RTM_NEWNEIGH, index, mac, dst, seq))
+                self._replies.append(_message(netlink.NLMSG_DONE,
+                                              '\0' * 4, seq))
+            else:
+                code = -self.errors.get(self._count, 0)
+                self._count += 1
+                self._replies.append(_message(
+                    netlink.NLMSG_ERROR, netlink.NLMSG_ERR.pack(code), seq))
+
+    def sent_messages(self):
+        return [m for data in self.sent for m in netlink.parse_messages(data)]
+
+    def recv(self, size):
+        replies = self._replies
+        self._replies = []
+        return ''.join(replies)
+
+    def close(self):
+        pass
+
+
+class TestIpRoute(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestIpRoute, self).setUp()
+        self.ip_route = netlink.IpRoute()
+        self.sock = FakeNetlinkSocket()
+        mock.patch.object(self.ip_route, '_socket',
+                          return_value=self.sock).start()
+        self.indexes = {'vxlan-1': 7, 'eth0': 2, 'brq1': 8}
+        mock.patch.object(self.ip_route, 'get_link_index',
+                          side_effect=self.indexes.get).start()
+        mock.patch.object(self.ip_route._fdb, 'start').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_request(self):
+        self.sock.errors = {1: errno.EEXIST}
+        errors = self.ip_route.request(
+            [(netlink.RTM_NEWNEIGH, 0, ''), (netlink.RTM_NEWNEIGH, 0, ''),
+             (netlink.RTM_DELNEIGH, 0, '')])
+        self.assertIsNone(errors[0])
+        self.assertEqual(errno.EEXIST, errors[1].errno)
+        self.assertIsNone(errors[2])
+        # The requests are sent in a single datagram
+        self.assertEqual(1, len(self.sock.sent))
+
+    def test_request_batches(self):
+        with mock.patch.object(netlink, 'MAX_BATCH_SIZE',
+                               netlink.NLMSG_HDR.size * 2):
+            errors = self.ip_route.request([(netlink.RTM_DELNEIGH, 0, '')] *
+                                           3)
+        self.assertEqual([None] * 3, errors)
+        self.assertEqual(2, len(self.sock.sent))
+
+    def test_concurrent_requests_serialized(self):
+        calls = []
+        sendall, recv = self.sock.sendall, self.sock.recv
+
+        def record_sendall(data):
+            calls.append('send')
+            sendall(data)
+
+        def record_recv(size):
+            calls.append('recv')
+            eventlet.sleep(0)
+            return recv(size)
+
+        self.sock.sendall = record_sendall
+        self.sock.recv = record_recv
+        threads = [eventlet.spawn(self.ip_route.request,
+                                  [(netlink.RTM_DELNEIGH, 0, '')])
+                   for _i in range(2)]
+        self.assertEqual([[None], [None]], [t.wait() for t in threads])
+        self.assertEqual(['send', 'recv'] * 2, calls)
+
+    def test_request_timeout(self):
+        self.sock.recv = mock.Mock(side_effect=socket.timeout('timed out'))
+        self.ip_route._sock = self.sock
+        with mock.patch.object(self.sock, 'close') as close:
+            self.assertRaises(netlink.NetlinkError, self.ip_route.request,
+                              [(netlink.RTM_DELNEIGH, 0, '')])
+        close.assert_called_once_with()
+        self.assertIsNone(self.ip_route._sock)
+
+    def test_add_vlan(self):
+        self.ip_route.add_vlan('eth0.5', 'eth0', 5)
+        [(msg_type, _seq, payload)] = self.sock.sent_messages()
+        self.assertEqual(netlink.RTM_NEWLINK, msg_type)
+        _family, _type, index, flags, change = (
+            netlink.IFINFOMSG.unpack_from(payload))
+        self.assertEqual((0, netlink.IFF_UP, netlink.IFF_UP),
+                         (index, flags, change))
+        attrs = netlink.parse_attrs(payload, netlink.IFINFOMSG.size)
+        self.assertEqual('eth0.5\0', attrs[netlink.IFLA_IFNAME])
+        self.assertEqual(2, struct.unpack('=I', attrs[netlink.IFLA_LINK])[0])
+        info = netlink.parse_attrs(attrs[netlink.IFLA_LINKINFO])
+        self.assertEqual('vlan', info[netlink.IFLA_INFO_KIND])
+        data = netlink.parse_attrs(info[netlink.IFLA_INFO_DATA])
+        self.assertEqual(5, struct.unpack('=H', data[netlink.IFLA_VLAN_ID])[0])
+
+    def test_add_link_error(self):
+        self.sock.errors = {0: errno.EPERM}
+        self.assertRaises(netlink.NetlinkError, self.ip_route.set_master,
+                          'vxlan-1', 'brq1')
+
+    def test_get_fdb_entries_cached(self):
+        self.sock.dump_replies = [(7, 'fa:16:3e:00:00:01', '10.0.0.2'),
+                                  (9, 'fa:16:3e:00:00:02', '10.0.0.3')]
+        self.ip_route._fdb._sock = mock.Mock()
+        expected = set([('fa:16:3e:00:00:01', '10.0.0.2')])
+        self.assertEqual(expected, self.ip_route.get_fdb_entries('vxlan-1'))
+        self.assertEqual(expected, self.ip_route.get_fdb_entries('vxlan-1'))
+        self.assertEqual(1, len(self.sock.sent))
+
+        # The cache is refreshed from the notifications
+        self.ip_route._fdb._handle_data(
+            _fdb_message(netlink.RTM_DELNEIGH, 7, 'fa:16:3e:00:00:01',
+                         '10.0.0.2') +
+            _fdb_message(netlink.RTM_NEWNEIGH, 7, 'fa:16:3e:00:00:03',
+                         '10.0.0.4'))
+        self.assertEqual(set([('fa:16:3e:00:00:03', '10.0.0.4')]),
+                         self.ip_route.get_fdb_entries('vxlan-1'))
+
+        # and is dumped again when notifications are lost
+        self.ip_route._fdb._handle_lost()
+        self.assertEqual(expected, self.ip_route.get_fdb_entries('vxlan-1'))
+        self.assertEqual(2, len(self.sock.sent))
+
+    def test_fdb_notified_during_dump(self):
+        self.sock.dump_replies = [(7, 'fa:16:3e:00:00:01', '10.0.0.2')]
+        self.ip_route._fdb._sock = mock.Mock()
+        dump = self.ip_route.dump
+
+        def notified_dump(msg_type, payload):
+            replies = dump(msg_type, payload)
+            self.ip_route._fdb._handle_data(
+                _fdb_message(netlink.RTM_NEWNEIGH, 7, 'fa:16:3e:00:00:02',
+                             '10.0.0.3'))
+            return replies
+
+        with mock.patch.object(self.ip_route, 'dump',
+                               side_effect=notified_dump):
+            self.ip_route.get_fdb_entries('vxlan-1')
+        self.assertEqual(set([('fa:16:3e:00:00:01', '10.0.0.2'),
+                              ('fa:16:3e:00:00:02', '10.0.0.3')]),
+                         self.ip_route.get_fdb_entries('vxlan-1'))
+        self.assertEqual(1, len(self.sock.sent))
+
+    def test_fdb_lost_during_dump_not_cached(self):
+        self.sock.dump_replies = [(7, 'fa:16:3e:00:00:01', '10.0.0.2')]
+        self.ip_route._fdb._sock = mock.Mock()
+        dump = self.ip_route.dump
+
+        def lost_dump(msg_type, payload):
+            replies = dump(msg_type, payload)
+            self.ip_route._fdb._handle_lost()
+            return replies
+
+        with mock.patch.object(self.ip_route, 'dump', side_effect=lost_dump):
+            self.assertEqual(set([('fa:16:3e:00:00:01', '10.0.0.2')]),
+                             self.ip_route.get_fdb_entries('vxlan-1'))
+        self.assertNotIn(7, self.ip_route._fdb.entries)
+        self.ip_route.get_fdb_entries('vxlan-1')
+        self.assertEqual(2, len(self.sock.sent))
+
+    def test_fdb_dump_error_not_cached(self):
+        self.ip_route._fdb._sock = mock.Mock()
+        with mock.patch.object(self.ip_route, 'dump',
+                               side_effect=netlink.NetlinkError(errno.EIO)):
+            self.assertRaises(netlink.NetlinkError,
+                              self.ip_route.get_fdb_entries, 'vxlan-1')
+        self.assertNotIn(7, self.ip_route._fdb.entries)
+
+    def test_get_fdb_entries_not_monitored(self):
+        self.ip_route.get_fdb_entries('vxlan-1')
+        self.ip_route.get_fdb_entries('vxlan-1')
+        self.assertEqual(2, len(self.sock.sent))
+
+    def test_update_fdb_entries(self):
+        self.ip_route._fdb.entries[7] = set(
+            [('00:00:00:00:00:00', '10.0.0.1'),
+             ('fa:16:3e:00:00:01', '10.0.0.1')])
+        self.sock.errors = {2: errno.EEXIST}
+        errors = self.ip_route.add_fdb_entries(
+            'vxlan-1', [('fa:16:3e:00:00:01', '10.0.0.2'),
+                        ('fa:16:3e:00:00:02', '10.0.0.2'),
+                        ('fa:16:3e:00:00:03', '10.0.0.2')])
+        self.assertEqual(errno.EEXIST, errors[2].errno)
+        self.ip_route.add_fdb_entries(
+            'vxlan-1', [('00:00:00:00:00:00', '10.0.0.2')], append=True)
+        self.ip_route.delete_fdb_entries(
+            'vxlan-1', [('fa:16:3e:00:00:02', '10.0.0.2')])
+        self.assertEqual(set([('00:00:00:00:00:00', '10.0.0.1'),
+                              ('00:00:00:00:00:00', '10.0.0.2'),
+                              ('fa:16:3e:00:00:01', '10.0.0.2')]),
+                         self.ip_route._fdb.entries[7])
+        flags = [netlink.NLMSG_HDR.unpack_from(data)[2]
+                 for data in self.sock.sent]
+        self.assertEqual(
+            [netlink.NLM_F_CREATE | netlink.NLM_F_REPLACE,
+             netlink.NLM_F_CREATE | netlink.NLM_F_APPEND, 0],
+            [f & ~(netlink.NLM_F_REQUEST | netlink.NLM_F_ACK)
+             for f in flags])
@@ -0,0 +1,264 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+
+import eventlet
+from eventlet.green import socket
+import mock
+from oslo.config import cfg
+
+from neutron.agent.linux import ovsdb_client
+from neutron.tests import base
+
+IFACE_UUID = '2a6e7f0b-8b45-4b5e-9b3e-3c4bd8e5b8a1'
+PORT_UUID = 'c1b0e5f5-3a6d-4d1c-8a3e-6a3c3a0e4d2f'
+BRIDGE_UUID = '7b4a3d2e-1f0c-4b9a-8e7d-6c5b4a3f2e1d'
+
+SCHEMA = {'tables': {
+    'Bridge': {'columns': {'name': {'type': 'string'},
+                           'ports': {'type': {'key': 'uuid', 'min': 0,
+                                              'max': 'unlimited'}},
+                           'datapath_id': {'type': 'string'},
+                           'external_ids': {'type': {'key': 'string',
+                                                     'value': 'string',
+                                                     'min': 0,
+                                                     'max': 'unlimited'}}}},
+    'Port': {'columns': {'name': {'type': 'string'},
+                         'tag': {'type': {'key': {'type': 'integer'},
+                                          'min': 0, 'max': 1}}}},
+    'Interface': {'columns': {'name': {'type': 'string'},
+                              'options': {'type': {'key': 'string',
+                                                   'value': 'string',
+                                                   'min': 0,
+                                                   'max': 'unlimited'}}}},
+    'Open_vSwitch': {'columns': {'ovs_version': {'type': 'string'}}}}}
+
+INITIAL = {
+    'Bridge': {BRIDGE_UUID: {'new': {
+        'name': 'br-int', 'ports': ['uuid', PORT_UUID],
+        'datapath_id': '0000a6e3b9e3a04b', 'external_ids': ['map', []]}}},
+    'Port': {PORT_UUID: {'new': {
+        'name': 'tap1', 'interfaces': ['uuid', IFACE_UUID],
+        'tag': ['set', []], 'other_config': ['map', []],
+        'external_ids': ['map', []]}}},
+    'Interface': {IFACE_UUID: {'new': {
+        'name': 'tap1', 'ofport': 5, 'type': '', 'options': ['map', []],
+        'external_ids': ['map', [['iface-id', 'port-id'],
+                                 ['attached-mac', 'fa:16:3e:00:00:01']]]}}},
+}
+
+
+class TestOvsdbDatum(base.BaseTestCase):
+
+    def test_from_datum(self):
+        self.assertEqual(5, ovsdb_client.from_datum(5))
+        self.assertEqual([], ovsdb_client.from_datum(['set', []]))
+        self.assertEqual(['a', 'b'],
+                         ovsdb_client.from_datum(['set', ['a', 'b']]))
+        self.assertEqual({'a': 'b'},
+                         ovsdb_client.from_datum(['map', [['a', 'b']]]))
+        self.assertEqual(IFACE_UUID,
+                         ovsdb_client.from_datum(['uuid', IFACE_UUID]))
+
+    def test_to_vsctl_str(self):
+        self.assertEqual('5', ovsdb_client.to_vsctl_str(5))
+        self.assertEqual('[]', ovsdb_client.to_vsctl_str([]))
+        self.assertEqual('true', ovsdb_client.to_vsctl_str(True))
+        self.assertEqual('patch', ovsdb_client.to_vsctl_str('patch'))
+        self.assertEqual('"tap1"', ovsdb_client.to_vsctl_str('tap1'))
+        self.assertEqual('"true"', ovsdb_client.to_vsctl_str('true'))
+        self.assertEqual('"%s"' % IFACE_UUID,
+                         ovsdb_client.to_vsctl_str(IFACE_UUID))
+        self.assertEqual('{attached-mac="fa:16:3e:00:00:01", '
+                         'iface-id=port}',
+                         ovsdb_client.to_vsctl_str(
+                             {'iface-id': 'port',
+                              'attached-mac': 'fa:16:3e:00:00:01'}))
+
+
+class TestJsonStreamParser(base.BaseTestCase):
+
+    def test_feed(self):
+        parser = ovsdb_client.JsonStreamParser()
+        self.assertEqual([], parser.feed('{"id": 1, "a": "}\\"{'))
+        self.assertEqual([{'id': 1, 'a': '}"{', 'b': {}},
+                          {'id': 2}],
+                         parser.feed('", "b": {}}\n{"id": 2}{"id"'))
+        self.assertEqual([{'id': 3}], parser.feed(': 3}'))
+
+
+class FakeOvsdbServer(object):
+    """Answer the requests of a client on the other end of a socketpair."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.requests = []
+        self.results = {'get_schema': SCHEMA,
+                        'monitor': INITIAL,
+                        'transact': [{'count': 1}]}
+
+    def serve(self):
+        parser = ovsdb_client.JsonStreamParser()
+        while True:
+            data = self.sock.recv(4096)
+            if not data:
+                return
+            for request in parser.feed(data):
+                self.requests.append(request)
+                if 'method' not in request:
+                    continue
+                if request['method'] == 'monitor':
+                    # The first notification is sent with the reply
+                    self.send({'id': request['id'], 'error': None,
+                               'result': self.results['monitor']})
+                    self.send({'id': None, 'method': 'update', 'params': [
+                        None, {'Interface': {IFACE_UUID: {
+                            'old': {'ofport': 5},
+                            'new': dict(INITIAL['Interface'][IFACE_UUID]
+                                        ['new'], ofport=6)}}}]})
+                else:
+                    self.send({'id': request['id'], 'error': None,
+                               'result': self.results[request['method']]})
+
+    def send(self, message):
+        self.sock.sendall(json.dumps(message))
+
+
+class TestOvsdbClient(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestOvsdbClient, self).setUp()
+        client_sock, server_sock = socket.socketpair()
+        self.addCleanup(server_sock.close)
+        self.server = FakeOvsdbServer(server_sock)
+        self.addCleanup(eventlet.spawn(self.server.serve).kill)
+        self.client = ovsdb_client.OvsdbClient('unix:/db.sock', timeout=5)
+        self.addCleanup(self.client.stop)
+        with mock.patch.object(self.client, '_connect',
+                               return_value=client_sock):
+            self.client.start()
+
+    def _wait_for(self, predicate):
+        with eventlet.Timeout(5):
+            while not predicate():
+                eventlet.sleep(0)
+
+    def test_start_replicates_tables(self):
+        self.assertTrue(self.client.connected)
+        self.assertEqual(['get_schema', 'monitor'],
+                         [r['method'] for r in self.server.requests])
+        self.assertEqual(sorted(ovsdb_client.MONITORED_COLUMNS),
+                         sorted(self.server.requests[1]['params'][2]))
+        self._wait_for(
+            lambda: self.client.get_row('Interface', 'tap1')['ofport'] == 6)
+        self.assertEqual(['tap1'], self.client.get_port_names('br-int'))
+        self.assertEqual([], self.client.get_port_names('br-tun'))
+        self.assertEqual({'iface-id': 'port-id',
+                          'attached-mac': 'fa:16:3e:00:00:01'},
+                         self.client.get_row('Interface',
+                                             IFACE_UUID)['external_ids'])
+
+    def test_row_deleted(self):
+        self.client._handle_message(
+            {'id': None, 'method': 'update',
+             'params': [None, {'Port': {PORT_UUID: {'old': {}}}}]})
+        self.assertIsNone(self.client.get_row('Port', 'tap1'))
+        self.assertEqual([], self.client.get_port_names('br-int'))
+
+    def test_echo(self):
+        self.server.sock.sendall(json.dumps(
+            {'id': 'echo', 'method': 'echo', 'params': []}))
+        self._wait_for(lambda: self.server.requests[-1].get('id') == 'echo')
+        self.assertEqual({'id': 'echo', 'result': [], 'error': None},
+                         self.server.requests[-1])
+
+    def test_set_column(self):
+        self.assertTrue(self.client.set_column('Port', 'tap1', 'tag', '3'))
+        self.assertEqual(
+            ['Open_vSwitch',
+             {'op': 'update', 'table': 'Port',
+              'where': [['name', '==', 'tap1']], 'row': {'tag': 3}}],
+            self.server.requests[-1]['params'])
+        self.assertEqual(3, self.client.get_row('Port', 'tap1')['tag'])
+
+    def test_set_column_map_key(self):
+        self.assertTrue(self.client.set_column(
+            'Interface', IFACE_UUID, 'options:peer', 'patch-tun'))
+        self.assertEqual(
+            ['Open_vSwitch',
+             {'op': 'mutate', 'table': 'Interface',
+              'where': [['_uuid', '==', ['uuid', IFACE_UUID]]],
+              'mutations': [['options', 'delete', ['set', ['peer']]],
+                            ['options', 'insert',
+                             ['map', [['peer', 'patch-tun']]]]]}],
+            self.server.requests[-1]['params'])
+        self.assertEqual({'peer': 'patch-tun'},
+                         self.client.get_row('Interface', 'tap1')['options'])
+
+    def test_set_column_unnamed_table(self):
+        self.assertFalse(self.client.set_column('Open_vSwitch', '.',
+                                                'ovs_version', '2.0'))
+        self.assertEqual(2, len(self.server.requests))
+
+    def test_set_column_missing_row(self):
+        self.server.results['transact'] = [{'count': 0}]
+        self.assertRaises(ovsdb_client.OvsdbError, self.client.set_column,
+                          'Port', 'tap2', 'tag', 3)
+
+    def test_transact_error(self):
+        self.server.results['transact'] = [{'error': 'constraint violation'}]
+        self.assertRaises(ovsdb_client.OvsdbError, self.client.transact,
+                          [{'op': 'comment', 'comment': 'test'}])
+
+    def test_connection_lost(self):
+        self.server.sock.close()
+        self._wait_for(lambda: not self.client.connected)
+        self.assertRaises(ovsdb_client.OvsdbError, self.client.transact,
+                          [{'op': 'comment', 'comment': 'test'}])
+
+
+class TestGetClient(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestGetClient, self).setUp()
+        mock.patch.object(ovsdb_client, '_client', None).start()
+        mock.patch.object(ovsdb_client, '_retry_after', 0).start()
+        self.addCleanup(mock.patch.stopall)
+        self.addCleanup(cfg.CONF.reset)
+
+    def test_vsctl_backend(self):
+        self.assertIsNone(ovsdb_client.get_client())
+
+    def test_native_backend(self):
+        cfg.CONF.set_override('ovsdb_backend', 'native', 'OVS')
+        with mock.patch.object(ovsdb_client.OvsdbClient, 'start') as start:
+            client = ovsdb_client.get_client()
+            start.assert_called_once_with()
+            client.connected = True
+            self.assertIs(client, ovsdb_client.get_client())
+        self.assertEqual('unix:/var/run/openvswitch/db.sock',
+                         client.connection)
+
+    def test_native_backend_connection_failure(self):
+        cfg.CONF.set_override('ovsdb_backend', 'native', 'OVS')
+        with mock.patch.object(ovsdb_client.OvsdbClient, 'start',
+                               side_effect=socket.error()) as start:
+            self.assertIsNone(ovsdb_client.get_client())
+            self.assertIsNone(ovsdb_client.get_client())
+        # The connection is not attempted again before RETRY_INTERVAL
+        self.assertEqual(1, start.call_count)
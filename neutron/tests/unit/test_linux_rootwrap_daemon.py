@@ -0,0 +1,85 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import socket
+import threading
+
+import mock
+
+from neutron.agent.linux import rootwrap_daemon
+from neutron.openstack.common.rootwrap import filters
+from neutron.tests import base
+
+
+class RootwrapDaemonTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(RootwrapDaemonTestCase, self).setUp()
+        config = mock.Mock(exec_dirs=['/bin', '/usr/bin'], use_syslog=False)
+        self.daemon = rootwrap_daemon.RootwrapDaemon(
+            config, [filters.CommandFilter('/bin/cat', 'root')], 'token')
+
+    def _connect(self):
+        client, server = socket.socketpair(socket.AF_UNIX,
+                                           socket.SOCK_STREAM)
+        self.addCleanup(client.close)
+        thread = threading.Thread(target=self.daemon.handle_connection,
+                                  args=(server,))
+        thread.daemon = True
+        thread.start()
+        return client
+
+    def test_run_command(self):
+        self.assertEqual((0, 'data', ''),
+                         self.daemon.run_command(['cat'], 'data'))
+
+    def test_run_command_unauthorized(self):
+        returncode, stdout, stderr = self.daemon.run_command(['ls'])
+        self.assertEqual(rootwrap_daemon.RC_UNAUTHORIZED, returncode)
+        self.assertIn('Unauthorized command: ls', stderr)
+
+    def test_request(self):
+        client = self._connect()
+        for data in ('first', '\xff\x00binary'):
+            rootwrap_daemon.send_message(
+                client, {'token': 'token', 'cmd': ['cat'],
+                         'stdin': rootwrap_daemon.encode_data(data)})
+            reply = rootwrap_daemon.recv_message(client)
+            self.assertEqual(0, reply['returncode'])
+            self.assertEqual(data,
+                             rootwrap_daemon.decode_data(reply['stdout']))
+
+    def test_request_invalid_token(self):
+        client = self._connect()
+        rootwrap_daemon.send_message(client, {'token': 'wrong',
+                                              'cmd': ['cat']})
+        self.assertIsNone(rootwrap_daemon.recv_message(client))
+
+
+class RootwrapDataTestCase(base.BaseTestCase):
+
+    def test_encode_bytes(self):
+        data = '\xff\x00binary'
+        encoded = rootwrap_daemon.encode_data(data)
+        self.assertIsInstance(encoded, unicode)
+        self.assertEqual(data, rootwrap_daemon.decode_data(encoded))
+
+    def test_encode_unicode(self):
+        data = u'caf\xe9 \u20ac'
+        encoded = rootwrap_daemon.encode_data(data)
+        self.assertEqual(data.encode('utf-8'),
+                         rootwrap_daemon.decode_data(encoded))
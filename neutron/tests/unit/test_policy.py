@@ -112,6 +112,29 @@ class PolicyTestCase(base.BaseTestCase):
                           policy.check_if_exists,
                           self.context, action, self.target)
 
+    def test_check_without_target(self):
+        self.assertTrue(policy.check_without_target(self.context,
+                                                    "example:allowed"))
+        self.assertFalse(policy.check_without_target(self.context,
+                                                     "example:denied"))
+        self.assertFalse(policy.check_without_target(
+            self.context, "example:early_and_fail"))
+        self.assertTrue(policy.check_without_target(
+            self.context, "example:early_or_success"))
+        # The result of the tenant_id check depends on the target
+        self.assertIsNone(policy.check_without_target(self.context,
+                                                      "example:my_file"))
+        admin_context = context.Context('admin', 'fake',
+                                        roles=['compute_admin'])
+        self.assertTrue(policy.check_without_target(admin_context,
+                                                    "example:my_file"))
+
+    def test_check_without_target_non_existent_action_raises(self):
+        self.assertRaises(exceptions.PolicyRuleNotFound,
+                          policy.check_without_target,
+                          self.context, "example:idonotexist",
+                          must_exist=True)
+
     def test_enforce_good_action(self):
         action = "example:allowed"
         result = policy.enforce(self.context, action, self.target)
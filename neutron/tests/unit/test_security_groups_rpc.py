@@ -16,6 +16,7 @@
 #    under the License.
 
 from contextlib import nested
+import copy
 
 import mock
 from mock import call
@@ -33,6 +34,7 @@ from neutron.db import securitygroups_rpc_base as sg_db_rpc
 from neutron.extensions import allowedaddresspairs as addr_pair
 from neutron.extensions import securitygroup as ext_sg
 from neutron.manager import NeutronManager
+from neutron.openstack.common.rpc import common as rpc_common
 from neutron.openstack.common.rpc import proxy
 from neutron.tests import base
 from neutron.tests.unit import test_extension_security_group as test_sg
@@ -285,6 +287,71 @@ class SGServerRpcCallBackMixinTestCase(test_sg.SecurityGroupDBTestCase):
                 self._delete('ports', port_id1)
                 self._delete('ports', port_id2)
 
+    def test_security_group_info_for_devices_ipv4_source_group(self):
+
+        with self.network() as n:
+            with nested(self.subnet(n),
+                        self.security_group(),
+                        self.security_group()) as (subnet_v4,
+                                                   sg1,
+                                                   sg2):
+                sg1_id = sg1['security_group']['id']
+                sg2_id = sg2['security_group']['id']
+                rule1 = self._build_security_group_rule(
+                    sg1_id,
+                    'ingress', const.PROTO_NAME_TCP, '24',
+                    '25', remote_group_id=sg2['security_group']['id'])
+                rules = {
+                    'security_group_rules': [rule1['security_group_rule']]}
+                res = self._create_security_group_rule(self.fmt, rules)
+                self.deserialize(self.fmt, res)
+                self.assertEqual(res.status_int, webob.exc.HTTPCreated.code)
+
+                res1 = self._create_port(
+                    self.fmt, n['network']['id'],
+                    security_groups=[sg1_id,
+                                     sg2_id])
+                ports_rest1 = self.deserialize(self.fmt, res1)
+                port_id1 = ports_rest1['port']['id']
+                devices = [port_id1, 'no_exist_device']
+
+                res2 = self._create_port(
+                    self.fmt, n['network']['id'],
+                    security_groups=[sg2_id])
+                ports_rest2 = self.deserialize(self.fmt, res2)
+                port_id2 = ports_rest2['port']['id']
+                ctx = context.get_admin_context()
+                self.rpc.devices = {port_id1: copy.deepcopy(
+                    ports_rest1['port'])}
+                sg_info = self.rpc.security_group_info_for_devices(
+                    ctx, devices=devices)
+                self.assertEqual([port_id1], sg_info['devices'].keys())
+                self.assertEqual(set([sg1_id, sg2_id]),
+                                 set(sg_info['security_groups']))
+                self.assertEqual(
+                    {sg2_id: {const.IPv4: ['10.0.0.2', '10.0.0.3'],
+                              const.IPv6: []}},
+                    dict((sg_id, dict((k, sorted(v))
+                                      for k, v in ips.iteritems()))
+                         for sg_id, ips in
+                         sg_info['sg_member_ips'].iteritems()))
+
+                # Rules expanded by the agent are the ones returned by
+                # security_group_rules_for_devices
+                agent = sg_rpc.SecurityGroupAgentRpcMixin()
+                port_info = agent._expand_security_group_info(
+                    sg_info)[port_id1]
+                self.rpc.devices = {port_id1: copy.deepcopy(
+                    ports_rest1['port'])}
+                port_rpc = self.rpc.security_group_rules_for_devices(
+                    ctx, devices=devices)[port_id1]
+                self.assertEqual(sorted(port_rpc['security_group_rules']),
+                                 sorted(port_info['security_group_rules']))
+                self.assertEqual(port_rpc['security_group_source_groups'],
+                                 port_info['security_group_source_groups'])
+                self._delete('ports', port_id1)
+                self._delete('ports', port_id2)
+
     def test_security_group_rules_for_devices_ipv6_ingress(self):
         fake_prefix = test_fw.FAKE_PREFIX[const.IPv6]
         with self.network() as n:
@@ -509,6 +576,7 @@ class SecurityGroupAgentRpcTestCase(base.BaseTestCase):
         mock.patch('neutron.agent.linux.iptables_manager').start()
         self.agent.root_helper = 'sudo'
         self.agent.init_firewall()
+        self.agent.use_enhanced_rpc = False
         self.firewall = mock.Mock()
         firewall_object = firewall_base.FirewallDriver()
         self.firewall.defer_apply.side_effect = firewall_object.defer_apply
@@ -592,6 +660,126 @@ class SecurityGroupAgentRpcTestCase(base.BaseTestCase):
         self.agent.refresh_firewall([])
         self.firewall.assert_has_calls([])
 
+    def _delay_refresh(self):
+        cfg.CONF.set_override('firewall_refresh_delay', 2,
+                              group='SECURITYGROUP')
+        self.agent.refresh_firewall = mock.Mock()
+        return mock.patch('eventlet.spawn_after').start()
+
+    def test_delayed_refresh_coalesced(self):
+        spawn_after = self._delay_refresh()
+        self.agent.security_groups_member_updated(['fake_sgid2'])
+        self.agent.security_groups_member_updated(['fake_sgid2'])
+        self.agent.security_groups_rule_updated(['fake_sgid1'])
+        spawn_after.assert_called_once_with(2, self.agent._refresh_delayed)
+        self.assertFalse(self.agent.refresh_firewall.called)
+        self.agent._refresh_delayed()
+        self.agent.refresh_firewall.assert_called_once_with(
+            [self.fake_device])
+        self.assertEqual({'requested': 3, 'coalesced': 2, 'executed': 1},
+                         self.agent.refresh_stats)
+        self.assertEqual(set(), self.agent.devices_to_refresh)
+        self.assertEqual({'firewall_refreshes_requested': 3,
+                          'firewall_refreshes_coalesced': 2,
+                          'firewall_refreshes_executed': 1},
+                         self.agent.get_refresh_state())
+
+    def test_delayed_refresh_global(self):
+        self._delay_refresh()
+        self.agent.security_groups_member_updated(['fake_sgid2'])
+        self.agent.security_groups_provider_updated()
+        self.agent._refresh_delayed()
+        self.agent.refresh_firewall.assert_called_once_with(None)
+        self.assertFalse(self.agent.global_refresh_firewall)
+
+    def test_delayed_refresh_removed_device(self):
+        self._delay_refresh()
+        self.agent.security_groups_member_updated(['fake_sgid2'])
+        self.firewall.ports = {}
+        self.agent._refresh_delayed()
+        self.assertFalse(self.agent.refresh_firewall.called)
+
+    def test_delayed_refresh_failure_retried(self):
+        spawn_after = self._delay_refresh()
+        self.agent.refresh_firewall.side_effect = RuntimeError()
+        self.agent.security_groups_member_updated(['fake_sgid2'])
+        self.agent._refresh_delayed()
+        self.assertEqual(2, spawn_after.call_count)
+        self.assertEqual(set(['fake_device']),
+                         self.agent.devices_to_refresh)
+
+
+class SecurityGroupAgentEnhancedRpcTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(SecurityGroupAgentEnhancedRpcTestCase, self).setUp()
+        self.agent = sg_rpc.SecurityGroupAgentRpcMixin()
+        self.agent.context = None
+        self.addCleanup(mock.patch.stopall)
+        mock.patch('neutron.agent.linux.iptables_manager').start()
+        self.agent.root_helper = 'sudo'
+        self.agent.init_firewall()
+        self.firewall = mock.Mock()
+        firewall_object = firewall_base.FirewallDriver()
+        self.firewall.defer_apply.side_effect = firewall_object.defer_apply
+        self.agent.firewall = self.firewall
+        self.rpc = mock.Mock()
+        self.agent.plugin_rpc = self.rpc
+        self.sg_rule = {'direction': 'ingress', 'ethertype': const.IPv4,
+                        'security_group_id': 'fake_sgid1'}
+        self.remote_rule = {'direction': 'ingress',
+                            'ethertype': const.IPv4,
+                            'protocol': const.PROTO_NAME_TCP,
+                            'security_group_id': 'fake_sgid1',
+                            'remote_group_id': 'fake_sgid2'}
+        self.provider_rule = {'direction': 'ingress',
+                              'ethertype': const.IPv4,
+                              'source_ip_prefix': '10.0.0.1/32'}
+        self.rpc.security_group_info_for_devices.return_value = {
+            'devices': {'fake_device': {
+                'device': 'fake_device',
+                'fixed_ips': ['10.0.0.3'],
+                'security_groups': ['fake_sgid1'],
+                'security_group_rules': [self.provider_rule],
+                'security_group_source_groups': []}},
+            'security_groups': {'fake_sgid1': [self.sg_rule,
+                                               self.remote_rule]},
+            'sg_member_ips': {'fake_sgid2': {
+                const.IPv4: ['10.0.0.3', '10.0.0.4', '10.0.1.0/24'],
+                const.IPv6: ['fe80::1']}}}
+
+    def test_prepare_devices_filter_expands_rules(self):
+        self.agent.prepare_devices_filter(['fake_device'])
+        self.assertFalse(self.rpc.security_group_rules_for_devices.called)
+        device = self.firewall.prepare_port_filter.call_args[0][0]
+        rule_4 = dict(self.remote_rule, source_ip_prefix='10.0.0.4/32')
+        rule_net = dict(self.remote_rule, source_ip_prefix='10.0.1.0/24')
+        self.assertEqual([self.sg_rule, rule_4, rule_net,
+                          self.provider_rule],
+                         device['security_group_rules'])
+        self.assertEqual(['fake_sgid2'],
+                         device['security_group_source_groups'])
+
+    def test_fallback_to_security_group_rules_for_devices(self):
+        self.rpc.security_group_info_for_devices.side_effect = (
+            rpc_common.RemoteError('UnsupportedRpcVersion'))
+        devices = {'fake_device': {'device': 'fake_device'}}
+        self.rpc.security_group_rules_for_devices.return_value = devices
+        self.agent.prepare_devices_filter(['fake_device'])
+        self.agent.prepare_devices_filter(['fake_device'])
+        self.assertFalse(self.agent.use_enhanced_rpc)
+        self.assertEqual(
+            1, self.rpc.security_group_info_for_devices.call_count)
+        self.assertEqual(
+            2, self.rpc.security_group_rules_for_devices.call_count)
+
+    def test_remote_error_not_hidden(self):
+        self.rpc.security_group_info_for_devices.side_effect = (
+            rpc_common.RemoteError('DBError'))
+        self.assertRaises(rpc_common.RemoteError,
+                          self.agent.prepare_devices_filter,
+                          ['fake_device'])
+        self.assertTrue(self.agent.use_enhanced_rpc)
+
 
 class FakeSGRpcApi(agent_rpc.PluginApi,
                    sg_rpc.SecurityGroupServerRpcApiMixin):
@@ -615,6 +803,17 @@ class SecurityGroupServerRpcApiTestCase(base.BaseTestCase):
              version=sg_rpc.SG_RPC_VERSION,
              topic='fake_topic')])
 
+    def test_security_group_info_for_devices(self):
+        self.rpc.security_group_info_for_devices(None, ['fake_device'])
+        self.rpc.call.assert_has_calls(
+            [call(None,
+             {'args':
+                 {'devices': ['fake_device']},
+              'method': 'security_group_info_for_devices',
+              'namespace': None},
+             version=sg_rpc.SG_INFO_RPC_VERSION,
+             topic='fake_topic')])
+
 
 class FakeSGNotifierAPI(proxy.RpcProxy,
                         sg_rpc.SecurityGroupAgentRpcApiMixin):
@@ -1242,6 +1441,7 @@ class TestSecurityGroupAgentWithIptables(base.BaseTestCase):
         self.root_helper = 'sudo'
         self.agent.root_helper = 'sudo'
         self.agent.init_firewall()
+        self.agent.use_enhanced_rpc = False
 
         self.iptables = self.agent.firewall.iptables
         self.iptables_execute = mock.patch.object(self.iptables,
@@ -0,0 +1,123 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Measure create_port throughput with concurrent workers.
+
+Ports are created on a single subnet by N threads, each one using its own
+database session, so that the contention on the IPAM tables can be compared
+between the availability range tables and the IPAM drivers. The driver is
+selected with the ipam_driver option of the config files, e.g.:
+
+    python tools/ipam_benchmark.py --config-file /etc/neutron/neutron.conf \
+        --config-file chunk_ipam.conf --workers 32 --ports 2000
+
+Row locks are only meaningful on a server backend such as MySQL or
+PostgreSQL. The network created for the benchmark is deleted at the end.
+"""
+
+from __future__ import print_function
+
+import sys
+import threading
+import time
+
+from oslo.config import cfg
+
+from neutron.api.v2 import attributes
+from neutron.common import config
+from neutron import context
+from neutron.db import db_base_plugin_v2
+
+benchmark_opts = [
+    cfg.IntOpt('workers', default=16,
+               help='Number of concurrent workers creating ports'),
+    cfg.IntOpt('ports', default=1000,
+               help='Total number of ports to create'),
+    cfg.StrOpt('cidr', default='10.0.0.0/16',
+               help='CIDR of the subnet ports are created on'),
+]
+
+
+def _port_body(network_id, tenant_id):
+    return {'port': {'network_id': network_id,
+                     'tenant_id': tenant_id,
+                     'name': '',
+                     'admin_state_up': True,
+                     'device_id': '',
+                     'device_owner': '',
+                     'mac_address': attributes.ATTR_NOT_SPECIFIED,
+                     'fixed_ips': attributes.ATTR_NOT_SPECIFIED}}
+
+
+def _worker(plugin, network_id, count, latencies, errors):
+    ctx = context.get_admin_context()
+    for _i in range(count):
+        start = time.time()
+        try:
+            plugin.create_port(ctx, _port_body(network_id, 'bench'))
+        except Exception as e:
+            errors.append(e)
+            continue
+        latencies.append(time.time() - start)
+
+
+def main():
+    cfg.CONF.register_cli_opts(benchmark_opts)
+    config.parse(sys.argv[1:])
+    plugin = db_base_plugin_v2.NeutronDbPluginV2()
+    ctx = context.get_admin_context()
+    net = plugin.create_network(ctx, {'network': {
+        'tenant_id': 'bench', 'name': 'bench', 'admin_state_up': True,
+        'shared': False}})
+    plugin.create_subnet(ctx, {'subnet': {
+        'tenant_id': 'bench', 'name': 'bench', 'network_id': net['id'],
+        'ip_version': 4, 'cidr': cfg.CONF.cidr, 'enable_dhcp': False,
+        'gateway_ip': attributes.ATTR_NOT_SPECIFIED,
+        'allocation_pools': attributes.ATTR_NOT_SPECIFIED,
+        'dns_nameservers': attributes.ATTR_NOT_SPECIFIED,
+        'host_routes': attributes.ATTR_NOT_SPECIFIED}})
+
+    latencies = []
+    errors = []
+    per_worker = cfg.CONF.ports // cfg.CONF.workers
+    threads = [threading.Thread(target=_worker,
+                                args=(plugin, net['id'], per_worker,
+                                      latencies, errors))
+               for _i in range(cfg.CONF.workers)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    latencies.sort()
+    print('ipam_driver: %s' % (cfg.CONF.ipam_driver or 'availability ranges'))
+    print('workers: %d, ports: %d, errors: %d' %
+          (cfg.CONF.workers, len(latencies), len(errors)))
+    print('elapsed: %.2fs, throughput: %.1f ports/s' %
+          (elapsed, len(latencies) / elapsed))
+    if latencies:
+        print('latency p50: %.1fms, p99: %.1fms' %
+              (latencies[len(latencies) // 2] * 1000,
+               latencies[int(len(latencies) * 0.99)] * 1000))
+    plugin.delete_ports(ctx, filters={'network_id': [net['id']]})
+    plugin.delete_network(ctx, net['id'])
+
+
+if __name__ == '__main__':
+    main()
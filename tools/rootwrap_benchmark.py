@@ -0,0 +1,88 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Compare the cost of running commands with root_helper and its daemon.
+
+The same command is run with the agent execute() helper, first through
+root_helper, then through root_helper_daemon, e.g.:
+
+    python tools/rootwrap_benchmark.py --config-file /etc/neutron/neutron.conf \
+        --count 200 --command "ip link show lo"
+
+The [AGENT] root_helper and root_helper_daemon options of the config files
+are used, and the command must be allowed by the rootwrap filters.
+"""
+
+from __future__ import print_function
+
+import shlex
+import sys
+import time
+
+from oslo.config import cfg
+
+from neutron.agent.common import config as agent_config
+from neutron.agent.linux import utils
+from neutron.common import config
+
+benchmark_opts = [
+    cfg.IntOpt('count', default=100,
+               help='Number of times the command is run in each mode'),
+    cfg.StrOpt('command', default='ip link show lo',
+               help='Command run as root'),
+]
+
+
+def _run(cmd, root_helper, count):
+    latencies = []
+    for _i in range(count):
+        start = time.time()
+        utils.execute(cmd, root_helper=root_helper)
+        latencies.append(time.time() - start)
+    latencies.sort()
+    return latencies
+
+
+def _report(mode, latencies):
+    total = sum(latencies)
+    print('%s: %d commands in %.2fs, mean %.1fms, p50 %.1fms, p99 %.1fms' %
+          (mode, len(latencies), total, total / len(latencies) * 1000,
+           latencies[len(latencies) // 2] * 1000,
+           latencies[int(len(latencies) * 0.99)] * 1000))
+
+
+def main():
+    cfg.CONF.register_cli_opts(benchmark_opts)
+    agent_config.register_root_helper(cfg.CONF)
+    config.parse(sys.argv[1:])
+    root_helper = agent_config.get_root_helper(cfg.CONF)
+    daemon_cmd = cfg.CONF.AGENT.root_helper_daemon
+    if not daemon_cmd:
+        sys.exit('The [AGENT] root_helper_daemon option must be set')
+    cmd = shlex.split(cfg.CONF.command)
+
+    cfg.CONF.set_override('root_helper_daemon', None, 'AGENT')
+    _report('root_helper', _run(cmd, root_helper, cfg.CONF.count))
+
+    cfg.CONF.set_override('root_helper_daemon', daemon_cmd, 'AGENT')
+    # The daemon is started by the first command, outside of the measure
+    utils.execute(cmd, root_helper=root_helper)
+    _report('root_helper_daemon', _run(cmd, root_helper, cfg.CONF.count))
+
+
+if __name__ == '__main__':
+    main()